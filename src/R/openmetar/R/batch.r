@@ -0,0 +1,148 @@
+####################################
+# OpenMeta[Analyst]                #
+# ----                             #
+# batch.r                          #
+# Runs one method over many        #
+# analysis units (outcome,         #
+# follow-up, group pair) of a      #
+# dataset in a single call.        #
+####################################
+
+units.raw.data.cols <- function(data.type) {
+    switch(data.type,
+           binary=c("g1O1", "g1O2", "g2O1", "g2O2"),
+           continuous=c("N1", "mean1", "sd1", "N2", "mean2", "sd2"),
+           stop(paste("batch analysis is not available for", data.type, "data")))
+}
+
+units.ma <- function(fname, units.data, params, data.type, n.cores=1) {
+    # units.data is a long-format data frame with one row per study per unit,
+    # where a unit is an (outcome, follow-up, group pair). Besides the unit
+    # columns (unit, outcome, follow.up, group1, group2) it has study.name,
+    # year, y, SE and the raw data columns for data.type (these may be NA).
+    #
+    # fname is run on each unit; the overall results are returned as a data
+    # frame with one row per unit, in the order the units first appear.
+    # Units are farmed out over n.cores processes where possible.
+    params$supress.output <- TRUE
+    unit.ids <- unique(as.character(units.data$unit))
+    rows.by.unit <- split(seq_len(nrow(units.data)),
+                          factor(as.character(units.data$unit), levels=unit.ids))
+
+    run.unit <- function(unit.id) {
+        ma.for.unit(fname, units.data[rows.by.unit[[unit.id]], , drop=FALSE],
+                    params, data.type)
+    }
+
+    if (n.cores > 1 && .Platform$OS.type != "windows" &&
+            suppressWarnings(require(parallel, quietly=TRUE))) {
+        unit.results <- mclapply(unit.ids, run.unit, mc.cores=n.cores)
+    } else {
+        unit.results <- lapply(unit.ids, run.unit)
+    }
+    results <- do.call(rbind, unit.results)
+    rownames(results) <- NULL
+    results
+}
+
+ma.for.unit <- function(fname, unit.rows, params, data.type) {
+    unit.info <- data.frame(unit=as.character(unit.rows$unit[1]),
+                            outcome=as.character(unit.rows$outcome[1]),
+                            follow.up=as.character(unit.rows$follow.up[1]),
+                            group1=as.character(unit.rows$group1[1]),
+                            group2=as.character(unit.rows$group2[1]),
+                            stringsAsFactors=FALSE)
+    overall <- tryCatch({
+        om.data <- om.data.for.unit(unit.rows, params, data.type)
+        res <- eval(call(fname, om.data, params))
+        res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
+        unit.overall.row(res.overall, length(om.data@study.names), params, data.type)
+    }, error=function(e) {
+        unit.overall.row(NULL, nrow(unit.rows), params, data.type,
+                         error=conditionMessage(e))
+    })
+    cbind(unit.info, overall)
+}
+
+om.data.for.unit <- function(unit.rows, params, data.type) {
+    raw.cols <- units.raw.data.cols(data.type)
+    has.raw <- all(raw.cols %in% names(unit.rows)) &&
+               !any(is.na(unit.rows[, raw.cols]))
+    if (!has.raw) {
+        # only studies with an (entered) effect and standard error can be used
+        unit.rows <- unit.rows[!is.na(unit.rows$y) & !is.na(unit.rows$SE), , drop=FALSE]
+    }
+    if (nrow(unit.rows) == 0) {
+        stop("no studies with sufficient data")
+    }
+    study.names <- as.character(unit.rows$study.name)
+    years <- as.integer(unit.rows$year)
+
+    if (data.type == "binary") {
+        if (has.raw) {
+            om.data <- new('BinaryData', g1O1=unit.rows$g1O1, g1O2=unit.rows$g1O2,
+                           g2O1=unit.rows$g2O1, g2O2=unit.rows$g2O2,
+                           y=unit.rows$y, SE=unit.rows$SE,
+                           study.names=study.names, years=years)
+            estimates <- compute.for.one.bin.study(om.data, params)
+        } else {
+            om.data <- new('BinaryData', y=unit.rows$y, SE=unit.rows$SE,
+                           study.names=study.names, years=years)
+        }
+    } else {
+        if (has.raw) {
+            om.data <- new('ContinuousData', N1=unit.rows$N1, mean1=unit.rows$mean1,
+                           sd1=unit.rows$sd1, N2=unit.rows$N2, mean2=unit.rows$mean2,
+                           sd2=unit.rows$sd2, y=unit.rows$y, SE=unit.rows$SE,
+                           study.names=study.names, years=years)
+            estimates <- compute.for.one.cont.study(om.data, params)
+        } else {
+            om.data <- new('ContinuousData', y=unit.rows$y, SE=unit.rows$SE,
+                           study.names=study.names, years=years)
+        }
+    }
+
+    # effects that weren't computed on the python side (e.g., for group
+    # pairs that have never been displayed) come from the raw data
+    missing <- is.na(om.data@y) | is.na(om.data@SE)
+    if (has.raw && any(missing)) {
+        om.data@y[missing] <- estimates$yi[missing]
+        om.data@SE[missing] <- sqrt(estimates$vi[missing])
+    }
+    om.data
+}
+
+unit.overall.row <- function(res.overall, k, params, data.type, error=NA) {
+    # one row of the combined results table; anything the method doesn't
+    # report (e.g., tau^2 for fixed-effect models) is NA
+    get.value <- function(name) {
+        if (is.null(res.overall) || is.null(res.overall[[name]])) {
+            NA
+        } else {
+            as.numeric(res.overall[[name]])[1]
+        }
+    }
+    est <- get.value("b")
+    lower <- get.value("ci.lb")
+    upper <- get.value("ci.ub")
+
+    trans.f <- switch(data.type,
+                      binary=binary.transform.f(as.character(params$measure)),
+                      continuous=continuous.transform.f(as.character(params$measure)))
+    to.display <- function(x) {
+        if (is.na(x)) NA else trans.f$display.scale(x)
+    }
+
+    data.frame(k=k,
+               est=est, lower=lower, upper=upper, se=get.value("se"),
+               display.est=to.display(est),
+               display.lower=to.display(lower),
+               display.upper=to.display(upper),
+               p.value=get.value("pval"),
+               tau2=get.value("tau2"),
+               Q=get.value("QE"),
+               Q.p=get.value("QEp"),
+               I2=get.value("I2"),
+               error=as.character(error),
+               stringsAsFactors=FALSE)
+}
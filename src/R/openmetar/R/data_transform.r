@@ -942,6 +942,134 @@ calc.est.var <- function(ci.data) {
   est.var
 }
 
+########################################
+# Batch (spreadsheet-wide) imputation  #
+########################################
+# The gimpute.* functions above back-calculate the data of a single study.
+# The functions below take a data frame with one row per study (NA where a
+# value is missing) so that all of the studies of an outcome can be filled
+# in with one call.
+
+gimpute.bin.data.batch <- function(bin.data) {
+	# Vectorized version of gimpute.bin.data. bin.data has the columns
+	# metric, estimate, lower, upper (on the display scale), N_A, N_B and
+	# conf.level. Returns a data frame with the counts of both solutions
+	# (a1, c1 and a2, c2; RR has a single solution, so a2 and c2 are NA for
+	# it); rows for which no table can be imputed are all NA.
+	metric <- as.character(bin.data[["metric"]])
+	N_1 <- bin.data[["N_A"]]
+	N_0 <- bin.data[["N_B"]]
+	n <- N_0 + N_1
+	alpha <- 1.0-(bin.data[["conf.level"]]/100.0)
+	mult <- abs(qnorm(alpha/2.0))
+	
+	# OR and RR are symmetric on the log scale
+	to.calc.scale <- function(x) ifelse(metric %in% c("OR", "RR"), suppressWarnings(log(x)), x)
+	d   <- to.calc.scale(bin.data[["estimate"]])
+	d_L <- to.calc.scale(bin.data[["lower"]])
+	d_U <- to.calc.scale(bin.data[["upper"]])
+	# as in calc.d.and.b
+	d   <- ifelse(is.na(d), (d_L + d_U)/2, d)
+	d_U <- ifelse(is.na(d_U), 2*d - d_L, d_U)
+	b   <- ((d_U - d) / mult)^2
+	
+	n.studies <- length(metric)
+	p0.op1 <- p1.op1 <- p0.op2 <- p1.op2 <- rep(NA, n.studies)
+	
+	rd <- which(metric == "RD")
+	if (length(rd) > 0) {
+		A <- n[rd]
+		B <- 2*N_0[rd]*d[rd] - n[rd]
+		C <- N_0[rd]*(N_1[rd]*b[rd] - d[rd]*(1-d[rd]))
+		root <- suppressWarnings(sqrt(B^2-4*A*C))
+		p0.op1[rd] <- (-B+root)/(2*A)
+		p0.op2[rd] <- (-B-root)/(2*A)
+		p1.op1[rd] <- d[rd] + p0.op1[rd]
+		p1.op2[rd] <- d[rd] + p0.op2[rd]
+	}
+	
+	or <- which(metric == "OR")
+	if (length(or) > 0) {
+		OR <- exp(d[or])
+		A <- N_0[or]*(1-OR)^2 + b[or]*OR*N_0[or]*N_1[or]
+		B <- -1*(2*N_0[or]*(1-OR) + b[or]*OR*N_0[or]*N_1[or])
+		C <- N_0[or] + OR*N_1[or]
+		root <- suppressWarnings(sqrt(B^2-4*A*C))
+		p0.op1[or] <- (-B+root)/(2*A)
+		p0.op2[or] <- (-B-root)/(2*A)
+		p1.op1[or] <- OR*p0.op1[or]/(OR*p0.op1[or]+1-p0.op1[or])
+		p1.op2[or] <- OR*p0.op2[or]/(OR*p0.op2[or]+1-p0.op2[or])
+	}
+	
+	rr <- which(metric == "RR")
+	if (length(rr) > 0) {
+		RR <- exp(d[rr])
+		p0.op1[rr] <- (N_0[rr]+RR*N_1[rr])/(RR*(b[rr]*N_1[rr]*N_0[rr]+N_1[rr]+N_0[rr]))
+		p1.op1[rr] <- p0.op1[rr]*RR
+	}
+	
+	a1 <- round(p1.op1 * N_1, digits=0); c1 <- round(p0.op1 * N_0, digits=0)
+	a2 <- round(p1.op2 * N_1, digits=0); c2 <- round(p0.op2 * N_0, digits=0)
+	
+	# gimpute.bin.data fails if either solution is NaN
+	failed <- is.na(a1) | is.na(c1) | (metric != "RR" & (is.na(a2) | is.na(c2)))
+	failed <- failed | is.na(N_1) | is.na(N_0)
+	a1[failed] <- NA; c1[failed] <- NA; a2[failed] <- NA; c2[failed] <- NA
+	data.frame(a1=a1, c1=c1, a2=a2, c2=c2)
+}
+
+gimpute.cont.data.batch <- function(cont.data) {
+	# Applies gimpute.cont.data to each row of cont.data, which has the
+	# columns n1, mean1, sd1, n2, mean2, sd2, est, low, high, metric,
+	# met.param and conf.level. Returns a data frame with the columns n1,
+	# mean1, sd1, n2, mean2, sd2; a value is NA where it could not be
+	# imputed or where there is more than one solution for it.
+	cont.data$metric <- as.character(cont.data$metric)
+	value.cols <- c("n1", "mean1", "sd1", "n2", "mean2", "sd2")
+	single.value <- function(x) {
+		if (is.null(x) || length(x) != 1 || !is.finite(x)) NA else x
+	}
+	imputed <- lapply(seq_len(nrow(cont.data)), function(i) {
+		row <- as.list(cont.data[i, ])
+		res <- try(gimpute.cont.data(group1=list(n=row$n1, mean=row$mean1, sd=row$sd1),
+						             group2=list(n=row$n2, mean=row$mean2, sd=row$sd2),
+						             effect_data=list(est=row$est, low=row$low, high=row$high,
+						                              metric=row$metric, met.param=row$met.param),
+						             conf.level=row$conf.level), silent=TRUE)
+		if (class(res) == "try-error" || is.null(res) || "FAIL" %in% names(res)) {
+			res <- list()
+		}
+		sapply(value.cols, function(col) single.value(res[[col]]))
+	})
+	imputed <- do.call(rbind, c(list(matrix(nrow=0, ncol=length(value.cols))), imputed))
+	colnames(imputed) <- value.cols
+	as.data.frame(imputed)
+}
+
+gimpute.diagnostic.data.batch <- function(diag.data) {
+	# Applies gimpute.diagnostic.data to each row of diag.data (which has
+	# any of the columns that function uses: total, prev, sens, sens.lb,
+	# sens.ub, spec, spec.lb, spec.ub, conf.level). Returns a data frame
+	# with the columns TP, FN, TN and FP.
+	value.cols <- c("TP", "FN", "TN", "FP")
+	imputed <- lapply(seq_len(nrow(diag.data)), function(i) {
+		row <- as.list(diag.data[i, ])
+		# gimpute.diagnostic.data tells missing fields by their being NULL
+		row <- row[!sapply(row, is.na)]
+		res <- try(gimpute.diagnostic.data(row), silent=TRUE)
+		if (class(res) == "try-error") {
+			res <- list()
+		}
+		sapply(value.cols, function(col) {
+			x <- res[[col]]
+			if (is.null(x) || length(x) != 1 || !is.finite(x)) NA else x
+		})
+	})
+	imputed <- do.call(rbind, c(list(matrix(nrow=0, ncol=length(value.cols))), imputed))
+	colnames(imputed) <- value.cols
+	as.data.frame(imputed)
+}
+
 rescale.effect.and.ci.conf.level <- function(dataf.arg) {
 	# Rescales est,low,high to target confidence level
 	#  dataf.arg is a dataframe of arguments
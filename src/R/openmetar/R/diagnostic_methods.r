@@ -8,12 +8,14 @@
 #######################################
 
 library(metafor)
-library(HSROC)
+# HSROC is loaded by diagnostic.hsroc, when it's actually needed
 library(graphics)
 
 diagnostic.logit.metrics <- c("Sens", "Spec", "PPV", "NPV", "Acc")
 diagnostic.log.metrics <- c("PLR", "NLR", "DOR")
 bivariate.methods <- c("diagnostic.hsroc", "diagnostic.bivariate.ml")
+# the methods that can leave their forest plot to the caller (params$defer.plot)
+deferred.plot.methods <- c("diagnostic.fixed.inv.var", "diagnostic.fixed.mh", "diagnostic.fixed.peto", "diagnostic.random")
 
 adjust.raw.data <- function(diagnostic.data, params) {
     # adjust raw data by adding a constant to each entry   
@@ -215,38 +217,64 @@ multiple.diagnostic <- function(fnames, params.list, diagnostic.data) {
     plot.names <- c()
     plot.params.paths <- c()
     plot.pdfs.paths <- c() # sometimes we want to just output pdfs at run-time
-    remove.indices <- c()
 	references <- c()
 
+    ###
+    # The metrics are analyzed independently of one another, so the
+    # analyses are all run up front (in worker processes, where possible --
+    # see diagnostic.metric.fits) without plots; the plots, side-by-side
+    # and single, are then made here once all of them are done.
+    bivariate <- ("Sens" %in% metrics) && ("Spec" %in% metrics) &&
+                 (fnames[sens.index] %in% bivariate.methods)
+    side.by.side.indices <- c()
+    if (("Sens" %in% metrics) && ("Spec" %in% metrics) && !bivariate) {
+        side.by.side.indices <- c(sens.index, spec.index)
+    }
+    if (("NLR" %in% metrics) && ("PLR" %in% metrics)) {
+        side.by.side.indices <- c(side.by.side.indices, nlr.index, plr.index)
+    }
+    single.indices <- setdiff(1:length(params.list), side.by.side.indices)
+    if (bivariate) {
+        single.indices <- setdiff(single.indices, c(sens.index, spec.index))
+    }
+    # single forest plots can only be put off for the methods that support it
+    deferred.indices <- single.indices[fnames[single.indices] %in% deferred.plot.methods]
+    fit.params.list <- params.list
+    for (count in side.by.side.indices) {
+        fit.params.list[[count]]$create.plot <- FALSE
+    }
+    for (count in deferred.indices) {
+        fit.params.list[[count]]$defer.plot <- TRUE
+    }
+    fits <- diagnostic.metric.fits(fnames, fit.params.list, diagnostic.data,
+                                   c(side.by.side.indices, deferred.indices))
+
     if (("Sens" %in% metrics) & ("Spec" %in% metrics)) {
         ####
         # we are running an analysis for sens *and* spec;
         # has a bivariate method been selected??
         fname <- fnames[sens.index]
-        if (fname %in% bivariate.methods){
+        if (bivariate){
             params.sens <- params.list[[sens.index]] # we could pick either here
             biv.results <- eval(call(fname, diagnostic.data, params.sens))
             results <- c(results, biv.results$Summary)
             images <- c(images, biv.results$images)
             image.order <- append.image.order(image.order, biv.results)
-            remove.indices <- c(sens.index, spec.index)
 			references <- c(references, biv.results$Reference)
         } else {
             ###
             # we're not running bivariate; proceed as usual
             # create side-by-side forest plots for sens and spec.
-            params.sens <- params.list[[sens.index]]
-            params.spec <- params.list[[spec.index]]
-            params.sens$create.plot <- FALSE
-            params.spec$create.plot <- FALSE
+            params.sens <- fit.params.list[[sens.index]]
+            params.spec <- fit.params.list[[spec.index]]
             params.tmp <- list("left"=params.sens, "right"=params.spec)
             
-            diagnostic.data.sens <- compute.diag.point.estimates(diagnostic.data, params.sens)
-            diagnostic.data.spec <- compute.diag.point.estimates(diagnostic.data, params.spec)
+            diagnostic.data.sens <- fits[[sens.index]]$diagnostic.data
+            diagnostic.data.spec <- fits[[spec.index]]$diagnostic.data
             diagnostic.data.all <- list("left"=diagnostic.data.sens, "right"=diagnostic.data.spec)
             
-            results.sens <- eval(call(fname, diagnostic.data.sens, params.sens))
-            results.spec <- eval(call(fname, diagnostic.data.spec, params.spec))
+            results.sens <- fits[[sens.index]]$results
+            results.spec <- fits[[spec.index]]$results
             summary.sens <- list("Summary"=results.sens$Summary)
             names(summary.sens) <- paste(eval(parse(text=paste("pretty.names$measure$", params.sens$measure,sep=""))), " Summary", sep="")
             summary.spec <- list("Summary"=results.spec$Summary)
@@ -284,25 +312,21 @@ multiple.diagnostic <- function(fnames, params.list, diagnostic.data) {
             images <- c(images, c("SROC"=sroc.path))
             image.order <- c(image.order, "SROC")
             plot.names <- c(plot.names, c("sroc"="sroc"))
-            remove.indices <- c(sens.index, spec.index)
         }
     }
     
     if (("NLR" %in% metrics) & ("PLR" %in% metrics)) {
         # create side-by-side forest plots for NLR and PLR.
-        params.nlr <- params.list[[nlr.index]]
-        params.plr <- params.list[[plr.index]]
-        params.nlr$create.plot <- FALSE
-        params.plr$create.plot <- FALSE
+        params.nlr <- fit.params.list[[nlr.index]]
+        params.plr <- fit.params.list[[plr.index]]
         params.tmp <- list("left"=params.nlr, "right"=params.plr)
         
-        fname <- fnames[nlr.index]
-        diagnostic.data.nlr <- compute.diag.point.estimates(diagnostic.data, params.nlr)
-        diagnostic.data.plr <- compute.diag.point.estimates(diagnostic.data, params.plr)
+        diagnostic.data.nlr <- fits[[nlr.index]]$diagnostic.data
+        diagnostic.data.plr <- fits[[plr.index]]$diagnostic.data
         diagnostic.data.all <- list("left"=diagnostic.data.nlr, "right"=diagnostic.data.plr)
         
-        results.nlr <- eval(call(fname, diagnostic.data.nlr, params.nlr))
-        results.plr <- eval(call(fname, diagnostic.data.plr, params.plr))
+        results.nlr <- fits[[nlr.index]]$results
+        results.plr <- fits[[plr.index]]$results
         summary.nlr <- list("Summary"=results.nlr$Summary)
         names(summary.nlr) <- paste(eval(parse(text=paste("pretty.names$measure$", params.nlr$measure,sep=""))), " Summary", sep="")
         summary.plr <- list("Summary"=results.plr$Summary)
@@ -331,37 +355,35 @@ multiple.diagnostic <- function(fnames, params.list, diagnostic.data) {
         plot.names.tmp <- c("forest plot"="forest.plot")
         plot.names <- c(plot.names, plot.names.tmp)
         
-        remove.indices <- c(remove.indices, nlr.index, plr.index)
 		
 		cat("end of plr/nlr stuff")
     }
 
-    # remove fnames and params for side-by-side plots
-    fnames <- fnames[setdiff(1:length(fnames), remove.indices)]
-    params.list <- params.list[setdiff(1:length(params.list), remove.indices)]
-	
-	
-
-    if (length(params.list) > 0) {
-        for (count in 1:length(params.list)) {
-            # create ma summaries and single (not side-by-side) forest plots.
-            #pretty.names <- eval(call(paste(fnames[count],".pretty.names",sep="")))
+    for (count in single.indices) {
+        # create ma summaries and single (not side-by-side) forest plots.
+        #pretty.names <- eval(call(paste(fnames[count],".pretty.names",sep="")))
+        if (is.null(fits[[count]])) {
             diagnostic.data.tmp <- compute.diag.point.estimates(diagnostic.data, params.list[[count]])
             results.tmp <- eval(call(fnames[count], diagnostic.data.tmp, params.list[[count]]))
-            images.tmp <- results.tmp$images
-            names(images.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
-            images <- c(images, images.tmp)
-            image.order <- c(image.order, names(images.tmp))
-            plot.params.paths.tmp <- results.tmp$plot_params_paths
-            names(plot.params.paths.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$", params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
-            plot.params.paths <- c(plot.params.paths, plot.params.paths.tmp)
-            plot.names <- c(plot.names, results.tmp$plot_names)
-            summary.tmp <- list("Summary"=results.tmp$Summary)
-            names(summary.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Summary", sep="")
-      
-		    references <- c(references, results.tmp$References)
-			results <- c(results, summary.tmp)
+        } else {
+            results.tmp <- fits[[count]]$results
+            if (!is.null(results.tmp$deferred.plot)) {
+                results.tmp <- c(results.tmp, do.call(diagnostic.forest.plot, results.tmp$deferred.plot))
+            }
         }
+        images.tmp <- results.tmp$images
+        names(images.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
+        images <- c(images, images.tmp)
+        image.order <- c(image.order, names(images.tmp))
+        plot.params.paths.tmp <- results.tmp$plot_params_paths
+        names(plot.params.paths.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$", params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
+        plot.params.paths <- c(plot.params.paths, plot.params.paths.tmp)
+        plot.names <- c(plot.names, results.tmp$plot_names)
+        summary.tmp <- list("Summary"=results.tmp$Summary)
+        names(summary.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Summary", sep="")
+  
+	    references <- c(references, results.tmp$References)
+		results <- c(results, summary.tmp)
     }
 
     graphics.off()
@@ -373,6 +395,63 @@ multiple.diagnostic <- function(fnames, params.list, diagnostic.data) {
     results
 }
 
+diagnostic.metric.fits <- function(fnames, params.list, diagnostic.data, indices) {
+    # For each count in indices, computes the point estimates of
+    # diagnostic.data for params.list[[count]] and runs fnames[count] on them.
+    # The metrics are independent of one another, so these are run in worker
+    # processes (see parallel.lapply); the params should turn off or defer
+    # the plots. Returns a list, indexed as params.list, of the data and
+    # results of each fit (NULL for the indices not fit).
+    fit <- function(count) {
+        diagnostic.data.tmp <- compute.diag.point.estimates(diagnostic.data, params.list[[count]])
+        list(diagnostic.data=diagnostic.data.tmp,
+             results=eval(call(fnames[count], diagnostic.data.tmp, params.list[[count]])))
+    }
+    fits <- vector("list", length(params.list))
+    fits[indices] <- parallel.lapply(indices, fit)
+    fits
+}
+
+diagnostic.forest.plot.results <- function(diagnostic.data, params, res, summary.disp) {
+    # the results of a diagnostic method with a forest plot. If
+    # params$defer.plot is TRUE, the plot is left to the caller, which
+    # makes it with do.call(diagnostic.forest.plot, results$deferred.plot)
+    # (see multiple.diagnostic)
+    if (isTRUE(params$defer.plot)) {
+        return(list("Summary"=summary.disp,
+                    "deferred.plot"=list(diagnostic.data=diagnostic.data, params=params, res=res)))
+    }
+    forest.plot.results <- diagnostic.forest.plot(diagnostic.data, params, res)
+    list("images"=forest.plot.results$images,
+         "Summary"=summary.disp,
+         "plot_names"=forest.plot.results$plot_names,
+         "plot_params_paths"=forest.plot.results$plot_params_paths)
+}
+
+diagnostic.forest.plot <- function(diagnostic.data, params, res) {
+    # creates the forest plot of res (to params$fp_outpath) and saves its
+    # data for the plot editor; returns the images, plot names and plot
+    # params paths for the results of a diagnostic method
+    if (is.null(diagnostic.data@y) || is.null(diagnostic.data@SE)) {
+        # compute point estimates for plot.data in case they are missing
+        diagnostic.data <- compute.diag.point.estimates(diagnostic.data, params)
+    }
+    forest.path <- paste(params$fp_outpath, sep="")
+    plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res)
+    changed.params <- plot.data$changed.params
+    # list of changed params values
+    params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
+    changed.params <- c(changed.params, params.changed.in.forest.plot)
+    params[names(changed.params)] <- changed.params
+    # dump the forest plot params to disk; return path to
+    # this .Rdata for later use
+    forest.plot.params.path <- save.data(diagnostic.data, res, params, plot.data)
+
+    list("images"=c("Forest Plot"=forest.path),
+         "plot_names"=c("forest plot"="forest_plot"),
+         "plot_params_paths"=c("Forest Plot"=forest.plot.params.path))
+}
+
 append.image.order <- function(image.order, results){
     if ("image_order" %in% names(results)){
         image.order <- c(image.order, results[["image_order"]])
@@ -423,26 +502,7 @@ diagnostic.fixed.inv.var <- function(diagnostic.data, params){
         if ((is.null(params$create.plot)) || params$create.plot == TRUE) {
             # A forest plot will be created unless
             # params.create.plot is set to FALSE.
-            forest.path <- paste(params$fp_outpath, sep="")
-            plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res)
-            changed.params <- plot.data$changed.params
-            # list of changed params values
-            params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
-            changed.params <- c(changed.params, params.changed.in.forest.plot)
-            params[names(changed.params)] <- changed.params
-            # dump the forest plot params to disk; return path to
-            # this .Rdata for later use
-            forest.plot.params.path <- save.data(diagnostic.data, res, params, plot.data)
-
-            plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
-            images <- c("Forest Plot"=forest.path)
-            plot.names <- c("forest plot"="forest_plot")
-
-			
-            results <- list("images"=images,
-					        "Summary"=summary.disp,
-                            "plot_names"=plot.names, 
-                            "plot_params_paths"=plot.params.paths)
+            results <- diagnostic.forest.plot.results(diagnostic.data, params, res, summary.disp)
         } else {
             results <- list("Summary"=summary.disp)
         } 
@@ -550,28 +610,7 @@ diagnostic.fixed.mh <- function(diagnostic.data, params){
         # generate forest plot
         #
         if ((is.null(params$create.plot)) || (params$create.plot == TRUE)) {
-            if (is.null(diagnostic.data@y) || is.null(diagnostic.data@SE)) {
-                diagnostic.data <- compute.diag.point.estimates(diagnostic.data, params)
-                # compute point estimates for plot.data in case they are missing
-            }
-            forest.path <- paste(params$fp_outpath, sep="")
-            plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res)
-            changed.params <- plot.data$changed.params
-            # list of changed params values
-            params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
-            changed.params <- c(changed.params, params.changed.in.forest.plot)
-            params[names(changed.params)] <- changed.params
-            # dump the forest plot params to disk; return path to
-            # this .Rdata for later use
-            forest.plot.params.path <- save.data(diagnostic.data, res, params, plot.data)
-            
-            plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
-            images <- c("Forest Plot"=forest.path)
-            plot.names <- c("forest plot"="forest_plot")
-            results <- list("images"=images,
-					        "Summary"=summary.disp,
-                            "plot_names"=plot.names, 
-                            "plot_params_paths"=plot.params.paths)
+            results <- diagnostic.forest.plot.results(diagnostic.data, params, res, summary.disp)
         }
         else {
             results <- list("Summary"=summary.disp)
@@ -687,30 +726,7 @@ diagnostic.fixed.peto <- function(diagnostic.data, params){
         #
         # generate forest plot 
         #
-        forest.path <- paste(params$fp_outpath, sep="")
-        plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res)
-        changed.params <- plot.data$changed.params
-        # list of changed params values
-        params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
-        changed.params <- c(changed.params, params.changed.in.forest.plot)
-        params[names(changed.params)] <- changed.params
-        # dump the forest plot params to disk; return path to
-        # this .Rdata for later use
-        forest.plot.params.path <- save.data(diagnostic.data, res, params, plot.data)
-        #
-        # Now we package the results in a dictionary (technically, a named 
-        # vector). In particular, there are two fields that must be returned; 
-        # a dictionary of images (mapping titles to image paths) and a list of texts
-        # (mapping titles to pretty-printed text). In this case we have only one 
-        # of each. 
-        # 
-        plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
-        images <- c("Forest Plot"=forest.path)
-        plot.names <- c("forest plot"="forest_plot")
-        results <- list("images"=images,
-				        "Summary"=summary.disp,
-                        "plot_names"=plot.names,
-						"plot_params_paths"=plot.params.paths)
+        results <- diagnostic.forest.plot.results(diagnostic.data, params, res, summary.disp)
       }
     }
     else {
@@ -811,27 +827,7 @@ diagnostic.random <- function(diagnostic.data, params){
         # generate forest plot 
         #
         if ((is.null(params$create.plot)) || (params$create.plot == TRUE)) {
-            forest.path <- paste(params$fp_outpath, sep="")
-            plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res)
-            changed.params <- plot.data$changed.params
-            # list of changed params values
-            params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
-            changed.params <- c(changed.params, params.changed.in.forest.plot)
-            params[names(changed.params)] <- changed.params
-            # update params values
-            # we use the system time as our unique-enough string to store
-            # the params object
-            forest.plot.params.path <- save.data(diagnostic.data, res, params, plot.data)
-            
-            plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
-            images <- c("Forest Plot"=forest.path)
-            plot.names <- c("forest plot"="forest_plot")
-			
-			
-            results <- list("images"=images,
-					        "Summary"=summary.disp,
-                            "plot_names"=plot.names, 
-                            "plot_params_paths"=plot.params.paths)
+            results <- diagnostic.forest.plot.results(diagnostic.data, params, res, summary.disp)
         }
         else {
             results <- list("Summary"=summary.disp)
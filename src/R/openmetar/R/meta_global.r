@@ -24,4 +24,51 @@ get.global.conf.level <- function(NA.if.missing=FALSE) {
 	return(CONF.LEVEL.GLOBAL)
 }
 ################################################################################
+
+###############################################################################
+# global value set from python: the number of processes analyses may farm
+# independent fits (subgroups, metrics) out to; see parallel.lapply
+
+set.n.cores <- function(n.cores) {
+	N.CORES.GLOBAL <<- max(1, as.integer(n.cores))
+	return(N.CORES.GLOBAL)
+}
+
+get.n.cores <- function() {
+	if (!("N.CORES.GLOBAL" %in% ls(envir=globalenv()))) {
+		return(1)
+	}
+	return(N.CORES.GLOBAL)
+}
+
+parallel.lapply <- function(X, FUN, n.cores=get.n.cores()) {
+	# lapply(X, FUN), with the calls run in (forked) worker processes, n.cores
+	# at a time, where possible, i.e., not on windows and not from within a
+	# worker. The results are in the order of X; an error in any of the calls
+	# is raised here. FUN must not plot, nor write files with names that
+	# aren't its own (save.data's time-based names could clash between
+	# workers); any other side effects are lost with the worker.
+	if (n.cores <= 1 || length(X) <= 1 || .Platform$OS.type == "windows" ||
+			isTRUE(getOption("openmetar.in.worker")) ||
+			!suppressWarnings(require(parallel, quietly=TRUE))) {
+		return(lapply(X, FUN))
+	}
+	run.in.worker <- function(x) {
+		options(openmetar.in.worker=TRUE)
+		FUN(x)
+	}
+	# one call per fork, as the calls can take very different times (e.g.,
+	# subgroups of different sizes)
+	results <- mclapply(X, run.in.worker, mc.cores=min(n.cores, length(X)),
+	                    mc.preschedule=FALSE)
+	for (result in results) {
+		if (inherits(result, "try-error")) {
+			condition <- attr(result, "condition")
+			stop(if (is.null(condition)) as.character(result) else conditionMessage(condition))
+		}
+	}
+	names(results) <- names(X)
+	results
+}
+################################################################################
 	
@@ -219,11 +219,13 @@ bootstrap <- function(fname, omdata, params, cond.means.data=FALSE) {
 		bootstrap.plot.path <- "./r_tmp/bootstrap.png"
 	}
 	
-	# used in the meta.reg.statistic to see if the covariates match
+	# used in the meta.reg.statistic to see if the covariates match. these
+	# are extracted once: a sample has the covariate array rows of the
+	# sampled studies, as long as all the levels of the factors are present
 	if (length(omdata@covariates) > 0) {
-		cov.data <- extract.cov.data(omdata, dont.make.array=TRUE)
-		factor.n.levels <- cov.data$display.data$factor.n.levels
-		n.cont.covs <- cov.data$display.data$n.cont.covs
+		cov.data <- extract.cov.data(omdata)
+		cov.array <- cov.data$cov.array
+		level.structure <- cov.level.structure(omdata)
 		cat.ref.var.and.levels <- cov.data$cat.ref.var.and.levels
 	}
 	
@@ -244,23 +246,15 @@ bootstrap <- function(fname, omdata, params, cond.means.data=FALSE) {
 	
 	
 	meta.reg.statistic <- function(data, indices) {
-		data.ok <- function(data.subset) {
-			subset.cov.data <- extract.cov.data(data.subset, dont.make.array=TRUE)
-			subset.factor.n.levels <- subset.cov.data$display.data$factor.n.levels
-			subset.n.cont.covs <- subset.cov.data$display.data$n.cont.covs
-			subset.cat.ref.var.and.levels <- subset.cov.data$cat.ref.var.and.levels
-			
-			# are the number of levels for each categorical covariate and the number of continuous covariates the same?
-			if (!(all(factor.n.levels==subset.factor.n.levels) && all(n.cont.covs==subset.n.cont.covs)))
-				return(FALSE)
-			
-			return(TRUE)
+		data.ok <- function(indices) {
+			# are all the levels of each categorical covariate present? (the
+			# number of continuous covariates is always the same)
+			all.levels.present(level.structure, indices)
 		}
 		
-		data.tmp <- get.subset(omdata, indices, make.unique.names=TRUE)
 		error.during.meta.regression <- FALSE
 		first.try <- TRUE
-		while (first.try || !data.ok(data.tmp) || error.during.meta.regression) {
+		while (first.try || !data.ok(indices) || error.during.meta.regression) {
 			if (extra.attempts >= max.extra.attempts)
 				stop("Number of extra attempts exceeded 5x the number of replicates")
 			
@@ -268,23 +262,24 @@ bootstrap <- function(fname, omdata, params, cond.means.data=FALSE) {
 			if (!first.try) {
 				extra.attempts <<- extra.attempts + 1
 				#cat("attempt: ", extra.attempts, "\n")
-				new.indices <- sample.int(length(omdata.rows), size=length(indices), replace=TRUE)
-				data.tmp <- get.subset(omdata, new.indices, make.unique.names=TRUE)
+				indices <- sample.int(length(omdata.rows), size=length(indices), replace=TRUE)
 			} else {
 				first.try <- FALSE
 			}
 
-			if (data.ok(data.tmp)) {
+			if (data.ok(indices)) {
 				#cat("   data is ok maybe")
+				data.tmp <- get.subset(omdata, indices, make.unique.names=TRUE)
 				
 				# try to run the meta.regression
-				res <- try(meta.regression(data.tmp, params, stop.at.rma=TRUE), silent=FALSE)
+				res <- try(meta.regression(data.tmp, params, stop.at.rma=TRUE,
+				                           cov.array=cov.array[indices,,drop=FALSE]), silent=FALSE)
 				if (class(res)[1] == "try-error") {
 					error.during.meta.regression <- TRUE
 					#cat("There was ane error during meta regression\n")
 				}
 				else {
-					error.during.meta.regrssion <- FALSE
+					error.during.meta.regression <- FALSE
 				}
 			}
 		} # end while
@@ -727,6 +722,13 @@ cum.ma.continuous <- function(fname, cont.data, params){
 #  diagnostic cumulative MA     #
 #################################
 cum.ma.diagnostic <- function(fname, diagnostic.data, params){
+	fit <- cum.ma.diagnostic.fit(fname, diagnostic.data, params)
+	cum.ma.diagnostic.plot(diagnostic.data, params, fit)
+}
+
+cum.ma.diagnostic.fit <- function(fname, diagnostic.data, params){
+	# the cumulative meta-analysis of diagnostic.data, without the plot (see
+	# cum.ma.diagnostic.plot); neither plots nor writes any files.
 	# assert that the argument is the correct type
 	if (!("DiagnosticData" %in% class(diagnostic.data))) stop("Diagnostic data expected.")  
 	
@@ -737,12 +739,6 @@ cum.ma.diagnostic <- function(fname, diagnostic.data, params){
 	res <- eval(call(fname, diagnostic.data, params.tmp))
 	res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
 	# parse out the overall estimate
-	plot.data <- create.plot.data.diagnostic(diagnostic.data, params, res.overall)
-	# data for standard forest plot
-	
-	####
-	#### SOMETHING MISSING HERE?
-	####
 	
 	# iterate over the binaryData elements, adding one study at a time
 	cum.results <- array(list(NULL), dim=c(length(diagnostic.data@study.names)))
@@ -790,6 +786,16 @@ cum.ma.diagnostic <- function(fname, diagnostic.data, params){
                           diagnostic.hsroc         = paste("Diagnostic HSROC\n\nMetric: ", metric.name, sep=""),
                           diagnostic.random        = paste("Diagnostic Random-Effects\n\nMetric: ", metric.name, sep=""))
 	cum.disp <- create.overall.display(res=cum.results, study.names, params, model.title, data.type="diagnostic")
+	list(res=res, res.overall=res.overall, cum.results=cum.results, cum.disp=cum.disp)
+}
+
+cum.ma.diagnostic.plot <- function(diagnostic.data, params, fit){
+	# makes the plots of the cumulative meta-analysis fit (as returned by
+	# cum.ma.diagnostic.fit) and returns the results
+	res <- fit$res
+	cum.results <- fit$cum.results
+	plot.data <- create.plot.data.diagnostic(diagnostic.data, params, fit$res.overall)
+	# data for standard forest plot
 	forest.path <- paste(params$fp_outpath, sep="")
 	params.cum <- params
 	params.cum$fp_col1_str <- "Cumulative Studies"
@@ -821,7 +827,7 @@ cum.ma.diagnostic <- function(fname, diagnostic.data, params){
 	references <- c(res$References, cum_meta_analysis_ref)
 	
 	results <- list("images"=images,
-			        "Cumulative Summary"=cum.disp,
+			        "Cumulative Summary"=fit$cum.disp,
 			        "plot_names"=plot.names, 
 					"plot_params_paths"=plot.params.paths,
 					"References"=references)
@@ -845,12 +851,20 @@ multiple.cum.ma.diagnostic <- function(fnames, params.list, diagnostic.data) {
 	plot.params.paths <- c()
 	
 	references <- c()
+	
+	# the metrics are independent of one another, so their cumulative
+	# analyses are run in worker processes (see parallel.lapply); the plots
+	# are made here once all of them are done
+	fit <- function(count) {
+		diagnostic.data.tmp <- compute.diag.point.estimates(diagnostic.data, params.list[[count]])
+		list(diagnostic.data=diagnostic.data.tmp,
+		     fit=cum.ma.diagnostic.fit(fnames[count], diagnostic.data.tmp, params.list[[count]]))
+	}
+	fits <- parallel.lapply(1:length(params.list), fit)
 			
 	for (count in 1:length(params.list)) {
 		params <- params.list[[count]]
-		fname <- fnames[count]
-		diagnostic.data <- compute.diag.point.estimates(diagnostic.data, params)
-		res <- cum.ma.diagnostic(fname, diagnostic.data, params)
+		res <- cum.ma.diagnostic.plot(fits[[count]]$diagnostic.data, params, fits[[count]]$fit)
 		
 		summary <- list("Summary"=res[["Cumulative Summary"]])
 		names(summary) <- paste(eval(parse(text=paste("pretty.names$measure$", params$measure,sep=""))), " Summary", sep="")
@@ -992,6 +1006,42 @@ loo.ma.continuous <- function(fname, cont.data, params){
     results
 }
 
+######################
+#  subgroup fitting  #
+######################
+subgroup.fits <- function(fname, om.data, params, cov.vals, get.subgroup.data) {
+    # Runs fname on the data of each subgroup -- the studies of om.data with
+    # each of the values in unique(cov.vals), as built by get.subgroup.data --
+    # and on all of om.data. The fits are independent, so they are run in
+    # worker processes (see parallel.lapply); params should suppress the
+    # plots and files fname makes, as these stay in the workers. Returns the
+    # subgroup values, the data of each subgroup (and all of om.data last),
+    # the .overall results of each fit (in the same order) and the fit to
+    # all of om.data.
+    subgroup.list <- unique(cov.vals)
+    grouped.data <- array(list(NULL), c(length(subgroup.list)+1))
+    for (count in seq_along(subgroup.list)) {
+        grouped.data[[count]] <- get.subgroup.data(om.data, subgroup.list[count], cov.vals)
+    }
+    grouped.data[[length(subgroup.list)+1]] <- om.data
+
+    overall.fit <- length(grouped.data)
+    fit <- function(count) {
+        res <- eval(call(fname, grouped.data[[count]], params))
+        res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
+        # only the fit to all of the data is needed in full
+        list(res=if (count == overall.fit) res else NULL, overall=res.overall)
+    }
+    fits <- parallel.lapply(seq_along(grouped.data), fit)
+
+    subgroup.results <- array(list(NULL), c(length(grouped.data)))
+    for (count in seq_along(fits)) {
+        subgroup.results[[count]] <- fits[[count]]$overall
+    }
+    list(subgroup.list=subgroup.list, grouped.data=grouped.data,
+         results=subgroup.results, res=fits[[overall.fit]]$res)
+}
+
 ########################
 #  binary subgroup MA  #
 ########################
@@ -1005,32 +1055,23 @@ subgroup.ma.binary <- function(fname, binary.data, params){
     #params.tmp$create.plot <- FALSE
     #params.tmp$write.to.file <- FALSE
 	params.tmp$supress.output <- TRUE
-    subgroup.list <- unique(cov.vals)
-    grouped.data <- array(list(NULL),c(length(subgroup.list)+1))
-    subgroup.results <- array(list(NULL), c(length(subgroup.list)+1))
+    fits <- subgroup.fits(fname, binary.data, params.tmp, cov.vals, get.subgroup.data.binary)
+    subgroup.list <- fits$subgroup.list
+    grouped.data <- fits$grouped.data
+    subgroup.results <- fits$results
+    res <- fits$res
     col3.nums <- NULL
     col3.denoms <- NULL
     col4.nums <- NULL
     col4.denoms <- NULL
-    count <- 1
-    for (i in subgroup.list){
-      # build a BinaryData object for each subgroup
-      bin.data.tmp <- get.subgroup.data.binary(binary.data, i, cov.vals)
-      grouped.data[[count]] <- bin.data.tmp
+    for (count in seq_along(subgroup.list)){
+      bin.data.tmp <- grouped.data[[count]]
       # collect raw data columns
       col3.nums <- c(col3.nums, bin.data.tmp@g1O1, sum(bin.data.tmp@g1O1)) 
       col3.denoms <- c(col3.denoms, bin.data.tmp@g1O1 + bin.data.tmp@g1O2, sum(bin.data.tmp@g1O1 + bin.data.tmp@g1O2)) 
       col4.nums <- c(col4.nums, bin.data.tmp@g2O1, sum(bin.data.tmp@g2O1)) 
       col4.denoms <- c(col4.denoms, bin.data.tmp@g2O1 + bin.data.tmp@g2O2, sum(bin.data.tmp@g2O1 + bin.data.tmp@g2O2)) 
-      cur.res <- eval(call(fname, bin.data.tmp, params.tmp))
-      cur.overall <- eval(call(paste(fname, ".overall", sep=""), cur.res))
-      subgroup.results[[count]] <- cur.overall
-      count <- count + 1
     }
-    res <- eval(call(fname, binary.data, params.tmp))
-    res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
-    grouped.data[[count]] <- binary.data
-    subgroup.results[[count]] <- res.overall
     subgroup.names <- paste("Subgroup ", subgroup.list, sep="")
     subgroup.names <- c(subgroup.names, "Overall")
     metric.name <- pretty.metric.name(as.character(params$measure))
@@ -1113,27 +1154,17 @@ subgroup.ma.continuous <- function(fname, cont.data, params){
     #params$create.plot <- FALSE
     #params.tmp$write.to.file <- FALSE
 	params.tmp$supress.output <- TRUE
-    subgroup.list <- unique(cov.vals)
-    grouped.data <- array(list(NULL),c(length(subgroup.list)+1))
-    subgroup.results <- array(list(NULL), c(length(subgroup.list)+1))
+    # (the fits used to be given params, so that each wrote out a forest
+    # plot that was never shown)
+    fits <- subgroup.fits(fname, cont.data, params.tmp, cov.vals, get.subgroup.data.cont)
+    subgroup.list <- fits$subgroup.list
+    grouped.data <- fits$grouped.data
+    subgroup.results <- fits$results
+    res <- fits$res
     col3.nums <- NULL
     col3.denoms <- NULL
     col4.nums <- NULL
     col4.denoms <- NULL
-    count <- 1
-    for (i in subgroup.list){
-      # build a ContinuousData object 
-      cont.data.tmp <- get.subgroup.data.cont(cont.data, i, cov.vals) 
-      grouped.data[[count]] <- cont.data.tmp
-      cur.res <- eval(call(fname, cont.data.tmp, params))
-      cur.overall <- eval(call(paste(fname, ".overall", sep=""), cur.res))
-      subgroup.results[[count]] <- cur.overall
-      count <- count + 1
-    }
-    res <- eval(call(fname, cont.data, params))
-    res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
-    grouped.data[[count]] <- cont.data
-    subgroup.results[[count]] <- res.overall
     subgroup.names <- paste("Subgroup ", subgroup.list, sep="")
     subgroup.names <- c(subgroup.names, "Overall")
     metric.name <- pretty.metric.name(as.character(params$measure))
@@ -1344,6 +1375,20 @@ multiple.loo.diagnostic <- function(fnames, params.list, diagnostic.data) {
     plot.params.paths <- c()
     remove.indices <- c()
 
+    # the metrics are independent of one another, so their leave-one-out
+    # analyses are run in worker processes (see parallel.lapply), without
+    # plots; the plots, side-by-side and single, are made here once all of
+    # them are done
+    fit <- function(count) {
+        params <- params.list[[count]]
+        params$create.plot <- FALSE
+        params$write.to.file <- FALSE
+        diagnostic.data.tmp <- compute.diag.point.estimates(diagnostic.data, params)
+        list(diagnostic.data=diagnostic.data.tmp,
+             results=loo.ma.diagnostic(fnames[[count]], diagnostic.data.tmp, params))
+    }
+    fits <- parallel.lapply(1:length(params.list), fit)
+
     if (("Sens" %in% metrics) & ("Spec" %in% metrics)) {
         # create side-by-side forest plots for sens and spec.
         params.sens <- params.list[[sens.index]]
@@ -1354,12 +1399,11 @@ multiple.loo.diagnostic <- function(fnames, params.list, diagnostic.data) {
         params.spec$write.to.file <- FALSE
         params.tmp <- list("left"=params.sens, "right"=params.spec)
         
-        fname <- fnames[sens.index]
-        diagnostic.data.sens <- compute.diag.point.estimates(diagnostic.data, params.sens)
-        diagnostic.data.spec <- compute.diag.point.estimates(diagnostic.data, params.spec)
+        diagnostic.data.sens <- fits[[sens.index]]$diagnostic.data
+        diagnostic.data.spec <- fits[[spec.index]]$diagnostic.data
         
-        results.sens <- loo.ma.diagnostic(fname, diagnostic.data.sens, params.sens)
-        results.spec <- loo.ma.diagnostic(fname, diagnostic.data.spec, params.spec)
+        results.sens <- fits[[sens.index]]$results
+        results.spec <- fits[[spec.index]]$results
 
         diagnostic.data.sens.spec <- list("left"=diagnostic.data.sens, "right"=diagnostic.data.spec)
         
@@ -1400,11 +1444,10 @@ multiple.loo.diagnostic <- function(fnames, params.list, diagnostic.data) {
         params.plr$write.to.file <- FALSE
         params.tmp <- list("left"=params.nlr, "right"=params.plr)
         
-        fname <- fnames[nlr.index]
-        diagnostic.data.nlr <- compute.diag.point.estimates(diagnostic.data, params.nlr)
-        diagnostic.data.plr <- compute.diag.point.estimates(diagnostic.data, params.plr)
-        results.nlr <- loo.ma.diagnostic(fname, diagnostic.data.nlr, params.nlr)
-        results.plr <- loo.ma.diagnostic(fname, diagnostic.data.plr, params.plr)
+        diagnostic.data.nlr <- fits[[nlr.index]]$diagnostic.data
+        diagnostic.data.plr <- fits[[plr.index]]$diagnostic.data
+        results.nlr <- fits[[nlr.index]]$results
+        results.plr <- fits[[plr.index]]$results
         diagnostic.data.nlr.plr <- list("left"=diagnostic.data.nlr, "right"=diagnostic.data.plr)
         
 		references <- c(references, results.nlr$References)
@@ -1435,18 +1478,22 @@ multiple.loo.diagnostic <- function(fnames, params.list, diagnostic.data) {
         remove.indices <- c(remove.indices, nlr.index, plr.index)
     }
 
-    # remove fnames and params for side-by-side plots
+    # remove fnames, params and fits for side-by-side plots
     fnames <- fnames[setdiff(1:length(fnames), remove.indices)]
     params.list <- params.list[setdiff(1:length(params.list), remove.indices)]
+    fits <- fits[setdiff(1:length(fits), remove.indices)]
 
     if (length(params.list) > 0) {
         for (count in 1:length(params.list)) {
             # create ma summaries and single (not side-by-side) forest plots.
             #pretty.names <- eval(call(paste(fnames[count],".pretty.names",sep="")))
-            diagnostic.data.tmp <- compute.diag.point.estimates(diagnostic.data, params.list[[count]])
-            results.tmp <- loo.ma.diagnostic(fnames[[count]], diagnostic.data.tmp, params.list[[count]])
-            #if (is.null(params.list[[count]]$create.plot)) {
-            # create plot
+            results.tmp <- fits[[count]]$results
+            if (is.null(params.list[[count]]$create.plot)) {
+                # create plot
+                results.tmp <- c(loo.ma.diagnostic.plot(fits[[count]]$diagnostic.data, params.list[[count]],
+                                                        results.tmp$res, results.tmp$Summary),
+                                 list("References"=results.tmp$References))
+            }
             images.tmp <- results.tmp$images
             names(images.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
             images <- c(images, images.tmp)
@@ -1454,7 +1501,6 @@ multiple.loo.diagnostic <- function(fnames, params.list, diagnostic.data) {
             names(plot.params.paths.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$", params.list[[count]]$measure,sep=""))), " Forest Plot", sep="")
             plot.params.paths <- c(plot.params.paths, plot.params.paths.tmp)
             plot.names <- c(plot.names, results.tmp$plot.names)
-            #}
             summary.tmp <- list("Summary"=results.tmp$Summary)
             names(summary.tmp) <- paste(eval(parse(text=paste("pretty.names$measure$",params.list[[count]]$measure,sep=""))), " Summary", sep="")
             
@@ -1528,30 +1574,7 @@ loo.ma.diagnostic <- function(fname, diagnostic.data, params){
     loo.disp <- create.overall.display(res=loo.results, study.names, params, model.title, data.type="diagnostic")
         
     if (is.null(params$create.plot)) {
-        plot.data <- create.plot.data.loo(diagnostic.data, params, res=loo.results)
-        forest.path <- paste(params$fp_outpath, sep="")
-        changed.params <- plot.data$changed.params
-        # list of changed params values
-        params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
-        changed.params <- c(changed.params, params.changed.in.forest.plot)
-        params[names(changed.params)] <- changed.params
-        # update params values
-        # we use the system time as our unique-enough string to store
-        # the params object
-        forest.plot.params.path <- save.data(diagnostic.data, res=loo.results, params, plot.data)
-        #
-        # Now we package the results in a dictionary (technically, a named 
-        # vector). In particular, there are two fields that must be returned; 
-        # a dictionary of images (mapping titles to image paths) and a list of texts
-        # (mapping titles to pretty-printed text). In this case we have only one 
-        # of each. 
-        #     
-        plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
-        images <- c("Leave-one-out Forest plot"=forest.path)
-        plot.names <- c("loo forest plot"="loo_forest_plot")
-        results <- list("images"=images, "Summary"=loo.disp, 
-                        "plot_names"=plot.names, 
-                        "plot_params_paths"=plot.params.paths)
+        results <- loo.ma.diagnostic.plot(diagnostic.data, params, loo.results, loo.disp)
     } else {
         results <- list(res=loo.results, res.overall=res.overall, Summary=loo.disp) 
     } 
@@ -1561,6 +1584,36 @@ loo.ma.diagnostic <- function(fname, diagnostic.data, params){
     results
 }
 
+loo.ma.diagnostic.plot <- function(diagnostic.data, params, loo.results, loo.disp) {
+    # makes the forest plot of the leave-one-out results loo.results (and
+    # summary loo.disp) of loo.ma.diagnostic and returns the results
+    plot.data <- create.plot.data.loo(diagnostic.data, params, res=loo.results)
+    forest.path <- paste(params$fp_outpath, sep="")
+    changed.params <- plot.data$changed.params
+    # list of changed params values
+    params.changed.in.forest.plot <- forest.plot(forest.data=plot.data, outpath=forest.path)
+    changed.params <- c(changed.params, params.changed.in.forest.plot)
+    params[names(changed.params)] <- changed.params
+    # update params values
+    # we use the system time as our unique-enough string to store
+    # the params object
+    forest.plot.params.path <- save.data(diagnostic.data, res=loo.results, params, plot.data)
+    #
+    # Now we package the results in a dictionary (technically, a named 
+    # vector). In particular, there are two fields that must be returned; 
+    # a dictionary of images (mapping titles to image paths) and a list of texts
+    # (mapping titles to pretty-printed text). In this case we have only one 
+    # of each. 
+    #     
+    plot.params.paths <- c("Forest Plot"=forest.plot.params.path)
+    images <- c("Leave-one-out Forest plot"=forest.path)
+    plot.names <- c("loo forest plot"="loo_forest_plot")
+    results <- list("images"=images, "Summary"=loo.disp, 
+                    "plot_names"=plot.names, 
+                    "plot_params_paths"=plot.params.paths)
+    results
+}
+
 create.loo.side.by.side.plot.data <- function(diagnostic.data, params, res) {    
     # creates data for two side-by-side leave-one-out forest plots
     params.left <- params$left
@@ -1783,32 +1836,23 @@ subgroup.ma.diagnostic <- function(fname, diagnostic.data, params, selected.cov)
     params.tmp <- params
     params.tmp$create.plot <- FALSE
     params.tmp$write.to.file <- FALSE
-    subgroup.list <- unique(cov.vals)
-    grouped.data <- array(list(NULL),c(length(subgroup.list) + 1))
-    subgroup.results <- array(list(NULL), c(length(subgroup.list) + 1))
+    fits <- subgroup.fits(fname, diagnostic.data, params.tmp, cov.vals, get.subgroup.data.diagnostic)
+    subgroup.list <- fits$subgroup.list
+    grouped.data <- fits$grouped.data
+    subgroup.results <- fits$results
+    res <- fits$res
     col3.nums <- NULL
     col3.denoms <- NULL
     col4.nums <- NULL
     col4.denoms <- NULL
-    count <- 1
-    for (i in subgroup.list){
-      # build a DiagnosticData object 
-      diag.data.tmp <- get.subgroup.data.diagnostic(diagnostic.data, i, cov.vals)
-      grouped.data[[count]] <- diag.data.tmp
+    for (count in seq_along(subgroup.list)){
+      diag.data.tmp <- grouped.data[[count]]
       # collect raw data columns
       raw.data <- list("TP"=diag.data.tmp@TP, "FN"=diag.data.tmp@FN, "TN"=diag.data.tmp@TN, "FP"=diag.data.tmp@FP)
       terms <- compute.diagnostic.terms(raw.data, params.tmp)
       col3.nums <- c(col3.nums, terms$numerator, sum(terms$numerator))
       col3.denoms <- c(col3.denoms, terms$denominator, sum(terms$denominator))
-      cur.res <- eval(call(fname, diag.data.tmp, params.tmp))
-      cur.overall <- eval(call(paste(fname, ".overall", sep=""), cur.res))
-      subgroup.results[[count]] <- cur.overall
-      count <- count + 1
     }
-    res <- eval(call(fname, diagnostic.data, params.tmp))
-    res.overall <- eval(call(paste(fname, ".overall", sep=""), res))
-    grouped.data[[count]] <- diagnostic.data
-    subgroup.results[[count]] <- res.overall
     subgroup.names <- paste("Subgroup ", subgroup.list, sep="")
     subgroup.names <- c(subgroup.names, "Overall")
     
@@ -80,254 +80,80 @@ make.mods.str <-function(mods) {
 	mods.str
 }
 
-make.design.matrix <- function(strat.cov, mods, cond.means.data, data) {
-	# Make design matrix for conditional means
-	# strat.cov is the name of the covariate in data to stratify over
-	# This code is very sensitive to the fact that when there is an interaction
-	# of the form A:B, the coefficients are given such that the A coefficients iterate
-	# before the B coefficients
-	
-	nlevels <- length(levels(data[[strat.cov]])) # num of levels in strat.cov
-	rownames <- levels(data[[strat.cov]])
-	colnames <- c("Intercept")
-	dsn.matrix <- matrix(rep(1,nlevels)) # intercept column
-	
-	# 1 column for each numeric moderator
-	for (mod in mods[["numeric"]]) {
-		value <- cond.means.data[[mod]]
-		dsn.matrix <- cbind(dsn.matrix,rep(value,nlevels))
-		colnames<-c(colnames, mod)
-	}
-	
-	### NOTE: In following code mod.matrix is the part of the matrix to be stuck
-	###       on to dsn.matrix corresponding to a categorical moderator or
-	###       an interaction
-	# qi-1 columns for each categorical modertor where q is the # of levels of
-	# the moderator
+mods.level.structure <- function(data, mods) {
+	# The level structure of the categorical moderators in data (which are
+	# factors, with the reference value as the first level): for each, its
+	# levels and the integer code of each row. This is computed once per
+	# dataset and reused for the design matrices and the subset checks of
+	# bootstrap replicates (see all.levels.present), rather than going back
+	# to the data for each.
+	level.structure <- list()
 	for (mod in mods[["categorical"]]) {
-		l.mod <- levels(data[[mod]]) # levels of the moderator
-		mod.matrix <- c()
-		
-		if (mod==strat.cov) {
-			# iterate over the levels of the moderator
-			for (x in l.mod) {
-				x.coded <- coded.cat.mod.level(x, l.mod)
-				mod.matrix <- rbind(mod.matrix,x.coded)
-			}
-		} else {
-			# just replicate the coding of the desired level
-			value <- cond.means.data[[mod]]
-			lvl.coded <- coded.cat.mod.level(value, l.mod)
-			for (x in 1:nlevels) {
-				mod.matrix <- rbind(mod.matrix, lvl.coded)
-			}
-		} # end of else
-
-		dsn.matrix <- cbind(dsn.matrix, mod.matrix)
-		colnames<-c(colnames, paste(mod, l.mod[2:length(l.mod)],sep=""))
-	} # end for categorical
-	
-	
-	# interactions
-	interaction.mod.matrix <- c()
-	for (interaction in names(mods[['interactions']])) {
-		interaction.vars <- mods[['interactions']][[interaction]]
-		# What type of interaction? CAT:CAT, CAT:CONT, or CONT:CONT?
-		
-		cat.cat <- (interaction.vars[1] %in% mods[['categorical']]) && (interaction.vars[2] %in% mods[['categorical']])
-		# same thing
-		cat.cont <- (interaction.vars[1] %in% mods[['categorical']]) && (interaction.vars[2] %in% mods[['numeric']])
-		cont.cat <- (interaction.vars[1] %in% mods[['numeric']]) && (interaction.vars[2] %in% mods[['categorical']])
-		cat.cont <- cat.cont || cont.cat
-		
-		if (cat.cat) {
-			# two categorical variables Note: (p-1)*(q-1) columns where p and q
-		    # are the # of levels in the first categorical var and the 2nd
-		    # respectively
-			
-			cat1.levels <- levels(data[[interaction.vars[1]]])
-			cat2.levels <- levels(data[[interaction.vars[2]]])
-			
-			if (strat.cov %in% interaction.vars) {
-				# One of the variables in the interaction is the stratification variable		
-				strat.cov.is.first <- strat.cov ==  interaction.vars[1]
-				if (strat.cov.is.first) {
-					# iterate over levels of first cov, keeping 2nd cov level constant
-					value2 <- cond.means.data[[interaction.vars[2]]]
-					mod.matrix <- c()
-					for (value1 in cat1.levels) {
-						row.vector <- get.row.vector.cat.cat(
-								cat1.levels, cat2.levels,
-								value1, value2)
-						mod.matrix <- rbind(mod.matrix,row.vector)
-					}
-				}
-				else {
-					# strat.cov is 2nd
-					# Iterate over levels of 2nd cov, keeping the 1st cov level
-				    # constant.
-					value1 = cond.means.data[[interaction.vars[1]]]
-					mod.matrix <- c()
-					for (value2 in cat2.levels) {
-						row.vector <- get.row.vector.cat.cat(
-								cat1.levels, cat2.levels,
-								value1, value2)
-						mod.matrix <- rbind(mod.matrix,row.vector)
-					}
-				}
-			} else {
-				# Neither of the variables in the interaction is the stratification variable
-				value1 = cond.means.data[[interaction.vars[1]]]
-				value2 = cond.means.data[[interaction.vars[2]]]
-				
-				row.vector <- get.row.vector.cat.cat(
-						cat1.levels, cat2.levels,
-						value1, value2)
-				
-				mod.matrix <- c()
-				for (i in 1:nlevels) {
-					mod.matrix <- rbind(mod.matrix,row.vector)
-				}
-			} # end else strat.cov cat:cat
-			
-			### Generate column labels
-			# names of interaction vars
-			intvar1 <- interaction.vars[1]
-			intvar2 <- interaction.vars[2]
-			col.names.for.interaction <- c()
-			for (y in cat2.levels[2:length(cat2.levels)]) {
-				for (x in cat1.levels[2:length(cat1.levels)]) {
-					col.names.for.interaction <- c(col.names.for.interaction, paste(intvar1, x, ":",intvar2,y,sep=""))
-				}
-			}
-			colnames<-c(colnames, col.names.for.interaction)
-		} else if (cat.cont) {
-			# one categorical, one continuous # (p-1) columns
-			if (strat.cov %in% interaction.vars) {
-				# One of the variables in the interaction is the stratification variable
-				if (strat.cov==interaction.vars[1]) {
-					strat.levels <- levels(data[[interaction.vars[1]]])
-					cont.val <- cond.means.data[[interaction.vars[2]]]
-				} else {
-					strat.levels <- levels(data[[interaction.vars[2]]])
-					cont.val <- cond.means.data[[interaction.vars[1]]]
-				}
-				
-				mod.matrix <- c()
-				for (x in strat.levels) {
-					row.vector <- get.row.vector.cat.cont(strat.levels, x, cont.val)
-					mod.matrix <- rbind(mod.matrix,row.vector)
-				}
-				
-		    } else {
-             	# Neither of the variables in the interaction is the stratification variable
-                value1 <- cond.means.data[[interaction.vars[1]]]
-                value2 <- cond.means.data[[interaction.vars[2]]]
-				# Which of the interactions is the numeric, which the categorical?
-				if (class(value1) == "numeric") {
-					cont.val <- value1
-					cat.val <- value2
-					cat.levels <- levels(data[[interaction.vars[2]]])
-				} else {
-					cont.val <- value2
-					cat.val <- value1
-					cat.levels <- levels(data[[interaction.vars[1]]])
-				}
-			
-				row.vector <- get.row.vector.cat.cont(cat.levels, cat.val, cont.val)
-				mod.matrix <- c()
-				for (i in 1:nlevels) {
-					mod.matrix <- rbind(mod.matrix,row.vector)
-				}
-			}
-			
-			### Make column labels
-			intVar1 <- interaction.vars[1]
-			intVar2 <- interaction.vars[2]
-			if (intVar1 %in% mods[["numeric"]]) {
-				cont.var <- intVar1
-				cat.var <- intVar2
-			} else {
-				cont.var <- intVar2
-				cat.var <- intVar1
-			}
-			cat.levels <- levels(data[[cat.var]])
-			# Continuous label comes first, followed by cat levels
-            colnames <- c(colnames, paste(cont.var,":",cat.levels[2:length(cat.levels)],sep=""))
-			### END of make column labels
-		} else {
-			# two continuous variables # 1 column
-	        value1 <- cond.means.data[[interaction.vars[1]]]
-	        value2 <- cond.means.data[[interaction.vars[2]]]
-			mod.matrix <- rep(value1*value2, nlevels)
-			
-			colnames <- c(colnames, paste(interaction.vars[1],":",interaction.vars[2], sep=""))
-		}
-		interaction.mod.matrix <- cbind(interaction.mod.matrix,mod.matrix)
-		
-	} # end for interactions
-	dsn.matrix <- cbind(dsn.matrix, interaction.mod.matrix)
-	# Set helpful dimnames
-	dimnames(dsn.matrix) <- list(rownames, colnames)
-	return(dsn.matrix)
+		level.structure[[mod]] <- list(levels=levels(data[[mod]]),
+		                               codes=as.integer(data[[mod]]))
+	}
+	level.structure
 }
 
-#mod.matrix.for.strat.cov.in.cat.cat <- function()
-get.row.vector.cat.cat <- function(cat1.levels, cat2.levels, value1, value2) {	
-	# Returns a row vector for part of the mod.matrix for a cat:cat interaction
-	# given the levels of the categories and the values the categories take
-	row.vector <- c()
-	# We need to generate a vector, then replicate it 
-	# iterate over column values
-	# Note: we ignore the first level in each category since it is naturally
-	# coded
-	for (y in cat2.levels[2:length(cat2.levels)]) {
-		# rma varies 1st covariate faster than 2nd
-		for (x in cat1.levels[2:length(cat1.levels)]) {
-			row.vector <- c(row.vector, ifelse(y==value2 && x==value1, 1,0))
+cov.level.structure <- function(reg.data) {
+	# As mods.level.structure, for the factor covariates of reg.data; the
+	# levels are as in extract.cov.data (sorted, without "")
+	level.structure <- list()
+	for (cov in reg.data@covariates) {
+		if (cov@cov.type=="factor") {
+			levels <- setdiff(sort(unique(cov@cov.vals)), "")
+			level.structure[[cov@cov.name]] <- list(levels=levels,
+			                                        codes=match(cov@cov.vals, levels))
 		}
 	}
-	
-	return(row.vector)
+	level.structure
 }
 
-get.row.vector.cat.cont <- function(cat.levels, cat.val, cont.val) {
-	# cat.levels: levels of categorical covariate
-	# cat.val: chosen value of categorical variable (a level)
-	# cont.val: chosen value of continuous variable
-	
-	row <- c()
-	# ignore first level since it is naturally coded
-	for (x in cat.levels[2:length(cat.levels)]) {
-		row <- c(row, ifelse(x==cat.val, 1, 0))
+all.levels.present <- function(level.structure, indices) {
+	# Are all the levels of each categorical variable in level.structure
+	# (see mods.level.structure) present among the rows at indices?
+	for (var in level.structure) {
+		counts <- tabulate(var$codes[indices], nbins=length(var$levels)) # ignores NAs
+		if (any(counts==0)) {
+			return(FALSE)
+		}
 	}
-	row <- cont.val * row
-	return(row)
+	return(TRUE)
 }
 
-
-coded.cat.mod.level <- function(lvl, l.mod) {
-	# gives a coded representation of the moderator according to the order
-	# of levels in l.mod
-	# l.mod: levels in the moderator
-	# lvl chosen lvl to get the coding for
-	#
-	# E.g. if levels(moderator) == c("USA","CANADA","CHINA")
-	# lvl
-	# "USA" --> c(0,0)
-	# "CANADA" --> c(1,0)
-	# "CHINA" -- > c(0,1)
-	
-	# Find index of lvl in l.mod
-	index <- match(lvl, l.mod)
-	n.levels <- length(l.mod)
+make.design.matrix <- function(strat.cov, mods, cond.means.data, data,
+                               level.structure=mods.level.structure(data, mods)) {
+	# Make design matrix for conditional means
+	# strat.cov is the name of the covariate in data to stratify over
+	# There is a row for each level of strat.cov, with the other moderators
+	# held at their values in cond.means.data. The rows are built in one go
+	# by model.matrix from the same formula that rma.uni is given, so the
+	# columns (treatment contrasts, with the reference value as the first
+	# level, and interactions in the order rma iterates over them) line up
+	# with the regression coefficients.
+	rownames <- level.structure[[strat.cov]]$levels
+	nlevels <- length(rownames) # num of levels in strat.cov
+	
+	new.data <- list()
+	for (mod in mods[["numeric"]]) {
+		new.data[[mod]] <- rep(as.numeric(cond.means.data[[mod]]), nlevels)
+	}
+	for (mod in mods[["categorical"]]) {
+		if (mod==strat.cov) {
+			values <- rownames
+		} else {
+			values <- rep(as.character(cond.means.data[[mod]]), nlevels)
+		}
+		new.data[[mod]] <- factor(values, levels=level.structure[[mod]]$levels)
+	}
+	new.data <- data.frame(new.data, check.names=FALSE)
 	
-	# Make coding matrix e.g.
-	# USA    0 0 # zero vector
-	# CANADA 1 0 # identity matrix 
-	# CHINA  0 1 # 
-	code.matrix <- rbind(rep(0,n.levels-1),diag(n.levels-1))
-	code.matrix[index,]
+	mods.formula <- as.formula(make.mods.str(mods))
+	dsn.matrix <- model.matrix(mods.formula, data=new.data)
+	colnames <- c("Intercept", colnames(dsn.matrix)[-1])
+	# Set helpful dimnames
+	dsn.matrix <- matrix(dsn.matrix, nrow=nlevels, dimnames=list(rownames, colnames))
+	return(dsn.matrix)
 }
 
 
@@ -593,12 +419,8 @@ g.bootstrap.meta.regression <- function(data, mods, method, level, digits,
 	
 	###### Bootstrap
 	max.failures <- 5*n.replicates # # failures generating test statistic before we give up
-	# Count number of levels for each categorical covariate
-	cat.mods.level.counts <- list()
-	for (mod in mods[["categorical"]]) {
-		n.levels <- length(levels(data[[mod]]))
-		cat.mods.level.counts[[mod]] <- n.levels
-	}
+	# The levels of each categorical covariate
+	level.structure <- mods.level.structure(data, mods)
 	
 	# Statistic passed to boot
 	meta.reg.statistic <- function(data, indices) {
@@ -632,15 +454,7 @@ g.bootstrap.meta.regression <- function(data, mods, method, level, digits,
 	
 	subset.ok <- function(data, indices) {
 		# Are all the categorical levels present in the subset?
-		data.subset = data[indices,]
-		
-		for (mod in mods[["categorical"]]) {
-			n.levels <- length(unique(data[[mod]]))
-			if (n.levels != cat.mods.level.counts[[mod]]) {
-				return(FALSE)
-			}
-		}
-		return(TRUE)
+		all.levels.present(level.structure, indices)
 	}
 	
 	# Run the bootstrap analysis
@@ -694,17 +508,14 @@ g.bootstrap.meta.regression.cond.means <- function(
 	
 	mods.str <- make.mods.str(mods)
 	
+	# The levels of each categorical covariate
+	level.structure <- mods.level.structure(data, mods)
+	
 	### Generate conditional means
-	A <- make.design.matrix(strat.cov, mods, cond.means.data, data)
+	A <- make.design.matrix(strat.cov, mods, cond.means.data, data, level.structure)
 
 	###### Bootstrap
 	max.failures <- 5*n.replicates # # failures generating test statistic before we give up
-	# Count number of levels for each categorical covariate
-	cat.mods.level.counts <- list()
-	for (mod in mods[["categorical"]]) {
-		n.levels <- length(levels(data[[mod]]))
-		cat.mods.level.counts[[mod]] <- n.levels
-	}
 	
 	# Statistic passed to boot
 	cond.means.reg.statistic <- function(data, indices) {
@@ -742,18 +553,9 @@ g.bootstrap.meta.regression.cond.means <- function(
 	
 	subset.ok <- function(data, indices) {
 		# Are all the categorical levels present in the subset?
-		data.subset = data[indices,]
-		
-		for (mod in mods[["categorical"]]) {
-			# issue #205 (OpenMEE) -- to be changed data to data.subset
-			# here to make sure all levels are present in 
-			# the sample
-			n.levels <- length(unique(data.subset[[mod]]))
-			if (n.levels != cat.mods.level.counts[[mod]]) {
-				return(FALSE)
-			}
-		}
-		return(TRUE)
+		# issue #205 (OpenMEE) -- make sure all levels are present in 
+		# the sample
+		all.levels.present(level.structure, indices)
 	}
 	
 	# Run the bootstrap analysis
@@ -761,7 +563,7 @@ g.bootstrap.meta.regression.cond.means <- function(
 	res.boot <- boot(data, statistic=cond.means.reg.statistic, R=n.replicates)
 	
 	### Construct output
-	coeff.names <- levels(data[[strat.cov]])
+	coeff.names <- level.structure[[strat.cov]]$levels
 	b=res.boot$t0
 	ci.lb <- c()
 	ci.ub <- c()
@@ -807,10 +609,15 @@ g.bootstrap.meta.regression.cond.means <- function(
 }
 
 
-meta.regression <- function(reg.data, params, cond.means.data=NULL, stop.at.rma=FALSE) {
-	cov.data <- extract.cov.data(reg.data)
-	cov.array <- cov.data$cov.array
-	cat.ref.var.and.levels <- cov.data$cat.ref.var.and.levels
+meta.regression <- function(reg.data, params, cond.means.data=NULL, stop.at.rma=FALSE, cov.array=NULL) {
+	# cov.array: the covariate array of reg.data (see extract.cov.data), if
+	# it is already at hand, e.g. as rows of the array of the dataset that
+	# reg.data is a bootstrap sample of. Only used if stop.at.rma is TRUE.
+	if (!(stop.at.rma && isnt.null(cov.array))) {
+		cov.data <- extract.cov.data(reg.data)
+		cov.array <- cov.data$cov.array
+		cat.ref.var.and.levels <- cov.data$cat.ref.var.and.levels
+	}
 
 	# remove when and if method dialog is added
 	method <- as.character(params$rm.method)
@@ -953,15 +760,14 @@ extract.cov.data <- function(reg.data, dont.make.array = FALSE) {
 	  
 	  
       cov.cols <- array(dim=c(length(reg.data@y), length(levels.minus.ref.var)))
-      studies.col <- c(sum(cov.vals==ref.var))
-      for (col.index in 1:length(levels.minus.ref.var)) {
-           level <- levels.minus.ref.var[col.index]
-		   if (!dont.make.array) {
-               cov.cols[cov.vals!="" & cov.vals!=level, col.index] <- 0
-               cov.cols[cov.vals!="" & cov.vals==level, col.index] <- 1
-	       }
-           studies.col <- c(studies.col, sum(cov.vals==level)) 
+      if (!dont.make.array) {
+          # dummy coding of all the levels at once; missing values ("" or
+          # NA) are NA
+          cov.cols[] <- 1 * outer(cov.vals, levels.minus.ref.var, "==")
+          cov.cols[which(cov.vals==""),] <- NA
       }
+      studies.col <- c(sum(cov.vals==ref.var),
+                       sapply(levels.minus.ref.var, function(level) sum(cov.vals==level), USE.NAMES=FALSE))
       factor.cov.array <- cbind(factor.cov.array, cov.cols)
       factor.n.levels <- c(factor.n.levels, length(levels.minus.NA))
       factor.cov.display.col <- c(factor.cov.display.col, cov.name, rep("",length(levels.minus.ref.var)))
@@ -24,13 +24,17 @@
 #	iter:
 #	retpermdist:
 #	makepermdisthist:
+#	n.cores: # of processes to run the (approximate) permutations over
+#	mc.error: stop early once the Monte-Carlo standard error of the
+#		p-values is below this (see parallel.permutest)
+#	seed: seed for the permutations
 #
 ############################################################################
 permuted.ma <- function(
 	# meta-analysis parameters
 	data, method, intercept=TRUE, level=95, digits=4, knha=FALSE, weighted=TRUE,
 	# Permutation parameters
-	exact=FALSE, iter=1000, retpermdist=FALSE) {
+	exact=FALSE, iter=1000, retpermdist=FALSE, n.cores=1, mc.error=NULL, seed=NULL) {
 	
 	ma.res <- rma.uni(yi, vi,
 		intercept=intercept,
@@ -42,9 +46,9 @@ permuted.ma <- function(
 		digits=digits,
 		weighted=weighted)
 
-	perm.res <- permutest(ma.res, exact=exact, iter=iter,
-              retpermdist=FALSE, digits=digits)
-	summary <- paste(capture.output(perm.res), collapse="\n")
+	perm.res <- run.permutest(ma.res, exact=exact, iter=iter,
+              retpermdist=FALSE, digits=digits, n.cores=n.cores, mc.error=mc.error, seed=seed)
+	summary <- permutest.summary(perm.res)
 
 	results <- list(
 		"Summary"=summary,
@@ -57,7 +61,7 @@ permuted.meta.reg <- function (
 	# meta-regresion parameters
 	data, method, mods, intercept=TRUE, level=95, digits=4, knha=FALSE, btt=NULL,
 	# Permutation parameters
-	exact=FALSE, iter=1000, retpermdist=FALSE,
+	exact=FALSE, iter=1000, retpermdist=FALSE, n.cores=1, mc.error=NULL, seed=NULL,
 	# Other parameters
 	include.meta.reg.summary=TRUE # show regular meta regression results too in output
 	) {
@@ -67,9 +71,9 @@ permuted.meta.reg <- function (
 	# obtain regression result rma.uni
 	reg.res <- regression.wrapper(data, mods.str, method, level, digits, btt)
 
-	perm.res <- permutest(reg.res, exact=exact, iter=iter,
-              retpermdist=retpermdist, digits=digits)
-	summary <- paste(capture.output(perm.res), collapse="\n")
+	perm.res <- run.permutest(reg.res, exact=exact, iter=iter,
+              retpermdist=retpermdist, digits=digits, n.cores=n.cores, mc.error=mc.error, seed=seed)
+	summary <- permutest.summary(perm.res)
 
 	results <- list(
 		"Permuted Meta-Regression Summary"=summary,
@@ -97,6 +101,182 @@ permuted.meta.reg <- function (
 	results
 }
 
+run.permutest <- function(res, exact, iter, retpermdist, digits, n.cores=1, mc.error=NULL, seed=NULL) {
+	# metafor's permutest, unless the approximate test is to be run in
+	# parallel or stopped early. Exact tests enumerate the permutations and
+	# are always run by permutest.
+	if (exact || (n.cores <= 1 && is.null(mc.error))) {
+		if (isnt.null(seed)) {
+			set.seed(seed)
+		}
+		return(permutest(res, exact=exact, iter=iter, retpermdist=retpermdist, digits=digits))
+	}
+	parallel.permutest(res, iter=iter, retpermdist=retpermdist, digits=digits,
+	                   n.cores=n.cores, mc.error=mc.error, seed=seed)
+}
+
+parallel.permutest <- function(res, iter=1000, retpermdist=FALSE, digits=4,
+                               n.cores=1, mc.error=NULL, chunk.size=1000, seed=NULL) {
+	# An approximate permutation test of res (an rma.uni fit), as
+	# permutest(res, exact=FALSE, iter=iter, ...), with the iterations split
+	# in chunks of (at most) chunk.size that are run over n.cores processes.
+	# Each chunk has its own L'Ecuyer-CMRG random number stream, so the
+	# results depend on seed but not on n.cores. The permutation
+	# distributions of the chunks are merged and the p-values computed from
+	# the merged distributions.
+	#
+	# If mc.error is given, the chunks are run n.cores at a time, and the
+	# test stops after the first chunk (in chunk order) at which the
+	# Monte-Carlo standard error of every p-value, sqrt((p(1-p) + 1/n)/n)
+	# after n iterations, is below mc.error; iter is
+	# then the most iterations that are run. Chunks run past that point are
+	# dropped, so that where the test stops doesn't depend on n.cores either.
+	if (!suppressWarnings(require(parallel, quietly=TRUE))) {
+		return(permutest(res, exact=FALSE, iter=iter, retpermdist=retpermdist, digits=digits))
+	}
+	if (.Platform$OS.type == "windows") {
+		n.cores <- 1
+	}
+	
+	chunk.iters <- rep(chunk.size, iter %/% chunk.size)
+	if (iter %% chunk.size > 0) {
+		chunk.iters <- c(chunk.iters, iter %% chunk.size)
+	}
+	streams <- permutation.rng.streams(length(chunk.iters), seed)
+	
+	# run.chunk sets the global generator to the chunk's stream; that is
+	# undone once the chunks are run in this process
+	rng.state <- save.rng.state()
+	on.exit(restore.rng.state(rng.state))
+	run.chunk <- function(i) {
+		assign(".Random.seed", streams[[i]], envir=globalenv())
+		permutest(res, exact=FALSE, iter=chunk.iters[i], retpermdist=TRUE, digits=digits)
+	}
+	merge.chunks <- function(chunks) {
+		zval.perm <- do.call(rbind, lapply(chunks, function(chunk) as.matrix(chunk$zval.perm)))
+		QM.perm <- unlist(lapply(chunks, function(chunk) chunk$QM.perm))
+		list(zval.perm=zval.perm, QM.perm=QM.perm,
+		     pvals=permutation.pvals(res, zval.perm, QM.perm))
+	}
+	
+	round.size <- if (is.null(mc.error)) length(chunk.iters) else max(n.cores, 1)
+	chunks <- list()
+	stopped <- FALSE
+	while (!stopped && length(chunks) < length(chunk.iters)) {
+		to.run <- (length(chunks)+1):min(length(chunks)+round.size, length(chunk.iters))
+		if (n.cores > 1) {
+			round.chunks <- mclapply(to.run, run.chunk, mc.cores=n.cores)
+		} else {
+			round.chunks <- lapply(to.run, run.chunk)
+		}
+		for (chunk in round.chunks) {
+			if (class(chunk)[1] == "try-error") {
+				stop(chunk)
+			}
+			chunks <- c(chunks, list(chunk))
+			if (isnt.null(mc.error)) {
+				merged <- merge.chunks(chunks)
+				n.iter <- nrow(merged$zval.perm)
+				# p(1-p)/n alone is 0 while no permutation is as extreme as
+				# the data (p = 0 or 1), which would stop the tests that
+				# matter most after the first chunk; the 1/n keeps it from
+				# going below what n iterations can resolve
+				if (all(sqrt((merged$pvals*(1-merged$pvals) + 1/n.iter)/n.iter) < mc.error)) {
+					stopped <- TRUE
+					break
+				}
+			}
+		}
+	}
+	
+	merged <- merge.chunks(chunks)
+	zval.perm <- merged$zval.perm
+	QM.perm <- merged$QM.perm
+	pvals <- merged$pvals
+	n.iter <- nrow(zval.perm)
+	
+	# the first chunk's result, with the merged distributions
+	perm.res <- chunks[[1]]
+	perm.res$pval <- pvals[seq_len(ncol(zval.perm))]
+	if (isnt.null(QM.perm)) {
+		perm.res$QMp <- pvals[["QMp"]]
+	}
+	perm.res$zval.perm <- if (retpermdist) data.frame(zval.perm) else NULL
+	perm.res$QM.perm <- if (retpermdist) QM.perm else NULL
+	perm.res$iter <- n.iter
+	perm.res$mc.error <- mc.error
+	perm.res
+}
+
+permutation.rng.streams <- function(n, seed=NULL) {
+	# n independent L'Ecuyer-CMRG streams, starting from seed (drawn from
+	# the current generator if it is NULL). The caller's generator is left
+	# as it was (after drawing the seed).
+	if (is.null(seed)) {
+		seed <- sample.int(.Machine$integer.max, 1)
+	}
+	rng.state <- save.rng.state()
+	on.exit(restore.rng.state(rng.state))
+	
+	RNGkind("L'Ecuyer-CMRG")
+	set.seed(seed)
+	streams <- list(get(".Random.seed", envir=globalenv()))
+	for (i in seq_len(n-1)) {
+		streams[[i+1]] <- nextRNGStream(streams[[i]])
+	}
+	streams
+}
+
+save.rng.state <- function() {
+	# the kind of the global random number generator and its seed (NULL if
+	# it hasn't been seeded yet); see restore.rng.state
+	seed <- NULL
+	if (exists(".Random.seed", envir=globalenv(), inherits=FALSE)) {
+		seed <- get(".Random.seed", envir=globalenv(), inherits=FALSE)
+	}
+	list(kind=RNGkind()[1], seed=seed)
+}
+
+restore.rng.state <- function(state) {
+	RNGkind(state$kind)
+	if (is.null(state$seed)) {
+		if (exists(".Random.seed", envir=globalenv(), inherits=FALSE)) {
+			rm(".Random.seed", envir=globalenv())
+		}
+	} else {
+		assign(".Random.seed", state$seed, envir=globalenv())
+	}
+}
+
+permutation.pvals <- function(res, zval.perm, QM.perm) {
+	# The p-values of the coefficients of res (and of the omnibus test, as
+	# QMp, if QM.perm isn't NULL) from permutation distributions, computed
+	# as permutest does
+	zval <- c(res$zval)
+	if (isTRUE(res$int.only)) {
+		# two-sided
+		pval <- min(1, 2*min(mean(zval.perm[,1] >= zval), mean(zval.perm[,1] <= zval)))
+	} else {
+		pval <- colMeans(abs(zval.perm) >= rep(abs(zval), each=nrow(zval.perm)))
+	}
+	pval <- unname(pval)
+	if (isnt.null(QM.perm)) {
+		pval <- c(pval, QMp=mean(QM.perm >= res$QM))
+	}
+	pval
+}
+
+permutest.summary <- function(perm.res) {
+	summary <- paste(capture.output(perm.res), collapse="\n")
+	if (isnt.null(perm.res$iter) && isnt.null(perm.res$mc.error)) {
+		summary <- paste(summary,
+		                 sprintf("Stopped after %d iterations; Monte-Carlo standard error of the p-values < %s",
+		                         perm.res$iter, perm.res$mc.error),
+		                 sep="\n\n")
+	}
+	summary
+}
+
 permutest.value.info <- function(retpermdist, meta.reg.mode=TRUE) {
 	info = list(
 			pval = list(type="vector", description='p-value(s) based on the permutation test.'),
@@ -701,6 +701,10 @@ set.plot.options <- function(params) {
     }
     plot.options$show.y.axis <- TRUE
     
+    # if layout.only is TRUE, forest.plot doesn't draw anything; the plot
+    # is rendered on the python side from forest.plot.layout
+    plot.options$layout.only <- isTRUE(as.logical(params$fp_layout_only))
+    
     plot.options$digits <- params$digits
     plot.options$changed.params <- changed.params
     plot.options
@@ -807,6 +811,11 @@ pretty.metric.name <- function(metric) {
 #            forest plot              #
 #######################################
 forest.plot <- function(forest.data, outpath) {
+  if (isTRUE(forest.data$options$layout.only)) {
+      # nothing is drawn here (see forest.plot.layout); just report the
+      # params that drawing the plot would have changed.
+      return(forest.plot.layout(forest.data)$changed.params)
+  }
   png(filename=paste("r_tmp","INTER",sep="/")) # to fix windows popping out at you issue
 	
   # calculates plot sizes and layout, and then calls draw.forest.plot.
@@ -886,6 +895,230 @@ forest.plot <- function(forest.data, outpath) {
   changed.params
 }
 
+#######################################
+#         forest plot layout          #
+#######################################
+forest.plot.layout <- function(forest.data) {
+    # Computes what forest.plot draws -- row positions, the text columns,
+    # CIs, boxes and diamonds, axis ticks -- as plain vectors, without
+    # opening a graphics device. This is used to render forest plots
+    # directly on the python side. Fields:
+    #
+    # - rows, types - row numbers (including blank rows) and row types (see
+    #                 forest.plot) of all rows, including the header row
+    # - text.cols - named list of the text columns (study names, effect
+    #               sizes, raw data), one entry per row; shown columns only
+    # - ES, LL, UL, box.sizes - effects (in plot scale) and box sizes of
+    #               the rows after the header row
+    # - plot.range, scale, summary.est
+    # - tick.at, tick.labels - x-axis ticks (in plot scale) and their labels
+    # - xlabel, title, show.summary.line, zero.line
+    # - changed.params - params that drawing the plot would have changed
+    forest.data <- format.data.cols(forest.data)
+    options <- forest.data$options
+    types <- forest.data$types
+    rows <- assign.rows(types, length(forest.data$label))
+    effects <- forest.data$effects
+    plot.range <- forest.data$plot.range
+    scale <- forest.data$scale
+    if (!is.null(forest.data$summary.est)) {
+       # This is the summary estimate for loo plots.  
+       summary.est <- forest.data$summary.est    
+    } else {
+       summary.est <- effects$ES[length(effects$ES)]
+    }
+
+    text.cols <- list()
+    if (options$show.study.col == TRUE) {
+        text.cols$study <- as.character(forest.data$label)
+    }
+    for (col.name in names(forest.data$additional.col.data)) {
+        text.cols[[col.name]] <- as.character(forest.data$additional.col.data[[col.name]])
+    }
+    text.cols <- lapply(text.cols, function(col) {col[is.na(col)] <- ""; col})
+
+    zero.line <- options$show.y.axis == TRUE && scale %in% c("log", "standard", "logit") &&
+                 min(plot.range) < 0 && max(plot.range) > 0
+
+    layout <- list(rows=rows, types=types, text.cols=text.cols,
+                   ES=effects$ES, LL=effects$LL, UL=effects$UL,
+                   box.sizes=calc.box.sizes(forest.data, box.sca=0.8),
+                   plot.range=plot.range, scale=scale, summary.est=summary.est,
+                   zero.line=zero.line)
+    c(layout, forest.plot.axis.layout(forest.data, summary.est))
+}
+
+forest.plot.axis.layout <- function(forest.data, summary.est) {
+    # the fields of forest.plot.layout that depend only on the x-axis options
+    options <- forest.data$options
+    ticks <- forest.plot.ticks(forest.data$scale, forest.data$plot.range,
+                               options$xticks, summary.est)
+    list(tick.at=ticks$at, tick.labels=as.character(ticks$labels),
+         xlabel=as.character(options$xlabel), title=as.character(options$fp.title),
+         show.summary.line=isTRUE(options$show.summary.line),
+         changed.params=ticks$changed.params)
+}
+
+forest.plot.ticks <- function(scale, plot.range, user.ticks, summary.est) {
+    # x-axis tick marks as chosen in draw.data.col, but without a device
+    changed.params <- list()
+    if (scale == "log") {
+        if (is.na(user.ticks[1])) {
+            to.make.ticks <- range(exp(plot.range))
+            ticks <- axTicks(1, axp=c(to.make.ticks, 3), usr=c(-100, 100), log=TRUE)
+            log.ticks <- sort(c(log(ticks), plot.range, summary.est))
+            log.ticks <- log.ticks[log.ticks >= min(plot.range)]
+            log.ticks <- log.ticks[log.ticks <= max(plot.range)]
+            ticks <- exp(log.ticks)
+            labels <- round(ticks, 2)
+            changed.params$fp_xticks <- ticks
+        } else {
+            ticks <- user.ticks[user.ticks > 0]
+            if (length(ticks) > 0) {
+                ticks <- unique(ticks)
+                log.ticks <- log(sort(ticks))
+                labels <- round(sort(ticks), 2)
+            } else {
+                log.ticks <- plot.range
+                labels <- rep("", 2)
+            }
+        }
+        at <- log.ticks
+    } else if (scale %in% c("logit", "arcsine")) {
+        if (is.na(user.ticks[1])) {
+            at <- axTicks(1, axp=c(min(plot.range), max(plot.range), 4),
+                          usr=range(plot.range), log=FALSE)
+            changed.params$fp_xticks <- at
+        } else {
+            at <- user.ticks
+        }
+        labels <- round(at, 2)
+    } else {
+        # standard
+        if (is.na(user.ticks[1])) {
+            at <- grid.pretty(plot.range)
+        } else {
+            at <- user.ticks
+        }
+        labels <- at
+    }
+    list(at=at, labels=labels, changed.params=changed.params)
+}
+
+#######################################
+#       forest plot edit sessions     #
+#######################################
+# While a forest plot is open in the plot editor, its data, params, results,
+# plot data and layout are kept here, in an environment of their own keyed
+# by the plot's params path. Applying an edit then only recomputes what the
+# edited params affect, rather than re-loading everything from disk and
+# building the plot data from scratch.
+plot.edit.sessions <- new.env()
+
+# params that change the plot data itself (i.e., the range of the plot);
+# the plot data is rebuilt when one of these is edited
+PLOT.DATA.PARAMS <- c("fp_plot_lb", "fp_plot_ub")
+# params that affect only the x-axis of the plot, not the columns
+PLOT.AXIS.PARAMS <- c("fp_xticks", "fp_xlabel", "fp_show_summary_line")
+
+open.plot.edit.session <- function(params.path) {
+    # loads the plot saved to params.path (see save.data) and returns its params
+    session <- new.env()
+    for (ext in c("data", "params", "res")) {
+        load(paste(params.path, ext, sep="."), envir=session)
+    }
+    plot.data.path <- paste(params.path, "plotdata", sep=".")
+    if (file.exists(plot.data.path)) {
+        load(plot.data.path, envir=session)
+    } else {
+        session$plot.data <- create.plot.data.for.editing(session$om.data, session$params, session$res)
+    }
+    session$layout <- NULL
+    assign(params.path, session, envir=plot.edit.sessions)
+    session$params
+}
+
+close.plot.edit.session <- function(params.path) {
+    if (exists(params.path, envir=plot.edit.sessions, inherits=FALSE)) {
+        rm(list=params.path, envir=plot.edit.sessions)
+    }
+}
+
+plot.edit.session.data <- function(params.path) {
+    get(params.path, envir=plot.edit.sessions, inherits=FALSE)$plot.data
+}
+
+update.plot.edit.session <- function(params.path, new.params) {
+    # Applies the (named list of) plot params new.params to the plot being
+    # edited, recomputing only what they affect, and writes the params and
+    # plot data out. Returns the layout of the updated plot (see
+    # forest.plot.layout).
+    session <- get(params.path, envir=plot.edit.sessions, inherits=FALSE)
+    params <- session$params
+    changed <- c()
+    for (name in names(new.params)) {
+        if (!identical(as.character(params[[name]]), as.character(new.params[[name]]))) {
+            changed <- c(changed, name)
+        }
+    }
+    params[names(new.params)] <- new.params
+    session$params <- params
+
+    if (length(changed) == 0 && !is.null(session$layout)) {
+        return(session$layout)
+    }
+
+    if (any(changed %in% PLOT.DATA.PARAMS)) {
+        session$plot.data <- create.plot.data.for.editing(session$om.data, params, session$res)
+        session$layout <- forest.plot.layout(session$plot.data)
+    } else {
+        session$plot.data <- update.plot.data.options(session$plot.data, params)
+        if (!is.null(session$layout) && all(changed %in% PLOT.AXIS.PARAMS)) {
+            # the rows and columns are as they were
+            session$layout <- update.forest.plot.layout.axis(session$layout, session$plot.data)
+        } else {
+            session$layout <- forest.plot.layout(session$plot.data)
+        }
+    }
+
+    save(params, file=paste(params.path, ".params", sep=""))
+    save.plot.data(session$plot.data, params.path)
+    session$layout
+}
+
+create.plot.data.for.editing <- function(om.data, params, res) {
+    if (is(om.data, "BinaryData")) {
+        create.plot.data.binary(om.data, params, res)
+    } else if (is(om.data, "ContinuousData")) {
+        create.plot.data.continuous(om.data, params, res)
+    } else {
+        create.plot.data.diagnostic(om.data, params, res)
+    }
+}
+
+update.plot.data.options <- function(plot.data, params) {
+    # sets the options of plot.data from params, without recomputing the
+    # effects or plot range (so the plot bounds are kept as they were)
+    options <- set.plot.options(params)
+    options$plot.lb <- plot.data$options$plot.lb
+    options$plot.ub <- plot.data$options$plot.ub
+    options$show.y.axis <- plot.data$options$show.y.axis
+    plot.data$options <- options
+    if (plot.data$types[1] == 3) {
+        # the label of the study column
+        plot.data$label[1] <- as.character(params$fp_col1_str)
+    }
+    plot.data$changed.params[names(options$changed.params)] <- options$changed.params
+    plot.data
+}
+
+update.forest.plot.layout.axis <- function(layout, forest.data) {
+    # recomputes only the x-axis part of layout (see forest.plot.layout)
+    axis <- forest.plot.axis.layout(forest.data, layout$summary.est)
+    layout[names(axis)] <- axis
+    layout
+}
+
 #############################################################
 #   functions for creating graphical objects and viewports  #
 #############################################################
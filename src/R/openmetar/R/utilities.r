@@ -36,76 +36,51 @@ print.summary.display <- function(summary.disp,...) {
 
 print.summary.data <- function(table.data,...) {
   # Prints an array table.data.
+  cat("\n")
+  cat(paste(summary.table.rows(table.data), "\n\n", sep=""), sep="")
+}
+
+summary.table.rows <- function(table.data) {
+  # Returns the rows of table.data as printed by print.summary.data. The
+  # columns are padded whole, rather than entry by entry, as cumulative and
+  # leave-one-out summaries have a row per study.
   num.rows <- length(table.data[,1])
   num.cols <- length(table.data[1,])
   # Compute column widths
   extra.col.spaces <- 2
-  #table.line <- " "
-  # This was for the old table lines.
-  col.widths <- NULL
-  for (col.index in 1:num.cols) {
-    width <- max(nchar(table.data[,col.index])) + extra.col.spaces
-    col.widths <- c(col.widths, max(nchar(table.data[,col.index])) + extra.col.spaces)
-    #spaces <- rep(" ", width)
-    #dash.line <- create.repeat.string("-", width)
-    #table.line <- paste(table.line, spaces, " ", sep="")
-  }
-  table.width <- sum(col.widths) + num.cols + 1
-  # Build table
-  #cat(table.line)
-  cat("\n")
-  
-  for (row.index in 1:num.rows) {
-    study.name <- table.data[row.index, 1]
-    # Study names are aligned left
-    end.num <- col.widths[1] - nchar(study.name) -1
-    table.row <- pad.with.spaces(study.name, 1, end.num)
-    if (num.cols > 1) {
-      for (col.index in 2:num.cols) {
-        # Data is aligned right
-        col.width <- col.widths[col.index]
-        entry <- table.data[row.index,col.index]
-        # pad entries with spaces to align columns.
-        end.num <- ceiling((col.width - nchar(entry))/2)
-        pos.num.check <- ((row.index>1) & (regexpr("-", entry)!=1) & (regexpr("<", entry)!=1))
-        if (!(is.na(pos.num.check)) && pos.num.check) {
-          # entry is a positive number so add extra space to align decimal sign.
-          entry <- paste(" ", entry, sep="")
-        } 
-        begin.num <- floor((col.width - nchar(entry))/2)
-        end.num <- col.width - begin.num - nchar(entry)
-        padded.entry <- pad.with.spaces(entry, begin.num, end.num)
-        table.row <- paste(table.row, padded.entry, " ", sep="")
-      }
+  col.widths <- sapply(1:num.cols, function(col.index) max(nchar(table.data[,col.index])) + extra.col.spaces)
+  # Study names are aligned left
+  study.names <- table.data[,1]
+  table.rows <- pad.with.spaces(study.names, 1, col.widths[1] - nchar(study.names) - 1)
+  if (num.cols > 1) {
+    for (col.index in 2:num.cols) {
+      # Data is aligned right
+      col.width <- col.widths[col.index]
+      entries <- table.data[,col.index]
+      # positive numbers get an extra space to align the decimal signs
+      pos.num.check <- ((1:num.rows > 1) & (regexpr("-", entries)!=1) & (regexpr("<", entries)!=1))
+      pos.num <- !is.na(pos.num.check) & pos.num.check
+      entries[pos.num] <- paste(" ", entries[pos.num], sep="")
+      # pad entries with spaces to align columns.
+      begin.num <- floor((col.width - nchar(entries))/2)
+      end.num <- col.width - begin.num - nchar(entries)
+      table.rows <- paste(table.rows, pad.with.spaces(entries, begin.num, end.num), " ", sep="")
     }
-    cat(table.row)
-    cat("\n")
-    #cat(table.line)
-    cat("\n")
   }
+  table.rows
 }
 
 pad.with.spaces <- function(entry, begin.num, end.num) {
-  # Adds spaces to beginning and end of entry
-  repeat.string.begin <- ""
-  if (begin.num > 0) {
-    repeat.string.begin <- create.repeat.string(" ", begin.num)
-  }
-  repeat.string.end <- ""
-  if (end.num > 0) {
-    repeat.string.end <- create.repeat.string(" ", end.num)
-  }
-  padded.entry <- paste(repeat.string.begin, entry, repeat.string.end, sep="")
-  padded.entry
+  # Adds begin.num spaces to the beginning and end.num spaces to the end of
+  # entry (vectorized over all three)
+  paste(create.repeat.string(" ", begin.num), entry, create.repeat.string(" ", end.num), sep="")
 }
 
 create.repeat.string <- function(symbol, num.repeats) {
-  # creates a string in which symbol is repeated num.repeats times
-  repeat.string <- NULL
-  for (count in 1:num.repeats) {
-    repeat.string <- paste(repeat.string, symbol, sep="")
-  }
-  repeat.string
+  # creates a string in which symbol is repeated num.repeats times (for each
+  # of num.repeats; "" where it isn't positive)
+  longest <- paste(rep(symbol, max(c(num.repeats, 0))), collapse="")
+  substring(longest, 1, nchar(symbol) * pmax(num.repeats, 0))
 }
  
 round.display <- function(x, digits) {
@@ -408,25 +383,18 @@ create.overall.display <- function(res, study.names, params, model.title, data.t
   
   overall.array[1,] <- c("Studies", "Estimate", "Lower bound", "Upper bound", "Std. error", "p-Val")
   
-  # unpack the data
-  for (count in 1:length(res)) {
-    y <- res[[count]]$b
-    lb <- res[[count]]$ci.lb
-    ub <- res[[count]]$ci.ub
-    se <- res[[count]]$se
-    digits.str <- paste("%.", params$digits, "f", sep="")
-    y.disp <- sprintf(digits.str, eval(call(transform.name, params$measure))$display.scale(y, n=NULL))
-    lb.disp <- sprintf(digits.str, eval(call(transform.name, params$measure))$display.scale(lb, n=NULL))
-    ub.disp <- sprintf(digits.str, eval(call(transform.name, params$measure))$display.scale(ub, n=NULL))
-    se.disp <- sprintf(digits.str, se)
-    
-    if (!is.null(res[[count]]$pval)) {
-      pVal <- round.display(res[[count]]$pval, digits=params$digits)
-    } else {
-      pVal <- "NA"
-    }
-    overall.array[count+1,] <- c(study.names[count], y.disp, lb.disp, ub.disp, se.disp, pVal)
+  # unpack the data, a column at a time
+  digits.str <- paste("%.", params$digits, "f", sep="")
+  trans.f <- eval(call(transform.name, params$measure))
+  # the display scale is applied to each value on its own, as for some
+  # metrics (e.g., PFT) it differs for a single value
+  display.col <- function(name) {
+    sprintf(digits.str, sapply(res, function(r) trans.f$display.scale(r[[name]], n=NULL)))
   }
+  se.disp <- sprintf(digits.str, sapply(res, function(r) r$se))
+  pVal <- sapply(res, function(r) if (is.null(r$pval)) "NA" else round.display(r$pval, digits=params$digits))
+  overall.array[1 + seq_along(res),] <- cbind(study.names[seq_along(res)], display.col("b"),
+                                              display.col("ci.lb"), display.col("ci.ub"), se.disp, pVal)
 
   table.titles <- c(" Model Results")
   arrays <- list(arr1=overall.array)
@@ -747,6 +715,99 @@ loo.rma.mh.value.info <- function () {
   )
 }
 
+#######################################
+#     results as (typed) tables       #
+#######################################
+RES.COEFFICIENT.FIELDS <- c("b", "se", "zval", "pval", "ci.lb", "ci.ub")
+
+results.tables <- function(res, res.info, study.names=NULL, prefix="") {
+  # Turns res, as described by res.info (e.g., rma.uni.value.info()), into
+  # a named list of data frames, so that the numbers can be exported as is
+  # rather than scraped from the text output:
+  #   - summary: one row with the single-valued fields (k, tau2, QE, I2, ...)
+  #   - coefficients: one row per model coefficient (b, se, ci.lb, ...)
+  #   - studies: one row per study (yi, vi, weights, ...)
+  #   - one table per matrix or data frame field (X, fit.stats, ...)
+  # Entries of res.info that are value infos themselves (e.g., one per
+  # subgroup) are handled recursively; their tables are named
+  # '<entry name>/<table name>'. 'blob' fields aren't tabular and are skipped.
+  tables <- list()
+  summary.cols <- list()
+  coef.cols <- list()
+  study.cols <- list()
+  
+  n.coef <- if (is.null(res$b)) NA else length(res$b)
+  coef.names <- if (is.matrix(res$b)) rownames(res$b) else names(res$b)
+  n.studies <- if (!is.null(study.names)) length(study.names) else if (!is.null(res$yi)) length(res$yi) else NA
+  
+  for (i in seq_along(res.info)) {
+    name <- names(res.info)[i]
+    info <- res.info[[i]]
+    value <- if (name %in% names(res)) res[[name]] else NULL
+    
+    if (!(is.list(info) && is.character(info$type))) {
+      # nested value info; subgroup results aren't named, so match them up
+      # by position
+      if (is.null(value) && is.null(names(res)) && i <= length(res)) {
+        value <- res[[i]]
+      }
+      if (!is.null(value)) {
+        # (the studies of a subgroup aren't those of the whole analysis)
+        tables <- c(tables, results.tables(value, info, study.names=NULL,
+                                           prefix=paste(prefix, name, "/", sep="")))
+      }
+      next
+    }
+    if (is.null(value) || info$type == "blob") {
+      next
+    }
+    
+    if (is.matrix(value) && ncol(value) == 1) {
+      # e.g., the coefficients of rma.uni
+      value <- as.vector(value)
+    }
+    if (is.matrix(value) || is.data.frame(value)) {
+      table <- as.data.frame(value, stringsAsFactors=FALSE)
+      if (is.matrix(value) && !is.null(rownames(value))) {
+        table <- data.frame(row=rownames(value), table, check.names=FALSE,
+                            stringsAsFactors=FALSE)
+      }
+      tables[[paste(prefix, name, sep="")]] <- table
+    } else if (is.atomic(value) && length(value) > 0) {
+      value <- as.vector(value)
+      if (length(value) == 1) {
+        summary.cols[[name]] <- value
+      } else if (name %in% RES.COEFFICIENT.FIELDS && identical(length(value), n.coef)) {
+        coef.cols[[name]] <- value
+      } else if (identical(length(value), n.studies)) {
+        study.cols[[name]] <- value
+      } else {
+        tables[[paste(prefix, name, sep="")]] <- data.frame(value=value)
+      }
+    }
+  }
+  
+  if (length(coef.cols) > 0) {
+    if (!is.null(coef.names)) {
+      coef.cols <- c(list(coefficient=coef.names), coef.cols)
+    }
+    tables <- c(list(data.frame(coef.cols, check.names=FALSE, stringsAsFactors=FALSE)), tables)
+    names(tables)[1] <- paste(prefix, "coefficients", sep="")
+  }
+  if (length(study.cols) > 0) {
+    if (identical(length(study.names), n.studies)) {
+      study.cols <- c(list(study=as.character(study.names)), study.cols)
+    }
+    tables <- c(list(data.frame(study.cols, check.names=FALSE, stringsAsFactors=FALSE)), tables)
+    names(tables)[1] <- paste(prefix, "studies", sep="")
+  }
+  if (length(summary.cols) > 0) {
+    tables <- c(list(data.frame(summary.cols, check.names=FALSE, stringsAsFactors=FALSE)), tables)
+    names(tables)[1] <- paste(prefix, "summary", sep="")
+  }
+  tables
+}
+
 capture.output.and.collapse <- function (x) {
   output <- paste(capture.output(x), collapse="\n")
   output
@@ -11,9 +11,18 @@ test.all <- function() {
   cont.data <- create.cont.data(params)
   try.errors <- test.cont.functions(cont.data, params, try.errors)
   
+  try.errors <- test.units.functions(binary.data, params, try.errors)
+  try.errors <- test.results.tables(binary.data, params, try.errors)
+  try.errors <- test.batch.imputation(try.errors)
+  try.errors <- test.design.matrix(try.errors)
+  try.errors <- test.parallel.permutest(binary.data, try.errors)
+  try.errors <- test.subgroup.fits(binary.data, params, try.errors)
+  try.errors <- test.summary.tables(try.errors)
+  
   params <- set.params(data.type="diagnostic")
   diagnostic.data <- create.diag.data(params)
   try.errors <- test.diag.functions(diagnostic.data, params, try.errors)
+  try.errors <- test.diagnostic.metric.fits(diagnostic.data, params, try.errors)
   try.errors
 }  
 
@@ -161,4 +170,253 @@ call.function <- function(fname, om.data, params) {
 
 call.meta.function <- function(meta.fname, fname, om.data, params, cov.name) {
    results <- try(eval(call(meta.fname, fname, om.data, params)), silent=TRUE)
-}
\ No newline at end of file
+}
+
+create.units.data <- function(binary.data) {
+  # the same studies twice over, as two (outcome, follow-up, group pair) units;
+  # the second unit has no effects, so these must be computed from the raw data
+  n <- length(binary.data@study.names)
+  units.data <- data.frame(unit=rep(c("a", "b"), each=n),
+                           outcome=rep(c("outcome a", "outcome b"), each=n),
+                           follow.up="first", group1="tx A", group2="tx B",
+                           study.name=rep(binary.data@study.names, 2),
+                           year=NA,
+                           y=c(binary.data@y, rep(NA, n)),
+                           SE=c(binary.data@SE, rep(NA, n)),
+                           g1O1=rep(binary.data@g1O1, 2), g1O2=rep(binary.data@g1O2, 2),
+                           g2O1=rep(binary.data@g2O1, 2), g2O2=rep(binary.data@g2O2, 2),
+                           stringsAsFactors=FALSE)
+}
+
+test.units.functions <- function(binary.data, params, try.errors) {
+  units.data <- create.units.data(binary.data)
+  for (fname in create.binary.fnames()) {
+    results <- try(units.ma(fname, units.data, params, "binary"), silent=TRUE)
+    if (class(results) == "try-error") {
+      try.errors[[paste("units.ma", fname)]] <- results
+      next
+    }
+    params.tmp <- params
+    params.tmp$supress.output <- TRUE
+    overall <- eval(call(paste(fname, ".overall", sep=""), call.function(fname, binary.data, params.tmp)))
+    if (nrow(results) != 2 || !isTRUE(all.equal(results$est, rep(as.numeric(overall$b)[1], 2)))) {
+      try.errors[[paste("units.ma", fname)]] <- "units.ma estimates differ from a single-unit analysis"
+    }
+  }
+  try.errors
+}
+
+test.batch.imputation <- function(try.errors) {
+  # the batch imputation should agree with imputing the studies one at a time
+  bin.data <- data.frame(metric=c("OR", "RR", "RD", "OR"),
+                         estimate=c(0.5, 0.6, -0.05, NA),
+                         lower=c(0.3, 0.4, -0.1, 0.3),
+                         upper=c(0.833, 0.9, 0, 0.833),
+                         N_A=c(100, 200, 150, 100), N_B=c(110, 190, 160, 110),
+                         conf.level=95)
+  batch <- try(gimpute.bin.data.batch(bin.data), silent=TRUE)
+  if (class(batch) == "try-error") {
+    try.errors[["gimpute.bin.data.batch"]] <- batch
+    return(try.errors)
+  }
+  for (i in seq_len(nrow(bin.data))) {
+    row <- as.list(bin.data[i, ])
+    row <- row[!sapply(row, is.na)]
+    one <- gimpute.bin.data(row)
+    if ("FAIL" %in% names(one)) {
+      agrees <- is.na(batch$a1[i])
+    } else {
+      agrees <- isTRUE(all.equal(c(one$op1$a, one$op1$c), c(batch$a1[i], batch$c1[i])))
+      if (isnt.null(one$op2)) {
+        agrees <- agrees && isTRUE(all.equal(c(one$op2$a, one$op2$c), c(batch$a2[i], batch$c2[i])))
+      }
+    }
+    if (!agrees) {
+      try.errors[[paste("gimpute.bin.data.batch row", i)]] <- "batch and single-study imputation differ"
+    }
+  }
+  
+  diag.data <- data.frame(sens=c(0.8, NA), sens.lb=c(0.7, NA), sens.ub=c(NA, NA),
+                          spec=c(0.9, 0.85), spec.lb=c(0.85, 0.8), spec.ub=c(NA, 0.9),
+                          conf.level=95)
+  batch <- try(gimpute.diagnostic.data.batch(diag.data), silent=TRUE)
+  if (class(batch) == "try-error") {
+    try.errors[["gimpute.diagnostic.data.batch"]] <- batch
+  } else if (nrow(batch) != 2 || !is.na(batch$TP[2]) || is.na(batch$TN[2])) {
+    try.errors[["gimpute.diagnostic.data.batch"]] <- "unexpected imputed diagnostic data"
+  }
+  try.errors
+}
+
+test.design.matrix <- function(try.errors) {
+  # the conditional means design matrix should code the levels as rma does
+  data <- data.frame(x=c(1, 2, 3, 4, 5, 6),
+                     A=factor(c("a", "b", "c", "a", "b", "c")),
+                     B=factor(c("u", "v", "u", "v", "u", "v")))
+  mods <- list(numeric=c("x"), categorical=c("A", "B"), interactions=list("A:B"=c("A", "B")))
+  A <- try(make.design.matrix("A", mods, list(x=2, B="v"), data), silent=TRUE)
+  expected <- rbind(a=c(1, 2, 0, 0, 1, 0, 0),
+                    b=c(1, 2, 1, 0, 1, 1, 0),
+                    c=c(1, 2, 0, 1, 1, 0, 1))
+  if (class(A) == "try-error") {
+    try.errors[["make.design.matrix"]] <- A
+  } else if (!isTRUE(all.equal(unname(A), unname(expected))) || !identical(rownames(A), c("a", "b", "c"))) {
+    try.errors[["make.design.matrix"]] <- "unexpected design matrix"
+  }
+  
+  level.structure <- mods.level.structure(data, mods)
+  if (!all.levels.present(level.structure, c(1, 2, 3, 4)) ||
+      all.levels.present(level.structure, c(1, 3, 4, 6))) {
+    try.errors[["all.levels.present"]] <- "levels present in subsets misreported"
+  }
+  try.errors
+}
+
+test.parallel.permutest <- function(binary.data, try.errors) {
+  # the permutation results depend on the seed, not on the number of processes
+  res <- rma.uni(yi=binary.data@y, sei=binary.data@SE, method="DL")
+  serial <- try(parallel.permutest(res, iter=3500, n.cores=1, seed=42), silent=TRUE)
+  in.parallel <- try(parallel.permutest(res, iter=3500, n.cores=2, seed=42), silent=TRUE)
+  if (class(serial)[1] == "try-error" || class(in.parallel)[1] == "try-error") {
+    try.errors[["parallel.permutest"]] <- "parallel.permutest failed"
+  } else if (!identical(serial$pval, in.parallel$pval) || serial$iter != 3500) {
+    try.errors[["parallel.permutest"]] <- "serial and parallel permutations differ"
+  }
+  
+  # and neither does where the test stops
+  stopped.early <- try(parallel.permutest(res, iter=100000, n.cores=1, mc.error=0.05, seed=42), silent=TRUE)
+  stopped.in.parallel <- try(parallel.permutest(res, iter=100000, n.cores=3, mc.error=0.05, seed=42), silent=TRUE)
+  if (class(stopped.early)[1] == "try-error" || stopped.early$iter >= 100000) {
+    try.errors[["parallel.permutest mc.error"]] <- "permutations weren't stopped early"
+  } else if (class(stopped.in.parallel)[1] == "try-error" ||
+             stopped.in.parallel$iter != stopped.early$iter) {
+    try.errors[["parallel.permutest mc.error"]] <- "serial and parallel permutations stopped at different points"
+  }
+  
+  # an extreme statistic (no permutation is as extreme, so the p-values
+  # are 0) isn't taken as precise after the first chunk
+  extreme <- rma.uni(yi=rep(c(4, 5), 10), sei=rep(0.5, 20), method="DL")
+  stopped.extreme <- try(parallel.permutest(extreme, iter=10000, n.cores=1, mc.error=0.0005, seed=42), silent=TRUE)
+  if (class(stopped.extreme)[1] == "try-error" || stopped.extreme$iter <= 2000 ||
+      stopped.extreme$pval != 0) {
+    try.errors[["parallel.permutest extreme"]] <- "permutations of an extreme statistic stopped too early"
+  }
+  
+  # the caller's random number generator is left as it was
+  RNGkind("Mersenne-Twister")
+  set.seed(1)
+  seed.before <- .Random.seed
+  try(parallel.permutest(res, iter=1500, n.cores=1, seed=42), silent=TRUE)
+  if (RNGkind()[1] != "Mersenne-Twister" || !identical(.Random.seed, seed.before)) {
+    try.errors[["parallel.permutest rng"]] <- "the global random number generator was changed"
+  }
+  try.errors
+}
+
+test.subgroup.fits <- function(binary.data, params, try.errors) {
+  # the subgroups are fit the same (and reassembled in order) in parallel
+  params$supress.output <- TRUE
+  cov.vals <- binary.data@covariates$groups
+  n.cores <- get.n.cores()
+  set.n.cores(1)
+  serial <- try(subgroup.fits("binary.random", binary.data, params, cov.vals, get.subgroup.data.binary), silent=TRUE)
+  set.n.cores(2)
+  in.parallel <- try(subgroup.fits("binary.random", binary.data, params, cov.vals, get.subgroup.data.binary), silent=TRUE)
+  set.n.cores(n.cores)
+  if (class(serial)[1] == "try-error" || class(in.parallel)[1] == "try-error") {
+    try.errors[["subgroup.fits"]] <- "subgroup.fits failed"
+  } else if (length(in.parallel$results) != 3 || !identical(serial$results, in.parallel$results) ||
+             !identical(in.parallel$grouped.data[[1]]@study.names, binary.data@study.names[cov.vals == "1"]) ||
+             is.null(in.parallel$res)) {
+    try.errors[["subgroup.fits"]] <- "serial and parallel subgroup fits differ"
+  }
+  try.errors
+}
+
+test.diagnostic.metric.fits <- function(diagnostic.data, params, try.errors) {
+  # the metrics are fit the same (and returned in order) in parallel
+  params$create.plot <- FALSE
+  params$write.to.file <- FALSE
+  params.list <- lapply(c("Sens", "Spec", "DOR"), function(measure) { params$measure <- measure; params })
+  fnames <- rep("diagnostic.random", length(params.list))
+  n.cores <- get.n.cores()
+  set.n.cores(1)
+  serial <- try(diagnostic.metric.fits(fnames, params.list, diagnostic.data, c(1, 3)), silent=TRUE)
+  set.n.cores(2)
+  in.parallel <- try(diagnostic.metric.fits(fnames, params.list, diagnostic.data, c(1, 3)), silent=TRUE)
+  set.n.cores(n.cores)
+  if (class(serial)[1] == "try-error" || class(in.parallel)[1] == "try-error") {
+    try.errors[["diagnostic.metric.fits"]] <- "diagnostic.metric.fits failed"
+  } else if (length(in.parallel) != 3 || !is.null(in.parallel[[2]]) ||
+             !identical(serial[[1]]$results$Summary$MAResults$b, in.parallel[[1]]$results$Summary$MAResults$b) ||
+             !identical(serial[[3]]$results$Summary$MAResults$b, in.parallel[[3]]$results$Summary$MAResults$b)) {
+    try.errors[["diagnostic.metric.fits"]] <- "serial and parallel metric fits differ"
+  }
+  try.errors
+}
+
+test.summary.tables <- function(try.errors, golden.dir="golden") {
+  # the printed summary tables should match the golden files (written by the
+  # cell-at-a-time formatting) exactly; golden.dir is relative to this file
+  compare.to.golden <- function(test.name, printed, golden.file) {
+    printed <- try(printed, silent=TRUE)
+    if (class(printed)[1] == "try-error") {
+      try.errors[[test.name]] <<- printed
+    } else if (!identical(printed, readLines(file.path(golden.dir, golden.file)))) {
+      try.errors[[test.name]] <<- paste("printed table differs from", golden.file)
+    }
+  }
+  
+  table.data <- rbind(c("Studies", "Estimate", "Lower bound", "Upper bound", "Std. error", "p-Val"),
+                      c("Carroll 1997", "0.946", "0.712", "1.257", "0.145", "0.702"),
+                      c("+ Grant 1981", "-0.210", "-1.011", "0.591", "0.409", "< 0.001"),
+                      c("+ Peck 1985", "12.500", "NA", "NA", "3.200", "NA"),
+                      c("+ Fleming 1991 (long name)", "-3.000", "-10.250", "4.250", "3.700", "0.417"))
+  compare.to.golden("print.summary.data", capture.output(print.summary.data(table.data)),
+                    "summary_data.txt")
+  
+  b <- c(-0.5, -0.3, 0.1, 0.02, -1.2)
+  ci.lb <- c(-1.284, -0.888, -0.39, -0.372, -1.494)
+  ci.ub <- c(0.284, 0.288, 0.59, 0.412, -0.906)
+  se <- c(0.4, 0.3, 0.25, 0.2, 0.15)
+  pval <- c(0.2123, 0.0004, 0.6891, 0.92, 0.0000001)
+  res <- lapply(1:5, function(i) list(b=b[i], ci.lb=ci.lb[i], ci.ub=ci.ub[i], se=se[i], pval=pval[i]))
+  study.names <- c("Carroll", "+ Grant", "+ Peck", "+ Fleming", "+ Silverman")
+  params <- list(measure="OR", digits=3)
+  overall.disp <- try(create.overall.display(res, study.names, params, "Cumulative Meta-Analysis",
+                                             data.type="binary"), silent=TRUE)
+  compare.to.golden("create.overall.display", capture.output(print.summary.display(overall.disp)),
+                    "overall_display.txt")
+  try.errors
+}
+
+test.results.tables <- function(binary.data, params, try.errors) {
+  n <- length(binary.data@study.names)
+  for (fname in create.binary.fnames()) {
+    results <- call.function(fname, om.data=binary.data, params)
+    if (class(results) == "try-error") {
+      next # reported by test.binary.functions
+    }
+    tables <- try(results.tables(results$res, results$res.info, binary.data@study.names), silent=TRUE)
+    test.name <- paste("results.tables", fname)
+    if (class(tables) == "try-error") {
+      try.errors[[test.name]] <- tables
+    } else if (is.null(tables$summary) || is.null(tables$studies)) {
+      try.errors[[test.name]] <- "results.tables is missing the summary or studies table"
+    } else if (nrow(tables$studies) != n || !identical(tables$studies$study, binary.data@study.names) ||
+               !isTRUE(all.equal(tables$summary$b, as.numeric(results$res$b)[1]))) {
+      try.errors[[test.name]] <- "results.tables doesn't match the results"
+    }
+  }
+  
+  results <- try(subgroup.ma.binary("binary.random", binary.data, params, cov.name="groups"), silent=TRUE)
+  if (class(results) != "try-error") {
+    tables <- try(results.tables(results$res, results$res.info), silent=TRUE)
+    if (class(tables) == "try-error") {
+      try.errors[["results.tables subgroup.ma.binary"]] <- tables
+    } else if (!all(c("Subgroup 1/summary", "Subgroup 2/summary", "Overall/summary") %in% names(tables))) {
+      try.errors[["results.tables subgroup.ma.binary"]] <- "results.tables is missing subgroup tables"
+    }
+  }
+  try.errors
+}
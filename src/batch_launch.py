@@ -0,0 +1,381 @@
+#############################################################################
+#                                                                           #
+#  OpenMeta[analyst]                                                        #
+#  ---                                                                      #
+#  Headless (batch) entry point. Re-runs analyses over .oma datasets        #
+#  without the GUI: a job spec lists the dataset, outcome, follow-up,       #
+#  groups, metric, method, params and (optionally) meta-method for each     #
+#  analysis, and the jobs are farmed out to a pool of R worker processes.   #
+#                                                                           #
+#  usage: python batch_launch.py job_spec.json out_dir [--workers N]        #
+#                                                                           #
+#  The job spec is a JSON file of the form                                  #
+#     {"defaults": {"method": "binary.random", "params": {"digits": 3}},    #
+#      "jobs": [{"name": "bcg_or", "dataset": "BCG.oma", "metric": "OR"},   #
+#               {"name": "bcg_cum", "dataset": "BCG.oma", "metric": "RR",   #
+#                "meta_method": "cum.ma.binary"}]}                          #
+#  (a bare list of jobs works, too). Each job's results and plots are       #
+#  written to out_dir/<job name>/ and a summary to out_dir/summary.json.    #
+#  The numbers behind the results are written out as tables, too: a CSV    #
+#  file per table in out_dir/<job name>/tables/ (and, with                  #
+#  --binary-tables, all of them in a single compact binary file).           #
+#                                                                           #
+#############################################################################
+
+import os, sys, time, copy, json, shutil, pickle
+import optparse
+import multiprocessing
+
+import results_export
+
+# NOTE: nothing that touches R (meta_py_r, ma_data_table_model) is imported
+# at module level. rpy2 starts an R session on import and every worker needs
+# its own; the parent process only hands out jobs.
+
+JOB_FIELDS = ("name", "dataset", "outcome", "follow_up", "groups", "metric",
+              "method", "params", "meta_method")
+
+# what the forest plot fields on the analysis details form default to
+# (see ma_specs.add_plot_params)
+DEFAULT_PLOT_PARAMS = {"fp_show_col1":True, "fp_col1_str":"[default]",
+                       "fp_show_col2":True, "fp_col2_str":"[default]",
+                       "fp_show_col3":True, "fp_col3_str":"[default]",
+                       "fp_show_col4":True, "fp_col4_str":"[default]",
+                       "fp_xlabel":"[default]",
+                       "fp_outpath":"./r_tmp/forest.png",
+                       "fp_plot_lb":"[default]", "fp_plot_ub":"[default]",
+                       "fp_xticks":"[default]",
+                       "fp_show_summary_line":True}
+
+DEFAULT_DIAG_METRICS = ["Sens", "Spec"]
+# same order the GUI runs them in
+ORDERED_DIAG_METRICS = ["Sens", "Spec", "NLR", "PLR", "DOR"]
+
+##################### JOB SPECS #####################
+
+def read_job_spec(spec_path):
+    ''' Returns the list of jobs in the spec, with the defaults filled in
+    and dataset paths made absolute (relative paths are taken relative
+    to the spec file) '''
+    spec = json.load(open(spec_path))
+    if isinstance(spec, list):
+        spec = {"jobs":spec}
+    defaults = spec.get("defaults", {})
+    spec_dir = os.path.dirname(os.path.abspath(spec_path))
+
+    jobs, names = [], set()
+    for i, job_d in enumerate(spec["jobs"]):
+        job = copy.deepcopy(defaults)
+        job.update(job_d)
+        # params are merged rather than replaced
+        job["params"] = dict(defaults.get("params", {}), **job_d.get("params", {}))
+
+        unknown = set(job.keys()) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError("job %s: unknown field(s) %s" % (i, ", ".join(sorted(unknown))))
+        for field in ("dataset", "method"):
+            if not job.get(field):
+                raise ValueError("job %s: no %s given" % (i, field))
+
+        job["dataset"] = os.path.join(spec_dir, job["dataset"])
+        if not job.get("name"):
+            job["name"] = "job_%s" % i
+        if job["name"] in names:
+            raise ValueError("job name %s is used more than once" % job["name"])
+        names.add(job["name"])
+        jobs.append(job)
+    return jobs
+
+##################### WORKER SIDE #####################
+
+# per worker-process state; filled in by _init_worker
+_worker = {}
+
+def _init_worker(out_dir, binary_tables=False):
+    ''' Runs once in each worker process: starts R, loads the libraries
+    and gives the worker its own scratch (R working) directory '''
+    import meta_py_r
+
+    work_dir = os.path.join(out_dir, "_workers", str(os.getpid()))
+    r_tmp = os.path.join(work_dir, "r_tmp")
+    if not os.path.isdir(r_tmp):
+        os.makedirs(r_tmp)
+    _worker["out_dir"] = out_dir
+    _worker["work_dir"] = work_dir
+    _worker["binary_tables"] = binary_tables
+    _worker["datasets"] = {}
+    _enter_work_dir()
+
+    meta_py_r.RlibLoader().load_core()
+    meta_py_r.turn_off_R_graphics()
+
+def _enter_work_dir():
+    ''' Points both python and R at the worker's scratch directory. Done
+    before every job, since a failed R call resets R's working directory
+    (see meta_py_r.execute_r_string) and the plots would then be written
+    (and looked for) elsewhere '''
+    import meta_py_r
+
+    work_dir = _worker["work_dir"]
+    os.chdir(work_dir)
+    meta_py_r.execute_r_string("setwd('%s')" % work_dir.replace('\\', '/'))
+
+def load_oma(file_path):
+    ''' Loads a pickled dataset (and its .state dictionary, if there is
+    one) without bringing up any windows. Returns (dataset, state_dict);
+    the latter may be None '''
+    dataset = pickle.load(open(file_path, 'rb'))
+    state_dict = None
+    if os.path.exists(file_path + ".state"):
+        state_dict = pickle.load(open(file_path + ".state", 'rb'))
+    return (dataset, state_dict)
+
+def model_for_job(job, dataset, state_dict):
+    ''' Builds a DatasetModel that 'displays' the outcome, follow-up, groups
+    and metric the job asks for -- i.e., what the user would otherwise
+    click through in the GUI '''
+    import ma_data_table_model
+    from meta_globals import DIAGNOSTIC
+
+    model = ma_data_table_model.DatasetModel(dataset=dataset, add_blank_study=False)
+    if state_dict is not None:
+        model.set_state(state_dict)
+
+    outcome = job.get("outcome") or model.current_outcome or dataset.get_outcome_names()[0]
+    if outcome not in dataset.get_outcome_names():
+        raise ValueError("no outcome named %s in %s" % (outcome, job["dataset"]))
+    model.set_current_outcome(outcome)
+
+    follow_ups = dataset.outcome_names_to_follow_ups[outcome]
+    follow_up = job.get("follow_up")
+    if follow_up is None:
+        model.set_current_time_point(follow_ups.keys()[0])
+    elif follow_up in follow_ups.values():
+        model.set_current_follow_up(follow_up)
+    else:
+        raise ValueError("outcome %s has no follow-up %s" % (outcome, follow_up))
+
+    data_type = dataset.get_outcome_type(outcome)
+    groups = job.get("groups")
+    if groups is None:
+        groups = dataset.get_group_names_for_outcome_fu(outcome,
+                                        model.get_current_follow_up_name())
+        groups = groups[:1] if data_type == DIAGNOSTIC else groups[:2]
+    if data_type == DIAGNOSTIC and len(groups) == 1:
+        # set_current_groups wants two names; the second is ignored for
+        # diagnostic data
+        groups = [groups[0], groups[0]]
+    model.set_current_groups(list(groups))
+
+    if data_type != DIAGNOSTIC and job.get("metric"):
+        model.set_current_metric(job["metric"])
+
+    conf_level = job["params"].get("conf.level")
+    if conf_level is not None:
+        model.set_conf_level(conf_level)
+
+    model.try_to_update_outcomes()
+    return model
+
+def _param_vals_for_job(job, model):
+    import meta_py_r
+
+    params, defaults, var_order, param_d = meta_py_r.get_params(job["method"])
+    param_vals = dict(DEFAULT_PLOT_PARAMS)
+    param_vals.update(defaults)
+    param_vals["conf.level"] = model.get_global_conf_level()
+    param_vals.update(job["params"])
+    return param_vals
+
+def _run_analysis(job, model):
+    ''' The headless counterpart of MA_Specs.run_ma '''
+    import meta_py_r
+
+    data_type = model.get_current_outcome_type()
+    meta_f_str = job.get("meta_method")
+    param_vals = _param_vals_for_job(job, model)
+
+    if data_type == "binary":
+        param_vals["measure"] = model.current_effect
+        meta_py_r.ma_dataset_to_simple_binary_robj(model)
+        if meta_f_str is None:
+            return meta_py_r.run_binary_ma(job["method"], param_vals)
+        return meta_py_r.run_meta_method(meta_f_str, job["method"], param_vals)
+    elif data_type == "continuous":
+        param_vals["measure"] = model.current_effect
+        meta_py_r.ma_dataset_to_simple_continuous_robj(model)
+        if meta_f_str is None:
+            return meta_py_r.run_continuous_ma(job["method"], param_vals)
+        return meta_py_r.run_meta_method(meta_f_str, job["method"], param_vals)
+    elif data_type == "diagnostic":
+        diag_metrics = job.get("metric") or DEFAULT_DIAG_METRICS
+        if isinstance(diag_metrics, basestring):
+            diag_metrics = [diag_metrics]
+
+        method_names, list_of_param_vals = [], []
+        for diag_metric in [m for m in ORDERED_DIAG_METRICS if m in diag_metrics]:
+            metric_param_vals = copy.deepcopy(param_vals)
+            split_fp_path = param_vals["fp_outpath"].split(".")
+            new_str = split_fp_path[0] if len(split_fp_path) == 1 else \
+                      ".".join(split_fp_path[:-1])
+            metric_param_vals["fp_outpath"] = new_str + "_%s" % diag_metric.lower() + ".png"
+            metric_param_vals["measure"] = diag_metric
+            method_names.append(job["method"])
+            list_of_param_vals.append(metric_param_vals)
+
+        meta_py_r.ma_dataset_to_simple_diagnostic_robj(model)
+        if meta_f_str is None:
+            return meta_py_r.run_diagnostic_multi(method_names, list_of_param_vals)
+        return meta_py_r.run_meta_method_diag(meta_f_str, method_names, list_of_param_vals)
+    else:
+        raise ValueError("Don't know how to analyze %s data" % data_type)
+
+def _safe_file_name(s):
+    keep = "-_. "
+    return "".join([c if (c.isalnum() or c in keep) else "_" for c in s]).strip() or "unnamed"
+
+def _write_out_results(job, results, job_dir):
+    ''' Writes the texts of the analysis to .txt files, its results tables
+    to job_dir/tables and copies the plots (which R wrote to the worker's
+    r_tmp) to job_dir; returns a dictionary describing what was written '''
+    texts = {}
+    for title, text in results["texts"].items():
+        fname = _safe_file_name(title) + ".txt"
+        with open(os.path.join(job_dir, fname), 'w') as f:
+            f.write(text.encode("utf-8") if isinstance(text, unicode) else text)
+        texts[title] = fname
+
+    images = {}
+    for title, img_path in results["images"].items():
+        if not os.path.isabs(img_path):
+            img_path = os.path.join(_worker["work_dir"], img_path)
+        if not os.path.exists(img_path):
+            print("batch: %s -- could not find image %s" % (job["name"], img_path))
+            continue
+        fname = _safe_file_name(title) + os.path.splitext(img_path)[1]
+        shutil.copy(img_path, os.path.join(job_dir, fname))
+        images[title] = fname
+
+    tables = results_export.write_tables(results.get("tables", {}),
+                                         os.path.join(job_dir, "tables"),
+                                         binary=_worker.get("binary_tables", False))
+    binary_tables = tables.pop(None, None)
+    tables = dict([(name, os.path.join("tables", fname)) for name, fname in tables.items()])
+    written = {"texts":texts, "images":images, "image_order":results["image_order"],
+               "tables":tables}
+    if binary_tables is not None:
+        written["binary_tables"] = os.path.join("tables", binary_tables)
+    return written
+
+def run_job(job):
+    ''' Runs a single job in the current (worker) process. Never raises;
+    failures are reported in the returned dictionary '''
+    start_time = time.time()
+    summary = {"name":job["name"], "pid":os.getpid(), "ok":False}
+    job_dir = os.path.join(_worker["out_dir"], _safe_file_name(job["name"]))
+    try:
+        _enter_work_dir()
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+
+        # each worker loads a given dataset only once; the analyses
+        # themselves don't modify it
+        if job["dataset"] not in _worker["datasets"]:
+            _worker["datasets"][job["dataset"]] = load_oma(job["dataset"])
+        dataset, state_dict = _worker["datasets"][job["dataset"]]
+
+        model = model_for_job(job, dataset, state_dict)
+        results = _run_analysis(job, model)
+        if results is None:
+            raise Exception("the analysis returned no results")
+        summary.update(_write_out_results(job, results, job_dir))
+        summary["ok"] = True
+    except Exception, e:
+        summary["error"] = str(e)
+        print("batch: job %s failed: %s" % (job["name"], e))
+        try:
+            # leave the worker as the next job expects to find it
+            _enter_work_dir()
+        except Exception, e:
+            print("batch: couldn't restore the working directory: %s" % e)
+    summary["seconds"] = time.time() - start_time
+
+    with open(os.path.join(job_dir, "results.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+##################### DRIVER #####################
+
+def run_jobs(jobs, out_dir, num_workers=None, binary_tables=False):
+    ''' Runs the jobs on a pool of num_workers R processes (one per core
+    by default); returns the batch summary. If binary_tables is True, the
+    results tables are also written in binary form (see results_export) '''
+    num_workers = num_workers or multiprocessing.cpu_count()
+    num_workers = max(1, min(num_workers, len(jobs)))
+    out_dir = os.path.abspath(out_dir)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes=num_workers, initializer=_init_worker,
+                                initargs=(out_dir, binary_tables))
+    try:
+        # chunksize=1: analyses vary a lot in cost (e.g., bootstraps) so
+        # hand them out one at a time
+        job_summaries = pool.map(run_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    wall_time = time.time() - start_time
+    shutil.rmtree(os.path.join(out_dir, "_workers"), ignore_errors=True)
+
+    busy_time = sum([s["seconds"] for s in job_summaries])
+    summary = {"jobs":job_summaries,
+               "num_jobs":len(jobs),
+               "num_failed":len([s for s in job_summaries if not s["ok"]]),
+               "num_workers":num_workers,
+               "wall_time":wall_time,
+               "jobs_per_second":len(jobs)/wall_time if wall_time > 0 else None,
+               "jobs_per_second_per_core":len(jobs)/wall_time/num_workers if wall_time > 0 else None,
+               # how well the workers were kept busy (1.0 is perfect)
+               "core_utilization":busy_time/(wall_time*num_workers) if wall_time > 0 else None}
+    with open(os.path.join(out_dir, "summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def print_summary(summary):
+    for s in summary["jobs"]:
+        status = "ok" if s["ok"] else "FAILED (%s)" % s["error"]
+        print("%-30s %8.2f s  %s" % (s["name"], s["seconds"], status))
+    print("")
+    print("%s jobs (%s failed) on %s worker(s)" % \
+            (summary["num_jobs"], summary["num_failed"], summary["num_workers"]))
+    print("total wall time:        %.2f s" % summary["wall_time"])
+    if summary["wall_time"] > 0:
+        print("throughput:             %.3f jobs/s" % summary["jobs_per_second"])
+        print("throughput per core:    %.3f jobs/s" % summary["jobs_per_second_per_core"])
+        print("core utilization:       %.0f%%" % (100*summary["core_utilization"]))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog job_spec.json out_dir [options]")
+    parser.add_option("-n", "--workers", type="int", dest="num_workers", default=None,
+                      help="number of R worker processes (default: one per core)")
+    parser.add_option("--binary-tables", action="store_true", dest="binary_tables",
+                      default=False,
+                      help="also write each job's results tables to a single binary file")
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error("need a job spec and an output directory")
+    spec_path, out_dir = args
+
+    jobs = read_job_spec(spec_path)
+    if len(jobs) == 0:
+        print("nothing to do.")
+        return 0
+    summary = run_jobs(jobs, out_dir, num_workers=options.num_workers,
+                       binary_tables=options.binary_tables)
+    print_summary(summary)
+    return 1 if summary["num_failed"] > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
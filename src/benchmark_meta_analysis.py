@@ -0,0 +1,451 @@
+#############################################################################
+#                                                                           #
+#  OpenMeta[analyst]                                                        #
+#  ---                                                                      #
+#  Benchmarks for the Python <-> R bridge and the core analyses. On         #
+#  synthetic binary, continuous and diagnostic datasets of the given        #
+#  sizes (with a continuous and a factor covariate), times                  #
+#     - building the R data object (ma_dataset_to_simple_*_robj)            #
+#     - each *.random and *.fixed.* method that is feasible for the data    #
+#     - the meta-methods: cumulative, leave-one-out, subgroup (over the     #
+#       factor covariate) and bootstrap                                     #
+#     - parse_out_results, on the results of each of the above              #
+#                                                                           #
+#  usage: python benchmark_meta_analysis.py out.json [--sizes 10,1000]      #
+#         python benchmark_meta_analysis.py --compare old.json new.json     #
+#                                                                           #
+#  The timings are written to out.json, one record per data type, number   #
+#  of studies, stage and method (with the seconds each repeat took), so    #
+#  that the runs of two commits can be compared with --compare.             #
+#                                                                           #
+#############################################################################
+
+import os, sys, time, json, math, random, platform, subprocess
+import optparse
+
+import batch_launch
+
+# NOTE: as in batch_launch, nothing that touches R is imported at module
+# level, so that --compare doesn't need R.
+
+BENCHMARK_FORMAT_VERSION = 1
+
+DATA_TYPES = ["binary", "continuous", "diagnostic"]
+DEFAULT_SIZES = [10, 100, 1000]
+
+OUTCOME_NAME = "outcome"
+FOLLOW_UP = "first" # see Dataset.add_outcome
+ARM_LEVELS = ["low", "mid", "high"]
+# subgroup analyses are over this (factor) covariate
+SUBGROUP_COVARIATE = "arm"
+
+# the metric the binary and continuous methods are run for, and the
+# metrics the diagnostic methods are run for
+METRICS = {"binary":["OR"], "continuous":["MD"], "diagnostic":["Sens", "Spec", "DOR"]}
+
+# the meta-methods are run over the random-effects method, for (the first
+# two of) the metrics above
+META_METHOD_BASES = {"binary":"binary.random",
+                     "continuous":"continuous.random",
+                     "diagnostic":"diagnostic.random"}
+META_METHODS = {"binary":["cum.ma.binary", "loo.ma.binary", "subgroup.ma.binary",
+                          "bootstrap.binary"],
+                "continuous":["cum.ma.continuous", "loo.ma.continuous",
+                              "subgroup.ma.continuous", "bootstrap.continuous"],
+                "diagnostic":["cum.ma.diagnostic", "loo.ma.diagnostic",
+                              "subgroup.ma.diagnostic"]}
+
+##################### SYNTHETIC DATA #####################
+
+def synthetic_dataset(data_type, n_studies, seed=0):
+    '''
+    Returns a Dataset of n_studies studies with a single outcome of
+    data_type ('binary', 'continuous' or 'diagnostic') at a single
+    follow-up; every study has complete raw data and values for the
+    covariates 'dose' (continuous) and 'arm' (a factor). The same
+    arguments always give the same dataset.
+    '''
+    import ma_dataset
+    from meta_globals import BINARY, CONTINUOUS, DIAGNOSTIC, DEFAULT_GROUP_NAMES
+
+    rng = random.Random(seed*1000003 + n_studies*len(DATA_TYPES) + DATA_TYPES.index(data_type))
+    dataset = ma_dataset.Dataset(title="synthetic %s data" % data_type,
+                                 is_diag=(data_type == "diagnostic"))
+    for i in range(n_studies):
+        dataset.add_study(ma_dataset.Study(i, name="Study %d" % (i+1), year=1970 + i % 50))
+
+    outcome_type = {"binary":BINARY, "continuous":CONTINUOUS, "diagnostic":DIAGNOSTIC}[data_type]
+    dataset.add_outcome(ma_dataset.Outcome(OUTCOME_NAME, outcome_type))
+    groups = ["test 1"] if data_type == "diagnostic" else DEFAULT_GROUP_NAMES
+    raw_data_f = {"binary":_binary_raw_data,
+                  "continuous":_continuous_raw_data,
+                  "diagnostic":_diagnostic_raw_data}[data_type]
+    for study in dataset.studies:
+        ma_unit = study.get_ma_unit(OUTCOME_NAME, FOLLOW_UP)
+        ma_unit.set_raw_data_for_groups(groups, raw_data_f(rng))
+
+    doses = dict([(study.name, round(rng.uniform(0, 10), 2)) for study in dataset.studies])
+    dataset.add_covariate(ma_dataset.Covariate("dose", "continuous"), cov_values=doses)
+    arms = dict([(study.name, rng.choice(ARM_LEVELS)) for study in dataset.studies])
+    dataset.add_covariate(ma_dataset.Covariate(SUBGROUP_COVARIATE, "factor"), cov_values=arms)
+    return dataset
+
+def _binary_raw_data(rng):
+    ''' [[events, total] for the treated and control groups], with a log
+    odds ratio of about -0.3 '''
+    n1, n2 = rng.randint(20, 500), rng.randint(20, 500)
+    p2 = rng.uniform(0.05, 0.4)
+    odds1 = p2/(1-p2) * math.exp(rng.gauss(-0.3, 0.3))
+    p1 = odds1/(1+odds1)
+    return [[_count(rng, n1, p1), n1], [_count(rng, n2, p2), n2]]
+
+def _continuous_raw_data(rng):
+    ''' [[n, mean, sd] for the treated and control groups] '''
+    n1, n2 = rng.randint(10, 300), rng.randint(10, 300)
+    mean2 = rng.gauss(50, 10)
+    mean1 = mean2 + rng.gauss(-2, 3)
+    return [[n1, round(mean1, 2), round(rng.uniform(5, 15), 2)],
+            [n2, round(mean2, 2), round(rng.uniform(5, 15), 2)]]
+
+def _diagnostic_raw_data(rng):
+    ''' [[TP, FN, FP, TN]] (see DatasetModel.get_cur_raw_data_for_study) '''
+    n_diseased, n_healthy = rng.randint(20, 300), rng.randint(20, 300)
+    tp = _count(rng, n_diseased, rng.uniform(0.6, 0.95))
+    tn = _count(rng, n_healthy, rng.uniform(0.6, 0.95))
+    return [[tp, n_diseased-tp, n_healthy-tn, tn]]
+
+def _count(rng, n, p):
+    ''' about n*p (normal approximation to the binomial); kept away from 0
+    and n, so that every metric can be computed for every study '''
+    x = int(round(rng.gauss(n*p, math.sqrt(n*p*(1-p)))))
+    return min(max(x, 1), n-1)
+
+##################### TIMING #####################
+
+class ParseTimer:
+    '''
+    Stands in for meta_py_r.parse_out_results while installed, keeping
+    the seconds each call took; the run_* functions of meta_py_r call it
+    on the R results before returning them.
+    '''
+    def __init__(self, meta_py_r):
+        self.meta_py_r = meta_py_r
+        self.parse_out_results = meta_py_r.parse_out_results
+        self.seconds = []
+
+    def __call__(self, result):
+        start_time = time.time()
+        parsed = self.parse_out_results(result)
+        self.seconds.append(time.time() - start_time)
+        return parsed
+
+    def install(self):
+        self.meta_py_r.parse_out_results = self
+
+    def uninstall(self):
+        self.meta_py_r.parse_out_results = self.parse_out_results
+
+class Benchmark:
+    ''' Runs the benchmarks and collects their records (see time_calls) '''
+    def __init__(self, repeats=3, log=None):
+        self.repeats = repeats
+        self.records = []
+        self.log = log or sys.stderr
+
+    def time_calls(self, data_type, n_studies, stage, name, f, repeats=None):
+        '''
+        Calls f repeats times and adds a record of how long each call took
+        (or of the error it raised); returns what the last call returned,
+        or None if it failed
+        '''
+        record = {"data_type":data_type, "n_studies":n_studies, "stage":stage, "name":name}
+        self.records.append(record)
+        seconds, value = [], None
+        for i in range(repeats or self.repeats):
+            start_time = time.time()
+            try:
+                value = f()
+            except Exception, e:
+                record["error"] = str(e)
+                self._log("%s/%s %s %s failed: %s" % (data_type, n_studies, stage, name, e))
+                return None
+            seconds.append(time.time() - start_time)
+        record.update(timing_stats(seconds))
+        self._log("%s/%s %-8s %-45s %10.4f s" % (data_type, n_studies, stage, name, record["median"]))
+        return value
+
+    def add_record(self, data_type, n_studies, stage, name, seconds=None, skipped=None):
+        record = {"data_type":data_type, "n_studies":n_studies, "stage":stage, "name":name}
+        if skipped is not None:
+            record["skipped"] = skipped
+        else:
+            record.update(timing_stats(seconds))
+        self.records.append(record)
+
+    def _log(self, msg):
+        self.log.write(msg + "\n")
+        self.log.flush()
+
+def timing_stats(seconds):
+    ordered = sorted(seconds)
+    n = len(ordered)
+    median = ordered[n/2] if n % 2 == 1 else (ordered[n/2-1] + ordered[n/2])/2.0
+    return {"seconds":seconds, "min":ordered[0], "median":median,
+            "mean":sum(ordered)/float(n)}
+
+##################### THE BENCHMARKS #####################
+
+def benchmark_dataset(bench, data_type, n_studies, options):
+    ''' Times the conversion, the methods and meta-methods (and parsing
+    their results) on a synthetic dataset of data_type and n_studies '''
+    import meta_py_r
+    from meta_globals import NATIVE_FOREST_PLOTS
+
+    dataset = synthetic_dataset(data_type, n_studies, seed=options.seed)
+    job = {"dataset":"synthetic %s data (%s studies)" % (data_type, n_studies),
+           "params":{}}
+    if data_type != "diagnostic":
+        job["metric"] = METRICS[data_type][0]
+    # this computes the effects of the studies, too
+    model = bench.time_calls(data_type, n_studies, "prepare", "model_for_job",
+                             lambda: batch_launch.model_for_job(job, dataset, None), repeats=1)
+    if model is None:
+        return
+
+    to_robj_name = "ma_dataset_to_simple_%s_robj" % data_type
+    to_robj = getattr(meta_py_r, to_robj_name)
+    if bench.time_calls(data_type, n_studies, "convert", to_robj_name,
+                        lambda: to_robj(model)) is None:
+        return
+
+    def param_vals(method, metric):
+        vals = batch_launch._param_vals_for_job({"method":method, "params":{}}, model)
+        vals["measure"] = metric
+        # what the analysis details form asks for; see ma_specs.add_plot_params
+        vals["fp_layout_only"] = NATIVE_FOREST_PLOTS
+        if data_type == "diagnostic":
+            vals["fp_outpath"] = "./r_tmp/forest_%s.png" % metric.lower()
+        return vals
+
+    timer = ParseTimer(meta_py_r)
+    timer.install()
+    try:
+        ##
+        # the methods
+        for metric in METRICS[data_type]:
+            for method in feasible_methods(data_type, metric, options.methods):
+                name = method if data_type != "diagnostic" else "%s (%s)" % (method, metric)
+                vals = param_vals(method, metric)
+                if data_type == "binary":
+                    run = lambda: meta_py_r.run_binary_ma(method, vals)
+                elif data_type == "continuous":
+                    run = lambda: meta_py_r.run_continuous_ma(method, vals)
+                else:
+                    run = lambda: meta_py_r.run_diagnostic_multi([method], [vals])
+                _time_with_parsing(bench, timer, data_type, n_studies, "analysis", name, run)
+
+        ##
+        # the meta-methods; these fit a model per study (or, for the
+        # bootstrap, per replicate)
+        method = META_METHOD_BASES[data_type]
+        metrics = METRICS[data_type][:2]
+        for meta_method in META_METHODS[data_type]:
+            name = "%s(%s)" % (meta_method, method)
+            if n_studies > options.meta_max_studies:
+                bench.add_record(data_type, n_studies, "meta", name,
+                                 skipped="more than %s studies" % options.meta_max_studies)
+                continue
+            list_of_params = [param_vals(method, metric) for metric in metrics]
+            for vals in list_of_params:
+                if meta_method.startswith("subgroup"):
+                    vals["cov_name"] = SUBGROUP_COVARIATE
+                elif meta_method.startswith("bootstrap"):
+                    vals["num.bootstrap.replicates"] = options.bootstrap_replicates
+                    vals["bootstrap.type"] = "boot.ma"
+                    vals["bootstrap.plot.path"] = "./r_tmp/bootstrap.png"
+            if data_type == "diagnostic":
+                run = lambda: meta_py_r.run_meta_method_diag(meta_method, [method]*len(metrics),
+                                                             list_of_params)
+            else:
+                run = lambda: meta_py_r.run_meta_method(meta_method, method, list_of_params[0])
+            _time_with_parsing(bench, timer, data_type, n_studies, "meta", name, run)
+    finally:
+        timer.uninstall()
+
+def _time_with_parsing(bench, timer, data_type, n_studies, stage, name, run):
+    ''' times run (which includes parsing its results), and parse_out_results
+    on its own '''
+    timer.seconds = []
+    if bench.time_calls(data_type, n_studies, stage, name, run) is not None:
+        bench.add_record(data_type, n_studies, "parse", name, seconds=timer.seconds)
+
+def feasible_methods(data_type, metric, only_these=None):
+    ''' the *.random and *.fixed.* methods that are feasible for the data
+    (in R's tmp_obj) and metric, optionally restricted to only_these '''
+    import meta_py_r
+    methods = meta_py_r.get_available_methods(for_data_type=data_type,
+                                              data_obj_name="tmp_obj", metric=metric).values()
+    methods = [m for m in methods if m.endswith(".random") or ".fixed." in m]
+    if only_these:
+        methods = [m for m in methods if m in only_these]
+    return sorted(methods)
+
+def run_benchmarks(options, out_path):
+    import meta_py_r
+
+    r_tmp = os.path.join(os.getcwd(), "r_tmp")
+    if not os.path.isdir(r_tmp):
+        os.makedirs(r_tmp)
+    meta_py_r.execute_r_string("setwd('%s')" % os.getcwd().replace('\\', '/'))
+    meta_py_r.RlibLoader().load_core()
+    meta_py_r.turn_off_R_graphics()
+    meta_py_r.set_n_cores(options.r_processes)
+
+    bench = Benchmark(repeats=options.repeats)
+    out = {"format_version":BENCHMARK_FORMAT_VERSION,
+           "info":run_info(options, meta_py_r),
+           "results":bench.records}
+    for n_studies in options.sizes:
+        for data_type in options.data_types:
+            # meta_py_r reports (very verbosely) what it sends to R; that
+            # isn't what's being timed
+            stdout = sys.stdout
+            if not options.verbose:
+                sys.stdout = open(os.devnull, 'w')
+            try:
+                benchmark_dataset(bench, data_type, n_studies, options)
+            finally:
+                sys.stdout = stdout
+            # written as we go, so that a long run isn't lost
+            with open(out_path, 'w') as f:
+                json.dump(out, f, indent=1)
+    return out
+
+def run_info(options, meta_py_r):
+    info = {"time":time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit":_git_commit(),
+            "python":sys.version.split()[0],
+            "platform":platform.platform(),
+            "R":meta_py_r.execute_r_string("R.version.string")[0],
+            "options":{"sizes":options.sizes, "data_types":options.data_types,
+                       "repeats":options.repeats, "seed":options.seed,
+                       "methods":options.methods,
+                       "meta_max_studies":options.meta_max_studies,
+                       "bootstrap_replicates":options.bootstrap_replicates,
+                       "r_processes":options.r_processes}}
+    return info
+
+def _git_commit():
+    try:
+        p = subprocess.Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = p.communicate()[0].strip()
+        return commit if p.returncode == 0 else None
+    except OSError:
+        return None
+
+##################### REPORTING #####################
+
+def _record_key(record):
+    return (record["data_type"], record["n_studies"], record["stage"], record["name"])
+
+def print_results(results):
+    for record in results["results"]:
+        label = "%s/%s %-8s %-45s" % _record_key(record)
+        if "error" in record:
+            print("%s FAILED (%s)" % (label, record["error"]))
+        elif "skipped" in record:
+            print("%s skipped (%s)" % (label, record["skipped"]))
+        else:
+            print("%s %10.4f s" % (label, record["median"]))
+
+def compare(old_results, new_results, threshold=1.1, min_seconds=0.01):
+    '''
+    Prints the median times of the records the two runs have in common,
+    old vs. new. Returns the keys (see _record_key) of the records that
+    got slower by more than threshold (a ratio); records that take less
+    than min_seconds in both runs are too noisy to count.
+    '''
+    old_medians = dict([(_record_key(r), r["median"]) for r in old_results["results"] \
+                            if "median" in r])
+    print("%-70s %10s %10s %8s" % ("", "old (s)", "new (s)", "new/old"))
+    regressions, n_compared = [], 0
+    for record in new_results["results"]:
+        key = _record_key(record)
+        if "median" not in record or key not in old_medians:
+            continue
+        n_compared += 1
+        old, new = old_medians[key], record["median"]
+        ratio = new/old if old > 0 else float("inf")
+        flag = ""
+        if ratio > threshold and max(old, new) >= min_seconds:
+            regressions.append(key)
+            flag = "  <-- slower"
+        print("%-70s %10.4f %10.4f %8.2f%s" % ("%s/%s %s %s" % key, old, new, ratio, flag))
+    print("")
+    print("%s of %s timings got slower by more than %.0f%%" % \
+            (len(regressions), n_compared, 100*(threshold-1)))
+    return regressions
+
+##################### DRIVER #####################
+
+def _int_list(option, opt_str, value, parser):
+    setattr(parser.values, option.dest, [int(x) for x in value.split(",")])
+
+def _str_list(option, opt_str, value, parser):
+    setattr(parser.values, option.dest, [x.strip() for x in value.split(",") if x.strip()])
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog out.json [options]\n" + \
+                                         "       %prog --compare old.json new.json [options]")
+    parser.add_option("--sizes", type="string", action="callback", callback=_int_list,
+                      dest="sizes", default=DEFAULT_SIZES,
+                      help="comma-separated numbers of studies (default: %s)" % \
+                                ",".join([str(n) for n in DEFAULT_SIZES]))
+    parser.add_option("--data-types", type="string", action="callback", callback=_str_list,
+                      dest="data_types", default=DATA_TYPES,
+                      help="comma-separated data types (default: %s)" % ",".join(DATA_TYPES))
+    parser.add_option("--methods", type="string", action="callback", callback=_str_list,
+                      dest="methods", default=None,
+                      help="comma-separated methods to time (default: all *.random and " + \
+                           "*.fixed.* methods feasible for the data)")
+    parser.add_option("-r", "--repeats", type="int", dest="repeats", default=3,
+                      help="times to repeat each timing; the median is reported (default: 3)")
+    parser.add_option("--seed", type="int", dest="seed", default=0,
+                      help="seed for the synthetic datasets")
+    parser.add_option("--meta-max-studies", type="int", dest="meta_max_studies", default=1000,
+                      help="skip the meta-methods, which fit a model per study, for " + \
+                           "datasets with more studies than this (default: 1000)")
+    parser.add_option("--bootstrap-replicates", type="int", dest="bootstrap_replicates",
+                      default=100, help="replicates for the bootstraps (default: 100)")
+    parser.add_option("--r-processes", type="int", dest="r_processes", default=1,
+                      help="processes R runs independent fits over (see set_n_cores)")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
+                      help="don't hide what meta_py_r prints")
+    parser.add_option("--compare", action="store_true", dest="compare", default=False,
+                      help="compare the results of two runs")
+    parser.add_option("--threshold", type="float", dest="threshold", default=1.1,
+                      help="with --compare, the new/old ratio above which a timing " + \
+                           "counts as slower (default: 1.1)")
+    options, args = parser.parse_args(argv)
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs two results files")
+        old_results, new_results = [json.load(open(path)) for path in args]
+        regressions = compare(old_results, new_results, threshold=options.threshold)
+        return 1 if regressions else 0
+
+    if len(args) != 1:
+        parser.error("need a file to write the results to")
+    unknown = set(options.data_types) - set(DATA_TYPES)
+    if unknown:
+        parser.error("unknown data type(s) %s" % ", ".join(sorted(unknown)))
+    results = run_benchmarks(options, args[0])
+    print_results(results)
+    failed = [r for r in results["results"] if "error" in r]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
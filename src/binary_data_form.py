@@ -9,7 +9,6 @@
 #  outcome data                                               #
 ###############################################################
 
-import copy
 from functools import partial
 
 from PyQt4.Qt import *
@@ -18,6 +17,8 @@ from PyQt4.QtGui import *
 import meta_py_r
 from meta_globals import *
 import calculator_routines as calc_fncs
+import settings
+import binary_imputation
 
 import forms.ui_binary_data_form
 import forms.ui_choose_back_calc_result_form
@@ -51,7 +52,14 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         self.ci_label.setText("{0:.1f}% Confidence Interval".format(self.global_conf_level))
         self.initialize_form()             # initialize all cell to empty items
         self.setup_inconsistency_checking()
-        self.undoStack = QUndoStack(self)
+        # (the same memory budget as the spreadsheet's undo stack)
+        self.undoStack = BudgetedUndoStack(self, memory_budget=settings.get_undo_memory_budget())
+        # the effect and the state of the back-calculation button are
+        # recomputed (in R) once the user pauses; the edits made until then
+        # are undone together. see _recompute
+        self.state_before_edits = None
+        self.recompute = calc_fncs.DeferredComputation(self._recompute_inputs,
+                self._recompute, self._apply_recompute, parent=self)
 
         #self.setup_clear_button_palettes()    # Color for clear_button_pallette
         self._update_raw_data()               # ma_unit --> table
@@ -91,73 +99,17 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         print self.ma_unit.get_effects_dict()
 
     def enable_back_calculation_btn(self, engage=False):
+        if not engage:
+            # worked out in the background; see _recompute
+            self.recompute.schedule()
+            return None
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                         table = self.raw_data_table,
                         ma_unit = self.ma_unit, 
                         use_old_value=False)
-        
-        def build_back_calc_args_dict():
-
-            d = {}
-            d["metric"] = str(self.cur_effect)
-
-            est,lower,upper = self.ma_unit.get_effect_and_ci(self.cur_effect, self.group_str, self.mult)
-            conv_to_disp_scale = lambda x: meta_py_r.binary_convert_scale(x, self.cur_effect, convert_to="display.scale")
-            d_est,d_lower,d_upper = [conv_to_disp_scale(x) for x in [est,lower,upper]]
-            for i,R_key in enumerate(["estimate", "lower", "upper"]):
-                try:
-                    d["%s" % R_key] = float([d_est,d_lower,d_upper][i])
-                except:
-                    d["%s" % R_key] = None
-
-            d["conf.level"] = self.global_conf_level
-
-            d["Ev_A"] = float(self._get_int(0, 0)) if not self._is_empty(0, 0) else None
-            d["N_A"]  = float(self._get_int(0, 2)) if not self._is_empty(0, 2) else None
-            d["Ev_B"] = float(self._get_int(1, 0)) if not self._is_empty(1, 0) else None
-            d["N_B"]  = float(self._get_int(1, 2)) if not self._is_empty(1, 2) else None
-
-            return d
-        def new_data(bin_data, imputed):
-            changed = False
-            old_data = (bin_data["Ev_A"],
-                        bin_data["N_A"],
-                        bin_data["Ev_B"],
-                        bin_data["N_B"])
-            new_data = []
-            new_data.append((int(round(imputed["op1"]["a"])),
-                             int(round(imputed["op1"]["b"])),
-                             int(round(imputed["op1"]["c"])),
-                             int(round(imputed["op1"]["d"])),
-                             ))
-            if "op2" in imputed:
-                new_data.append((int(round(imputed["op2"]["a"])),
-                                 int(round(imputed["op2"]["b"])),
-                                 int(round(imputed["op2"]["c"])),
-                                 int(round(imputed["op2"]["d"])),
-                                 ))
-            def new_item_available(old,new):
-                isBlank = lambda x: x in EMPTY_VALS
-                no_longer_blank = isBlank(old) and not isBlank(new)
-                return no_longer_blank
-            comparison0 = [new_item_available(old_data[i], new_data[0][i]) for i in range(len(old_data))]
-            new_data_in_op1 = any(comparison0)
-            print("Comparison0:", comparison0)
-
-            if new_data_in_op1:
-                changed = True
-                if "op2" in imputed:
-                    comparison1 = [new_item_available(old_data[i], new_data[1][i]) for i in range(len(old_data))]
-                    print("Comparison1:", comparison1)
-                    new_data_in_op2 = any(comparison1)
-                    if not new_data_in_op2:
-                        changed = False
-            else:
-                changed = False
-
-            return changed
-        ### end of new_data() definition ####
 
         # Makes no sense to show the button on a form where the back
         # calculation is not implemented
@@ -167,11 +119,7 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         else:
             self.back_calc_btn.setVisible(True)
 
-        bin_data = build_back_calc_args_dict()
-        print("Binary data for back-calculation:", bin_data)
-
-        imputed = meta_py_r.impute_bin_data(bin_data.copy())
-        print("Imputed data: %s", imputed)
+        bin_data, imputed = self._back_calc(self._recompute_inputs())
 
         # Leave if nothing was imputed
         if "FAIL" in imputed:
@@ -179,15 +127,8 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
             self.back_calc_btn.setEnabled(False)
             return None
 
-        if new_data(bin_data, imputed):
-            self.back_calc_btn.setEnabled(True)
-        else:
-            self.back_calc_btn.setEnabled(False)
-
-        #self.set_clear_btn_color()
+        self.back_calc_btn.setEnabled(self._imputed_new_data(bin_data, imputed))
 
-        if not engage:
-            return None
         ########################################################################
         # Actually do stuff with imputed data here if we are 'engaged'
         ########################################################################
@@ -224,6 +165,137 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f, restore_old_f=restore_old_f, parent=self)
         self.undoStack.push(command)
 
+    def _back_calc(self, inputs):
+        ''' Back-calculates the counts from the effect and CI in inputs (see
+        _recompute_inputs). Returns the data sent to R and the result '''
+        d = {}
+        d["metric"] = str(inputs["effect"])
+
+        conv_to_disp_scale = lambda x: binary_imputation.calc_to_display_scale(x, inputs["effect"])
+        d_est,d_lower,d_upper = [conv_to_disp_scale(x) for x in inputs["effect_and_ci"]]
+        for i,R_key in enumerate(["estimate", "lower", "upper"]):
+            try:
+                d["%s" % R_key] = float([d_est,d_lower,d_upper][i])
+            except:
+                d["%s" % R_key] = None
+
+        d["conf.level"] = inputs["conf_level"]
+
+        for key, count in zip(["Ev_A", "N_A", "Ev_B", "N_B"], inputs["counts"]):
+            d[key] = float(count) if count is not None else None
+        print("Binary data for back-calculation:", d)
+
+        imputed = binary_imputation.impute_bin_data(d.copy())
+        print("Imputed data: %s", imputed)
+        return d, imputed
+
+    def _imputed_new_data(self, bin_data, imputed):
+        ''' True if the back-calculation fills in something that's blank
+        (in each of its solutions) '''
+        changed = False
+        old_data = (bin_data["Ev_A"],
+                    bin_data["N_A"],
+                    bin_data["Ev_B"],
+                    bin_data["N_B"])
+        new_data = []
+        new_data.append((int(round(imputed["op1"]["a"])),
+                         int(round(imputed["op1"]["b"])),
+                         int(round(imputed["op1"]["c"])),
+                         int(round(imputed["op1"]["d"])),
+                         ))
+        if "op2" in imputed:
+            new_data.append((int(round(imputed["op2"]["a"])),
+                             int(round(imputed["op2"]["b"])),
+                             int(round(imputed["op2"]["c"])),
+                             int(round(imputed["op2"]["d"])),
+                             ))
+        def new_item_available(old,new):
+            isBlank = lambda x: x in EMPTY_VALS
+            no_longer_blank = isBlank(old) and not isBlank(new)
+            return no_longer_blank
+        comparison0 = [new_item_available(old_data[i], new_data[0][i]) for i in range(len(old_data))]
+        new_data_in_op1 = any(comparison0)
+        print("Comparison0:", comparison0)
+
+        if new_data_in_op1:
+            changed = True
+            if "op2" in imputed:
+                comparison1 = [new_item_available(old_data[i], new_data[1][i]) for i in range(len(old_data))]
+                print("Comparison1:", comparison1)
+                new_data_in_op2 = any(comparison1)
+                if not new_data_in_op2:
+                    changed = False
+        else:
+            changed = False
+
+        return changed
+
+    ####### Deferred recomputation (see calc_fncs.DeferredComputation) #######
+    def _recompute_inputs(self):
+        ''' Snapshot of everything _recompute needs '''
+        return {"effect":self.cur_effect,
+                "conf_level":self.global_conf_level,
+                "raw_data":tuple(self.ma_unit.get_raw_data_for_groups(self.cur_groups)),
+                "effect_and_ci":tuple(self.ma_unit.get_effect_and_ci(self.cur_effect, self.group_str, self.mult)),
+                "counts":tuple([self._get_int(row, col) for row, col in [(0,0), (0,2), (1,0), (1,2)]])}
+
+    def _recompute(self, inputs, options):
+        '''
+        Runs on a worker thread: must not touch the widgets or the ma_unit.
+        If options has update_effect, the effect is recomputed from the raw
+        data; either way, works out whether back-calculation would fill in
+        anything (None if it isn't available for the effect)
+        '''
+        result = {"effect_and_ci":None, "back_calc":None}
+        if options.get("update_effect"):
+            result["effect_and_ci"] = self._effect_for_raw_data(inputs)
+            if result["effect_and_ci"] is not None:
+                inputs = dict(inputs, effect_and_ci=result["effect_and_ci"])
+
+        if inputs["effect"] in ["OR", "RR", "RD"]:
+            bin_data, imputed = self._back_calc(inputs)
+            result["back_calc"] = "FAIL" not in imputed and self._imputed_new_data(bin_data, imputed)
+        return result
+
+    def _apply_recompute(self, inputs, options, result):
+        if result["effect_and_ci"] is not None:
+            est, low, high = result["effect_and_ci"]
+            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)
+            self.set_current_effect()
+        self.back_calc_btn.setVisible(result["back_calc"] is not None)
+        self.back_calc_btn.setEnabled(bool(result["back_calc"]))
+        self._push_pending_edits()
+
+    def _begin_edit(self, old_ma_unit, old_table):
+        # the state before the first of the edits that are still to be
+        # recomputed
+        if self.state_before_edits is None:
+            self.state_before_edits = (old_ma_unit, old_table)
+
+    def _push_pending_edits(self):
+        if self.state_before_edits is None:
+            return
+        old_ma_unit, old_table = self.state_before_edits
+        self.state_before_edits = None
+        new_ma_unit, new_table = self._save_ma_unit_and_table_state(
+                                table = self.raw_data_table,
+                                ma_unit = self.ma_unit,
+                                use_old_value = False)
+        restore_old_f = lambda: self.restore_ma_unit_and_table(old_ma_unit, old_table)
+        restore_new_f = lambda: self.restore_ma_unit_and_table(new_ma_unit, new_table)
+        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f,
+                        restore_old_f=restore_old_f, parent=self, refresh_on_push=False)
+        self.undoStack.push(command)
+
+    def done(self, result):
+        # finish (or drop) the pending recomputation before the form goes away
+        if result == QDialog.Accepted:
+            self.recompute.flush()
+        else:
+            self.recompute.cancel()
+        self.recompute.wait()
+        QDialog.done(self, result)
+
     def setup_inconsistency_checking(self):
         # set-up inconsistency label
         inconsistency_palette = QPalette()
@@ -359,6 +431,9 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
     
         
     def val_changed(self, val_str):
+        # the pending edits go on the undo stack first
+        self.recompute.flush()
+
         # Backup form state
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                                 table = self.raw_data_table,
@@ -452,8 +527,9 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         return None
         
     def restore_ma_unit(self, old_ma_unit):
-        ''' Restores the ma_unit data and resets the form'''
-        self.ma_unit.__dict__ = copy.deepcopy(old_ma_unit.__dict__)
+        ''' Restores the ma_unit data (as saved by ma_unit.get_state()) and
+        resets the form'''
+        self.ma_unit.set_state(old_ma_unit)
         print("Restored ma_unit data: %s" % str(self.ma_unit.get_raw_data_for_groups(self.cur_groups)))
         
         self.initialize_form() # clear form first
@@ -486,8 +562,8 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         if use_old_value:
             old_table[row][col] = old_value   # ...from BEFORE the cell changed
         
-        # Make backup copy of ma_unit
-        old_ma_unit = copy.deepcopy(ma_unit)
+        # Make backup of the ma_unit data
+        old_ma_unit = ma_unit.get_state()
         return old_ma_unit, old_table
         
     def cell_changed(self, row, col):
@@ -517,18 +593,11 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
             return  # and leave
           
         self._update_ma_unit()  # table widget --> ma_unit
-        self.try_to_update_cur_outcome()  # update metric in ma_unit and in table
 
-        new_ma_unit, new_table = self._save_ma_unit_and_table_state(
-                                table = self.raw_data_table,
-                                ma_unit = self.ma_unit, 
-                                row = row, col = col, use_old_value = False)
-        #restore_f = self.restore_ma_unit_and_table
-        #command = calc_fncs.CommandFieldChanged(old_ma_unit, new_ma_unit, old_table, new_table, restore_f=restore_f, parent=self)
-        restore_old_f = lambda: self.restore_ma_unit_and_table(old_ma_unit, old_table)
-        restore_new_f = lambda: self.restore_ma_unit_and_table(new_ma_unit, new_table)
-        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f, restore_old_f=restore_old_f, parent=self)        
-        self.undoStack.push(command)
+        # the metric (in ma_unit and in table) is updated once the user
+        # pauses, and the edit is pushed onto the undo stack then
+        self._begin_edit(old_ma_unit, old_table)
+        self.recompute.schedule(update_effect=True)
     
         
     def _get_table_vals(self):
@@ -630,27 +699,37 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
         return x is None or x == ""
         
     def try_to_update_cur_outcome(self):
-        e1, n1, e2, n2 = self.ma_unit.get_raw_data_for_groups(self.cur_groups)
+        effect_and_ci = self._effect_for_raw_data(self._recompute_inputs())
+        if effect_and_ci is not None:
+            est, low, high = effect_and_ci
+            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)
+            self.set_current_effect()
+
+    def _effect_for_raw_data(self, inputs):
+        ''' The effect and CI (on the calculation scale) for the raw data in
+        inputs (see _recompute_inputs), or None if there isn't enough of it '''
+        e1, n1, e2, n2 = inputs["raw_data"]
+        effect = inputs["effect"]
         print("e1: %s, n1: %s, e2: %s, n2: %s" % (str(e1),str(n1),str(e2),str(n2)))
         
         two_arm_raw_data_ok = not any([self._isBlank(x) for x in [e1, n1, e2, n2]])
         one_arm_raw_data_ok = not any([self._isBlank(x) for x in [e1, n1]])
-        curr_effect_is_one_arm = self.cur_effect in BINARY_ONE_ARM_METRICS
-        curr_effect_is_two_arm = self.cur_effect in BINARY_TWO_ARM_METRICS
+        curr_effect_is_one_arm = effect in BINARY_ONE_ARM_METRICS
+        curr_effect_is_two_arm = effect in BINARY_TWO_ARM_METRICS
         
         # if None is in the raw data, should we clear out current outcome?
-        if two_arm_raw_data_ok or (curr_effect_is_one_arm and one_arm_raw_data_ok):
-            if curr_effect_is_two_arm:
-                est_and_ci_d = meta_py_r.effect_for_study(e1, n1, e2, n2, metric=self.cur_effect, conf_level=self.global_conf_level)
-            else:
-                # binary, one-arm
-                est_and_ci_d = meta_py_r.effect_for_study(e1, n1, two_arm=False, metric=self.cur_effect, conf_level=self.global_conf_level)
-                                    
-            est, low, high = est_and_ci_d["calc_scale"]  # calculation (e.g., log) scale
-            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)
-            self.set_current_effect()
+        if not (two_arm_raw_data_ok or (curr_effect_is_one_arm and one_arm_raw_data_ok)):
+            return None
+        if curr_effect_is_two_arm:
+            est_and_ci_d = meta_py_r.effect_for_study(e1, n1, e2, n2, metric=effect, conf_level=inputs["conf_level"])
+        else:
+            # binary, one-arm
+            est_and_ci_d = meta_py_r.effect_for_study(e1, n1, two_arm=False, metric=effect, conf_level=inputs["conf_level"])
+        return tuple(est_and_ci_d["calc_scale"])  # calculation (e.g., log) scale
            
     def clear_form(self):
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                         table = self.raw_data_table,
@@ -711,10 +790,12 @@ class BinaryDataForm2(QDialog, forms.ui_binary_data_form.Ui_BinaryDataForm):
     ####### Undo framework ############
     def undo(self):
         print("undoing....")
+        self.recompute.flush()
         self.undoStack.undo()
         
     def redo(self):
         print("redoing....")
+        self.recompute.flush()
         self.undoStack.redo()
     #################################
         
@@ -0,0 +1,266 @@
+#############################################
+#                                           #
+#  OpenMeta[analyst]                        #
+#                                           #
+#  Back-calculates binary 2x2 tables from   #
+#  a RD, OR or RR and its CI, in Python.    #
+#  A native port of gimpute.bin.data (and   #
+#  gimpute.bin.data.batch) in               #
+#  data_transform.r; the results match R's  #
+#  (see test_meta_analysis.py).             #
+#                                           #
+#############################################
+
+import math
+
+NAN = float("nan")
+INF = float("inf")
+
+# the metrics a 2x2 table can be back-calculated from
+BACK_CALCULATABLE_METRICS = ["OR", "RR", "RD"]
+# these are symmetric on the log scale, and are given on the display
+# (i.e., not the log) scale
+LOG_METRICS = ["OR", "RR"]
+
+def impute_bin_data(bin_data):
+    '''
+    Drop-in replacement for meta_py_r.impute_bin_data. bin_data has the
+    metric, the estimate, lower and upper (on the display scale), N_A,
+    N_B and conf.level; any of these may be None. Returns
+    {"op1":{"a":..., "b":..., "c":..., "d":...}, "op2":{...}} (a and c
+    are the events and b and d the totals of groups A and B; RR only has
+    op1), or {"FAIL":None} if no table can be computed.
+    '''
+    get = lambda key: _none_if_missing(bin_data.get(key))
+    metric = bin_data.get("metric")
+    est, lower, upper = get("estimate"), get("lower"), get("upper")
+    N_1, N_0 = get("N_A"), get("N_B")
+    conf_level = get("conf.level")
+
+    # See if we have enough inputs to proceed
+    est_low_up_ok = (est is not None and (lower is not None or upper is not None)) or \
+                    (lower is not None and upper is not None)
+    if None in (metric, N_1, N_0, conf_level) or not est_low_up_ok:
+        return {"FAIL":None}
+    if metric not in BACK_CALCULATABLE_METRICS:
+        # gimpute.bin.data errors out in this case
+        return {"FAIL":None}
+
+    ps = _solve(metric, _nan_if_none(est), _nan_if_none(lower), _nan_if_none(upper),
+                float(N_1), float(N_0), mult_for_conf_level(float(conf_level)))
+    res = {}
+    for op, (p0, p1) in zip(["op1", "op2"], ps):
+        a, c = r_round(p1*N_1), r_round(p0*N_0)
+        if math.isnan(a) or math.isnan(c):
+            return {"FAIL":None}
+        res[op] = {"a":a, "b":float(N_1), "c":c, "d":float(N_0)}
+    return res
+
+def impute_bin_data_batch(rows):
+    '''
+    Drop-in replacement for meta_py_r.impute_bin_data_batch; each of rows
+    is a dictionary as taken by impute_bin_data. Returns, for each row, a
+    dictionary with the counts of both solutions, a1, c1 and a2, c2 (None
+    where there is no such solution, and all None for rows for which
+    nothing could be computed).
+    '''
+    column = lambda key: [_none_if_missing(row.get(key)) for row in rows]
+    return imputed_bin_data_columns(column("metric"), column("estimate"),
+                                    column("lower"), column("upper"),
+                                    column("N_A"), column("N_B"), column("conf.level"))
+
+def imputed_bin_data_columns(metric, estimate, lower, upper, N_A, N_B, conf_level):
+    '''
+    As impute_bin_data_batch, but takes the inputs as (equal length)
+    columns rather than rows. The multiplier for each confidence level is
+    computed once.
+    '''
+    mults = {}
+    results = []
+    for row in zip(metric, estimate, lower, upper, N_A, N_B, conf_level):
+        metric_i, est, low, up, N_1, N_0, conf_level_i = row
+        failed = {"a1":None, "c1":None, "a2":None, "c2":None}
+        if None in (N_1, N_0, conf_level_i) or metric_i not in BACK_CALCULATABLE_METRICS:
+            results.append(failed)
+            continue
+        if conf_level_i not in mults:
+            mults[conf_level_i] = mult_for_conf_level(float(conf_level_i))
+
+        ps = _solve(metric_i, _nan_if_none(est), _nan_if_none(low), _nan_if_none(up),
+                    float(N_1), float(N_0), mults[conf_level_i])
+        counts = []
+        for p0, p1 in ps:
+            counts.append((r_round(p1*N_1), r_round(p0*N_0)))
+        if any([math.isnan(x) for x in sum(counts, ())]):
+            results.append(failed)
+            continue
+        result = dict(failed)
+        for i, (a, c) in enumerate(counts):
+            result["a%d" % (i+1)], result["c%d" % (i+1)] = a, c
+        results.append(result)
+    return results
+
+def calc_to_display_scale(x, metric):
+    ''' binary.transform.f(metric)$display.scale for the metrics the table
+    can be back-calculated from (None stays None) '''
+    if x is None:
+        return None
+    if metric in LOG_METRICS:
+        return _exp(x)
+    return x
+
+def _solve(metric, est, lower, upper, N_1, N_0, mult):
+    '''
+    The proportions (p0, p1) of events in groups B and A of each solution
+    (two for RD and OR, one for RR); est, lower, upper are on the display
+    scale and are nan if not given. As impute.from.RD, impute.from.LOR and
+    impute.from.LRR in gimpute.bin.data
+    '''
+    if metric in LOG_METRICS:
+        est, lower, upper = _log(est), _log(lower), _log(upper)
+
+    # calc.d.and.b: the missing one of est, lower, upper, assuming a
+    # symmetric distribution
+    d, d_L, d_U = est, lower, upper
+    if math.isnan(d):
+        d = (d_L + d_U)/2
+    if math.isnan(d_U):
+        d_U = 2*d - d_L
+    b = ((d_U - d)/mult)
+    b = b*b
+    n = N_0 + N_1
+
+    if metric == "RD":
+        A = n
+        B = 2*N_0*d - n
+        C = N_0*(N_1*b - d*(1-d))
+        root = _sqrt(B*B - 4*A*C)
+        p0s = [_div(-B+root, 2*A), _div(-B-root, 2*A)]
+        return [(p0, d+p0) for p0 in p0s]
+    elif metric == "OR":
+        d = _exp(d)
+        A = N_0*(1-d)*(1-d) + b*d*N_0*N_1
+        B = -1*(2*N_0*(1-d) + b*d*N_0*N_1)
+        C = N_0 + d*N_1
+        root = _sqrt(B*B - 4*A*C)
+        p0s = [_div(-B+root, 2*A), _div(-B-root, 2*A)]
+        return [(p0, _div(d*p0, d*p0+1-p0)) for p0 in p0s]
+    else: # RR
+        d = _exp(d)
+        p0 = _div(N_0 + d*N_1, d*(b*N_1*N_0 + N_1 + N_0))
+        return [(p0, p0*d)]
+
+def mult_for_conf_level(conf_level):
+    ''' abs(qnorm(alpha/2)), e.g. ~1.96 for a 95% confidence level '''
+    alpha = 1.0 - (conf_level/100.0)
+    return abs(normal_quantile(alpha/2.0))
+
+##### R's arithmetic #####
+# python raises where R returns Inf or NaN; these do as R does, so that the
+# results (and failures) are the same
+
+def r_round(x):
+    ''' R's round(x, digits=0), which rounds halves to even '''
+    if math.isnan(x) or math.isinf(x):
+        return x
+    floor = math.floor(x)
+    diff = x - floor
+    if diff > 0.5:
+        return floor + 1
+    elif diff < 0.5:
+        return floor
+    return floor if floor % 2 == 0 else floor + 1
+
+def _div(x, y):
+    try:
+        return x/y
+    except ZeroDivisionError:
+        if x == 0 or math.isnan(x):
+            return NAN
+        return math.copysign(INF, x)*math.copysign(1, y)
+
+def _sqrt(x):
+    if math.isnan(x) or x < 0:
+        return NAN
+    return math.sqrt(x)
+
+def _log(x):
+    if math.isnan(x) or x < 0:
+        return NAN
+    if x == 0:
+        return -INF
+    return math.log(x)
+
+def _exp(x):
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return INF
+
+def _none_if_missing(x):
+    if x in (None, "", "NA"):
+        return None
+    if isinstance(x, float) and math.isnan(x):
+        return None
+    return x
+
+def _nan_if_none(x):
+    return NAN if x is None else float(x)
+
+##### the normal quantile function #####
+# Wichura's algorithm AS 241 (PPND16), which is what R's qnorm uses
+
+def normal_quantile(p):
+    if math.isnan(p) or p < 0 or p > 1:
+        return NAN
+    if p == 0:
+        return -INF
+    if p == 1:
+        return INF
+
+    q = p - 0.5
+    if abs(q) <= 0.425:
+        r = 0.180625 - q*q
+        return q * (((((((r * 2509.0809287301226727 +
+                   33430.575583588128105) * r + 67265.770927008700853) * r +
+                 45921.953931549871457) * r + 13731.693765509461125) * r +
+               1971.5909503065514427) * r + 133.14166789178437745) * r +
+             3.387132872796366608) / \
+            (((((((r * 5226.495278852545925 +
+                 28729.085735721942674) * r + 39307.89580009271061) * r +
+               21213.794301586595867) * r + 5394.1960214247511077) * r +
+             687.1870074920579083) * r + 42.313330701600911252) * r + 1.)
+
+    r = p if q < 0 else 1 - p
+    r = math.sqrt(-math.log(r))
+    if r <= 5.:
+        r -= 1.6
+        val = (((((((r * 7.7454501427834140764e-4 +
+                   .0227238449892691845833) * r + .24178072517745061177) *
+                 r + 1.27045825245236838258) * r +
+                3.64784832476320460504) * r + 5.7694972214606914055) *
+              r + 4.6303378461565452959) * r +
+             1.42343711074968357734) / \
+            (((((((r *
+                   1.05075007164441684324e-9 + 5.475938084995344946e-4) *
+                  r + .0151986665636164571966) * r +
+                 .14810397642748007459) * r + .68976733498510000455) *
+               r + 1.6763848301838038494) * r +
+              2.05319162663775882187) * r + 1.)
+    else:
+        r -= 5.
+        val = (((((((r * 2.01033439929228813265e-7 +
+                   2.71155556874348757815e-5) * r +
+                  .0012426609473880784386) * r + .026532189526576123093) *
+                r + .29656057182850489123) * r +
+               1.7848265399172913358) * r + 5.4637849111641143699) *
+             r + 6.6579046435011037772) / \
+            (((((((r *
+                   2.04426310338993978564e-15 + 1.4215117583164458887e-7) *
+                  r + 1.8463183175100546818e-5) * r +
+                 7.868691311456132591e-4) * r + .0148753612908506148525)
+               * r + .13692988092273580531) * r +
+              .59983220655588793769) * r + 1.)
+    if q < 0.0:
+        val = -val
+    return val
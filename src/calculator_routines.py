@@ -12,6 +12,7 @@
 
 from PyQt4.Qt import *
 from functools import partial
+import threading
 
 from meta_globals import *
 import meta_py_r
@@ -332,18 +333,27 @@ def save_table_data(table):
 
 class CommandFieldChanged(QUndoCommand):
     def __init__(self, restore_new_f = None, restore_old_f = None,
-                 parent=None, description=""):
+                 parent=None, description="", refresh_on_push=True):
         super(CommandFieldChanged, self).__init__(description)
         
         self.parent = parent
         self.just_created = True
+        # False when the form is already up to date with the change by the
+        # time it is pushed (see DeferredComputation)
+        self.refresh_on_push = refresh_on_push
         self.restore_new_f = restore_new_f
         self.restore_old_f = restore_old_f
+        # the states restored are bound in the closures of the restore
+        # functions (the forms are QObjects, so estimate_size skips them)
+        self.size = estimate_size([cell.cell_contents for f in (restore_new_f, restore_old_f) \
+                                        if f is not None for cell in (f.func_closure or ())],
+                                  follow_instances=False)
         
     def redo(self):
         if self.just_created:
             self.just_created = False
-            self.parent.enable_back_calculation_btn()
+            if self.refresh_on_push:
+                self.parent.enable_back_calculation_btn()
         else:
             print("Restoring new ma_unit")
             self.restore_new_f()
@@ -354,6 +364,149 @@ class CommandFieldChanged(QUndoCommand):
         self.restore_old_f()
         #self.parent.enable_back_calculation_btn() ##
 
+    def undo_size(self):
+        return self.size
+
+    def release(self):
+        # see BudgetedUndoStack
+        self.restore_new_f = self.restore_old_f = None
+        self.size = 0
+
+########################## Deferred (coalesced) recomputation ##########################
+# Every edit on the data forms used to go to R right away (for the new
+# effect, imputed values and whether back-calculation is possible), on the
+# GUI thread. A DeferredComputation instead waits until the edits have
+# paused for RECOMPUTE_DELAY_MS, then computes once for all of them on a
+# thread pool thread; results for inputs that have since changed again
+# are thrown away rather than applied.
+RECOMPUTE_DELAY_MS = 250
+
+class _ComputationRunner(QRunnable):
+    def __init__(self, notifier, generation, compute_f, inputs, options):
+        QRunnable.__init__(self)
+        # kept by the DeferredComputation until it reports back
+        self.setAutoDelete(False)
+        self.notifier = notifier
+        self.generation = generation
+        self.compute_f = compute_f
+        self.inputs, self.options = inputs, options
+        self.finished = threading.Event()
+
+    def run(self):
+        result, error = None, None
+        try:
+            result = self.compute_f(self.inputs, self.options)
+        except Exception, e:
+            print "deferred computation failed: %s" % e
+            error = e
+        self.finished.set()
+        try:
+            self.notifier.emit(SIGNAL("computed"), self.generation, result, error)
+        except RuntimeError:
+            # the form went away in the meantime
+            pass
+
+class DeferredComputation(QObject):
+    '''
+    Runs compute_f(inputs, options) some time after the last call to
+    schedule(), off the GUI thread, then apply_f(inputs, options, result)
+    on the GUI thread.
+
+    inputs_f is called (on the GUI thread) to take a snapshot of whatever
+    compute_f needs; compute_f must only use that snapshot (plus R), never
+    the form's widgets. The result is applied only if inputs_f() still
+    returns the same thing by the time it is ready; otherwise it is computed
+    again. The keyword options of the calls to schedule() made in the
+    meantime are merged (a flag stays set if any of them set it) and are
+    passed along to compute_f and apply_f.
+    '''
+    def __init__(self, inputs_f, compute_f, apply_f, delay=RECOMPUTE_DELAY_MS, parent=None):
+        super(DeferredComputation, self).__init__(parent)
+        self.inputs_f = inputs_f
+        self.compute_f = compute_f
+        self.apply_f = apply_f
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        QObject.connect(self.timer, SIGNAL("timeout()"), self._start)
+        QObject.connect(self, SIGNAL("computed"), self._computed)
+
+        # bumped whenever the inputs (may) have changed; results of an
+        # older generation are stale
+        self.generation = 0
+        self.options = {}
+        # True from a call to schedule() until a computation covering it starts
+        self.pending = False
+        self.running = None   # (runner, inputs, options) of the computation underway
+
+    def schedule(self, **options):
+        for key, value in options.items():
+            self.options[key] = self.options.get(key, False) or value
+        self.generation += 1
+        self.pending = True
+        self.timer.start()
+
+    def is_pending(self):
+        return self.pending or self.running is not None
+
+    def cancel(self):
+        self.timer.stop()
+        self.generation += 1
+        self.pending = False
+        self.options = {}
+
+    def wait(self):
+        ''' Blocks until the computation underway (if any) is done with R
+        and with the form '''
+        if self.running is not None:
+            self.running[0].finished.wait()
+
+    def flush(self):
+        ''' Computes and applies whatever is pending right now, on this
+        (the GUI) thread '''
+        if not self.is_pending():
+            return
+        self.timer.stop()
+        # a computation underway is now stale
+        self.generation += 1
+        self.pending = False
+        inputs, options = self.inputs_f(), dict(self.options)
+        try:
+            result = self.compute_f(inputs, options)
+        except Exception, e:
+            print "deferred computation failed: %s" % e
+            return
+        self.options = {}
+        self.apply_f(inputs, options, result)
+
+    def _start(self):
+        if self.running is not None:
+            # one at a time; _computed starts the next one
+            return
+        self.pending = False
+        inputs, options = self.inputs_f(), dict(self.options)
+        runner = _ComputationRunner(self, self.generation, self.compute_f, inputs, options)
+        self.running = (runner, inputs, options)
+        QThreadPool.globalInstance().start(runner)
+
+    def _computed(self, generation, result, error):
+        runner, inputs, options = self.running
+        self.running = None
+        if generation != self.generation:
+            # edited (or flushed, or cancelled) since; go again unless the
+            # timer is going to
+            if self.pending and not self.timer.isActive():
+                self._start()
+            return
+        if error is not None:
+            return
+        if self.inputs_f() != inputs:
+            self.schedule()
+            return
+        self.options = {}
+        self.apply_f(inputs, options, result)
+
 # Currently unused?
 def reset_table_item_flags(table):
     nrows = table.rowCount()
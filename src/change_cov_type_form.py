@@ -186,7 +186,7 @@ class CovModel(QAbstractTableModel):
                     if not converted_ok: 
                         print "whoops! can't convert %s to a number." % value
                         new_value = None
-                study.covariate_dict[cov_name] = new_value
+                self.dataset.set_covariate_value(study, cov_name, new_value)
                 self.refresh_cov_values()
                 return True
         return False
@@ -21,11 +21,11 @@
 
 #import pdb
 import sys
-import copy
 
 from PyQt4.Qt import *
 from functools import partial
 import calculator_routines as calc_fncs
+import settings
 
 import meta_py_r
 from meta_globals import *
@@ -84,12 +84,18 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         
         self.setup_clear_button_palettes() # Color for clear_button_pallette
         self.initialize_form() # initialize cells to empty items 
-        self.undoStack = QUndoStack(self)
-        
-        self.update_raw_data()
+        # (the same memory budget as the spreadsheet's undo stack)
+        self.undoStack = BudgetedUndoStack(self, memory_budget=settings.get_undo_memory_budget())
+        # imputation, the effect and the state of the back-calculation
+        # button are recomputed (in R) once the user pauses; the edits made
+        # until then are undone together. see _recompute
+        self.state_before_edits = None
+        self.recompute = calc_fncs.DeferredComputation(self._recompute_inputs,
+                self._recompute, self._apply_recompute, parent=self)
+        
+        self.update_raw_data() # also imputes what it can
         self._populate_effect_data()
         self.set_current_effect()
-        self.impute_data()
         self.enable_back_calculation_btn()
         
         print("current effect: %s" % str(self.cur_effect))
@@ -219,6 +225,9 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         return None # should never happen
       
     def val_changed(self, val_str):
+        # the pending edits go on the undo stack first
+        self.recompute.flush()
+
         # Backup form state
         old_ma_unit, old_tables_data = self._save_ma_unit_and_table_states(
                                 tables = [self.simple_table,
@@ -347,7 +356,7 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             se = self.ma_unit.get_se(self.cur_effect, self.group_str, self.mult)
             self._set_val(row_index, col, grp_raw_data[col], self.simple_table)
         self.simple_table.blockSignals(False) 
-        self.impute_data()
+        self.recompute.schedule(impute=True)
 
         
     def _cell_data_not_valid(self, celldata_string, cell_header=None):
@@ -385,7 +394,6 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             warning_msg = self._cell_data_not_valid(self.simple_table.item(row, col).text(),column_headers[col])
             if warning_msg:
                 raise Exception("Invalid Cell Data")
-            self.impute_data()
         except Exception as e:
             msg = e.args[0]
             QMessageBox.warning(self.parent(), "whoops", msg)
@@ -393,21 +401,11 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             return
         
         self._copy_raw_data_from_table_to_ma_unit() # table --> ma_unit
-        self.try_to_update_cur_outcome()
-        
-        new_ma_unit, new_tables_data = self._save_ma_unit_and_table_states(
-                            tables=self.tables,
-                            ma_unit=self.ma_unit,
-                            table=self.simple_table,
-                            row=row, col=col,
-                            use_old_value=False)
-        new_correlation = self._get_correlation_str()
-        restore_old_f = lambda: self.restore_ma_unit_and_tables(old_ma_unit, old_tables_data, old_correlation)
-        restore_new_f = lambda: self.restore_ma_unit_and_tables(new_ma_unit, new_tables_data, new_correlation)
-        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f,
-                                                restore_old_f=restore_old_f,
-                                                parent=self)
-        self.undoStack.push(command)
+
+        # imputation and the outcome are updated once the user pauses, and
+        # the edit is pushed onto the undo stack then
+        self._begin_edit(old_ma_unit, old_tables_data, old_correlation)
+        self.recompute.schedule(impute=True, update_effect=True)
         
         ###self.enable_txt_box_input() # if the effect was imputed
         ###self.set_clear_btn_color()
@@ -478,14 +476,14 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             ##self.ma_unit.set_SE(self.cur_effect, self.group_str, se):
             
     def restore_ma_unit(self, old_ma_unit):
-        ''' Restores the ma_unit data and resets the form'''
-        self.ma_unit.__dict__ = copy.deepcopy(old_ma_unit.__dict__)
+        ''' Restores the ma_unit data (as saved by ma_unit.get_state()) and
+        resets the form'''
+        self.ma_unit.set_state(old_ma_unit)
         print("Restored ma_unit data: %s" % str(self.ma_unit.get_raw_data_for_groups(self.cur_groups)))
         
         self.initialize_form() # clear form first
-        self.update_raw_data()
+        self.update_raw_data() # also imputes what it can
         self.set_current_effect()
-        self.impute_data()
         self.enable_back_calculation_btn()
         #self.set_clear_btn_color()
         
@@ -526,8 +524,8 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             # From before most recently changed cell changed
             old_tables_data[self._get_index_of_table(table)][row][col] = old_value
             
-        # Make backup copy of ma_unit
-        old_ma_unit = copy.deepcopy(ma_unit)
+        # Make backup of the ma_unit data
+        old_ma_unit = ma_unit.get_state()
         return old_ma_unit, old_tables_data
             
     
@@ -546,39 +544,46 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         # the meta_py_r routine expects.
         var_names = self.get_column_header_strs()
         for row_index, group_name in enumerate(self.cur_groups):
-            # assemble the fields in a dictionary; pass off to meta_py_r
-            cur_dict = {}
-            for var_index, var_name in enumerate(var_names):
-                var_value = self._get_float(row_index, var_index)
-                if var_value is not None:
-                    cur_dict[var_name] = var_value
-
-            # now pass off what we have for this study to the
-            # imputation routine
-            alpha = self.conf_level_to_alpha()
-            results_from_r = meta_py_r.impute_cont_data(cur_dict, alpha)
-
-            print "Raw results from R (imputation): %s" % results_from_r
-            print results_from_r
-
-            print "Results from r succeeded?:", results_from_r["succeeded"]
-            if results_from_r["succeeded"]:
-                computed_vals = results_from_r["output"]
+            row_values = [self._get_float(row_index, var_index) for var_index in range(len(var_names))]
+            computed_vals = self._impute_row(var_names, row_values, self.conf_level)
+            if computed_vals is not None:
                 # and then iterate over the columns again, 
                 # populating the table with any available
                 # computed fields
-            
-                print "Computed vals:",computed_vals
                 for var_index, var_name in enumerate(var_names):  
                     self._set_val(row_index, var_index, computed_vals[var_name])
                 self._copy_raw_data_from_table_to_ma_unit()
-            else:
-                try:
-                    print("Why didn't it succeed?: '%s'" % results_from_r["comment"])
-                except KeyError:
-                    pass
-    def conf_level_to_alpha(self):
-        alpha = 1-self.conf_level/100.0
+
+    def _impute_row(self, var_names, row_values, conf_level):
+        ''' The values R imputes for a row of the table (None if it can't);
+        doesn't touch the form, so may be called from any thread '''
+        # assemble the fields in a dictionary; pass off to meta_py_r
+        cur_dict = {}
+        for var_name, var_value in zip(var_names, row_values):
+            if var_value is not None:
+                cur_dict[var_name] = var_value
+
+        # now pass off what we have for this study to the
+        # imputation routine
+        alpha = self.conf_level_to_alpha(conf_level)
+        results_from_r = meta_py_r.impute_cont_data(cur_dict, alpha)
+
+        print "Raw results from R (imputation): %s" % results_from_r
+
+        print "Results from r succeeded?:", results_from_r["succeeded"]
+        if not results_from_r["succeeded"]:
+            try:
+                print("Why didn't it succeed?: '%s'" % results_from_r["comment"])
+            except KeyError:
+                pass
+            return None
+        print "Computed vals:",results_from_r["output"]
+        return results_from_r["output"]
+
+    def conf_level_to_alpha(self, conf_level=None):
+        if conf_level is None:
+            conf_level = self.conf_level
+        alpha = 1-conf_level/100.0
         return alpha
            
     def impute_pre_post_data(self, table, group_index, row=None, col=None):
@@ -590,6 +595,8 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         '''
         
         if not (row,col) == (None, None): # means this was called through user interaction, not programmatically
+            # the pending edits go on the undo stack first
+            self.recompute.flush()
             old_ma_unit, old_tables_data = self._save_ma_unit_and_table_states(
                                 tables=self.tables,
                                 ma_unit=self.ma_unit,
@@ -726,24 +733,36 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         n1, m1, sd1, n2, m2, sd2 = self.ma_unit.get_raw_data_for_groups(self.cur_groups)
         se1, se2 = self._get_float(0, 3), self._get_float(1, 3)
         
+        effect_and_ci = self._effect_for_raw_data(self.cur_effect, self.conf_level,
+                                                  (n1, m1, sd1, se1), (n2, m2, sd2, se2))
+        if effect_and_ci is not None:
+            est, low, high = effect_and_ci
+            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)    
+            self.set_current_effect()
+
+    def _effect_for_raw_data(self, effect, conf_level, group1, group2):
+        ''' The effect and CI (on the calculation scale) for the (n, mean, sd,
+        se) of each group, or None if there isn't enough data '''
+        n1, m1, sd1, se1 = group1
+        n2, m2, sd2, se2 = group2
+
         # here we check whether or not we have sufficient data to compute an outcome
         if not any([self.no_val(x) for x in [n1, m1, sd1, n2, m2, sd2 ]]) or \
-                    not any([self.no_val(x) for x in [m1, se1, m2, se2]]) and self.cur_effect=="MD" or \
-                    not any([self.no_val(x) for x in [n1, m1, sd1]]) and self.cur_effect in CONTINUOUS_ONE_ARM_METRICS:
+                    not any([self.no_val(x) for x in [m1, se1, m2, se2]]) and effect=="MD" or \
+                    not any([self.no_val(x) for x in [n1, m1, sd1]]) and effect in CONTINUOUS_ONE_ARM_METRICS:
             est_and_ci_d = None
-            if self.cur_effect in CONTINUOUS_TWO_ARM_METRICS:
+            if effect in CONTINUOUS_TWO_ARM_METRICS:
                 est_and_ci_d = meta_py_r.continuous_effect_for_study(n1, m1, sd1, se1=se1, 
                                                                      n2=n2, m2=m2, sd2=sd2, se2=se2,
-                                                                     metric=self.cur_effect,
-                                                                     conf_level=self.conf_level)
+                                                                     metric=effect,
+                                                                     conf_level=conf_level)
             else:
                 # continuous, one-arm metric
                 est_and_ci_d = meta_py_r.continuous_effect_for_study(n1, m1, sd1,
-                                      two_arm=False, metric=self.cur_effect, conf_level=self.conf_level)                          
+                                      two_arm=False, metric=effect, conf_level=conf_level)                          
             
-            est, low, high = est_and_ci_d["calc_scale"] # calculation (e.g., log) scale
-            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)    
-            self.set_current_effect()
+            return tuple(est_and_ci_d["calc_scale"]) # calculation (e.g., log) scale
+        return None
     
     def enable_txt_box_input(self):
         ''' Enables text boxes if they are empty, disables them otherwise '''
@@ -752,6 +771,13 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         #                                  self.high_txt_box, self.correlation_pre_post)
         
     def enable_back_calculation_btn(self, engage = False):
+        self._choose_metric_parameter()
+        if not engage:
+            # worked out in the background; see _recompute
+            self.recompute.schedule()
+            return None
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_tables_data = self._save_ma_unit_and_table_states(
                                 tables = [self.simple_table,
@@ -760,71 +786,6 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
                                 ma_unit = self.ma_unit, 
                                 use_old_value=False)
         old_correlation = self._get_correlation_str()
-        
-        # Choose metric parameter if not already chosen
-        if (self.metric_parameter is None) and self.cur_effect in ["MD","SMD"]:
-            print("need to choose metric parameter because it is %s" % str(self.metric_parameter))
-            if self.cur_effect == "MD":
-                info = "In order to perform back-calculation most accurately, we need to know something about the assumptions about the two population standard deviations.\n*Are we assuming that both of the population standard deviations are the same (as in most parametric data analysis techniques)"
-                option0_txt = "yes (default)."
-                option1_txt = "no"
-                dialog = ChooseBackCalcResultForm(info, option0_txt, option1_txt)
-                dialog.setWindowTitle("Population SD Assumptions")
-                if dialog.exec_():
-                    self.metric_parameter = True if dialog.getChoice() == 0 else False
-            elif self.cur_effect == "SMD":
-                info = "In order to perform back-calculation most accurately, we need to know if the the bias in the SMD been corrected i.e. should we use Hedge's g or Cohen's d when performing the back calculation?"
-                option0_txt = "Hedges' g (default)" 
-                option1_txt = "Cohen's d"
-                dialog = ChooseBackCalcResultForm(info, option0_txt, option1_txt)
-                dialog.setWindowTitle("SMD bias correction")
-                if dialog.exec_():
-                    self.metric_parameter = True if dialog.getChoice() == 0 else False
-            print("metric_parameter is now %s" % str(self.metric_parameter))
-                
-        def build_data_dicts():
-            var_names = self.get_column_header_strs()
-            tmp = []
-            for row_index in range(2):
-                value = lambda x: self._get_float(row_index, x)
-                tmp.append([(var_name, value(i)) for i, var_name in enumerate(var_names) if value(i) is not None])
-            group1_data = dict(tmp[0])
-            group2_data = dict(tmp[1])
-            
-            tmp = self.ma_unit.get_effect_and_ci(self.cur_effect, self.group_str, self.mult)
-            effect_data = {"est":tmp[0], "low":tmp[1], "high":tmp[2],
-                           "metric":self.cur_effect,
-                           "met.param":self.metric_parameter}
-            
-            #print("Group 1 Data: ", group1_data)
-            #print("Group 2 Data: ", group2_data)
-            #print("Effect Data: ", effect_data)
-            
-            return (group1_data, group2_data, effect_data)
-        def new_data(g1_data, g2_data, imputed):
-            changed = False
-            
-            new_data = (imputed["n1"],
-                        imputed["sd1"],
-                        imputed["mean1"],
-                        imputed["n2"],
-                        imputed["sd2"],
-                        imputed["mean2"])
-            old_data = (g1_data["n"]    if "n"    in g1_data else None,
-                        g1_data["sd"]   if "sd"   in g1_data else None,
-                        g1_data["mean"] if "mean" in g1_data else None,
-                        g2_data["n"]    if "n"    in g2_data else None,
-                        g2_data["sd"]   if "sd"   in g2_data else None,
-                        g2_data["mean"] if "mean" in g2_data else None,
-                        )
-            new_item_available = lambda old, new: (old is None) and (new is not None)
-            comparison = [new_item_available(old_data[i], new_data[i]) for i in range(len(new_data))]
-            print("Comparison:", comparison)
-            if any(comparison):
-                changed = True
-            else:
-                changed = False
-            return changed
             
         if self.cur_effect not in ["MD", "SMD"]:
             self.back_calc_btn.setVisible(False)
@@ -832,9 +793,8 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
         else:
             self.back_calc_btn.setVisible(True)
             
-        (group1_data, group2_data, effect_data) = build_data_dicts()
-        imputed = meta_py_r.back_calc_cont_data(group1_data, group2_data, effect_data, self.conf_level)
-        print("Imputed data: ", imputed)
+        inputs = self._recompute_inputs()
+        group1_data, group2_data, imputed = self._back_calc(inputs, inputs["table"], inputs["effect_and_ci"])
         
         # Leave if there was a failure
         if "FAIL" in imputed:
@@ -842,15 +802,9 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
             self.back_calc_btn.setEnabled(False)
             return None
         
-        if new_data(group1_data, group2_data, imputed):
-            self.back_calc_btn.setEnabled(True)
-        else:
-            self.back_calc_btn.setEnabled(False)
+        self.back_calc_btn.setEnabled(self._imputed_new_data(group1_data, group2_data, imputed))
         self.set_clear_btn_color()
         
-        if not engage:
-            return None
-        
         ########################################################################
         # Actually do stuff with imputed data here if we are 'engaged'
         ########################################################################
@@ -918,7 +872,165 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
                                                 parent=self)
         self.undoStack.push(command)
          
+    def _choose_metric_parameter(self):
+        # Choose metric parameter if not already chosen
+        if (self.metric_parameter is None) and self.cur_effect in ["MD","SMD"]:
+            print("need to choose metric parameter because it is %s" % str(self.metric_parameter))
+            if self.cur_effect == "MD":
+                info = "In order to perform back-calculation most accurately, we need to know something about the assumptions about the two population standard deviations.\n*Are we assuming that both of the population standard deviations are the same (as in most parametric data analysis techniques)"
+                option0_txt = "yes (default)."
+                option1_txt = "no"
+                dialog = ChooseBackCalcResultForm(info, option0_txt, option1_txt)
+                dialog.setWindowTitle("Population SD Assumptions")
+                if dialog.exec_():
+                    self.metric_parameter = True if dialog.getChoice() == 0 else False
+            elif self.cur_effect == "SMD":
+                info = "In order to perform back-calculation most accurately, we need to know if the the bias in the SMD been corrected i.e. should we use Hedge's g or Cohen's d when performing the back calculation?"
+                option0_txt = "Hedges' g (default)" 
+                option1_txt = "Cohen's d"
+                dialog = ChooseBackCalcResultForm(info, option0_txt, option1_txt)
+                dialog.setWindowTitle("SMD bias correction")
+                if dialog.exec_():
+                    self.metric_parameter = True if dialog.getChoice() == 0 else False
+            print("metric_parameter is now %s" % str(self.metric_parameter))
+
+    def _back_calc(self, inputs, table, effect_and_ci):
+        ''' Back-calculates the group data from effect_and_ci and the values
+        in table (rows of the simple table). Returns the group data sent to R
+        and the result '''
+        tmp = []
+        for row_values in table:
+            tmp.append([(var_name, value) for var_name, value in zip(inputs["var_names"], row_values) if value is not None])
+        group1_data = dict(tmp[0])
+        group2_data = dict(tmp[1])
+
+        effect_data = {"est":effect_and_ci[0], "low":effect_and_ci[1], "high":effect_and_ci[2],
+                       "metric":inputs["effect"],
+                       "met.param":inputs["metric_parameter"]}
+
+        imputed = meta_py_r.back_calc_cont_data(group1_data, group2_data, effect_data, inputs["conf_level"])
+        print("Imputed data: ", imputed)
+        return group1_data, group2_data, imputed
+
+    def _imputed_new_data(self, g1_data, g2_data, imputed):
+        ''' True if the back-calculation fills in something that's blank '''
+        new_data = (imputed["n1"],
+                    imputed["sd1"],
+                    imputed["mean1"],
+                    imputed["n2"],
+                    imputed["sd2"],
+                    imputed["mean2"])
+        old_data = (g1_data["n"]    if "n"    in g1_data else None,
+                    g1_data["sd"]   if "sd"   in g1_data else None,
+                    g1_data["mean"] if "mean" in g1_data else None,
+                    g2_data["n"]    if "n"    in g2_data else None,
+                    g2_data["sd"]   if "sd"   in g2_data else None,
+                    g2_data["mean"] if "mean" in g2_data else None,
+                    )
+        new_item_available = lambda old, new: (old is None) and (new is not None)
+        comparison = [new_item_available(old_data[i], new_data[i]) for i in range(len(new_data))]
+        print("Comparison:", comparison)
+        return any(comparison)
+
+    ####### Deferred recomputation (see calc_fncs.DeferredComputation) #######
+    def _recompute_inputs(self):
+        ''' Snapshot of everything _recompute needs '''
+        ncols = self.simple_table.columnCount()
+        return {"effect":self.cur_effect,
+                "conf_level":self.conf_level,
+                "metric_parameter":self.metric_parameter,
+                "var_names":tuple(self.get_column_header_strs()),
+                "table":tuple([tuple([self._get_float(row, col) for col in range(ncols)]) for row in range(2)]),
+                "effect_and_ci":tuple(self.ma_unit.get_effect_and_ci(self.cur_effect, self.group_str, self.mult))}
+
+    def _recompute(self, inputs, options):
+        '''
+        Runs on a worker thread: must not touch the widgets or the ma_unit.
+        With the impute option, imputes what it can for each group; with
+        update_effect, recomputes the effect from the (imputed) table. Either
+        way, works out whether back-calculation would fill in anything (None
+        if it isn't available for the effect)
+        '''
+        result = {"imputed":[None, None], "effect_and_ci":None, "back_calc":None}
+        table = [list(row_values) for row_values in inputs["table"]]
+        if options.get("impute"):
+            for row_index in range(2):
+                computed_vals = self._impute_row(inputs["var_names"], table[row_index], inputs["conf_level"])
+                if computed_vals is None:
+                    continue
+                result["imputed"][row_index] = computed_vals
+                # as the table will read once they're filled in (see _set_val)
+                for var_index, var_name in enumerate(inputs["var_names"]):
+                    val = computed_vals[var_name]
+                    if is_NaN(val):
+                        continue
+                    table[row_index][var_index] = None if val in EMPTY_VALS else float(str(float(val)))
+
+        effect_and_ci = inputs["effect_and_ci"]
+        if options.get("update_effect"):
+            result["effect_and_ci"] = self._effect_for_raw_data(inputs["effect"], inputs["conf_level"],
+                                                                table[0][:4], table[1][:4])
+            if result["effect_and_ci"] is not None:
+                effect_and_ci = result["effect_and_ci"]
+
+        if inputs["effect"] in ["MD", "SMD"]:
+            group1_data, group2_data, imputed = self._back_calc(inputs, table, effect_and_ci)
+            result["back_calc"] = "FAIL" not in imputed and self._imputed_new_data(group1_data, group2_data, imputed)
+        return result
+
+    def _apply_recompute(self, inputs, options, result):
+        if any([computed_vals is not None for computed_vals in result["imputed"]]):
+            for row_index, computed_vals in enumerate(result["imputed"]):
+                if computed_vals is None:
+                    continue
+                for var_index, var_name in enumerate(inputs["var_names"]):
+                    self._set_val(row_index, var_index, computed_vals[var_name])
+            self._copy_raw_data_from_table_to_ma_unit()
+
+        if result["effect_and_ci"] is not None:
+            est, low, high = result["effect_and_ci"]
+            self.ma_unit.set_effect_and_ci(self.cur_effect, self.group_str, est, low, high, mult=self.mult)
+            self.set_current_effect()
+        self.back_calc_btn.setVisible(result["back_calc"] is not None)
+        self.back_calc_btn.setEnabled(bool(result["back_calc"]))
+        self.set_clear_btn_color()
+        self._push_pending_edits()
+
+    def _begin_edit(self, old_ma_unit, old_tables_data, old_correlation):
+        # the state before the first of the edits that are still to be
+        # recomputed
+        if self.state_before_edits is None:
+            self.state_before_edits = (old_ma_unit, old_tables_data, old_correlation)
+
+    def _push_pending_edits(self):
+        if self.state_before_edits is None:
+            return
+        old_ma_unit, old_tables_data, old_correlation = self.state_before_edits
+        self.state_before_edits = None
+        new_ma_unit, new_tables_data = self._save_ma_unit_and_table_states(
+                            tables=self.tables,
+                            ma_unit=self.ma_unit,
+                            use_old_value=False)
+        new_correlation = self._get_correlation_str()
+        restore_old_f = lambda: self.restore_ma_unit_and_tables(old_ma_unit, old_tables_data, old_correlation)
+        restore_new_f = lambda: self.restore_ma_unit_and_tables(new_ma_unit, new_tables_data, new_correlation)
+        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f,
+                                                restore_old_f=restore_old_f,
+                                                parent=self, refresh_on_push=False)
+        self.undoStack.push(command)
+
+    def done(self, result):
+        # finish (or drop) the pending recomputation before the form goes away
+        if result == QDialog.Accepted:
+            self.recompute.flush()
+        else:
+            self.recompute.cancel()
+        self.recompute.wait()
+        QDialog.done(self, result)
+
     def clear_form(self):
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_tables_data = self._save_ma_unit_and_table_states(
                                 tables = [self.simple_table,
@@ -989,10 +1101,12 @@ class ContinuousDataForm(QDialog, forms.ui_continuous_data_form.Ui_ContinuousDat
     ####### Undo framework ############
     def undo(self):
         print("undoing....")
+        self.recompute.flush()
         self.undoStack.undo()
         
     def redo(self):
         print("redoing....")
+        self.recompute.flush()
         self.undoStack.redo()
 
 
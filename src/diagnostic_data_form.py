@@ -11,7 +11,6 @@
 #
 ##################################################
 
-import copy
 from functools import partial
 
 from PyQt4.Qt import *
@@ -19,6 +18,7 @@ from PyQt4.Qt import *
 import meta_py_r
 from meta_globals import *
 import calculator_routines as calc_fncs
+import settings
 from forms.ui_diagnostic_data_form import Ui_DiagnosticDataForm
 
 BACK_CALCULATABLE_DIAGNOSTIC_EFFECTS = ["Sens", "Spec"]
@@ -49,7 +49,14 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         self.ci_label.setText("{0:.1f}% Confidence Interval".format(self.global_conf_level))
         self.initialize_form()
         self.setup_inconsistency_checking()
-        self.undoStack = QUndoStack(self)
+        # (the same memory budget as the spreadsheet's undo stack)
+        self.undoStack = BudgetedUndoStack(self, memory_budget=settings.get_undo_memory_budget())
+        # the effects and the state of the back-calculation button are
+        # recomputed (in R) once the user pauses; the edits made until then
+        # are undone together. see _recompute
+        self.state_before_edits = None
+        self.recompute = calc_fncs.DeferredComputation(self._recompute_inputs,
+                self._recompute, self._apply_recompute, parent=self)
         
         #self.setup_clear_button_palettes()
         self._update_raw_data()    # ma_unit -> table
@@ -245,23 +252,16 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         
         # if we got here, everything seems ok
         self._update_ma_unit()           # 2x2 table --> ma_unit
-        self.impute_effects_in_ma_unit() # effects   --> ma_unit
-        self.set_current_effect()        # ma_unit   --> effects
-    
-        new_ma_unit, new_table = self._save_ma_unit_and_table_state(
-                                    table = self.two_by_two_table,
-                                    ma_unit = self.ma_unit, 
-                                    row = row, col = col,
-                                    use_old_value = False)
-        new_prevalence = self._get_prevalence_str()
-        restore_old_f = lambda: self.restore_ma_unit_and_table(old_ma_unit, old_table, old_prevalence)
-        restore_new_f = lambda: self.restore_ma_unit_and_table(new_ma_unit, new_table, new_prevalence)
-        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f, restore_old_f=restore_old_f, parent=self)
-        self.undoStack.push(command)
+
+        # the effects are computed (effects --> ma_unit --> text boxes)
+        # once the user pauses, and the edit is pushed onto the undo stack then
+        self._begin_edit(old_ma_unit, old_table, old_prevalence)
+        self.recompute.schedule(update_effect=True)
         
     def restore_ma_unit(self, old_ma_unit):
-        ''' Restores the ma_unit data and resets the form'''
-        self.ma_unit.__dict__ = copy.deepcopy(old_ma_unit.__dict__)
+        ''' Restores the ma_unit data (as saved by ma_unit.get_state()) and
+        resets the form'''
+        self.ma_unit.set_state(old_ma_unit)
         print("Restored ma_unit data: %s" % str(self.ma_unit.get_raw_data_for_groups(self.cur_groups)))
         
         self.initialize_form() # clear form first
@@ -293,8 +293,8 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         if use_old_value:
             old_table[row][col] = old_value   # ...from BEFORE the cell changed
         
-        # Make backup copy of ma_unit
-        old_ma_unit = copy.deepcopy(ma_unit)
+        # Make backup of the ma_unit data
+        old_ma_unit = ma_unit.get_state()
         return old_ma_unit, old_table
 
     
@@ -328,9 +328,13 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
             
     def impute_effects_in_ma_unit(self):
         '''Calculate and store values for effects in ma_unit based on values in 2x2 table'''
-        
-        # diagnostic data
-        counts = self.get_raw_diag_data()
+        effects = self._effects_for_counts(self.get_raw_diag_data(), self.global_conf_level)
+        for metric, (est, lower, upper) in effects.items():
+            self.ma_unit.set_effect_and_ci(metric, self.group_str, est, lower, upper, mult=self.mult)
+
+    def _effects_for_counts(self, counts, conf_level):
+        ''' metric --> effect and CI (on the calculation scale) for the
+        metrics that can be computed from counts (TP, FN, FP, TN) '''
         tp, fn, fp, tn = counts['TP'], counts['FN'], counts['FP'], counts['TN']
         
         # Do what we can if we don't have all the counts
@@ -345,18 +349,17 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         # sensitivity and specificity
         ests_and_cis = meta_py_r.diagnostic_effects_for_study(
                                 tp, fn, fp, tn, metrics=DIAGNOSTIC_METRICS,
-                                conf_level=self.global_conf_level)
+                                conf_level=conf_level)
         
-        # now we're going to set the effect estimate/CI on the MA object.
+        effects = {}
         for metric in DIAGNOSTIC_METRICS:
             # don't set stuff if it made-up
             if metric.lower()=="sens" and not can_calculate_sens:
                 continue
             elif metric.lower()=="spec" and not can_calculate_spec:
                 continue
-            
-            est, lower, upper = ests_and_cis[metric]["calc_scale"]
-            self.ma_unit.set_effect_and_ci(metric, self.group_str, est, lower, upper, mult=self.mult)
+            effects[metric] = tuple(ests_and_cis[metric]["calc_scale"])
+        return effects
 
     def _get_row_col(self, field):
         row = 0 if field in ("FP", "TP") else 1
@@ -453,6 +456,9 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         
 
     def val_changed(self, val_str):
+        # the pending edits go on the undo stack first
+        self.recompute.flush()
+
         # Backup form state
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                                 table = self.two_by_two_table,
@@ -585,6 +591,8 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         self._update_ma_unit()
         
     def clear_form(self):
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                                 table = self.two_by_two_table,
@@ -634,6 +642,12 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
 #            self.clear_Btn.setPalette(self.orig_palette)
             
     def enable_back_calculation_btn(self, engage = False):
+        if not engage:
+            # worked out in the background; see _recompute
+            self.recompute.schedule()
+            return None
+        self.recompute.flush()
+
         # For undo/redo
         old_ma_unit, old_table = self._save_ma_unit_and_table_state(
                                 table = self.two_by_two_table,
@@ -641,61 +655,8 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
                                 use_old_value=False)
         old_prevalence = self._get_prevalence_str()
         
-        def build_dict():
-            d = {}
-
-            for effect in BACK_CALCULATABLE_DIAGNOSTIC_EFFECTS:    
-                est,lower,upper = self.ma_unit.get_effect_and_ci(effect,
-                                                                 self.group_str,
-                                                                 self.mult)
-                conv_to_disp_scale = lambda x: meta_py_r.diagnostic_convert_scale(x, effect, convert_to="display.scale")
-                d_est,d_lower,d_upper = [conv_to_disp_scale(x) for x in [est,lower,upper]]
-                for i,Rsubkey in enumerate(["",".lb",".ub"]):
-                    try:
-                        d["%s%s" % (effect.lower(), Rsubkey)] = float([d_est,d_lower,d_upper][i])
-                    except:
-                        pass
-            
-            x = self.getTotalSubjects()
-            d["total"] = float(x) if is_a_float(x) else None
-
-            x = self.prevalence_txt_box.text()
-            d["prev"] = float(x) if is_a_float(x) else None
-
-            d["conf.level"] = self.global_conf_level
-    
-            # now grab the raw data, if available
-            d.update(self.get_raw_diag_data())
-            
-            return d
-        
-        def new_data(diag_data, imputed):
-            new_data = (imputed["TP"],
-                        imputed["FP"],
-                        imputed["FN"],
-                        imputed["TN"])
-            old_data = (self._get_int(0,0),
-                        self._get_int(0,1),
-                        self._get_int(1,0),
-                        self._get_int(1,1),
-                        )
-            isBlank = lambda x: x in EMPTY_VALS
-            new_item_available = lambda old, new: isBlank(old) and not isBlank(new)
-            comparison = [new_item_available(old_data[i], new_data[i]) for i in range(len(new_data))]
-            print("Comparison:", comparison)
-            if any(comparison):
-                changed = True
-            else:
-                changed = False
-            return changed
-            
-        diag_data = build_dict()
-        print("Diagnostic Data for back-calculation: ", diag_data)
-
-        #if diag_data is not None:
-            
-        imputed = meta_py_r.impute_diag_data(diag_data)
-        print "imputed data: %s" % imputed
+        inputs = self._recompute_inputs()
+        diag_data, imputed = self._back_calc(inputs, dict(inputs["effects_and_cis"]))
         
         # Leave if nothing was imputed
         if not (imputed["TP"] or imputed["TN"] or imputed["FP"] or imputed["FN"]):
@@ -703,14 +664,9 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
             self.back_calc_Btn.setEnabled(False)
             return None
     
-        if new_data(diag_data, imputed):
-            self.back_calc_Btn.setEnabled(True)
-        else:
-            self.back_calc_Btn.setEnabled(False)
+        self.back_calc_Btn.setEnabled(self._imputed_new_data(diag_data, imputed))
         #self.set_clear_btn_color()
             
-        if not engage:
-            return None
         ########################################################################
         # Actually do stuff with imputed data here if we are 'engaged'
         ########################################################################
@@ -728,13 +684,131 @@ class DiagnosticDataForm(QDialog, Ui_DiagnosticDataForm):
         restore_new_f = lambda: self.restore_ma_unit_and_table(new_ma_unit, new_table, new_prevalence)
         command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f, restore_old_f=restore_old_f, parent=self)
         self.undoStack.push(command)
+    def _back_calc(self, inputs, effects_and_cis):
+        ''' Back-calculates the counts from effects_and_cis (effect --> est,
+        lower, upper) and the rest of inputs (see _recompute_inputs). Returns
+        the data sent to R and the result '''
+        d = {}
+
+        for effect in BACK_CALCULATABLE_DIAGNOSTIC_EFFECTS:    
+            est,lower,upper = effects_and_cis[effect]
+            conv_to_disp_scale = lambda x: meta_py_r.diagnostic_convert_scale(x, effect, convert_to="display.scale")
+            d_est,d_lower,d_upper = [conv_to_disp_scale(x) for x in [est,lower,upper]]
+            for i,Rsubkey in enumerate(["",".lb",".ub"]):
+                try:
+                    d["%s%s" % (effect.lower(), Rsubkey)] = float([d_est,d_lower,d_upper][i])
+                except:
+                    pass
+        
+        x = inputs["total"]
+        d["total"] = float(x) if is_a_float(x) else None
+
+        x = inputs["prevalence"]
+        d["prev"] = float(x) if is_a_float(x) else None
+
+        d["conf.level"] = inputs["conf_level"]
+
+        # now grab the raw data, if available
+        d.update(dict(inputs["counts"]))
+        print("Diagnostic Data for back-calculation: ", d)
+
+        imputed = meta_py_r.impute_diag_data(d)
+        print "imputed data: %s" % imputed
+        return d, imputed
+
+    def _imputed_new_data(self, diag_data, imputed):
+        ''' True if the back-calculation fills in a blank count '''
+        new_data = (imputed["TP"],
+                    imputed["FP"],
+                    imputed["FN"],
+                    imputed["TN"])
+        old_data = (diag_data["TP"],
+                    diag_data["FP"],
+                    diag_data["FN"],
+                    diag_data["TN"],
+                    )
+        isBlank = lambda x: x in EMPTY_VALS
+        new_item_available = lambda old, new: isBlank(old) and not isBlank(new)
+        comparison = [new_item_available(old_data[i], new_data[i]) for i in range(len(new_data))]
+        print("Comparison:", comparison)
+        return any(comparison)
+
+    ####### Deferred recomputation (see calc_fncs.DeferredComputation) #######
+    def _recompute_inputs(self):
+        ''' Snapshot of everything _recompute needs '''
+        effects_and_cis = [(effect, tuple(self.ma_unit.get_effect_and_ci(effect, self.group_str, self.mult))) \
+                                for effect in BACK_CALCULATABLE_DIAGNOSTIC_EFFECTS]
+        return {"conf_level":self.global_conf_level,
+                "counts":tuple(sorted(self.get_raw_diag_data().items())),
+                "effects_and_cis":tuple(effects_and_cis),
+                "total":self.getTotalSubjects(),
+                "prevalence":self._get_prevalence_str()}
+
+    def _recompute(self, inputs, options):
+        '''
+        Runs on a worker thread: must not touch the widgets or the ma_unit.
+        If options has update_effect, the effects are recomputed from the
+        counts; either way, works out whether back-calculation would fill in
+        anything
+        '''
+        result = {"effects":{}, "back_calc":False}
+        effects_and_cis = dict(inputs["effects_and_cis"])
+        if options.get("update_effect"):
+            result["effects"] = self._effects_for_counts(dict(inputs["counts"]), inputs["conf_level"])
+            effects_and_cis.update(result["effects"])
+
+        diag_data, imputed = self._back_calc(inputs, effects_and_cis)
+        if imputed["TP"] or imputed["TN"] or imputed["FP"] or imputed["FN"]:
+            result["back_calc"] = self._imputed_new_data(diag_data, imputed)
+        return result
+
+    def _apply_recompute(self, inputs, options, result):
+        for metric, (est, lower, upper) in result["effects"].items():
+            self.ma_unit.set_effect_and_ci(metric, self.group_str, est, lower, upper, mult=self.mult)
+        if options.get("update_effect"):
+            self.set_current_effect()        # ma_unit   --> effects
+        self.back_calc_Btn.setEnabled(result["back_calc"])
+        self._push_pending_edits()
+
+    def _begin_edit(self, old_ma_unit, old_table, old_prevalence):
+        # the state before the first of the edits that are still to be
+        # recomputed
+        if self.state_before_edits is None:
+            self.state_before_edits = (old_ma_unit, old_table, old_prevalence)
+
+    def _push_pending_edits(self):
+        if self.state_before_edits is None:
+            return
+        old_ma_unit, old_table, old_prevalence = self.state_before_edits
+        self.state_before_edits = None
+        new_ma_unit, new_table = self._save_ma_unit_and_table_state(
+                                    table = self.two_by_two_table,
+                                    ma_unit = self.ma_unit, 
+                                    use_old_value = False)
+        new_prevalence = self._get_prevalence_str()
+        restore_old_f = lambda: self.restore_ma_unit_and_table(old_ma_unit, old_table, old_prevalence)
+        restore_new_f = lambda: self.restore_ma_unit_and_table(new_ma_unit, new_table, new_prevalence)
+        command = calc_fncs.CommandFieldChanged(restore_new_f=restore_new_f,
+                        restore_old_f=restore_old_f, parent=self, refresh_on_push=False)
+        self.undoStack.push(command)
+
+    def done(self, result):
+        # finish (or drop) the pending recomputation before the form goes away
+        if result == QDialog.Accepted:
+            self.recompute.flush()
+        else:
+            self.recompute.cancel()
+        self.recompute.wait()
+        QDialog.done(self, result)
         
     ####### Undo framework ############
     def undo(self):
         print("undoing....")
+        self.recompute.flush()
         self.undoStack.undo()
         
     def redo(self):
         print("redoing....")
+        self.recompute.flush()
         self.undoStack.redo()
     #################################
\ No newline at end of file
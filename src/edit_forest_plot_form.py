@@ -5,6 +5,7 @@ from PyQt4.Qt import QObject, SIGNAL
 from PyQt4.QtGui import QDialog, QDialogButtonBox
 
 import forms.ui_edit_forest_plot
+import forest_plot_renderer
 import ma_specs
 import meta_py_r
 import meta_globals
@@ -21,9 +22,10 @@ class EditPlotWindow(QDialog, forms.ui_edit_forest_plot.Ui_edit_forest_plot_dlg)
         print "parameters: %s" % self.img_params_path
 
         # if we're unable to load the required R data files,
-        # e.g., because they were moved or deleted, then fail
-        self.params_d = meta_py_r.load_vars_for_plot(self.img_params_path, \
-                                                return_params_dict=True)
+        # e.g., because they were moved or deleted, then fail. otherwise
+        # the plot stays loaded in R (keyed by its params path) until
+        # this window is closed, so applying edits is cheap
+        self.params_d = meta_py_r.open_plot_edit_session(self.img_params_path)
 
 
         if not self.params_d:
@@ -45,6 +47,7 @@ class EditPlotWindow(QDialog, forms.ui_edit_forest_plot.Ui_edit_forest_plot_dlg)
         self.results_window = parent
 
         self.current_param_vals = {}
+        self.layout = None
 
         # get the button object
         self.apply_button = self.buttonBox.button(QDialogButtonBox.Apply)
@@ -124,8 +127,16 @@ class EditPlotWindow(QDialog, forms.ui_edit_forest_plot.Ui_edit_forest_plot_dlg)
 
 
     def swap_graphic(self):
-        new_pixmap = self.results_window.generate_pixmap(self.png_path)
-        self.pixmap_item.setPixmap(new_pixmap)
+        new_pixmap, svg = None, None
+        if self.layout is not None:
+            # update_plot has already cached the drawing of the new layout
+            new_pixmap = self.results_window.generate_native_pixmap(self.img_params_path)
+            svg = forest_plot_renderer.get_svg(self.img_params_path)
+        if new_pixmap is None:
+            new_pixmap = self.results_window.generate_pixmap(self.png_path)
+            svg = None
+        self.results_window.replace_image(self.pixmap_item, new_pixmap, \
+                                          image_path=self.png_path, svg=svg)
         print "ok -- plot updated in ui"
         # maybe do something pretty here... ?
 
@@ -138,27 +149,20 @@ class EditPlotWindow(QDialog, forms.ui_edit_forest_plot.Ui_edit_forest_plot_dlg)
         # parameter names in the plot params list
         ma_specs.add_plot_params(self)
 
-        # load things up in the R side
-        meta_py_r.load_vars_for_plot(self.img_params_path)
-
-        # update relevant variables (on the R side)
-        # with new values -- we also write the updated
-        # params out to disk here
-        meta_py_r.update_plot_params(self.current_param_vals, \
-                                      write_them_out=True, \
-                                      outpath="%s.params" % self.img_params_path)
-
-        # now re-generate the plot data on the R side of
-        # things
-        meta_py_r.regenerate_plot_data()
-
-
-        # finally, actually make the plot and spit it to disk
-        self.png_path = self.current_param_vals["fp_outpath"]
-        meta_py_r.generate_forest_plot(self.png_path)
-
-        #meta_py_r.write_out_plot_data("%s.plotdata" % self.img_params_path)
-        meta_py_r.write_out_plot_data("%s" % self.img_params_path)
+        # update the plot (on the R side) with the new values in one go;
+        # R only recomputes the parts of the plot the changed params
+        # affect, and writes the params and plot data out to disk
+        self.layout = meta_py_r.update_plot_edit_session(self.img_params_path, \
+                                                          self.current_param_vals)
+
+        if meta_globals.NATIVE_FOREST_PLOTS:
+            forest_plot_renderer.set_layout(self.img_params_path, self.layout)
+        else:
+            # actually make the plot and spit it to disk
+            self.layout = None
+            self.png_path = self.current_param_vals["fp_outpath"]
+            meta_py_r.generate_forest_plot(self.png_path, \
+                params_name=meta_py_r.plot_edit_session_data_name(self.img_params_path))
 
     def regenerate_graph(self):
         # this loads the plot.data into R's environment;
@@ -170,6 +174,11 @@ class EditPlotWindow(QDialog, forms.ui_edit_forest_plot.Ui_edit_forest_plot_dlg)
         #meta_py_r.generate_forest_plot(self.png_path)
         print "OK!"
 
+    def done(self, result):
+        # we're through editing; R can let go of the plot
+        meta_py_r.close_plot_edit_session(self.img_params_path)
+        super(EditPlotWindow, self).done(result)
+
    
     
 
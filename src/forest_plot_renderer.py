@@ -0,0 +1,357 @@
+#############################################
+#                                           #
+#  Byron C. Wallace     George E. Dietz     #
+#  Brown University     CEBM@Brown          #
+#  OpenMeta[analyst]                        #
+#                                           #
+#                                           #
+#  Draws forest plots with Qt from the      #
+#  layout computed in R (see                #
+#  forest.plot.layout in plotting.r),       #
+#  rather than having R write a png.        #
+#                                           #
+#############################################
+
+import math
+import os
+
+from PyQt4.Qt import *
+from PyQt4.QtSvg import QSvgGenerator, QSvgRenderer
+
+import meta_py_r
+
+# sizes are in points; these roughly follow the R version of the plot
+ROW_HEIGHT = 14.0
+PLOT_WIDTH = 360.0   # 5 inches, as in calc.forest.plot.size
+COL_GAP = 9.0        # 3.2 mm between columns
+MARGIN = 18.0
+TITLE_ROWS = 2       # space above the header row for the title
+AXIS_ROWS = 3        # space below the last row for the axis and its label
+ARROW_LENGTH = 3.6   # 0.05 inches
+
+LABEL_FONT = ("Helvetica", 10)
+DATA_FONT = ("Courier", 10)
+AXIS_FONT = ("Helvetica", 6)
+XLABEL_FONT = ("Helvetica", 8)
+
+SUBGROUP_COLOR = QColor("yellow")
+OVERALL_COLOR = QColor("lightblue")
+SUMMARY_LINE_COLOR = QColor("red")
+DIAMOND_HEIGHT = 0.8 # diam.size in draw.forest.plot
+
+# rendered plots, keyed by params path; see get_svg
+_svg_cache = {}
+
+
+def get_svg(params_path):
+    '''
+    Returns the forest plot saved at params_path as SVG data (a str), or
+    None if the plot can't be drawn natively (e.g., its data is missing).
+    The SVG is cached in memory and next to the plot data (as
+    params_path.svg), so it is only redrawn when the plot data changes.
+    '''
+    plot_data_path = "%s.plotdata" % params_path
+    if not os.path.exists(plot_data_path):
+        return None
+    plot_data_mtime = os.path.getmtime(plot_data_path)
+
+    if params_path in _svg_cache:
+        mtime, svg = _svg_cache[params_path]
+        if mtime == plot_data_mtime:
+            return svg
+
+    svg_path = "%s.svg" % params_path
+    if os.path.exists(svg_path) and os.path.getmtime(svg_path) >= plot_data_mtime:
+        with open(svg_path, 'rb') as svg_file:
+            svg = svg_file.read()
+    else:
+        try:
+            layout = meta_py_r.get_forest_plot_layout(params_path)
+        except Exception, e:
+            print "couldn't get the forest plot layout for %s: %s" % (params_path, e)
+            return None
+        if layout is None:
+            return None
+        svg = layout_to_svg(layout)
+        try:
+            with open(svg_path, 'wb') as svg_file:
+                svg_file.write(svg)
+        except IOError, e:
+            # not fatal; we just won't have it next time
+            print "couldn't cache the forest plot: %s" % e
+
+    _svg_cache[params_path] = (plot_data_mtime, svg)
+    return svg
+
+def set_layout(params_path, layout):
+    '''
+    Draws layout as the plot for params_path, replacing whatever was cached;
+    used by the plot editor, which gets the updated layout directly from R.
+    '''
+    svg = layout_to_svg(layout)
+    plot_data_path = "%s.plotdata" % params_path
+    plot_data_mtime = os.path.getmtime(plot_data_path) if os.path.exists(plot_data_path) else None
+    _svg_cache[params_path] = (plot_data_mtime, svg)
+    try:
+        with open("%s.svg" % params_path, 'wb') as svg_file:
+            svg_file.write(svg)
+    except IOError, e:
+        print "couldn't cache the forest plot: %s" % e
+    return svg
+
+def invalidate(params_path):
+    ''' Forgets the rendered plot for params_path (e.g., after editing it) '''
+    _svg_cache.pop(params_path, None)
+    svg_path = "%s.svg" % params_path
+    if os.path.exists(svg_path):
+        os.remove(svg_path)
+
+def get_renderer(params_path):
+    ''' Returns a QSvgRenderer for the plot at params_path, or None '''
+    svg = get_svg(params_path)
+    if svg is None:
+        return None
+    renderer = QSvgRenderer(QByteArray(svg))
+    if not renderer.isValid():
+        return None
+    return renderer
+
+def render_image(params_path, scale=1.0):
+    '''
+    Renders the plot at params_path to a QImage (on a white background),
+    with scale times the default size in pixels. Returns None on failure.
+    '''
+    renderer = get_renderer(params_path)
+    if renderer is None:
+        return None
+    size = renderer.defaultSize()
+    image = QImage(int(size.width()*scale), int(size.height()*scale),
+                   QImage.Format_ARGB32_Premultiplied)
+    image.fill(QColor("white").rgb())
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    renderer.render(painter)
+    painter.end()
+    return image
+
+
+##### Drawing #####
+
+def layout_to_svg(layout):
+    ''' Draws the forest plot described by layout and returns it as SVG '''
+    plot = ForestPlotPainter(layout)
+    width, height = plot.size()
+
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    generator = QSvgGenerator()
+    generator.setOutputDevice(buf)
+    generator.setSize(QSize(int(math.ceil(width)), int(math.ceil(height))))
+    generator.setViewBox(QRectF(0, 0, width, height))
+    generator.setTitle(plot.title)
+
+    painter = QPainter(generator)
+    painter.setRenderHint(QPainter.Antialiasing)
+    plot.draw(painter)
+    painter.end()
+    buf.close()
+    return str(buf.data())
+
+
+class ForestPlotPainter:
+    '''
+    Lays out and draws one forest plot: the study column (left-aligned),
+    the additional data columns (right-aligned) and then the plot itself,
+    one row per entry in layout['rows'].
+    '''
+    def __init__(self, layout):
+        self.layout = layout
+        self.title = layout.get("title", "")
+        self.rows = [int(row) for row in layout["rows"]]
+        self.types = [int(t) for t in layout["types"]]
+        self.text_cols = layout["text.cols"]
+        self.plot_range = (min(layout["plot.range"]), max(layout["plot.range"]))
+
+        self.label_font = QFont(*LABEL_FONT)
+        self.bold_label_font = QFont(*LABEL_FONT)
+        self.bold_label_font.setBold(True)
+        self.data_font = QFont(*DATA_FONT)
+        self.bold_data_font = QFont(*DATA_FONT)
+        self.bold_data_font.setBold(True)
+
+        # column widths (the widest entry in each)
+        self.col_widths = []
+        for col_name, col in self.text_cols:
+            widths = [QFontMetricsF(self._font_for(col_name, i)).width(text) \
+                                        for i, text in enumerate(col)]
+            self.col_widths.append(max(widths + [0]))
+
+        self.plot_left = MARGIN + sum([w + COL_GAP for w in self.col_widths])
+        self.top = MARGIN + TITLE_ROWS*ROW_HEIGHT
+        self.num_rows = max(self.rows) if len(self.rows) > 0 else 0
+
+    def size(self):
+        width = self.plot_left + PLOT_WIDTH + MARGIN
+        height = self.top + (self.num_rows + AXIS_ROWS)*ROW_HEIGHT + MARGIN
+        return (width, height)
+
+    def _font_for(self, col_name, i):
+        # the header and summary rows are bold; in the study column
+        # everything but the studies is
+        row_type = self.types[i] if i < len(self.types) else 0
+        if col_name == "study":
+            return self.label_font if row_type == 0 else self.bold_label_font
+        return self.bold_data_font if row_type in (1, 2, 3) else self.data_font
+
+    def row_y(self, row):
+        ''' y coordinate of the middle of (1-based) row '''
+        return self.top + (row - 0.5)*ROW_HEIGHT
+
+    def x(self, value):
+        ''' maps value (in the plot scale) to an x coordinate '''
+        lo, hi = self.plot_range
+        if hi == lo:
+            return self.plot_left + PLOT_WIDTH/2.0
+        return self.plot_left + (value - lo)/(hi - lo)*PLOT_WIDTH
+
+    def draw(self, painter):
+        self.draw_text_cols(painter)
+        self.draw_lines(painter)
+        self.draw_axis(painter)
+        self.draw_effects(painter)
+        self.draw_titles(painter)
+
+    def draw_text_cols(self, painter):
+        painter.setPen(QPen(QColor("black")))
+        col_left = MARGIN
+        for (col_name, col), col_width in zip(self.text_cols, self.col_widths):
+            for i, text in enumerate(col):
+                if i >= len(self.rows) or text == "":
+                    continue
+                painter.setFont(self._font_for(col_name, i))
+                y = self.row_y(self.rows[i])
+                rect = QRectF(col_left, y - ROW_HEIGHT/2.0, col_width, ROW_HEIGHT)
+                align = Qt.AlignLeft if col_name == "study" else Qt.AlignRight
+                painter.drawText(rect, align | Qt.AlignVCenter, QString(text))
+            col_left += col_width + COL_GAP
+
+    def draw_lines(self, painter):
+        plot_top = self.top
+        plot_bottom = self.top + self.num_rows*ROW_HEIGHT
+        if self.layout.get("zero.line"):
+            painter.setPen(QPen(QColor("black")))
+            painter.drawLine(QPointF(self.x(0), plot_top), QPointF(self.x(0), plot_bottom))
+
+        summary_est = self.layout.get("summary.est")
+        if self.layout.get("show.summary.line") and not _is_nan(summary_est):
+            pen = QPen(SUMMARY_LINE_COLOR)
+            pen.setStyle(Qt.DashLine)
+            painter.setPen(pen)
+            painter.drawLine(QPointF(self.x(summary_est), plot_top),
+                             QPointF(self.x(summary_est), plot_bottom))
+
+    def draw_axis(self, painter):
+        axis_y = self.top + self.num_rows*ROW_HEIGHT
+        painter.setPen(QPen(QColor("black")))
+        tick_at = [t for t in self.layout.get("tick.at", []) if not _is_nan(t)]
+        lo, hi = self.plot_range
+        painter.drawLine(QPointF(self.x(min([lo] + tick_at)), axis_y),
+                         QPointF(self.x(max([hi] + tick_at)), axis_y))
+
+        painter.setFont(QFont(*AXIS_FONT))
+        tick_length = ROW_HEIGHT/3.0
+        for at, label in zip(self.layout.get("tick.at", []), self.layout.get("tick.labels", [])):
+            if _is_nan(at):
+                continue
+            x = self.x(at)
+            painter.drawLine(QPointF(x, axis_y), QPointF(x, axis_y + tick_length))
+            rect = QRectF(x - 30, axis_y + tick_length, 60, ROW_HEIGHT)
+            painter.drawText(rect, Qt.AlignHCenter | Qt.AlignTop, QString(label))
+
+        painter.setFont(QFont(*XLABEL_FONT))
+        rect = QRectF(self.plot_left, axis_y + 1.5*ROW_HEIGHT, PLOT_WIDTH, ROW_HEIGHT)
+        painter.drawText(rect, Qt.AlignHCenter | Qt.AlignVCenter,
+                         QString(self.layout.get("xlabel", "")))
+
+    def draw_titles(self, painter):
+        if not self.title:
+            return
+        painter.setPen(QPen(QColor("black")))
+        painter.setFont(self.label_font)
+        rect = QRectF(MARGIN, MARGIN, self.plot_left + PLOT_WIDTH - MARGIN, ROW_HEIGHT)
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, QString(self.title))
+
+    def draw_effects(self, painter):
+        # the first row is the header; the effects start with the second
+        ES, LL, UL = self.layout["ES"], self.layout["LL"], self.layout["UL"]
+        box_sizes = self.layout["box.sizes"]
+        for i, (row, row_type) in enumerate(zip(self.rows[1:], self.types[1:])):
+            if i >= len(ES) or _is_nan(ES[i]):
+                continue
+            y = self.row_y(row)
+            if row_type == 0:
+                self.draw_normal_ci(painter, LL[i], ES[i], UL[i], box_sizes[i], y)
+            elif row_type == 1:
+                self.draw_summary_ci(painter, LL[i], ES[i], UL[i], SUBGROUP_COLOR, y)
+            elif row_type == 2:
+                self.draw_summary_ci(painter, LL[i], ES[i], UL[i], OVERALL_COLOR, y)
+            elif row_type == 5:
+                self.draw_unscaled_summary_ci(painter, LL[i], ES[i], UL[i], box_sizes[i], y)
+
+    def draw_normal_ci(self, painter, lower, est, upper, size, y):
+        side = size*ROW_HEIGHT
+        box = QRectF(self.x(est) - side/2.0, y - side/2.0, side, side)
+        self.draw_ci_line(painter, lower, est, upper, y, box)
+        painter.setPen(QPen(QColor("black")))
+        painter.setBrush(QBrush(QColor("black")))
+        painter.drawRect(box)
+        painter.setBrush(Qt.NoBrush)
+
+    def draw_summary_ci(self, painter, lower, est, upper, color, y):
+        half_height = 0.35*DIAMOND_HEIGHT*ROW_HEIGHT
+        self.draw_diamond(painter, self.x(lower), self.x(est), self.x(upper),
+                          y, half_height, color)
+
+    def draw_unscaled_summary_ci(self, painter, lower, est, upper, size, y):
+        half_width = PLOT_WIDTH/30.0
+        half_height = 0.5*DIAMOND_HEIGHT*ROW_HEIGHT
+        x = self.x(est)
+        box = QRectF(x - half_width, y - half_height, 2*half_width, 2*half_height)
+        self.draw_ci_line(painter, lower, est, upper, y, box)
+        self.draw_diamond(painter, x - half_width, x, x + half_width,
+                          y, half_height, OVERALL_COLOR)
+
+    def draw_diamond(self, painter, x_lower, x_est, x_upper, y, half_height, color):
+        diamond = QPolygonF([QPointF(x_lower, y), QPointF(x_est, y - half_height),
+                             QPointF(x_upper, y), QPointF(x_est, y + half_height)])
+        painter.setPen(QPen(QColor("black")))
+        painter.setBrush(QBrush(color))
+        painter.drawPolygon(diamond)
+        painter.setBrush(Qt.NoBrush)
+
+    def draw_ci_line(self, painter, lower, est, upper, y, box):
+        # CIs that run off the plot are drawn as arrows, as in draw.normal.CI
+        painter.setPen(QPen(QColor("black")))
+        left, right = self.plot_left, self.plot_left + PLOT_WIDTH
+        x_lower, x_est, x_upper = self.x(lower), self.x(est), self.x(upper)
+        if x_upper > right and x_lower >= left:
+            self.draw_arrow(painter, x_lower, right, y)
+        elif x_upper <= right and x_lower < left:
+            self.draw_arrow(painter, x_upper, left, y)
+        elif x_upper > right and x_lower < left:
+            self.draw_arrow(painter, x_est, left, y)
+            self.draw_arrow(painter, x_est, right, y)
+        elif x_lower < box.left() or x_upper > box.right():
+            # otherwise the line is hidden by the box anyway
+            painter.drawLine(QPointF(x_lower, y), QPointF(x_upper, y))
+
+    def draw_arrow(self, painter, x_from, x_to, y):
+        painter.drawLine(QPointF(x_from, y), QPointF(x_to, y))
+        direction = 1 if x_to > x_from else -1
+        head = ARROW_LENGTH
+        painter.drawLine(QPointF(x_to, y), QPointF(x_to - direction*head, y - head/2.0))
+        painter.drawLine(QPointF(x_to, y), QPointF(x_to - direction*head, y + head/2.0))
+
+
+def _is_nan(x):
+    return x is None or (isinstance(x, float) and math.isnan(x))
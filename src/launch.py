@@ -1,4 +1,4 @@
-import sys, time
+import os, sys, time
 from PyQt4 import QtGui
 from PyQt4.Qt import *
 
@@ -6,65 +6,121 @@ import meta_py_r
 import meta_form
 import meta_globals
 import settings
-from meta_form import DISABLE_NETWORK_STUFF
 
 SPLASH_DISPLAY_TIME = 0 # TODO: change to 5 seconds in production version
+STARTUP_LOG_NAME = "startup_times.txt"
 
-def load_R_libraries(app, splash=None):
-    ''' Loads the R libraries while updating the splash screen'''
-    
-    meta_py_r.get_R_libpaths() # print the lib paths
-    rloader = meta_py_r.RlibLoader()
-    
-    splash.showMessage("Loading R libraries\n..")
-    app.processEvents()
-    
-    splash.showMessage("Loading metafor\n....")
-    app.processEvents()
-    rloader.load_metafor()
-    
-    splash.showMessage("Loading openmetar\n........")
-    app.processEvents()
-    rloader.load_openmetar()
-    
-    splash.showMessage("Loading igraph\n............")
-    app.processEvents()
-    rloader.load_igraph()
-    
-    splash.showMessage("Loading grid\n................")
-    app.processEvents()
-    rloader.load_grid()
-    
-    if not DISABLE_NETWORK_STUFF:
-        splash.showMessage("Loading gemtc\n...................")
-        app.processEvents()
-        rloader.load_gemtc()
+class StartupTimer:
+    ''' Keeps track of how long each phase of start-up takes. The breakdown
+    is written to the logs directory once the R libraries are in. '''
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = [] # (phase name, seconds) in the order recorded
+
+    def record(self, phase, seconds):
+        self.phases.append((phase, seconds))
+
+    def time_phase(self, phase, f, *args, **kw):
+        phase_start = time.time()
+        res = f(*args, **kw)
+        self.record(phase, time.time() - phase_start)
+        return res
+
+    def report(self):
+        lines = ["OpenMeta[analyst] start-up (%s)" % time.ctime(self.start_time)]
+        for phase, seconds in self.phases:
+            lines.append("%-40s %8.3f s" % (phase, seconds))
+        lines.append("%-40s %8.3f s" % ("total (wall clock)", time.time()-self.start_time))
+        return "\n".join(lines)
+
+    def write_report(self):
+        report = self.report()
+        print(report)
+        try:
+            log_path = os.path.join(settings.make_logs_dir(), STARTUP_LOG_NAME)
+            with open(log_path, 'w') as log_file:
+                log_file.write(report + "\n")
+        except Exception, e:
+            print("Could not write the start-up report: %s" % e)
+
+class RlibLoaderThread(QThread):
+    ''' Loads the core R libraries off of the GUI thread, so the main form
+    can be shown right away. The rest (igraph, gemtc, HSROC) are loaded
+    on first use (see meta_py_r.ensure_R_libs) '''
+    def __init__(self, timer, parent=None):
+        QThread.__init__(self, parent)
+        self.timer = timer
+        self.error = None
+
+    def run(self):
+        meta_py_r.set_core_R_libs_loader_thread()
+        rloader = meta_py_r.RlibLoader()
+        load_start = time.time()
+        try:
+            meta_py_r.get_R_libpaths() # print the lib paths
+            rloader.load_core()
+        except Exception, e:
+            self.error = str(e)
+
+        for name in meta_py_r.CORE_R_LIBS:
+            if name in rloader.load_times:
+                self.timer.record("R: library(%s)" % name, rloader.load_times[name])
+        self.timer.record("R core libraries (background)", time.time()-load_start)
+        meta_py_r.finished_loading_core_R_libs(self.error)
+
+def R_libraries_loaded(meta, rloader_thread, timer):
+    if rloader_thread.error is None:
+        # the R side of the set up that was put off while the libraries
+        # were loading (e.g., the main form's confidence level)
+        meta_py_r.apply_pending_R_settings()
+
+    if meta is None:
+        # the main form isn't up yet
+        pass
+    elif rloader_thread.error is not None:
+        QMessageBox.critical(meta, "Problem loading R libraries",
+                             rloader_thread.error)
+    else:
+        meta.statusBar().showMessage("R libraries loaded", 3000)
+    timer.write_report()
 
 def start():
-    app = QtGui.QApplication(sys.argv)
+    timer = StartupTimer()
+    app = timer.time_phase("QApplication", QtGui.QApplication, sys.argv)
     app.setApplicationName(meta_globals.APPLICATION_NAME)
     app.setOrganizationName(meta_globals.ORGANIZATION_NAME)
-    settings.setup_directories()
-    
+    timer.time_phase("setup directories", settings.setup_directories)
+
     splash_pixmap = QPixmap(":/misc/splash.png")
     splash = QSplashScreen(splash_pixmap)
     splash.show()
     splash_starttime = time.time()
-    
-    load_R_libraries(app, splash)
-    
+
+    # R calls made before the core libraries are in wait for them
+    meta_py_r.begin_loading_core_R_libs()
+    rloader_thread = RlibLoaderThread(timer)
+    main_window = {"meta":None}
+    QObject.connect(rloader_thread, SIGNAL("finished()"),
+                    lambda: R_libraries_loaded(main_window["meta"], rloader_thread, timer))
+    rloader_thread.start()
+
     # Show splash screen for at least SPLASH_DISPLAY_TIME seconds
     time_elapsed  = time.time() - splash_starttime
-    print("It took %s seconds to load the R libraries" % str(time_elapsed))
     if time_elapsed < SPLASH_DISPLAY_TIME: # seconds
         print("Going to sleep for %f seconds" % float(SPLASH_DISPLAY_TIME-time_elapsed))
         QThread.sleep(int(SPLASH_DISPLAY_TIME-time_elapsed))
 
-    meta = meta_form.MetaForm()
+    meta = timer.time_phase("MetaForm construction", meta_form.MetaForm)
+    main_window["meta"] = meta
     splash.finish(meta)
     meta.show()
+    timer.record("until main form shown", time.time()-timer.start_time)
+
+    if rloader_thread.isRunning():
+        meta.statusBar().showMessage("Loading R libraries...")
+
     meta.start()
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
-    start()
\ No newline at end of file
+    start()
@@ -12,21 +12,34 @@
 #########################################################################################
 
 # core libraries
+import itertools
 from PyQt4.Qt import Qt
 from PyQt4 import QtCore
 from PyQt4.QtCore import QAbstractTableModel, QModelIndex, QString, QVariant, SIGNAL
 from PyQt4.QtGui import QIcon
 
 # home-grown
-from ma_dataset import Dataset,Outcome,Study,Covariate
+from ma_dataset import Dataset,Outcome,Study,Covariate,MetaAnalyticUnit,MetaAnalyticUnitView
 from meta_globals import *
 import calculator_routines as calc_fncs
 import meta_py_r
+import binary_imputation
 
 # number of (empty) rows in the spreadsheet to show
 # following the last study.
 DUMMY_ROWS = 20
 
+# the metrics from whose effect and CI the raw data can be
+# back-calculated (see impute_raw_data_for_current_outcome)
+BACK_CALCULATABLE_EFFECTS = {BINARY:["OR", "RR", "RD"],
+                             CONTINUOUS:["MD", "SMD"],
+                             DIAGNOSTIC:["Sens", "Spec"]}
+
+# the data revisions of every DatasetModel (see DatasetModel.data_revision)
+# come from this one counter, so caches keyed on them can't mistake a new
+# model (or a new dataset at the same address) for an old one
+_data_revisions = itertools.count(1)
+
 def DebugHelper(function):
     def _DebugHelper(*args, **kw):
         print("Entered %s" % function.func_name)
@@ -61,6 +74,19 @@ class DatasetModel(QAbstractTableModel):
     
     def __init__(self, filename=QString(), dataset=None, add_blank_study=True):
         super(DatasetModel, self).__init__()
+
+        # rendered cell values, keyed by row and then (column, role); see
+        # data(). this has to exist before anything below touches the model.
+        self._render_cache = {}
+        # bumped whenever the render cache is invalidated, i.e., whenever the
+        # data may have changed; things computed from the data (e.g., the
+        # treatment network, see meta_py_r.ma_dataset_to_network_robj) are
+        # cached per revision. Revisions are unique across models (see
+        # _data_revisions), so a new model never repeats an old one's
+        self.data_revision = _data_revisions.next()
+        # study id --> ma_unit for the viewed outcome/follow-up/groups
+        # (see _current_ma_unit_index)
+        self.invalidate_ma_unit_index()
         
         self.conf_level = self.set_conf_level(DEFAULT_CONF_LEVEL)
 
@@ -108,6 +134,7 @@ class DatasetModel(QAbstractTableModel):
         
     def set_current_metric(self, metric):
         self.current_effect = metric
+        self.invalidate_render_cache()
         print "OK! metric updated."
         
     def update_current_outcome(self):
@@ -209,9 +236,114 @@ class DatasetModel(QAbstractTableModel):
 
 
 
+    ##### Render cache #####
+    # The view asks for every visible cell (and every role) each time it
+    # paints, i.e., on every scroll step. Computing a cell means looking up
+    # the ma_unit, converting to the display scale and formatting, so we
+    # keep what data() returned until something that could change it
+    # happens: the cell (row) is edited, the studies are re-ordered, or the
+    # outcome/follow-up/groups/metric/confidence level being viewed changes.
+    # Those paths call invalidate_render_cache() (reset() clears it, too).
+
+    def invalidate_render_cache(self, row=None):
+        ''' Forget the cached values for the given row, or for every row if
+        row is None '''
+        self.data_revision = _data_revisions.next()
+        if row is None:
+            self._render_cache.clear()
+        else:
+            self._render_cache.pop(row, None)
+
+    def reset(self):
+        self.invalidate_render_cache()
+        self.invalidate_ma_unit_index()
+        QAbstractTableModel.reset(self)
+
+    ##### Change notifications #####
+    # reset() makes the view throw away everything it knows about the model
+    # (the current index, the editor, the selection) and, through
+    # modelAboutToBeReset, has the display scale values of every study
+    # recalculated. It is meant for changes of the columns. Edits of the
+    # studies go through rows_changed, which has the view re-query just those
+    # rows; changes of what is displayed that leave the columns as they are
+    # (e.g., switching to an outcome of the same type) go through
+    # displayed_data_changed. Adding, removing and re-ordering studies emit
+    # the row insertion/removal and layout signals (see append_studies,
+    # remove_study and permute_studies).
+
+    def rows_changed(self, first_row, last_row=None):
+        ''' Tells the view that (any of) the cells of rows first_row through
+        last_row (or just first_row) have changed '''
+        if last_row is None:
+            last_row = first_row
+        for row in range(first_row, last_row+1):
+            self.invalidate_render_cache(row)
+        self.emit(SIGNAL("dataChanged(QModelIndex, QModelIndex)"),
+                  self.index(first_row, 0), self.index(last_row, self.columnCount()-1))
+
+    def all_rows_changed(self):
+        self.rows_changed(0, self.rowCount()-1)
+
+    def column_layout(self):
+        ''' Identifies the columns of the table; see displayed_data_changed '''
+        return (self.columnCount(), tuple(self.RAW_DATA), tuple(self.OUTCOMES))
+
+    def displayed_data_changed(self, old_column_layout):
+        '''
+        To be called when the outcome, follow-up or groups being displayed have
+        changed; old_column_layout is column_layout() from before the change.
+        If the columns are still the same, the view is told that every cell
+        (and the headers) changed; otherwise the model is reset.
+        '''
+        if old_column_layout != self.column_layout():
+            self.reset()
+            return
+        # as modelAboutToBeReset, for the display scale values
+        self.emit(SIGNAL("displayedDataAboutToChange()"))
+        self.invalidate_render_cache()
+        self.invalidate_ma_unit_index()
+        self.emit(SIGNAL("headerDataChanged(Qt::Orientation, int, int)"),
+                  Qt.Horizontal, 0, self.columnCount()-1)
+        self.all_rows_changed()
+
+    def append_studies(self, studies):
+        ''' Adds studies to the end of the dataset '''
+        if len(studies) == 0:
+            return
+        first_row = len(self.dataset.studies)
+        self.beginInsertRows(QModelIndex(), first_row, first_row+len(studies)-1)
+        for study in studies:
+            self.dataset.add_study(study)
+        # the (blank) rows below the studies were rendered as such
+        for row in [row for row in self._render_cache if row >= first_row]:
+            self.invalidate_render_cache(row)
+        self.endInsertRows()
+
     def data(self, index, role=Qt.DisplayRole):
         '''
-        Implements the required QTTableModel data method. There is a lot of switching on 
+        Implements the required QTTableModel data method. Values are served
+        from the render cache when possible; see _compute_data for the
+        actual switching on role/index/datatype.
+        '''
+        if not index.isValid():
+            return QVariant()
+        row = index.row()
+        key = (index.column(), role)
+        try:
+            return self._render_cache[row][key]
+        except KeyError:
+            pass
+
+        value = self._compute_data(index, role)
+        if row in self._render_cache:
+            self._render_cache[row][key] = value
+        else:
+            self._render_cache[row] = {key: value}
+        return value
+
+    def _compute_data(self, index, role=Qt.DisplayRole):
+        '''
+        Does the work for data(). There is a lot of switching on 
         role/index/datatype here, but this seems consistent with the QT paradigm (see 
         Summerfield's book)
         '''
@@ -571,10 +703,9 @@ class DatasetModel(QAbstractTableModel):
                 new_study = Study(self.max_study_id()+1)
                 # issue #133 fix; exclude newly added studies by default
                 new_study.include=False
-                self.dataset.add_study(new_study)
+                self.append_studies([new_study])
                 self.study_auto_added = int(new_study.id)
                 study_added_due_to_edit = int(new_study.id)
-                self.reset()
                 # new_index is where the user *should* be editing.
                 new_index = self.index(index.row(), index.column()+1)
                 self.emit(SIGNAL("modelReset(QModelIndex)"), new_index)
@@ -599,7 +730,7 @@ class DatasetModel(QAbstractTableModel):
 
             # @TODO make module-level constant?
             adjust_by = 3 # include study, study name, year columns
-            ma_unit = self.get_current_ma_unit_for_study(index.row())
+            ma_unit = self.materialize_current_ma_unit_for_study(index.row())
             group_name = self.current_txs[0]
             if current_data_type == BINARY:
                 if column in self.RAW_DATA[2:]:
@@ -666,7 +797,7 @@ class DatasetModel(QAbstractTableModel):
                         conv_to_disp_scale = self._get_conv_to_display_scale(data_type=current_data_type,
                                                                          effect=self.current_effect)
                     
-                    ma_unit = self.get_current_ma_unit_for_study(index.row())
+                    ma_unit = self.materialize_current_ma_unit_for_study(index.row())
                     if outcome_subtype == "generic_effect":
                         if column == self.OUTCOMES[0]: #estimate
                             ma_unit.set_effect(self.current_effect, group_str, calc_scale_val)
@@ -704,7 +835,7 @@ class DatasetModel(QAbstractTableModel):
 
                             
                 else: #outcome is diagnostic
-                    ma_unit = self.get_current_ma_unit_for_study(index.row())
+                    ma_unit = self.materialize_current_ma_unit_for_study(index.row())
                     # figure out if this column is sensitivity or specificity
                     m_str = "Sens"
                     if column in self.OUTCOMES[3:]:
@@ -756,9 +887,10 @@ class DatasetModel(QAbstractTableModel):
                 new_value, converted_ok = value.toDouble()
                 if not converted_ok: 
                     new_value = None
-            study.covariate_dict[cov_name] = new_value
+            self.dataset.set_covariate_value(study, cov_name, new_value)
             
-        self.emit(SIGNAL("dataChanged(QModelIndex, QModelIndex)"), index, index)
+        # edits can touch any cell in the row (e.g., raw data -> outcomes)
+        self.rows_changed(index.row())
 
         # tell the view that an entry in the table has changed, and what the old
         # and new values were. This for undo/redo purposes.
@@ -790,6 +922,8 @@ class DatasetModel(QAbstractTableModel):
                     # is automatically excluded.
                     if any([val is None for val in [effect_d[effect_key] for effect_key in ("upper", "lower", "est")]]):
                         study.include = False
+            # the include checkbox may have changed above
+            self.invalidate_render_cache(index.row())
         return True
         
     
@@ -1153,8 +1287,11 @@ class DatasetModel(QAbstractTableModel):
         self.reset()
         
     def remove_study(self, an_id):
+        self.beginRemoveRows(QModelIndex(), an_id, an_id)
         self.dataset.studies.pop(an_id)
-        self.reset()
+        # the rows below have moved up
+        self.invalidate_render_cache()
+        self.endRemoveRows()
 
     def get_name(self):
         return self.dataset.title
@@ -1202,9 +1339,10 @@ class DatasetModel(QAbstractTableModel):
         return (t_point, self.get_follow_up_name_for_t_point(t_point))
         
     def set_current_time_point(self, time_point):
+        column_layout = self.column_layout()
         self.current_time_point = time_point
         self.emit(SIGNAL("followUpChanged()"))
-        self.reset()
+        self.displayed_data_changed(column_layout)
         
     def set_current_follow_up(self, follow_up_name):
         t_point = self.dataset.outcome_names_to_follow_ups[self.current_outcome].get_key(follow_up_name)
@@ -1281,13 +1419,14 @@ class DatasetModel(QAbstractTableModel):
         return follow_up in outcome_d.keys()
         
     def outcome_fu_has_group(self, outcome, follow_up, group):
-        ## we just pull the outcome from the first study; we tacitly
-        # assume that all studies have the same outcomes/follow-ups.
-        # 
-        outcome_d = self.dataset.studies[0].outcomes_to_follow_ups[outcome]
-
-        ## we _assume_ that the follow_up is in this outcome!
-        return group in outcome_d[follow_up].tx_groups.keys()
+        ## we just pull the outcome from the first study that has it; we
+        # tacitly assume that all studies have the same groups.
+        # (studies added since the outcome was don't have it yet)
+        for study in self.dataset.studies:
+            ma_unit = study.outcomes_to_follow_ups.get(outcome, {}).get(follow_up)
+            if ma_unit is not None:
+                return group in ma_unit.tx_groups
+        return False
     
     def set_current_groups(self, group_names):
         self.previous_txs = self.current_txs
@@ -1295,27 +1434,32 @@ class DatasetModel(QAbstractTableModel):
         self.tx_index_a = self.dataset.get_group_names().index(group_names[0])
         self.tx_index_b = self.dataset.get_group_names().index(group_names[1])
         print "\ncurrent tx group index a, b: %s, %s" % (self.tx_index_a, self.tx_index_b)
+        self.invalidate_render_cache()
         
     def get_group_names(self):
         return self.dataset.get_group_names()
 
     def sort_studies(self, col, reverse):
+        '''
+        Sorts the studies on the values in column col. Returns the permutation
+        that was applied (see permute_studies), so that it can be undone.
+        '''
+        directions_to_ma_unit = None
         if col == self.NAME:
-            self.dataset.studies.sort(cmp = self.dataset.cmp_studies(compare_by="name", reverse=reverse, mult=self.get_mult()), reverse=reverse)
+            compare_by = "name"
         elif col == self.YEAR:
-            self.dataset.studies.sort(cmp = self.dataset.cmp_studies(compare_by="year", reverse=reverse, mult=self.get_mult()), reverse=reverse)
+            compare_by = "year"
         elif col in self.RAW_DATA:
-            #data_type = self.dataset.get_outcome_type(self.current_outcome)
             # need this to dig down to find right ma_unit and data we're looking for to compare against
-            ma_unit_reference_info = {'outcome_name': self.current_outcome, 
-                                      'follow_up': self.get_follow_up_name_for_t_point(self.current_time_point),
-                                      'current_groups': self.get_current_groups(),
-                                      'data_index': col - min(self.RAW_DATA)}
-            self.dataset.studies.sort(cmp = self.dataset.cmp_studies(compare_by="raw_data", 
-                reverse=reverse, directions_to_ma_unit=ma_unit_reference_info, mult=self.get_mult()), reverse=reverse)
+            compare_by = "raw_data"
+            directions_to_ma_unit = {'outcome_name': self.current_outcome, 
+                                     'follow_up': self.get_follow_up_name_for_t_point(self.current_time_point),
+                                     'current_groups': self.get_current_groups(),
+                                     'data_index': col - min(self.RAW_DATA)}
         elif col in self.OUTCOMES:
             # need this to dig down to find right ma_unit and data we're looking for to compare against
-            ma_unit_reference_info = {
+            compare_by = "outcomes"
+            directions_to_ma_unit = {
                 'outcome_type': self.dataset.get_outcome_type(self.current_outcome),
                 'outcome_name': self.current_outcome, 
                 'follow_up': self.get_follow_up_name_for_t_point(self.current_time_point),
@@ -1324,37 +1468,59 @@ class DatasetModel(QAbstractTableModel):
                 'group_str': self.get_cur_group_str(),
                 'data_index': col - min(self.OUTCOMES)
             }
-            self.dataset.studies.sort(cmp = self.dataset.cmp_studies(compare_by="outcomes", 
-                                      reverse=reverse, directions_to_ma_unit=ma_unit_reference_info, mult=self.get_mult()),
-                                      reverse=reverse)
-        
-            
         # covariates -- note that we assume anything to the right of the outcomes
         # is a covariate
         elif col > self.OUTCOMES[-1]:
-            cov = self.get_cov(col)
-            self.dataset.studies.sort(cmp = self.dataset.cmp_studies(\
-                                        compare_by=cov.name, reverse=reverse, mult=self.get_mult()), reverse=reverse)
+            compare_by = self.get_cov(col).name
+        else:
+            compare_by = None
 
-        self.reset()
+        if compare_by is None:
+            permutation = range(len(self.dataset.studies))
+        else:
+            sort_values = self.dataset.study_sort_values(compare_by, reverse=reverse,
+                                directions_to_ma_unit=directions_to_ma_unit, mult=self.get_mult())
+            permutation = self.dataset.argsort_studies(sort_values, reverse=reverse)
+        self.permute_studies(permutation)
+        return permutation
+
+    def permute_studies(self, permutation):
+        '''
+        Moves the study at index permutation[i] to position i. The rows are
+        moved as a layout change, so that the view keeps the current and
+        selected cells (and the cached renderings) with their studies.
+        '''
+        self.emit(SIGNAL("layoutAboutToBeChanged()"))
+        studies = self.dataset.studies
+        self.dataset.studies[:] = [studies[i] for i in permutation]
+
+        old_row_to_new = dict([(old_row, new_row) for new_row, old_row in enumerate(permutation)])
+        self._render_cache = dict([(old_row_to_new.get(row, row), cached) \
+                                    for row, cached in self._render_cache.items()])
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(old_row_to_new.get(index.row(), index.row()), index.column()) \
+                                    for index in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.emit(SIGNAL("layoutChanged()"))
 
     def order_studies(self, ids):
         ''' Shuffles studies vector to the order specified by ids'''
-        ordered_studies = []
-        for an_id in ids:
-            for study in self.dataset.studies:
-                if study.id == an_id:
-                    ordered_studies.append(study)
-                    break
-        self.dataset.studies = ordered_studies
-        self.reset()
+        rows = dict([(study.id, row) for row, study in enumerate(self.dataset.studies)])
+        permutation = [rows[an_id] for an_id in ids if an_id in rows]
+        if len(permutation) == len(self.dataset.studies):
+            self.permute_studies(permutation)
+        else:
+            # studies not in ids are dropped
+            self.dataset.studies = [self.dataset.studies[row] for row in permutation]
+            self.reset()
 
     def set_current_outcome(self, outcome_name):
+        column_layout = self.column_layout()
         self.current_outcome = outcome_name
         self.update_column_indices()
         self.update_cur_tx_effect()
         self.emit(SIGNAL("outcomeChanged()"))
-        self.reset()
+        self.displayed_data_changed(column_layout)
         
     def update_cur_tx_effect(self):
         outcome_type = self.dataset.get_outcome_type(self.current_outcome)
@@ -1540,6 +1706,175 @@ class DatasetModel(QAbstractTableModel):
         for study_index in range(len(self.dataset.studies)):
             self.update_outcome_if_possible(study_index)
 
+    ##### Spreadsheet-wide imputation #####
+    # The calculator forms back-calculate the raw data of one study at a
+    # time. impute_raw_data_for_current_outcome gathers the partial data of
+    # every study for the current outcome, follow-up and groups instead, and
+    # imputes all of them with a single call to R.
+
+    def impute_raw_data_for_current_outcome(self):
+        '''
+        Returns {study index:raw data} (the raw data being laid out as in
+        get_cur_raw_data_for_study) for every study whose blank raw data can
+        be filled in from the data it does have, i.e., from its effect
+        estimate and CI. Only blank cells are filled in, and only when the
+        imputation is unambiguous (when it has a single valid solution).
+        The dataset itself is not modified; see set_cur_raw_data_for_study.
+        '''
+        data_type = self.get_current_outcome_type(get_str=False)
+        if data_type == DIAGNOSTIC:
+            effects = BACK_CALCULATABLE_EFFECTS[DIAGNOSTIC]
+        elif self.current_effect in BACK_CALCULATABLE_EFFECTS.get(data_type, []):
+            effects = [self.current_effect]
+        else:
+            return {}
+        group_str = self.get_cur_group_str()
+
+        # the studies with blank raw data and an effect/CI to impute it from
+        study_indices, raw_data, effects_and_cis = [], [], []
+        for study_index in range(len(self.dataset.studies)):
+            study_raw_data = list(self.get_cur_raw_data_for_study(study_index))
+            if not any([x in EMPTY_VALS for x in study_raw_data]):
+                continue
+            ma_unit = self.get_current_ma_unit_for_study(study_index)
+            try:
+                study_effects = [ma_unit.get_effect_and_ci(effect, group_str, self.mult) for effect in effects]
+            except KeyError:
+                continue
+            if all([est in EMPTY_VALS and lower in EMPTY_VALS and upper in EMPTY_VALS \
+                            for est, lower, upper in study_effects]):
+                continue
+            study_indices.append(study_index)
+            raw_data.append(study_raw_data)
+            effects_and_cis.append(study_effects)
+
+        if len(study_indices) == 0:
+            return {}
+
+        if data_type == CONTINUOUS:
+            # MD and SMD are on the same scale for calculation and display
+            display_effects = effects_and_cis
+        elif data_type == BINARY:
+            # exp for OR and RR; no need to go to R
+            to_display = lambda x: binary_imputation.calc_to_display_scale(x, self.current_effect)
+            display_effects = [[tuple([to_display(x) for x in effect_and_ci]) for effect_and_ci in study_effects] \
+                                    for study_effects in effects_and_cis]
+        else:
+            display_effects = self._effects_and_cis_to_display_scale(effects_and_cis, effects, data_type)
+
+        impute = {BINARY:self._impute_binary_raw_data,
+                  CONTINUOUS:self._impute_continuous_raw_data,
+                  DIAGNOSTIC:self._impute_diagnostic_raw_data}[data_type]
+        imputed = impute(raw_data, display_effects)
+
+        new_raw_data = {}
+        for study_index, old, new in zip(study_indices, raw_data, imputed):
+            if new is None:
+                continue
+            # only fill in the blanks
+            filled_in = [new_x if (old_x in EMPTY_VALS and new_x not in EMPTY_VALS) else old_x \
+                                for old_x, new_x in zip(old, new)]
+            if filled_in != old:
+                new_raw_data[study_index] = filled_in
+        return new_raw_data
+
+    def _effects_and_cis_to_display_scale(self, effects_and_cis, effects, data_type):
+        ''' converts the (est, lower, upper) of each effect for each study to
+        the display scale, with one call to R per effect '''
+        display_effects = [[None for effect in effects] for study_effects in effects_and_cis]
+        for effect_index, effect in enumerate(effects):
+            calc_values = []
+            for study_effects in effects_and_cis:
+                calc_values.extend(study_effects[effect_index])
+            display_values = self.dataset._values_to_display_scale(calc_values, data_type, effect)
+            for i, study_effects in enumerate(display_effects):
+                study_effects[effect_index] = tuple(display_values[3*i:3*i+3])
+        return display_effects
+
+    def _impute_binary_raw_data(self, raw_data, display_effects):
+        rows = []
+        for (e1, n1, e2, n2), [(est, lower, upper)] in zip(raw_data, display_effects):
+            rows.append({"metric":self.current_effect, "estimate":est, "lower":lower,
+                         "upper":upper, "N_A":n1, "N_B":n2, "conf.level":self.conf_level})
+        imputed = binary_imputation.impute_bin_data_batch(rows)
+
+        new_raw_data = []
+        for (e1, n1, e2, n2), solutions in zip(raw_data, imputed):
+            # the solutions that are valid counts and agree with whatever
+            # counts were already entered
+            valid = set()
+            for a, c in [(solutions["a1"], solutions["c1"]), (solutions["a2"], solutions["c2"])]:
+                if a is None or c is None or n1 in EMPTY_VALS or n2 in EMPTY_VALS:
+                    continue
+                a, c = int(round(a)), int(round(c))
+                if not (0 <= a <= n1 and 0 <= c <= n2):
+                    continue
+                if (e1 not in EMPTY_VALS and e1 != a) or (e2 not in EMPTY_VALS and e2 != c):
+                    continue
+                valid.add((a, c))
+            if len(valid) == 1:
+                a, c = valid.pop()
+                new_raw_data.append([a, n1, c, n2])
+            else:
+                # nothing to impute, or the user has to choose between
+                # the two solutions (in the binary data form)
+                new_raw_data.append(None)
+        return new_raw_data
+
+    def _impute_continuous_raw_data(self, raw_data, display_effects):
+        raw_cols = ["n1", "mean1", "sd1", "n2", "mean2", "sd2"]
+        rows = []
+        for study_raw_data, [(est, low, high)] in zip(raw_data, display_effects):
+            row = dict(zip(raw_cols, study_raw_data))
+            # the defaults of the continuous data form: equal population
+            # SDs for MD, Hedges' g for SMD
+            row.update({"est":est, "low":low, "high":high, "metric":self.current_effect,
+                        "met.param":True, "conf.level":self.conf_level})
+            rows.append(row)
+        imputed = meta_py_r.back_calc_cont_data_batch(rows)
+
+        new_raw_data = []
+        for values in imputed:
+            new = [values[col] for col in raw_cols]
+            n1, n2 = new[0], new[3]
+            if any([n not in EMPTY_VALS and n <= 1 for n in (n1, n2)]):
+                new_raw_data.append(None)
+                continue
+            # sample sizes are counts
+            new[0] = None if n1 in EMPTY_VALS else int(round(n1))
+            new[3] = None if n2 in EMPTY_VALS else int(round(n2))
+            new_raw_data.append(new)
+        return new_raw_data
+
+    def _impute_diagnostic_raw_data(self, raw_data, display_effects):
+        raw_fields = sorted(DIAG_FIELDS_TO_RAW_INDICES.keys(), key=DIAG_FIELDS_TO_RAW_INDICES.get)
+        rows = []
+        for study_raw_data, study_effects in zip(raw_data, display_effects):
+            row = {"conf.level":self.conf_level}
+            for effect, (est, lower, upper) in zip(BACK_CALCULATABLE_EFFECTS[DIAGNOSTIC], study_effects):
+                prefix = effect.lower()
+                row.update({prefix:est, prefix+".lb":lower, prefix+".ub":upper})
+            rows.append(row)
+        imputed = meta_py_r.impute_diag_data_batch(rows)
+
+        new_raw_data = []
+        for values in imputed:
+            new = [values[field] for field in raw_fields]
+            if any([x not in EMPTY_VALS and x < 0 for x in new]):
+                new_raw_data.append(None)
+                continue
+            new_raw_data.append([None if x in EMPTY_VALS else int(round(x)) for x in new])
+        return new_raw_data
+
+    def set_cur_raw_data_for_study(self, study_index, raw_data):
+        ''' raw_data is laid out as returned by get_cur_raw_data_for_study, i.e.,
+        the raw data of each of the current groups, in order '''
+        ma_unit = self.materialize_current_ma_unit_for_study(study_index)
+        n_cols = len(raw_data) / len(self.current_txs)
+        ma_unit.set_raw_data_for_groups(self.current_txs,
+                [list(raw_data[i*n_cols:(i+1)*n_cols]) for i in range(len(self.current_txs))])
+        self.invalidate_render_cache(study_index)
+
         
     def blank_all_studies(self, include_them):
         # note that we do *not* change the status of the
@@ -1577,11 +1912,11 @@ class DatasetModel(QAbstractTableModel):
             If the raw data is empty, the outcome should not be effected
         '''
         est_and_ci_d = None
+        self.invalidate_render_cache(study_index)
         # to index into the effect belonging to the currently displayed groups
         group_str = self.get_cur_group_str() 
         data_type = self.get_current_outcome_type(get_str=False) 
         one_arm_effect = self.current_effect in BINARY_ONE_ARM_METRICS + CONTINUOUS_ONE_ARM_METRICS  
-        ma_unit = self.get_current_ma_unit_for_study(study_index)
 
         ####
         # previously we were always setting this to false here,
@@ -1595,6 +1930,7 @@ class DatasetModel(QAbstractTableModel):
         # metric then if sufficient raw data exists to compute this
         if self.raw_data_is_complete_for_study(study_index) or \
                 (one_arm_effect and self.raw_data_is_complete_for_study(study_index, first_arm_only=True)):
+            ma_unit = self.materialize_current_ma_unit_for_study(study_index)
             
             if not self.dataset.studies[study_index].manually_excluded:
                 # include the study -- note that if the user excluded the study, then
@@ -1668,6 +2004,7 @@ class DatasetModel(QAbstractTableModel):
                                 mult=self.mult)
         elif self._raw_data_is_not_empty_for_study(study_index) or (one_arm_effect and self._raw_data_is_not_empty_for_study(study_index, first_arm_only=True)):
             if data_type in [BINARY, CONTINUOUS]: # raw data is not blank but not full so clear outcome
+                ma_unit = self.materialize_current_ma_unit_for_study(study_index)
                 est, lower, upper, se = None, None, None, None
                 ma_unit.set_effect_and_ci(self.current_effect, group_str, est, lower, upper, mult=self.mult)
                 ma_unit.set_SE(self.current_effect, group_str, se)
@@ -1772,74 +2109,167 @@ class DatasetModel(QAbstractTableModel):
         return self.get_current_ma_unit_for_study(study_index).get_raw_data_for_groups(self.current_txs)
 
     def set_current_ma_unit_for_study(self, study_index, new_ma_unit):
-        # note that we just assume this exists.
-        self.dataset.studies[study_index].outcomes_to_follow_ups[self.current_outcome][self.get_current_follow_up_name()]=new_ma_unit
-        
+        # make sure the outcome/follow-up containers exist before
+        # swapping in the new unit
+        self.materialize_current_ma_unit_for_study(study_index)
+        study = self.dataset.studies[study_index]
+        study.outcomes_to_follow_ups[self.current_outcome][self.get_current_follow_up_name()]=new_ma_unit
+        self._current_ma_unit_index()[study.id] = new_ma_unit
+        self.invalidate_render_cache(study_index)
+
+    ##### MA unit lookup #####
+    # Reads (rendering, gathering data for R, exporting) go through
+    # get_current_ma_unit_for_study/get_ma_unit, which never modify the
+    # dataset. Studies that don't (yet) have a unit for the viewed
+    # outcome/follow-up are served a shared blank unit, and those whose
+    # unit lacks some of the viewed groups a view of it in which just
+    # those groups are blank (see MetaAnalyticUnitView). Anything
+    # that *writes* to a unit must get it from
+    # materialize_current_ma_unit_for_study/materialize_ma_unit, which
+    # add the missing outcome, follow-up and groups to the study.
+
+    def _current_ma_unit_index(self):
+        ''' study id --> ma_unit for the currently viewed outcome, follow-up
+        and groups. Rebuilt (in one pass) when any of these change '''
+        key = (self.current_outcome, self.get_current_follow_up_name(), tuple(self.current_txs))
+        if self._ma_unit_index_key != key:
+            self._ma_unit_index = {}
+            for study in self.dataset.studies:
+                ma_unit = self._ma_unit_for_reading(study, *key)
+                if ma_unit is not None:
+                    self._ma_unit_index[study.id] = ma_unit
+            self._ma_unit_index_key = key
+        return self._ma_unit_index
+
+    def invalidate_ma_unit_index(self):
+        self._ma_unit_index_key = None
+        self._ma_unit_index = {}
+        self._blank_ma_unit = None
+
+    def _get_blank_ma_unit(self):
+        ''' Read-only stand-in for studies without data for the current
+        outcome/follow-up/groups; it is never attached to a study '''
+        key = self._ma_unit_index_key
+        if self._blank_ma_unit is None or self._blank_ma_unit[0] != key:
+            outcome = self.dataset.get_outcome_obj(self.current_outcome)
+            self._blank_ma_unit = (key, MetaAnalyticUnit(outcome, group_names=list(self.current_txs)))
+        return self._blank_ma_unit[1]
+
     def get_current_ma_unit_for_study(self, study_index):
         '''
-        Returns the MetaAnalytic unit for the study @ study_index. If no such Unit exists,
-        it will be added. Thus when a new study is added to a dataset, there is no need
-        to initially populate this study with empty MetaAnalytic units reflecting the known
-        outcomes, time points & tx groups, as they will be added 'on-demand' here.
+        Returns the MetaAnalytic unit for the study @ study_index, for reading. If the
+        study has no such unit, a blank one is returned; the dataset is not changed.
+        Use materialize_current_ma_unit_for_study to get a unit to modify.
         '''
-        
-        return self.get_ma_unit(study_index=study_index,
-                                outcome=self.current_outcome,
-                                follow_up=self.get_current_follow_up_name(),
-                                tx_groups=self.current_txs)
+        study = self.dataset.studies[study_index]
+        ma_unit = self._current_ma_unit_index().get(study.id)
+        if ma_unit is None or \
+                (isinstance(ma_unit, MetaAnalyticUnitView) and not ma_unit.is_current()):
+            # e.g., a study added since the index was built
+            ma_unit = self._ma_unit_for_reading(study, self.current_outcome,
+                                                self.get_current_follow_up_name(),
+                                                self.current_txs)
+            if ma_unit is None:
+                return self._get_blank_ma_unit()
+            self._ma_unit_index[study.id] = ma_unit
+        return ma_unit
 
+    def _ma_unit_for_reading(self, study, outcome, follow_up, tx_groups):
+        ''' The study's unit for outcome at follow_up or, if it lacks some of
+        tx_groups, a view of it in which those are blank; None if the study has
+        no unit for outcome at follow_up '''
+        ma_unit = self.get_ma_unit(study=study, outcome=outcome, follow_up=follow_up)
+        if ma_unit is None:
+            return None
+        for tx_group in tx_groups:
+            if tx_group not in ma_unit.tx_groups:
+                return MetaAnalyticUnitView(ma_unit, list(tx_groups))
+        return ma_unit
 
-    def get_ma_unit(self, study=None, study_index=None, outcome=None, follow_up=None, tx_groups=None):
+    def materialize_current_ma_unit_for_study(self, study_index):
         '''
-        Returns the MetaAnalytic unit for the study @ study_index. If no such Unit exists,
-        it will be added. Thus when a new study is added to a dataset, there is no need
-        to initially populate this study with empty MetaAnalytic units reflecting the known
-        outcomes, time points & tx groups, as they will be added 'on-demand' here.
-        
-        outcome and follow_up are the names, not ids or instances, of these objects
-        
+        Returns the MetaAnalytic unit for the study @ study_index, adding it (or the
+        currently displayed groups) to the study if need be. Thus when a new study is
+        added to a dataset, there is no need to initially populate this study with
+        empty MetaAnalytic units reflecting the known outcomes, time points & tx groups,
+        as they will be added 'on-demand' here, when something is written to them.
         '''
-        
+        study = self.dataset.studies[study_index]
+        ma_unit = self.materialize_ma_unit(study=study,
+                                           outcome=self.current_outcome,
+                                           follow_up=self.get_current_follow_up_name(),
+                                           tx_groups=self.current_txs)
+        self._current_ma_unit_index()[study.id] = ma_unit
+        self.invalidate_render_cache(study_index)
+        return ma_unit
+
+    def _study_for(self, study, study_index):
         if None not in [study, study_index]:
             if study != self.dataset.studies[study_index]:
                 raise ValueError("study and study index don't match")
-        
+
         if study is None: # you can specify a study OR a study index
             study = self.dataset.studies[study_index]
-        
+        return study
+
+    def get_ma_unit(self, study=None, study_index=None, outcome=None, follow_up=None, tx_groups=None):
+        '''
+        Returns the MetaAnalytic unit for the study @ study_index (or study), or None if
+        the study doesn't have one containing all of tx_groups. Never modifies the study.
+
+        outcome and follow_up are the names, not ids or instances, of these objects
+
+        '''
+        study = self._study_for(study, study_index)
+        try:
+            ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
+        except KeyError:
+            return None
+
+        if tx_groups is not None:
+            for tx_group in tx_groups:
+                if tx_group not in ma_unit.tx_groups:
+                    return None
+        return ma_unit
+
+    def materialize_ma_unit(self, study=None, study_index=None, outcome=None, follow_up=None, tx_groups=None):
+        '''
+        As get_ma_unit, but adds whatever is missing (the outcome, the follow-up
+        or any of tx_groups) to the study first, so the result is always a unit
+        that belongs to the study.
+        '''
+        study = self._study_for(study, study_index)
+
         # first check to see that the current outcome is contained in this study
         if not outcome in study.outcomes_to_follow_ups:
             ###
             # Issue 7 (RESOLVED) http://github.com/bwallace/OpenMeta-analyst-/issues/#issue/7
             study.add_outcome(self.dataset.get_outcome_obj(outcome),
                               group_names=self.dataset.get_group_names())
-        
-        # we must also make sure the time point exists. note that we use the *name* rather than the 
+
+        # we must also make sure the time point exists. note that we use the *name* rather than the
         # index of the current time/follow up
-        if not self.get_current_follow_up_name() in study.outcomes_to_follow_ups[outcome]:
+        if not follow_up in study.outcomes_to_follow_ups[outcome]:
             study.add_outcome_at_follow_up(self.dataset.get_outcome_obj(outcome),
                                            follow_up)
-        
-        
+
         # finally, make sure the studies contain the currently selected tx groups; if not, add them
+        ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
         if tx_groups is not None:
-            ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
             for tx_group in tx_groups:
-                if not tx_group in ma_unit.get_group_names():
+                if not tx_group in ma_unit.tx_groups:
                     ma_unit.add_group(tx_group)
-        
+
         return ma_unit
-        
+
     def max_raw_data_cols_for_current_unit(self):
         '''
         Returns the length of the biggest raw data list for the parametric ma_unit. e.g.,
         if a two group, binary outcome is the current ma_unit, then the studies should
         raw data vectors that contain, at most, 4 elements.
         '''
-        return \
-          max([len(\
-            study.outcomes_to_follow_ups[self.current_outcome][self.current_time_point].get_raw_data_for_groups(self.current_txs)\
-          ) for study in self.dataset.studies if self.current_outcome in study.outcomes_to_follow_ups])
+        return max([len(self.get_current_ma_unit_for_study(study_index).get_raw_data_for_groups(self.current_txs)) \
+                        for study_index in range(len(self.dataset.studies))])
 
     def recalculate_display_scale(self):
         effect = self.current_effect
@@ -1847,9 +2277,14 @@ class DatasetModel(QAbstractTableModel):
         current_data_type = self.dataset.get_outcome_type(self.current_outcome)
         
         ma_units = []
-        # Gather ma_units for spreadsheet
-        for study_index in range(len(self.dataset.studies)-1): #-1 is because last study is always blank
-            ma_units.append(self.get_current_ma_unit_for_study(study_index))
+        # Gather ma_units for spreadsheet; studies without a unit for the
+        # current outcome/follow-up have nothing to recalculate
+        follow_up = self.get_current_follow_up_name()
+        for study in self.dataset.studies[:-1]: #-1 is because last study is always blank
+            ma_unit = self._ma_unit_for_reading(study, self.current_outcome,
+                                                follow_up, self.current_txs)
+            if ma_unit is not None:
+                ma_units.append(ma_unit)
             
         binary_display_scale = lambda x: meta_py_r.binary_convert_scale(x, self.current_effect, convert_to="display.scale")
         continuous_display_scale = lambda x: meta_py_r.continuous_convert_scale(x, self.current_effect, convert_to="display.scale")
@@ -1875,6 +2310,7 @@ class DatasetModel(QAbstractTableModel):
                                                       convert_to_display_scale=get_diagnostic_display_scale(m_str),
                                                       conf_level=self.get_global_conf_level(), mult=self.mult,
                                                       check_if_necessary=True)
+        self.invalidate_render_cache()
         print("Finished calculating display effect and cis")
 
     def _get_conv_to_display_scale(self, data_type, effect, n1=None):
@@ -1925,14 +2361,16 @@ class DatasetModel(QAbstractTableModel):
         self.conf_level = float(conf_lev)
         print("Set confidence level to: %f" % conf_lev)
         
-        self.mult = meta_py_r.get_mult_from_r(conf_lev)
+        # computed here rather than in R, so that building a model (e.g.,
+        # the main form's, while the R libraries are still loading) doesn't
+        # have to wait on R
+        self.mult = binary_imputation.mult_for_conf_level(self.conf_level)
         print("mult is now: %s" % str(self.mult))
         
-        # set in R as well
-        r_str = "set.global.conf.level("+str(float(conf_lev))+")"
-        new_cl_in_R = meta_py_r.ro.r(r_str)[0]
-        print("Set confidence level in R to: %f" % new_cl_in_R)
+        # set in R as well (once the core libraries are in, if they aren't yet)
+        meta_py_r.set_R_conf_level(self.conf_level)
 
+        self.invalidate_render_cache()
         self.emit(SIGNAL("conf_level_changed()"))
         
         return conf_lev
@@ -53,7 +53,8 @@ class MADataTable(QtGui.QTableView):
         # None maps to the special, no outcome/no follow up
         # undo stack
         self.undo_stack_dict = {None:QUndoStack(self)}
-        self.undoStack = QUndoStack(self)
+        # see MetaForm for the memory budget
+        self.undoStack = BudgetedUndoStack(self)
 
         header = self.horizontalHeader()
         self.connect(header, SIGNAL("sectionClicked(int)"), self.header_clicked)
@@ -216,11 +217,11 @@ class MADataTable(QtGui.QTableView):
 
     def include_all_studies(self):
         self.model().include_all_studies()
-        self.model().reset()
+        self.model().all_rows_changed()
 
     def exclude_all_studies(self):
         self.model().exclude_all_studies()
-        self.model().reset()
+        self.model().all_rows_changed()
 
     def keyPressEvent(self, event):                                  
         if (event.modifiers() & QtCore.Qt.ControlModifier):
@@ -289,9 +290,11 @@ class MADataTable(QtGui.QTableView):
         # dispatch on the data type
         form = None
         study_index = row
-        # fix for issue # 183
-        ma_unit = copy.deepcopy(self.model().get_current_ma_unit_for_study(study_index))
-        old_ma_unit = copy.deepcopy(ma_unit)
+        # the form edits the study's unit in place; its state is kept so
+        # that the edit can be undone (or dropped, if the form is
+        # cancelled -- fix for issue # 183)
+        ma_unit = self.model().materialize_current_ma_unit_for_study(study_index)
+        old_ma_unit_state = ma_unit.get_state()
         cur_txs = self.model().current_txs
         cur_effect = self.model().current_effect
         cur_group_str = self.model().get_cur_group_str()
@@ -310,8 +313,10 @@ class MADataTable(QtGui.QTableView):
             form = binary_data_form.BinaryDataForm2(ma_unit, cur_txs, cur_group_str, cur_effect, conf_level=self.model().get_global_conf_level(), parent=self)
             if form.exec_():
                 # push the edit even
-                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, old_ma_unit)
+                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, ma_unit.get_state(), old_ma_unit_state)
                 self.undoStack.push(ma_edit)
+            else:
+                ma_unit.set_state(old_ma_unit_state)
         elif data_type == "continuous":
             cur_raw_data_dict = {}
             for group_name in cur_txs:
@@ -321,8 +326,10 @@ class MADataTable(QtGui.QTableView):
             form = continuous_data_form.ContinuousDataForm(ma_unit, cur_txs, cur_group_str, cur_effect, conf_level=self.model().get_global_conf_level(), parent=self)
             if form.exec_():
                 # update the model; push this event onto the stack
-                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, old_ma_unit)
+                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, ma_unit.get_state(), old_ma_unit_state)
                 self.undoStack.push(ma_edit)
+            else:
+                ma_unit.set_state(old_ma_unit_state)
         else:
             # then this is diagnostic data
             cur_raw_data_dict = {}
@@ -331,10 +338,39 @@ class MADataTable(QtGui.QTableView):
 
             form = diagnostic_data_form.DiagnosticDataForm(ma_unit, cur_txs, cur_group_str, conf_level=self.model().get_global_conf_level(), parent=self)
             if form.exec_():
-                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, old_ma_unit)
+                ma_edit = CommandEditMAUnit(self, study_index, ma_unit, ma_unit.get_state(), old_ma_unit_state)
                 self.undoStack.push(ma_edit)
+            else:
+                ma_unit.set_state(old_ma_unit_state)
         self.vert_header.blockSignals(False)
 
+    def fill_in_imputable_data(self):
+        '''
+        Fills in the blank raw data of every study (for the current outcome,
+        follow-up and groups) that can be back-calculated from the effect
+        and CI the study has -- i.e., what the back-calculate button of the
+        data forms does, for the whole spreadsheet at once -- and tells the
+        user which studies were changed.
+        '''
+        model = self.model()
+        imputed = model.impute_raw_data_for_current_outcome()
+        if len(imputed) == 0:
+            QMessageBox.information(self, "nothing to fill in",
+                    "No raw data could be imputed for %s." % model.current_outcome)
+            return
+
+        self.undoStack.push(CommandImputeRawData(self, imputed))
+
+        study_names = [model.dataset.studies[study_index].name or "(study in row %s)" % (study_index+1) \
+                            for study_index in sorted(imputed.keys())]
+        MAX_NAMES_SHOWN = 20
+        msg = "Filled in raw data for %s %s:\n\n%s" % (len(study_names),
+                    "study" if len(study_names) == 1 else "studies",
+                    "\n".join(study_names[:MAX_NAMES_SHOWN]))
+        if len(study_names) > MAX_NAMES_SHOWN:
+            msg += "\n... and %s more" % (len(study_names) - MAX_NAMES_SHOWN)
+        QMessageBox.information(self, "imputed data", msg)
+
     def rowMoved(self, row, oldIndex, newIndex):
         pass
 
@@ -515,6 +551,7 @@ class MADataTable(QtGui.QTableView):
 
         # temporarily disable sorting to prevent automatic sorting of pasted data.
         # (note: this is consistent with Excel's approach.)
+        row_count_pre_paste = self.model().rowCount()
         self.model().blockSignals(True)
 
         for src_row in range(len(source_content)):
@@ -534,12 +571,36 @@ class MADataTable(QtGui.QTableView):
                     print "whoops, exception while pasting: %s" % e
 
         self.model().blockSignals(False)
-        self.model().reset()
+        if self.model().rowCount() == row_count_pre_paste:
+            self.model().rows_changed(origin_row, origin_row+len(source_content)-1)
+        else:
+            # the view missed the rows (studies) the edits added
+            self.model().reset()
 
     def set_data_in_model(self, index, val):
         self.model().setData(index, val)
         self.model().reset()
 
+    def resize_columns_to_contents(self, columns=None):
+        ''' As resizeColumnsToContents, but only measures the given columns
+        (all of them if columns is None) '''
+        if columns is None:
+            self.resizeColumnsToContents()
+            return
+        for col in columns:
+            self.resizeColumnToContents(col)
+
+    def columns_changed_by_edit(self, col):
+        ''' The columns whose contents an edit of column col can change:
+        editing the raw data (re)computes the outcome, and editing (a bound
+        of) the outcome can change the others '''
+        model = self.model()
+        if col in model.RAW_DATA:
+            return [col] + list(model.OUTCOMES)
+        elif col in model.OUTCOMES:
+            return list(model.OUTCOMES)
+        return [col]
+
     def column_widths(self):
         ''' returns the current column widths '''
         return [self.columnWidth(col_index) for col_index in range(self.model().columnCount())]
@@ -648,26 +709,21 @@ class MADataTable(QtGui.QTableView):
 
         num_to_add = len(content) - num_existing_studies - origin_row
 
-        last_id = -1
+        new_studies = []
+        max_study_id = self.model().dataset.max_study_id()
         for i in range(num_to_add):
-            # first let's give this a default study name, in case
-            # none has been provided
-            tmp_study_name = "study %s" % (num_existing_studies + i)
-            study_index = self.model().createIndex(num_existing_studies + i, self.model().NAME)
-            study_id = self.model().dataset.max_study_id()+1
-            new_study = Study(study_id)
-            self.model().dataset.add_study(new_study)
+            new_studies.append(Study(max_study_id+i+1))
 
         # now append a blank study if studies were added.
         if num_to_add > 0:
-            new_study = Study(self.model().dataset.max_study_id()+1)
+            new_study = Study(max_study_id+num_to_add+1)
             # ah! fix for issue #171. stupidly, I was not previously
             # excluding 'blank' studies appended here..
             new_study.include = False
-            self.model().dataset.add_study(new_study)
+            new_studies.append(new_study)
             self.model().dataset.study_auto_added = int(new_study.id)
 
-        self.model().reset()
+        self.model().append_studies(new_studies)
 
 class CommandCellEdit(QUndoCommand):
     '''
@@ -736,10 +792,15 @@ class CommandCellEdit(QUndoCommand):
 
             model.blockSignals(False)
             # make the view reflect the update
-            self.ma_data_table_view.model().reset()
+            if self.added_study is None:
+                model.rows_changed(self.row)
+            else:
+                # the view missed the study (row) the edit added
+                model.reset()
         
         self.ma_data_table_view._enable_analysis_menus_if_appropriate()
-        self.ma_data_table_view.resizeColumnsToContents()
+        self.ma_data_table_view.resize_columns_to_contents(
+                    self.ma_data_table_view.columns_changed_by_edit(self.col))
 
         # let everyone know that the data is dirty
         self.ma_data_table_view.emit(SIGNAL("dataDirtied()"))
@@ -761,13 +822,14 @@ class CommandCellEdit(QUndoCommand):
         model.setData(index, self.original_content, allow_empty_names=True)
 
         model.blockSignals(False)
-        self.ma_data_table_view.model().reset()
+        model.rows_changed(self.row)
 
             
         # here is where we check if there are enough studies to actually
         # perform an analysis.
         self.ma_data_table_view._enable_analysis_menus_if_appropriate()
-        self.ma_data_table_view.resizeColumnsToContents()
+        self.ma_data_table_view.resize_columns_to_contents(
+                    self.ma_data_table_view.columns_changed_by_edit(self.col))
         self.ma_data_table_view.emit(SIGNAL("dataDirtied()"))
         
     def _get_index(self):
@@ -795,11 +857,22 @@ class CommandPaste(QUndoCommand):
 
         print("CommandPaste created")
     
+    def undo_size(self):
+        return self.dataset_delta.undo_size()
+
+    def release(self):
+        self.dataset_delta = None
+        self.original_state_dict = None
+
     @DebugHelper
     def redo(self):
-        # cache the original dataset
-        self.original_dataset = copy.deepcopy(self.ma_data_table_view.model().dataset)
-        self.original_state_dict = copy.copy(self.ma_data_table_view.model().get_stateful_dict())
+        # record what the paste can change: the studies (rows) pasted
+        # into, and the studies, covariates, etc. of the dataset
+        model = self.ma_data_table_view.model()
+        origin_row = self.upper_left_coord.row()
+        self.dataset_delta = DatasetDelta(model.dataset,
+                touched_studies=model.dataset.studies[origin_row:origin_row+len(self.new_content)])
+        self.original_state_dict = copy.copy(model.get_stateful_dict())
 
         # paste the data
         self.ma_data_table_view._add_studies_if_necessary(self.upper_left_coord, self.new_content)
@@ -831,8 +904,10 @@ class CommandPaste(QUndoCommand):
     def undo(self):
         if self.added_study is not None:
             self.ma_data_table_view.model().remove_study(self.added_study)
-        self.ma_data_table_view.main_gui.set_model(self.original_dataset,
-                                 state_dict=self.original_state_dict)
+        self.dataset_delta.restore()
+        self.ma_data_table_view.model().set_state(self.original_state_dict)
+        self.ma_data_table_view.model().update_column_indices()
+        self.ma_data_table_view.resizeColumnsToContents()
 
 
         # did we change the metric automatically (e.g., because it
@@ -846,11 +921,14 @@ class CommandPaste(QUndoCommand):
         self.ma_data_table_view.emit(SIGNAL("dataDirtied()"))
 
 class CommandEditMAUnit(QUndoCommand):
-    def __init__(self, table_view, study_index, new_ma_unit, old_ma_unit, description="MA unit edit"):
+    ''' Sets the state (see MetaAnalyticUnit.get_state) of the ma_unit of
+    the study at study_index to new_state (or back to old_state) '''
+    def __init__(self, table_view, study_index, ma_unit, new_state, old_state, description="MA unit edit"):
         super(CommandEditMAUnit, self).__init__(description)
         self.model = table_view.model()
-        self.old_ma_unit = old_ma_unit
-        self.new_ma_unit = new_ma_unit
+        self.ma_unit = ma_unit
+        self.old_state = old_state
+        self.new_state = new_state
         self.table_view = table_view
         self.study_index = study_index
         self.ma_data_table_view = table_view
@@ -858,23 +936,74 @@ class CommandEditMAUnit(QUndoCommand):
         # for debugging
         print("CommandEditMAunit created")
     
+    def undo_size(self):
+        return estimate_size((self.old_state, self.new_state), follow_instances=False)
+
+    def release(self):
+        self.old_state = self.new_state = None
+
     @DebugHelper
     def undo(self):
-        self.model.set_current_ma_unit_for_study(self.study_index, self.old_ma_unit)
-        self.model.reset()
-        self.table_view.resizeColumnsToContents()
+        self.ma_unit.set_state(self.old_state)
+        self.model.set_current_ma_unit_for_study(self.study_index, self.ma_unit)
+        self.model.rows_changed(self.study_index)
+        self._resize_columns()
         self.ma_data_table_view.emit(SIGNAL("dataDirtied()"))
 
     @DebugHelper
     def redo(self):
-        self.model.set_current_ma_unit_for_study(self.study_index, self.new_ma_unit)
-        self.model.reset()
-        self.model.try_to_update_outcomes()
-        
-        #self.table_view.model().reset()
-        self.table_view.resizeColumnsToContents()
+        self.ma_unit.set_state(self.new_state)
+        self.model.set_current_ma_unit_for_study(self.study_index, self.ma_unit)
+        # (only this study's outcome can have changed)
+        self.model.update_outcome_if_possible(self.study_index)
+        self.model.rows_changed(self.study_index)
+        self._resize_columns()
         self.ma_data_table_view.emit(SIGNAL("dataDirtied()"))
 
+    def _resize_columns(self):
+        self.table_view.resize_columns_to_contents(
+                    list(self.model.RAW_DATA) + list(self.model.OUTCOMES))
+
+class CommandImputeRawData(QUndoCommand):
+    ''' Sets the raw data imputed by DatasetModel.impute_raw_data_for_current_outcome
+    ({study index:raw data}) and recomputes the effects of the studies changed '''
+    def __init__(self, table_view, imputed_raw_data, description="Fill in imputable data"):
+        super(CommandImputeRawData, self).__init__(description)
+        self.table_view = table_view
+        self.model = table_view.model()
+        self.imputed_raw_data = imputed_raw_data
+        # study index --> (ma_unit, its state before the raw data was set)
+        self.old_ma_unit_states = {}
+
+    def undo_size(self):
+        return estimate_size(self.old_ma_unit_states.values(), follow_instances=False)
+
+    def release(self):
+        self.old_ma_unit_states = {}
+
+    def redo(self):
+        self.old_ma_unit_states = {}
+        for study_index, raw_data in self.imputed_raw_data.items():
+            ma_unit = self.model.materialize_current_ma_unit_for_study(study_index)
+            self.old_ma_unit_states[study_index] = (ma_unit, ma_unit.get_state())
+            self.model.set_cur_raw_data_for_study(study_index, raw_data)
+            self.model.update_outcome_if_possible(study_index)
+        self._rows_changed()
+        self.table_view.emit(SIGNAL("dataDirtied()"))
+
+    def undo(self):
+        for study_index, (ma_unit, old_state) in self.old_ma_unit_states.items():
+            ma_unit.set_state(old_state)
+        self._rows_changed()
+        self.table_view.emit(SIGNAL("dataDirtied()"))
+
+    def _rows_changed(self):
+        study_indices = self.imputed_raw_data.keys()
+        if len(study_indices) > 0:
+            self.model.rows_changed(min(study_indices), max(study_indices))
+        self.table_view.resize_columns_to_contents(
+                    list(self.model.RAW_DATA) + list(self.model.OUTCOMES))
+
 # IS THIS CLASS USED ANYWHERE?
 class CommandEditRawData(QUndoCommand):
     def __init__(self, ma_unit, model, old_raw_data_dict, new_raw_data_dict, description="Raw data edit"):
@@ -912,18 +1041,25 @@ class CommandSort(QUndoCommand):
         self.model = ma_data_table_model
         self.col = col
         self.reverse = reverse_order
-        self.previous_order = None
+        # new position --> previous index of each study; see
+        # DatasetModel.permute_studies
+        self.permutation = None
         
         print("CommandSort created")
 
     def redo(self):
-        self.previous_order = self.model.get_ordered_study_ids()
-        self.model.sort_studies(self.col, self.reverse)
-        self.model.reset()
+        if self.permutation is None:
+            self.permutation = self.model.sort_studies(self.col, self.reverse)
+        else:
+            # nothing has changed since we were undone, so
+            # the studies sort the same way
+            self.model.permute_studies(self.permutation)
 
     def undo(self):
-        self.model.order_studies(self.previous_order)
-        self.model.reset()
+        inverse = [None]*len(self.permutation)
+        for new_index, old_index in enumerate(self.permutation):
+            inverse[old_index] = new_index
+        self.model.permute_studies(inverse)
         
 class StudyDelegate(QItemDelegate):
 
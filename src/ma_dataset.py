@@ -20,6 +20,7 @@
 import pdb
 from PyQt4.QtCore import pyqtRemoveInputHook
 import copy
+import array
 
 import two_way_dict
 import meta_globals
@@ -54,6 +55,17 @@ class Dataset:
         # to each of the covariate objects here.
         self.covariates = []
 
+        # typed columns of covariate values (see get_covariate_column),
+        # built as needed; these are not pickled
+        self._cov_columns = {}
+        self._cov_columns_studies = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_cov_columns", None)
+        state.pop("_cov_columns_studies", None)
+        return state
+
     def copy(self):
         cloned = Dataset(self.title, self.summary)
         cloned.studies = list(self.studies)
@@ -151,6 +163,7 @@ class Dataset:
         for study in self.studies:
             if covariate.name in study.covariate_dict:
                 study.covariate_dict.pop(covariate.name)
+        self._invalidate_covariate_column(covariate.name)
         return cov_index
             
     def add_covariate(self, covariate, cov_values=None, cov_index=None):
@@ -180,6 +193,7 @@ class Dataset:
                     study.covariate_dict[covariate.name] = cov_values[study.name]
                 else:
                     study.covariate_dict[covariate.name] = None
+        self._invalidate_covariate_column(covariate.name)
         
           
     def change_covariate_name(self, old_covariate, new_covariate_name):
@@ -227,6 +241,48 @@ class Dataset:
         
     def get_cov_names(self):
         return [cov.name for cov in self.covariates]
+
+    def set_covariate_value(self, study, cov_name, value):
+        ''' sets the value of covariate cov_name for study (which belongs to
+        this dataset); covariate values should be edited through here, so
+        that the covariate columns are kept up to date '''
+        study.covariate_dict[cov_name] = value
+        self._invalidate_covariate_column(cov_name)
+
+    def get_covariate_column(self, covariate):
+        '''
+        Returns the values of covariate (a Covariate object or name) for
+        all of the studies, in the order of self.studies, as a
+        CovariateColumn. Columns are built once and reused until the values
+        of the covariate or the studies of the dataset change.
+        '''
+        if not isinstance(covariate, Covariate):
+            covariate = self.get_cov_obj_from_name(covariate)
+        columns = getattr(self, "_cov_columns", {})
+        if getattr(self, "_cov_columns_studies", None) != self.studies:
+            # studies were added, removed or reordered
+            columns = {}
+            self._cov_columns_studies = list(self.studies)
+        self._cov_columns = columns
+
+        column = columns.get(covariate.name)
+        if column is None or column.data_type != covariate.data_type:
+            values = [study.covariate_dict.get(covariate.name) for study in self.studies]
+            column = CovariateColumn(covariate, values)
+            columns[covariate.name] = column
+        return column
+
+    def study_ids_to_rows(self):
+        ''' maps the id of each study to its index in self.studies, i.e.,
+        its row in the covariate columns '''
+        return dict([(study.id, row) for row, study in enumerate(self.studies)])
+
+    def _invalidate_covariate_column(self, cov_name=None):
+        ''' drops the column of cov_name, or all of them if it is None '''
+        if cov_name is None:
+            self._cov_columns = {}
+        elif hasattr(self, "_cov_columns"):
+            self._cov_columns.pop(cov_name, None)
         
     def add_outcome(self, outcome):
         cur_group_names = self.get_group_names()
@@ -352,19 +408,71 @@ class Dataset:
         return self.outcome_names_to_follow_ups[outcome].values()
 
     def get_network(self, outcome, time_point):
+        '''
+        Returns the network of the groups (treatments) of the outcome at
+        time_point: the list of nodes (group names), the list of edges --
+        the pairs of groups compared by at least one study, see
+        ma_unit_has_edge_between_groups -- and the weight of each edge, i.e.,
+        the number of studies comparing the pair, as a dictionary keyed by
+        edge. Each edge is listed once, in the order the studies are in.
+        '''
         node_list = [] # list of all nodes
+        node_bits = {} # node --> its bit in the groups with data bitmaps
         adjacency_list = [] # list of edges
+        edge_weights = {} # edge --> number of studies
         for study in self.studies:
-            ma_unit = study.outcomes_to_follow_ups[outcome][time_point]
-            group_names = ma_unit.get_group_names()
-            for g1 in group_names:
-                node_list.append(g1)
-                for g2 in [group for group in group_names if group != g1]:        
-                    if self.ma_unit_has_edge_between_groups(ma_unit, [g1, g2]) and\
-                     not (g1, g2) in adjacency_list and not (g2, g1) in adjacency_list:
-                        adjacency_list.append((g1,g2)) 
+            # studies added since the outcome was don't have a unit for it
+            # until something is entered for them
+            ma_unit = study.outcomes_to_follow_ups.get(outcome, {}).get(time_point)
+            if ma_unit is None:
+                continue
+            for group in ma_unit.get_group_names():
+                if group not in node_bits:
+                    node_bits[group] = 1 << len(node_list)
+                    node_list.append(group)
+
+            for g1, g2 in self.ma_unit_edges(ma_unit, node_bits):
+                edge = (g2, g1) if (g2, g1) in edge_weights else (g1, g2)
+                if edge not in edge_weights:
+                    adjacency_list.append(edge)
+                    edge_weights[edge] = 0
+                edge_weights[edge] += 1
+
+        return (node_list, adjacency_list, edge_weights)
+
+    def ma_unit_edges(self, ma_unit, node_bits):
+        '''
+        Returns the pairs of groups of ma_unit between which it has an edge
+        (see ma_unit_has_edge_between_groups), each pair once. node_bits maps
+        each group name to a distinct bit.
+        '''
+        groups_with_data = self.groups_with_data_bitmap(ma_unit, node_bits)
+        # the group strings ('txA-txB') with an estimate for any effect
+        estimated = set()
+        for group_strs in ma_unit.get_effects_dict().values():
+            for group_str, effect_d in group_strs.items():
+                if effect_d.get("est") is not None:
+                    estimated.add(group_str)
+
+        edges = []
+        group_names = ma_unit.get_group_names()
+        for i, g1 in enumerate(group_names):
+            for g2 in group_names[i+1:]:
+                pair_bits = node_bits[g1] | node_bits[g2]
+                if "-".join((g1, g2)) in estimated or groups_with_data & pair_bits == pair_bits:
+                    edges.append((g1, g2))
+                elif "-".join((g2, g1)) in estimated:
+                    edges.append((g2, g1))
+        return edges
 
-        return (list(set(node_list)), adjacency_list)
+    def groups_with_data_bitmap(self, ma_unit, node_bits):
+        ''' the bits (see get_network) of the groups of ma_unit that have
+        all of their raw data, or'd together '''
+        bitmap = 0
+        for group in ma_unit.get_group_names():
+            if "" not in ma_unit.get_raw_data_for_group(group):
+                bitmap |= node_bits[group]
+        return bitmap
         
     def ma_unit_has_edge_between_groups(self, ma_unit, groups):
         # first check the effects. if *any* effect contains data
@@ -486,6 +594,109 @@ class Dataset:
                                                 reverse)
     
 
+    ##### Key-based sorting #####
+    # cmp_studies (above) digs into the ma_units (and, for outcomes, goes to
+    # R to convert scales) on every comparison. study_sort_values extracts
+    # the value to sort on once per study instead; argsort_studies then
+    # orders them with the same rules as _meta_cmp_wrapper.
+
+    def study_sort_values(self, compare_by="name", reverse=False, directions_to_ma_unit=None, mult=None):
+        '''
+        Returns the value each study (in the order of self.studies) is compared on
+        by the function cmp_studies(compare_by, ...) returns. compare_by is 'name',
+        'year', 'raw_data', 'outcomes' or a covariate name.
+        '''
+        directions_to_ma_unit = directions_to_ma_unit or {}
+        outcome_name = directions_to_ma_unit.get('outcome_name')
+        follow_up = directions_to_ma_unit.get('follow_up')
+        current_groups = directions_to_ma_unit.get('current_groups')
+        data_index = directions_to_ma_unit.get('data_index')
+        current_effect = directions_to_ma_unit.get('current_effect')
+        group_str = directions_to_ma_unit.get('group_str')
+        outcome_type = directions_to_ma_unit.get('outcome_type')
+
+        def ma_unit_for(study):
+            return study.outcomes_to_follow_ups.get(outcome_name, {}).get(follow_up)
+
+        if compare_by == "name":
+            return [study.name for study in self.studies]
+        elif compare_by == "year":
+            return [study.year for study in self.studies]
+        elif compare_by == "raw_data":
+            values = []
+            for study in self.studies:
+                ma_unit = ma_unit_for(study)
+                try:
+                    values.append(ma_unit.get_raw_data_for_groups(current_groups)[data_index])
+                except (AttributeError, KeyError, IndexError):
+                    # no data for this outcome/follow-up/group(s)
+                    values.append("")
+            return values
+        elif compare_by == "outcomes":
+            if mult is None:
+                raise ValueError("mult must be specified")
+
+            effect, ci_index = current_effect, data_index
+            if outcome_type == DIAGNOSTIC:
+                # sens est, lower, upper then spec est, lower, upper; this
+                # is the order displayed on the spreadsheet
+                effect, ci_index = ["Sens","Spec"][data_index // 3], data_index % 3
+
+            calc_values = []
+            for study in self.studies:
+                ma_unit = ma_unit_for(study)
+                if ma_unit is None or group_str not in ma_unit.effects_dict.get(effect, {}):
+                    calc_values.append(None)
+                else:
+                    calc_values.append(ma_unit.get_effect_and_ci(effect, group_str, mult)[ci_index])
+            return self._values_to_display_scale(calc_values, outcome_type, effect)
+        else:
+            # then we assume that we're sorting by a covariate
+            # always want missing values at the 'bottom'
+            missing_val = float("-infinity") if reverse else float("infinity")
+            return [study.covariate_dict.get(compare_by, missing_val) for study in self.studies]
+
+    def _values_to_display_scale(self, calc_values, outcome_type, effect):
+        ''' Converts the non-empty values in calc_values to the display scale
+        in a single call to R '''
+        to_convert = [x for x in calc_values if x not in EMPTY_VALS]
+        if len(to_convert) == 0:
+            return [None for x in calc_values]
+
+        convert_scale = {BINARY:meta_py_r.binary_convert_scale,
+                         CONTINUOUS:meta_py_r.continuous_convert_scale,
+                         DIAGNOSTIC:meta_py_r.diagnostic_convert_scale}[outcome_type]
+        if len(to_convert) == 1:
+            converted = [convert_scale(to_convert[0], effect, convert_to="display.scale")]
+        else:
+            converted = convert_scale(tuple(to_convert), effect, convert_to="display.scale")
+
+        converted = iter(converted)
+        return [None if x in EMPTY_VALS else converted.next() for x in calc_values]
+
+    def argsort_studies(self, values, reverse=False):
+        '''
+        Returns the permutation (new position --> index into self.studies) that sorts
+        the studies by values (see study_sort_values). Empty values always end up at
+        the bottom; studies that both have empty values are ordered by name, as in
+        _meta_cmp_wrapper. The sort is stable.
+        '''
+        sort_keys = [self._meta_sort_key(study.name, value, reverse) \
+                                for study, value in zip(self.studies, values)]
+        return sorted(range(len(sort_keys)), key=sort_keys.__getitem__, reverse=reverse)
+
+    def _meta_sort_key(self, name, value, reverse):
+        # _cmp_wrapper ranks empties above everything when sorting in
+        # ascending order and below everything when reverse is True, so
+        # that either way they land at the bottom. the same goes for empty
+        # names among studies whose values are both empty.
+        empty_rank = 0 if reverse else 1
+        if value in EMPTY_VALS:
+            if name in EMPTY_VALS:
+                return (empty_rank, empty_rank)
+            return (empty_rank, 1-empty_rank, name)
+        return (1-empty_rank, value)
+
     def _both_empty(self, a, b):
         return a in EMPTY_VALS and b in EMPTY_VALS
         
@@ -600,6 +811,33 @@ class Study:
 
         self.outcomes_to_follow_ups[unit.outcome.name][follow_up] = unit
 
+    def get_state(self):
+        '''
+        Returns a copy of the fields of this study and of the data of its
+        ma units (see MetaAnalyticUnit.get_state) that set_state puts back;
+        units added in the meantime are dropped again.
+        '''
+        state = dict(self.__dict__)
+        state["covariate_dict"] = dict(self.covariate_dict)
+        state["outcomes"] = list(self.outcomes)
+        state["outcomes_to_follow_ups"] = dict([(outcome_name, dict(follow_ups)) \
+                        for outcome_name, follow_ups in self.outcomes_to_follow_ups.items()])
+        state["ma_unit_states"] = [(unit, unit.get_state()) for follow_ups in \
+                        self.outcomes_to_follow_ups.values() for unit in follow_ups.values()]
+        return state
+
+    def set_state(self, state):
+        state = dict(state)
+        unit_states = state.pop("ma_unit_states")
+        state["covariate_dict"] = dict(state["covariate_dict"])
+        state["outcomes"] = list(state["outcomes"])
+        state["outcomes_to_follow_ups"] = dict([(outcome_name, dict(follow_ups)) \
+                        for outcome_name, follow_ups in state["outcomes_to_follow_ups"].items()])
+        self.__dict__.clear()
+        self.__dict__.update(state)
+        for unit, unit_state in unit_states:
+            unit.set_state(unit_state)
+
         
 class MetaAnalyticUnit:
     '''
@@ -1020,6 +1258,60 @@ class MetaAnalyticUnit:
         
     def get_group_names(self):
         return self.tx_groups.keys()
+
+    def get_state(self):
+        '''
+        Returns a copy of the data of this unit -- the raw data of its
+        groups and its effects -- that set_state puts back, e.g., to undo
+        an edit. Unlike a deepcopy of the unit, this copies just the values.
+        '''
+        groups = [(group, group.name, list(group.raw_data)) for group in self.tx_groups.values()]
+        return {"groups":groups, "effects_dict":_copy_effects_dict(self.effects_dict)}
+
+    def set_state(self, state):
+        self.tx_groups = {}
+        for group, name, raw_data in state["groups"]:
+            group.name, group.raw_data = name, list(raw_data)
+            self.tx_groups[name] = group
+        self.effects_dict = _copy_effects_dict(state["effects_dict"])
+
+def _copy_effects_dict(effects_dict):
+    # effect --> group string --> {est:..., lower:..., ...}
+    return dict([(effect, dict([(group_str, dict(effect_d)) for group_str, effect_d in group_strs.items()])) \
+                    for effect, group_strs in effects_dict.items()])
+
+class MetaAnalyticUnitView(MetaAnalyticUnit):
+    '''
+    A read-only view of a study's MetaAnalyticUnit with the given groups,
+    for a unit that lacks some of them: the groups (raw data) and effects
+    the unit has are the unit's own, the rest are blank. This way the data
+    a study does have are shown (and analyzed) without the missing groups
+    being added to the study. Nothing written to the view's blank groups or
+    effects is kept.
+    '''
+    def __init__(self, ma_unit, group_names):
+        MetaAnalyticUnit.__init__(self, ma_unit.outcome, group_names=group_names)
+        self.ma_unit = ma_unit
+        for group_name in group_names:
+            if group_name in ma_unit.tx_groups:
+                self.tx_groups[group_name] = ma_unit.tx_groups[group_name]
+        for effect, group_strs in self.effects_dict.items():
+            unit_group_strs = ma_unit.effects_dict.get(effect, {})
+            for group_str in group_strs:
+                if group_str in unit_group_strs:
+                    group_strs[group_str] = unit_group_strs[group_str]
+
+        # what the view was made from; see is_current
+        self._unit_tx_groups = ma_unit.tx_groups
+        self._unit_effects_dict = ma_unit.effects_dict
+        self._unit_group_names = set(ma_unit.tx_groups)
+
+    def is_current(self):
+        ''' False once the unit has changed in a way the view doesn't
+        follow, i.e., its groups were changed or its state was set '''
+        return self.ma_unit.tx_groups is self._unit_tx_groups and \
+               self.ma_unit.effects_dict is self._unit_effects_dict and \
+               set(self.ma_unit.tx_groups) == self._unit_group_names
             
     
 class TreatmentGroup:
@@ -1051,6 +1343,108 @@ class Covariate:
     def get_data_type(self):
         return self.data_type
 
+class CovariateColumn:
+    '''
+    The values of a covariate for the studies of a dataset (see
+    Dataset.get_covariate_column). Values of continuous covariates are
+    held in an array of doubles, with nan where they are missing; values
+    of factors are held as an array of codes into levels (the distinct
+    values, in the order they first appear), with -1 where they are missing.
+    '''
+    MISSING_CODE = -1
+
+    def __init__(self, covariate, values):
+        self.name = covariate.name
+        self.data_type = covariate.data_type
+        self.levels = None
+        if self.data_type == CONTINUOUS:
+            self.values = array.array('d', [_to_float_or_nan(x) for x in values])
+        else:
+            self.levels = []
+            level_codes = {}
+            codes = []
+            for x in values:
+                if x is None:
+                    codes.append(self.MISSING_CODE)
+                    continue
+                level = _to_unicode(x)
+                if level not in level_codes:
+                    level_codes[level] = len(self.levels)
+                    self.levels.append(level)
+                codes.append(level_codes[level])
+            self.values = array.array('l', codes)
+
+    def __len__(self):
+        return len(self.values)
+
+    def is_missing(self, row):
+        if self.data_type == CONTINUOUS:
+            return self.values[row] != self.values[row] # nan
+        return self.values[row] == self.MISSING_CODE
+
+    def get_values(self, rows=None):
+        ''' the values at rows (all rows, by default), with None where they
+        are missing; factor values are the (unicode) levels '''
+        if rows is None:
+            rows = xrange(len(self.values))
+        values = []
+        for row in rows:
+            if row is None or self.is_missing(row):
+                values.append(None)
+            elif self.data_type == CONTINUOUS:
+                values.append(self.values[row])
+            else:
+                values.append(self.levels[self.values[row]])
+        return values
+
+def _to_float_or_nan(x):
+    if x in EMPTY_VALS:
+        return float("nan")
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def _to_unicode(x):
+    if isinstance(x, unicode):
+        return x
+    if isinstance(x, str):
+        return unicode(x, 'latin1')
+    # e.g., QStrings
+    return unicode(x)
+
+class DatasetDelta:
+    '''
+    Records what an in-place edit of dataset can change, before the edit,
+    so that restore can undo it without a copy of the whole dataset having
+    been made: the studies (in order), the covariates, the outcomes and
+    follow-ups, and the state of just the studies the edit touches (see
+    Study.get_state). Studies the edit adds are dropped by restore, and
+    studies it removes are put back.
+    '''
+    def __init__(self, dataset, touched_studies=None):
+        self.dataset = dataset
+        self.studies = list(dataset.studies)
+        self.covariates = list(dataset.covariates)
+        self.outcome_names_to_follow_ups = copy.deepcopy(dataset.outcome_names_to_follow_ups)
+        self.study_auto_added = getattr(dataset, "study_auto_added", None)
+        self.study_states = [(study, study.get_state()) for study in (touched_studies or [])]
+
+    def undo_size(self):
+        ''' the memory (in bytes) taken up by what was recorded '''
+        return meta_globals.estimate_size([self.studies, self.covariates,
+                    self.outcome_names_to_follow_ups, self.study_states], follow_instances=False)
+
+    def restore(self):
+        for study, state in self.study_states:
+            study.set_state(state)
+        self.dataset.studies[:] = self.studies
+        self.dataset.covariates[:] = self.covariates
+        self.dataset.outcome_names_to_follow_ups = copy.deepcopy(self.outcome_names_to_follow_ups)
+        self.dataset.study_auto_added = self.study_auto_added
+        # the covariate values of the studies may have changed
+        self.dataset._invalidate_covariate_column()
+
 class Link:
     pass
     
@@ -184,6 +184,10 @@ class MA_Specs(QDialog, forms.ui_ma_specs.Ui_Dialog):
         # this method is defined statically, below
         add_plot_params(self)
 
+        # independent fits (e.g., of subgroups) are run over this many
+        # processes on the R side
+        meta_py_r.set_n_cores(get_setting("r_processes"))
+
         # also add the metric to the parameters
         # -- this is for scaling
 
@@ -745,6 +749,8 @@ def add_plot_params(specs_form):
         specs_form.current_param_vals["fp_xticks"] = xticks
     
     specs_form.current_param_vals["fp_show_summary_line"] = specs_form.show_summary_line.isChecked()
+    # R only computes the layout of the plot; it's drawn by forest_plot_renderer
+    specs_form.current_param_vals["fp_layout_only"] = NATIVE_FOREST_PLOTS
 
 
 def _writeout_test_data(meta_f_str, method, params, results, diag=False):
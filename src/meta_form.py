@@ -120,6 +120,7 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         
         load_settings()
         self.populate_open_recent_menu()
+        self.tableView.undoStack.set_memory_budget(get_undo_memory_budget())
         
         # The most important code of the entire application
         show_tom = QAction(self)
@@ -180,11 +181,14 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         data_model = ma_dataset.Dataset(title=name, is_diag=is_diag)
         if self.model is not None:
             if use_undo_framework:
-                original_dataset = copy.deepcopy(self.model.dataset)
+                # set_model swaps in data_model, leaving the current dataset
+                # as it is, so undo can just swap it back
+                original_dataset = self.model.dataset
                 old_state_dict = self.tableView.model().get_stateful_dict()
                 undo_f = lambda : self.set_model(original_dataset, old_state_dict) 
                 redo_f = lambda : self.set_model(data_model)
-                edit_command = meta_globals.CommandGenericDo(redo_f, undo_f)
+                edit_command = meta_globals.CommandGenericDo(redo_f, undo_f,
+                                    size=meta_globals.estimate_size(original_dataset))
                 self.tableView.undoStack.push(edit_command)
             else: # not using undo framework (probably when importing csv (it will handle it internally)
                 self.set_model(data_model)
@@ -207,6 +211,7 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         self.action_cum_ma.setEnabled(enable)
         self.action_loo_ma.setEnabled(enable)
         self.action_meta_regression.setEnabled(enable)
+        self.action_impute_all.setEnabled(enable)
         self._enable_action_subgroup_ma()
         
     def _enable_action_subgroup_ma(self):
@@ -256,6 +261,8 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         
         QObject.disconnect(self.tableView.model(), SIGNAL("modelAboutToBeReset()"),
                            self._model_about_to_be_reset)
+        QObject.disconnect(self.tableView.model(), SIGNAL("displayedDataAboutToChange()"),
+                           self._model_about_to_be_reset)
 
 
     def data_error(self, msg):
@@ -322,6 +329,7 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         # Do actions when the model is about to be reset (for now, just
         # recalculate display scale values)
         QObject.connect(self.tableView.model(), SIGNAL("modelAboutToBeReset()"), self._model_about_to_be_reset)
+        QObject.connect(self.tableView.model(), SIGNAL("displayedDataAboutToChange()"), self._model_about_to_be_reset)
            
         ###
         # this listens to the model regarding errors in data entry -- 
@@ -356,6 +364,7 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
             QObject.connect(self.action_edit, SIGNAL("triggered()"), self.edit_dataset)
             QObject.connect(self.action_view_network, SIGNAL("triggered()"), self.view_network)
             QObject.connect(self.action_add_covariate, SIGNAL("triggered()"), self.add_covariate)
+            QObject.connect(self.action_impute_all, SIGNAL("triggered()"), self.tableView.fill_in_imputable_data)
             
             QObject.connect(self.action_meta_regression, SIGNAL("triggered()"), self.meta_reg)
             QObject.connect(self.action_subgroup_ma, SIGNAL("triggered()"), self.meta_subgroup_get_cov)
@@ -513,9 +522,11 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
             modified_dataset = edit_window.dataset
             
             redo_f = lambda : self.set_model(modified_dataset, new_state_dict)
-            original_dataset = copy.deepcopy(self.model.dataset)
+            # the dialog edited a copy, so the current dataset is unchanged
+            original_dataset = self.model.dataset
             undo_f = lambda : self.set_model(original_dataset, old_state_dict) 
-            edit_command = meta_globals.CommandGenericDo(redo_f, undo_f)
+            edit_command = meta_globals.CommandGenericDo(redo_f, undo_f,
+                                size=meta_globals.estimate_size(original_dataset))
             self.tableView.undoStack.push(edit_command)
             
     
@@ -876,9 +887,10 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
 
     def display_groups(self, groups):
         print "displaying groups: %s" % groups
+        column_layout = self.model.column_layout()
         self.model.set_current_groups(groups)
         self.model.try_to_update_outcomes()
-        self.model.reset()
+        self.model.displayed_data_changed(column_layout)
         self.tableView.resizeColumnsToContents()
         
     def display_outcome(self, outcome_name, group_names=None, follow_up_name=None):
@@ -887,6 +899,7 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         # We need to update which groups & follow-ups are current
         # in order to avoid attempting to display a group/fu that
         # do not belong to the outcome_name. 
+        column_layout = self.model.column_layout()
         self.model.set_current_outcome(outcome_name)
         self.populate_metrics_menu()
         
@@ -919,14 +932,15 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
             
         self.cur_outcome_lbl.setText(u"<font color='Blue'>%s</font>" % outcome_name)
         self.cur_time_lbl.setText(u"<font color='Blue'>%s</font>" % self.model.get_current_follow_up_name())
-        self.model.reset()
+        self.model.displayed_data_changed(column_layout)
         self.tableView.resizeColumnsToContents()
 
     def display_follow_up(self, time_point):
         print "follow up"
+        column_layout = self.model.column_layout()
         self.model.current_time_point = time_point
         self.update_follow_up_label()
-        self.model.reset()
+        self.model.displayed_data_changed(column_layout)
         self.tableView.resizeColumnsToContents()
         
     def update_follow_up_label(self):
@@ -1036,9 +1050,11 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
             new_state_dict = copy.deepcopy(old_state_dict)
 
             redo_f = lambda : self.set_model(modified_dataset, new_state_dict)
-            original_dataset = copy.deepcopy(self.model.dataset)
+            # the form changed a copy, so the current dataset is unchanged
+            original_dataset = self.model.dataset
             undo_f = lambda : self.set_model(original_dataset, old_state_dict) 
-            edit_command = meta_globals.CommandGenericDo(redo_f, undo_f)
+            edit_command = meta_globals.CommandGenericDo(redo_f, undo_f,
+                                size=meta_globals.estimate_size(original_dataset))
             self.tableView.undoStack.push(edit_command)
             
 
@@ -1169,7 +1185,9 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
             self.populate_metrics_menu(\
                 metric_to_check=self.tableView.model().current_effect)
 
-        self.model.reset()
+        # the update_current_* calls above reset the model; the outcomes
+        # may have been updated since
+        self.model.all_rows_changed()
         self._change_conf_level_label()
         
         
@@ -1298,13 +1316,14 @@ class MetaForm(QtGui.QMainWindow, ui_meta.Ui_MainWindow):
         elif path == "csv_import":
             csv_data = wizard_data['csv_data']
         
-            # Back-up original dataset
-            original_dataset = copy.deepcopy(self.model.dataset)
+            # Back-up original dataset; setting up the spreadsheet swaps
+            # in a new one, so this one is left as it is
+            original_dataset = self.model.dataset
             old_state_dict = self.tableView.model().get_stateful_dict()
             
             self._make_new_dataset_and_setup_spreadsheet(dataset_info)
             
-            new_dataset = copy.deepcopy(self.model.dataset)
+            new_dataset = self.model.dataset
             new_state_dict = self.tableView.model().get_stateful_dict()
             
             imported_data = csv_data['data']
@@ -1351,13 +1370,21 @@ class CommandImportCSV(QUndoCommand):
         self.new_state_dict = new_state_dict
         
         self.new_dataset_has_imported_data = False
+
+    def undo_size(self):
+        return meta_globals.estimate_size(self.original_dataset)
+
+    def release(self):
+        self.original_dataset = self.old_state_dict = None
         
     def redo(self):
         if self.new_dataset_has_imported_data: #already imported once before, this is a real 'redo'
             self.main_form.set_model(self.new_dataset, self.new_state_dict)
         else: # this a first run
             self._import_data_into_new_dataset()
-            self.new_dataset = copy.deepcopy(self.main_form.model.dataset)
+            # the data was imported into (and is kept in) self.new_dataset;
+            # undo swaps in the original dataset rather than changing it back
+            self.new_dataset = self.main_form.model.dataset
             self.new_state_dict = self.main_form.tableView.model().get_stateful_dict()
             self.new_dataset_has_imported_data = True
         
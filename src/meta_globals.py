@@ -13,6 +13,7 @@
 # TODO: move functions out of here and just have this be constants w/o imports
 
 import os
+import sys
 
 from PyQt4 import QtCore, QtGui
 from PyQt4.Qt import *
@@ -148,6 +149,10 @@ DIAG_FIELDS_TO_RAW_INDICES = {"TP":0, "FN":1, "FP":2, "TN":3}
 # list of methods with no forest plot parameters
 METHODS_WITH_NO_FOREST_PLOT = ["diagnostic.hsroc", "diagnostic.bivariate.ml"]
 
+# if True, (simple) forest plots are drawn on the python side from a layout
+# computed in R (see forest_plot_renderer.py) rather than rendered to png by R
+NATIVE_FOREST_PLOTS = True
+
 # this is the maximum size of a residual that we're willing to accept
 # when computing 2x2 data
 THRESHOLD = 1e-5
@@ -221,16 +226,143 @@ class CommandGenericDo(QUndoCommand):
    This is a generic undo/redo command that takes two unevaluated lambdas --
    thunks, if you will -- one for doing and one for undoing.
     '''
-    def __init__(self, redo_f, undo_f, description=""):
+    def __init__(self, redo_f, undo_f, description="", size=0):
         super(CommandGenericDo, self).__init__(description)
         self.redo_f = redo_f
         self.undo_f = undo_f
+        # the (approximate) memory, in bytes, held on to for undoing; see
+        # BudgetedUndoStack
+        self.size = size
         
     def redo(self):
         self.redo_f()
         
     def undo(self):
         self.undo_f()
+
+    def undo_size(self):
+        return self.size
+
+    def release(self):
+        # the thunks hold on to whatever they undo to
+        self.redo_f = self.undo_f = None
+        self.size = 0
+
+class BudgetedUndoStack(QObject):
+    '''
+    An undo stack (used like a QUndoStack: push() does a command, undo()
+    and redo() step back and forth through the commands) that bounds the
+    memory the commands on it hold on to for undoing. Commands report this
+    through an undo_size() method (commands without one count as 0 bytes);
+    once the commands that can be undone together hold more than the
+    budget, the oldest of them are released (via their release() method,
+    which drops what they kept for undoing) and taken off the stack.
+
+    (This isn't a QUndoStack because a QUndoStack can't drop its oldest
+    commands: setUndoLimit can only be set while the stack is empty, and
+    limits the number of commands rather than their size. Nor can a
+    subclass keep Qt from undoing a released command, as QUndoStack's
+    undo() and canUndo() aren't virtual.)
+    '''
+    def __init__(self, parent=None, memory_budget=None):
+        super(BudgetedUndoStack, self).__init__(parent)
+        # None means no budget
+        self.memory_budget = memory_budget
+        self.commands = []
+        # the commands before this index have been done (and can be undone)
+        self._index = 0
+
+    def set_memory_budget(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._enforce_budget()
+
+    def push(self, command):
+        # pushing discards the commands that were undone
+        del self.commands[self._index:]
+        command.redo()
+        self.commands.append(command)
+        self._index = len(self.commands)
+        self._enforce_budget()
+
+    def undo(self):
+        if self.canUndo():
+            self._index -= 1
+            self.commands[self._index].undo()
+
+    def redo(self):
+        if self.canRedo():
+            self.commands[self._index].redo()
+            self._index += 1
+
+    def canUndo(self):
+        return self._index > 0
+
+    def canRedo(self):
+        return self._index < len(self.commands)
+
+    def index(self):
+        return self._index
+
+    def count(self):
+        return len(self.commands)
+
+    def command(self, index):
+        return self.commands[index]
+
+    def clear(self):
+        self.commands = []
+        self._index = 0
+
+    def undo_size(self):
+        ''' the memory held by the commands that can still be undone '''
+        return sum([_undo_size(command) for command in self.commands[:self._index]])
+
+    def _enforce_budget(self):
+        if self.memory_budget is None:
+            return
+        total = self.undo_size()
+        num_released = 0
+        for command in self.commands[:self._index]:
+            if total <= self.memory_budget:
+                break
+            total -= _undo_size(command)
+            if hasattr(command, "release"):
+                command.release()
+            num_released += 1
+        del self.commands[:num_released]
+        self._index -= num_released
+
+def _undo_size(command):
+    if hasattr(command, "undo_size"):
+        return command.undo_size()
+    return 0
+
+def estimate_size(obj, follow_instances=True):
+    '''
+    Estimates the memory, in bytes, taken up by obj and the objects it
+    refers to (through containers and, if follow_instances is True, the
+    __dict__s of instances), counting each object once.
+    '''
+    seen = set()
+    to_visit = [obj]
+    size = 0
+    while to_visit:
+        x = to_visit.pop()
+        if id(x) in seen or x is None or isinstance(x, (type, QObject)):
+            continue
+        seen.add(id(x))
+        try:
+            size += sys.getsizeof(x)
+        except TypeError:
+            continue
+        if isinstance(x, dict):
+            to_visit.extend(x.keys())
+            to_visit.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            to_visit.extend(x)
+        elif follow_instances and hasattr(x, "__dict__"):
+            to_visit.append(x.__dict__)
+    return size
         
 
 def matrix_as_table(matrix, col_width=None, spacing=2):
@@ -12,78 +12,161 @@
 #                                                                           #
 #############################################################################
 
-print("Entering meta_py_r for import probably")
 import math
 import os
+from collections import OrderedDict
+import thread
+import threading
+import time
 from meta_globals import *
 from settings import *
 
-print("the path: %s" % os.getenv("PATH"))
-
 try:
-    print("importing from rpy2")
     # will fail if not properly configured
     # good place to debug when trying to get the mac build to work
     #from rpy2 import robjects as ro
     import rpy2.robjects as ro
-    print("succesfully imported from rpy2")
 except Exception, e:
     print e
     print("rpy2 import problem")
     #pyqtRemoveInputHook()
     #pdb.set_trace()
     raise Exception("rpy2 not properly installed!")
-    print e
-print("importing rpy2.robjects")
 import rpy2.robjects
-print("succesfully imported rpy2.robjects")
+import rpy2.rlike.container as rlc
 
 def execute_r_string(r_str):
-    
-    try:
-        print("Executing: %s\n" % r_str)
-        return ro.r(r_str)
-    except Exception as e:
-        # reset working directory in r then raise the error, hope this will address issue #244
-        print("something bad happened in R")
-        reset_Rs_working_dir()
-        raise e
+    wait_for_R_libs()
+    with _R_call_lock:
+        try:
+            print("Executing: %s\n" % r_str)
+            return ro.r(r_str)
+        except Exception as e:
+            # reset working directory in r then raise the error, hope this will address issue #244
+            print("something bad happened in R")
+            reset_Rs_working_dir()
+            raise e
 
 #################### R Library Loader ####################
+# The packages that nearly every analysis needs. These are loaded in the
+# background at start-up (see launch.py) so that the main form can be shown
+# right away; everything else is loaded the first time it is needed
+# (see ensure_R_libs)
+CORE_R_LIBS = ("metafor", "openmetar", "grid")
+
+# R packages that only some methods need; loaded on first use
+R_LIBS_FOR_METHOD = {"diagnostic.hsroc":("HSROC",)}
+
+_loaded_R_libs = set()
+_R_lib_lock = threading.RLock()
+
+# cleared while the core libraries are being loaded in the background;
+# R calls made from any other thread wait on it
+_core_R_libs_ready = threading.Event()
+_core_R_libs_ready.set()
+_core_R_libs_loader_ident = None
+_core_R_libs_error = None
+
+# R is single threaded, but it is called from worker threads too (e.g.,
+# the data forms' deferred recomputations; see
+# calculator_routines.DeferredComputation). Everything that talks to R
+# holds this while it does, so that a sequence of calls sharing R's
+# global environment (see generic_convert_scale) isn't interleaved with
+# another thread's
+_R_call_lock = threading.RLock()
+
+def begin_loading_core_R_libs():
+    ''' Call (from the GUI thread) right before the background loader is
+    started, so that R calls made in the meantime wait for it '''
+    global _core_R_libs_error
+    _core_R_libs_error = None
+    _core_R_libs_ready.clear()
+
+def set_core_R_libs_loader_thread():
+    ''' Called from the loader thread itself; that thread may talk to R
+    while the others wait '''
+    global _core_R_libs_loader_ident
+    _core_R_libs_loader_ident = thread.get_ident()
+
+def finished_loading_core_R_libs(error=None):
+    global _core_R_libs_error, _core_R_libs_loader_ident
+    _core_R_libs_error = error
+    _core_R_libs_loader_ident = None
+    _core_R_libs_ready.set()
+
+def wait_for_R_libs():
+    ''' Blocks until the core R libraries are loaded (a no-op once they
+    are, or if called from the loader thread) '''
+    if _core_R_libs_ready.isSet():
+        pass
+    elif thread.get_ident() == _core_R_libs_loader_ident:
+        return
+    else:
+        print("waiting for the R libraries to finish loading")
+        _core_R_libs_ready.wait()
+
+    if _core_R_libs_error is not None:
+        raise Exception(_core_R_libs_error)
+
+def ensure_R_libs(*names):
+    ''' Loads the given R packages unless they are already loaded '''
+    wait_for_R_libs()
+    rloader = RlibLoader()
+    for name in names:
+        rloader.load(name)
+
+def ensure_R_libs_for_methods(method_names):
+    for method_name in method_names:
+        ensure_R_libs(*R_LIBS_FOR_METHOD.get(method_name, ()))
+
 class RlibLoader:
     def __init__(self):
-        print("R Libary loader (RlibLoader) initialized...")
+        # seconds it took to load each library, for the startup report
+        self.load_times = {}
     def load_metafor(self):
-        return self._load_r_lib("metafor")
+        return self.load("metafor")
     def load_openmetar(self):
-        return self._load_r_lib("openmetar")
+        return self.load("openmetar")
     def load_igraph(self):
-        return self._load_r_lib("igraph")
+        return self.load("igraph")
     def load_grid(self):
-        return self._load_r_lib("grid")
+        return self.load("grid")
     def load_gemtc(self):
-        return self._load_r_lib("gemtc")
+        return self.load("gemtc")
+    def load_hsroc(self):
+        return self.load("HSROC")
+    def load_core(self):
+        for name in CORE_R_LIBS:
+            self.load(name)
     def load_all(self):
-        self.load_metafor()
-        self.load_openmetar()
+        self.load_core()
         self.load_igraph()
-        self.load_grid()
         self.load_gemtc()
-    def _load_r_lib(self, name):
-        try:
-            execute_r_string("library(%s)" % name)
-            msg = "%s package successfully loaded" % name
-            print(msg)
-            return (True, msg)
-        except:
-            raise Exception("The %s R package is not installed.\nPlease \
+        self.load_hsroc()
+    def load(self, name):
+        with _R_lib_lock:
+            if name in _loaded_R_libs:
+                return (True, "%s package already loaded" % name)
+            start_time = time.time()
+            try:
+                # not execute_r_string: this runs on the loader thread
+                ro.r("library(%s)" % name)
+            except:
+                raise Exception("The %s R package is not installed.\nPlease \
 install this package and then re-start OpenMeta." % name)
+            self.load_times[name] = time.time() - start_time
+            _loaded_R_libs.add(name)
+        msg = "%s package successfully loaded" % name
+        print(msg)
+        return (True, msg)
 #################### END OF R Library Loader ####################
 
 def RfunctionCaller(function):
     def _RfunctionCaller(*args, **kw):
         print("Using rpy2 interface to R to call %s" % function.func_name)
-        res = function(*args, **kw)
+        wait_for_R_libs()
+        with _R_call_lock:
+            res = function(*args, **kw)
         return res
     return _RfunctionCaller
 
@@ -355,7 +438,99 @@ def impute_pre_post_cont_data(cont_data_dict, correlation, alpha):
     
     return pythonized_data
 
+##################### BATCH IMPUTATION #########################################
+# The functions above impute the data of one study (as entered in one of
+# the calculator forms) per call to R. These take a list of rows, one per
+# study, and impute all of them in a single call; see
+# DatasetModel.impute_raw_data_for_current_outcome.
+
+BIN_IMPUTE_COLS = ["estimate", "lower", "upper", "N_A", "N_B", "conf.level"]
+CONT_IMPUTE_COLS = ["n1", "mean1", "sd1", "n2", "mean2", "sd2",
+                    "est", "low", "high", "met.param", "conf.level"]
+DIAG_IMPUTE_COLS = ["total", "prev", "sens", "sens.lb", "sens.ub",
+                    "spec", "spec.lb", "spec.ub", "conf.level"]
+
+def _rows_to_r_data_frame(rows, float_cols, str_cols=None):
+    ''' rows is a list of dictionaries; missing values (or None) become NAs '''
+    df_cols = rlc.OrdDict()
+    for col in str_cols or []:
+        df_cols[col] = ro.StrVector([str(row.get(col, "")) for row in rows])
+    for col in float_cols:
+        df_cols[col] = ro.FloatVector([_float_or_NA(row.get(col)) for row in rows])
+    return ro.DataFrame(df_cols)
+
+@RfunctionCaller
+def impute_bin_data_batch(rows):
+    '''
+    Back-calculates the 2x2 tables of many studies at once. Each row holds
+    the fields impute_bin_data takes (metric, estimate, lower and upper on
+    the display scale, N_A, N_B and conf.level). Returns a list with, for
+    each row, a dictionary of the counts of both solutions: a1, c1 and a2,
+    c2 (None where there is no such solution; see gimpute.bin.data.batch).
+    '''
+    if len(rows) == 0:
+        return []
+    dataf = _rows_to_r_data_frame(rows, BIN_IMPUTE_COLS, str_cols=["metric"])
+    return _r_data_frame_to_rows(ro.r['gimpute.bin.data.batch'](dataf))
+
+@RfunctionCaller
+def back_calc_cont_data_batch(rows):
+    '''
+    As back_calc_cont_data for many studies at once; each row holds n1,
+    mean1, sd1, n2, mean2, sd2, est, low, high, metric, met.param and
+    conf.level. Returns a list of dictionaries with the (possibly imputed)
+    n1, mean1, sd1, n2, mean2 and sd2; values that could not be imputed, or
+    that have more than one solution, are None.
+    '''
+    if len(rows) == 0:
+        return []
+    dataf = _rows_to_r_data_frame(rows, CONT_IMPUTE_COLS, str_cols=["metric"])
+    return _r_data_frame_to_rows(ro.r['gimpute.cont.data.batch'](dataf))
+
+@RfunctionCaller
+def impute_diag_data_batch(rows):
+    '''
+    As impute_diag_data for many studies at once; each row holds any of
+    total, prev, sens, sens.lb, sens.ub, spec, spec.lb, spec.ub (on the
+    display scale) and conf.level. Returns a list of dictionaries with TP,
+    FN, TN and FP (None where these could not be imputed).
+    '''
+    if len(rows) == 0:
+        return []
+    dataf = _rows_to_r_data_frame(rows, DIAG_IMPUTE_COLS)
+    return _r_data_frame_to_rows(ro.r['gimpute.diagnostic.data.batch'](dataf))
+
 ##################### DEALING WITH CONFIDENCE LEVEL IN R #######################
+# the confidence level set while the core R libraries were still loading;
+# it is handed to R once they are in (see apply_pending_R_settings)
+_pending_R_conf_level = None
+
+def set_R_conf_level(confidence_level):
+    ''' Sets the global confidence level in R. If the core libraries are
+    still being loaded this doesn't wait for them; the level is set once
+    they are in (see apply_pending_R_settings) '''
+    global _pending_R_conf_level
+    if _core_R_libs_ready.isSet() and _core_R_libs_error is None:
+        _pending_R_conf_level = None
+        _set_global_conf_level(confidence_level)
+    else:
+        _pending_R_conf_level = confidence_level
+
+def apply_pending_R_settings():
+    ''' Called (from the GUI thread) once the core R libraries have been
+    loaded in the background '''
+    global _pending_R_conf_level
+    if _pending_R_conf_level is not None:
+        confidence_level, _pending_R_conf_level = _pending_R_conf_level, None
+        _set_global_conf_level(confidence_level)
+
+@RfunctionCaller
+def _set_global_conf_level(confidence_level):
+    r_str = "set.global.conf.level(%s)" % str(float(confidence_level))
+    new_cl_in_R = execute_r_string(r_str)[0]
+    print("Set confidence level in R to: %f" % new_cl_in_R)
+    return new_cl_in_R
+
 @RfunctionCaller
 def get_mult_from_r(confidence_level):
     alpha = 1-float(confidence_level)/100.0
@@ -500,6 +675,7 @@ def draw_network(edge_list, unconnected_vertices, network_path = '"./r_tmp/netwo
     implementing a method on the R side that takes a graph/
     edge list. We may want to change this eventually.
     '''
+    ensure_R_libs("igraph")
     if len(edge_list) > 0:
         edge_str = ", ".join([" '%s' " % x for x in edge_list])
         execute_r_string("el <- matrix(c(%s), nc=2, byrow=TRUE)" % edge_str)
@@ -537,9 +713,8 @@ def ma_dataset_to_simple_continuous_robj(table_model, var_name="tmp_obj",
     ests_str = ", ".join(_to_strs(ests))
     SEs_str = ", ".join(_to_strs(SEs))
     
-    cov_str = list_of_cov_value_objects_str(table_model.dataset,
-                                            study_ids,
-                                            cov_list=covs_to_include,)
+    cov_str = covariates_to_R(table_model.dataset, study_ids,
+                              cov_list=covs_to_include)
 
 
     # first try and construct an object with raw data -- note that if
@@ -624,8 +799,8 @@ def ma_dataset_to_simple_binary_robj(table_model, var_name="tmp_obj",
 
             
     # generate the covariate string
-    cov_str = list_of_cov_value_objects_str(table_model.dataset, study_ids,
-                                            cov_list=covs_to_include)
+    cov_str = covariates_to_R(table_model.dataset, study_ids,
+                              cov_list=covs_to_include)
     
 
     # first try and construct an object with raw data
@@ -687,29 +862,50 @@ def ma_dataset_to_simple_binary_robj(table_model, var_name="tmp_obj",
     print "ok."
     return r_str
 
-def ma_dataset_to_simple_network(table_model,
-                                 var_name="tmp_obj",
-                                 studies=None,
-                                 data_type=None,
-                                 outcome=None,
-                                 follow_up=None,
-                                 network_path='./r_tmp/network.png'):
-    ''' This converts a DatasetModel to an mtc.network R object as described
-    in the getmc documentation for mtc.network'''
-    
+# mtc.network objects built by ma_dataset_to_network_robj, keyed by (dataset,
+# data type, outcome, follow-up, revision of the model's data); only those
+# of the latest revision are kept. Revisions are unique across models (see
+# ma_data_table_model._data_revisions), so a network is never handed to a
+# model other than the one it was built for
+_network_cache = {}
+
+@RfunctionCaller
+def ma_dataset_to_network_robj(table_model, data_type, outcome, follow_up,
+                               var_name="network", studies=None):
+    '''
+    Builds the gemtc mtc.network object for the outcome at follow_up and
+    assigns it to var_name on the R side. The treatments and the arm level
+    data are handed to R as typed columns of data frames. The network of all
+    of the studies is cached per (outcome, follow-up, table_model.data_revision),
+    so switching between outcomes (and analyzing the network) reuses it.
+    '''
     if data_type not in [BINARY, CONTINUOUS]:
         raise ValueError("Given data type: '%s' is unknown." % str(data_type))
     
+    ensure_R_libs("gemtc")
+    
+    cache_key = None
     if studies is None:
+        cache_key = (id(table_model.dataset), data_type, outcome, follow_up,
+                     table_model.data_revision)
+        if cache_key in _network_cache:
+            ro.globalenv[var_name] = _network_cache[cache_key]
+            return
         # we will exclude studies later on if they do not have full raw_data
         studies = table_model.get_studies(only_if_included=False)
+
+    # studies added since the outcome was have no unit for it yet
+    ma_units = [(study, study.outcomes_to_follow_ups.get(outcome, {}).get(follow_up)) \
+                    for study in studies]
+    ma_units = [(study, ma_unit) for study, ma_unit in ma_units if ma_unit is not None]
     
     #### Makes sure each group has at least one study with full raw data ####
     group_names = table_model.dataset.get_group_names_for_outcome_fu(outcome, follow_up)
     groups_to_include = []
     for group in group_names:
-        for study in studies:
-            ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
+        for study, ma_unit in ma_units:
+            if group not in ma_unit.tx_groups:
+                continue
             raw_data = ma_unit.get_raw_data_for_group(group)
             if not _data_blank_or_none(*raw_data):
                 groups_to_include.append(group)
@@ -720,52 +916,61 @@ def ma_dataset_to_simple_network(table_model,
     ############ Make 'treatments' data frame in R ###################
     
     # different id scheme in future? instead of just numbers?
-    ids, descriptions = list(range(len(groups_to_include))), groups_to_include
-    treatments = {'id': [x.replace(' ','_') for x in descriptions],   #ids, ""
-                  'description': descriptions}
-    treatments_table_str = _make_table_string_from_dict(treatments)
-    treatments_r_str = "treatments <- read.table(textConnection('%s'), header=TRUE)" % treatments_table_str
-    #execute_r_string(treatments_r_str)
-    execute_r_string(treatments_r_str)
-    
-    # Make 'data' data_frame in R
+    descriptions = [_sanitize_for_R(unicode(group)) for group in groups_to_include]
+    treatment_ids = [x.replace(' ','_') for x in descriptions]
+    treatments = rlc.OrdDict([("id", ro.StrVector(treatment_ids)),
+                              ("description", ro.StrVector(descriptions))])
+    
+    ############ Make 'data' data frame in R (one row per arm) #########
     if data_type == BINARY:
-        data = {'study':[], 'treatment':[], 'responders':[], 'sampleSize':[]}
+        raw_data_cols = ['responders', 'sampleSize']
     elif data_type == CONTINUOUS:
-        data = {'study':[], 'treatment':[], 'mean':[], 'std.dev':[], 'sampleSize':[]}
+        raw_data_cols = ['sampleSize', 'mean', 'std.dev']
+    data = dict([(col, []) for col in ['study', 'treatment'] + raw_data_cols])
 
-    for study in studies:
-        #ma_unit = table_model.get_current_ma_unit_for_study(table_model.dataset.studies.index(study))
-        #ma_unit = table_model.get_ma_unit(study=study, outcome=outcome, follow_up=follow_up):
-        ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
-        
-        for treatment_id, group_name in zip(treatments['id'], treatments['description']):
+    for study, ma_unit in ma_units:
+        for treatment_id, group_name in zip(treatment_ids, groups_to_include):
+            if group_name not in ma_unit.tx_groups:
+                continue
             raw_data = ma_unit.get_raw_data_for_group(group_name)
-            if data_type == BINARY:
-                responders, sampleSize = raw_data
-                data['responders'].append(responders)
-                data['sampleSize'].append(sampleSize)
-            elif data_type == CONTINUOUS:
-                sampleSize, mean, std_dev = raw_data
-                data['mean'].append(mean)
-                data['std_dev'].append(std_dev)
-                data['sampleSize'].append(sampleSize)
             if _data_blank_or_none(*raw_data): # make sure raw data is full
                 continue
             data['study'].append(study.id)
             data['treatment'].append(treatment_id)
-    data_table_str = _make_table_string_from_dict(data)
-    data_table_r_str = "data <- read.table(textConnection('%s'), header=TRUE)" % data_table_str
-    execute_r_string(data_table_r_str)
+            for col, x in zip(raw_data_cols, raw_data):
+                data[col].append(x)
+
+    data_cols = rlc.OrdDict([("study", ro.IntVector(data['study'])),
+                             ("treatment", ro.StrVector(data['treatment']))])
+    for col in raw_data_cols:
+        data_cols[col] = ro.FloatVector([_float_or_NA(x) for x in data[col]])
     
     ########## make the actual network ##########
-    make_network_r_str = "network <- mtc.network(data, description=\"MEWANTFOOD\", treatments=treatments)"
-    execute_r_string(make_network_r_str)
+    mtc_network = ro.r['mtc.network']
+    network = mtc_network(ro.DataFrame(data_cols), description="MEWANTFOOD",
+                          treatments=ro.DataFrame(treatments))
+    ro.globalenv[var_name] = network
+
+    if cache_key is not None:
+        for key in [key for key in _network_cache if key[-1] != cache_key[-1]]:
+            _network_cache.pop(key)
+        _network_cache[cache_key] = network
+
+def ma_dataset_to_simple_network(table_model,
+                                 var_name="tmp_obj",
+                                 studies=None,
+                                 data_type=None,
+                                 outcome=None,
+                                 follow_up=None,
+                                 network_path='./r_tmp/network.png'):
+    ''' This converts a DatasetModel to an mtc.network R object as described
+    in the getmc documentation for mtc.network (see ma_dataset_to_network_robj)
+    and plots it to network_path '''
+    ma_dataset_to_network_robj(table_model, data_type, outcome, follow_up,
+                               var_name="network", studies=studies)
     
     # plot the network and return path to the image
-    execute_r_string("png('%s')" % network_path)
-    execute_r_string("plot(network)")
-    execute_r_string("dev.off()")
+    execute_r_string("png('%s'); plot(network); dev.off()" % network_path)
     
     return network_path
     
@@ -782,43 +987,6 @@ def _data_blank_or_none(*args):
     return False
 
     
-def _make_table_string_from_dict(table_dict):
-    '''Makes a string from dictionary d with the keys of d serving as the
-    column headers'''
-    
-    keys, values = table_dict.keys(), table_dict.values()
-    if len(keys)==0:
-        raise ValueError("Dictionary must have at least one key")
-    
-    #import pdb; pdb.set_trace()
-
-    headers = [unicode(key) for key in keys]
-    header_str = u' '.join(headers)
-    table_str = header_str + "\n"
-    
-    table_row_data = zip(*values)
-    
-    row_strings = []
-    def process_datum(x):
-        # quote strings
-        if type(x) in [str, unicode]:
-            return '"' + str(x) + '"'
-        else:
-            return str(x)
-    row_data_to_row_str = lambda row_data: u" ".join([process_datum(datum) for datum in row_data])
-
-        
-        
-    for row_data in table_row_data:
-        row_str = row_data_to_row_str(row_data)
-        row_strings.append(row_str)
-    table_data_str = u"\n".join(row_strings)
-    
-    table_str += table_data_str
-    
-    return table_str
-
-
 def _sanitize_for_R(a_str):
     # may want to do something fancier in the future...
     return a_str.encode('latin-1', 'ignore')
@@ -860,9 +1028,8 @@ def ma_dataset_to_simple_diagnostic_robj(table_model, var_name="tmp_obj",
     y_SEs_str = ", ".join(_to_strs(y_SEs))
 
     # generate the covariate string
-    cov_str = list_of_cov_value_objects_str(table_model.dataset,
-                                            study_ids,
-                                            cov_list=covs_to_include)
+    cov_str = covariates_to_R(table_model.dataset, study_ids,
+                              cov_list=covs_to_include)
 
 
     # first try and construct an object with raw data
@@ -911,7 +1078,8 @@ def cov_to_str(cov, study_ids, dataset, \
     '''
     The string is constructed so that the covariate
     values are in the same order as the 'study_names'
-    list.
+    list. Analyses pass covariates to R as vectors
+    (see covariates_to_R) rather than as strings.
     '''
     cov_str = None
     if named_list:
@@ -919,28 +1087,28 @@ def cov_to_str(cov, study_ids, dataset, \
     else:
         cov_str = "c("
 
-    cov_value_d = dataset.get_values_for_cov(cov.name, ids_for_keys=True)
-    
-    # get the study ids in the same order as the names
     cov_values = []
-   
-    for study_id in study_ids:
-        if cov.data_type == CONTINUOUS:
-            if cov_value_d.has_key(study_id):
-                cov_values.append("%s" % cov_value_d[study_id])
-            else:
-                cov_values.append("NA")
+    for value in _cov_values_for_studies(cov, study_ids, dataset):
+        if value is None:
+            cov_values.append("NA")
+        elif cov.data_type == CONTINUOUS:
+            cov_values.append("%s" % value)
         else:
-            if cov_value_d.has_key(study_id):
-                # factor; note the string.
-                cov_values.append("'%s'" % unicode(str(cov_value_d[study_id]).encode('latin1'), 'latin1'))
-            else:
-                cov_values.append("NA")
+            # factor; note the string.
+            cov_values.append("'%s'" % value)
     cov_str += ",".join(cov_values) + ")"
     
     if return_cov_vals:
         return (cov_str, cov_values)
     return cov_str
+
+def _cov_values_for_studies(cov, study_ids, dataset, ids_to_rows=None):
+    ''' the values of cov (None where missing) for the studies with
+    study_ids, in that order '''
+    if ids_to_rows is None:
+        ids_to_rows = dataset.study_ids_to_rows()
+    column = dataset.get_covariate_column(cov)
+    return column.get_values([ids_to_rows.get(study_id) for study_id in study_ids])
         
 
 @RfunctionCaller
@@ -991,6 +1159,7 @@ def _to_R_params(params):
 
 @RfunctionCaller
 def run_diagnostic_multi(function_names, list_of_params, res_name="result", diag_data_name="tmp_obj"):
+    ensure_R_libs_for_methods(function_names)
     r_params_str = "list(%s)" % ",".join([_to_R_params(p) for p in list_of_params])
     
     execute_r_string("list.of.params <- %s" % r_params_str)
@@ -1011,6 +1180,7 @@ def run_diagnostic_multi(function_names, list_of_params, res_name="result", diag
 
 @RfunctionCaller
 def run_diagnostic_ma(function_name, params, res_name="result", diag_data_name="tmp_obj"):
+    ensure_R_libs_for_methods([function_name])
     params_str = _to_R_params(params)
 
     r_str = "%s<-%s(%s, %s)" % \
@@ -1107,7 +1277,88 @@ def generate_forest_plot(file_path, side_by_side=False, params_name="plot.data")
         execute_r_string("two.forest.plots(%s, '%s')" % (params_name, file_path))
     else:
         print("generating a forest plot....")
-        execute_r_string("forest.plot(%s, '%s')" % (params_name, file_path))
+        # the plot may have been set up to be drawn natively (see
+        # get_forest_plot_layout); here we always want R to draw it
+        execute_r_string("local({plot.data <- %s; plot.data$options$layout.only <- FALSE; forest.plot(plot.data, '%s')})" % (params_name, file_path))
+
+# fields of forest.plot.layout (in plotting.r) that are single values
+FOREST_LAYOUT_SCALARS = ("scale", "summary.est", "xlabel", "title",
+                         "show.summary.line", "zero.line")
+
+@RfunctionCaller
+def get_forest_plot_layout(params_path):
+    '''
+    Returns the layout of the forest plot whose data was saved to params_path
+    (see forest.plot.layout in plotting.r) as a dictionary, or None if there
+    is no plot data there. 'text.cols' is a list of (column name, entries)
+    tuples, in the order the columns are displayed. The plot data is loaded
+    into a local environment, so this won't clobber the current plot.data.
+    '''
+    plot_data_path = "%s.plotdata" % params_path
+    if not os.path.exists(plot_data_path):
+        return None
+
+    r_layout = execute_r_string("local({load('%s'); forest.plot.layout(plot.data)})" % plot_data_path)
+    return _forest_layout_to_dict(r_layout)
+
+def _forest_layout_to_dict(r_layout):
+    layout = {}
+    for name, value in zip(list(r_layout.names), list(r_layout)):
+        if name == "changed.params":
+            continue
+        elif name == "text.cols":
+            col_names = list(value.names) if len(value) > 0 else []
+            layout[name] = [(col_name, [_to_unicode(x) for x in col]) \
+                                for col_name, col in zip(col_names, list(value))]
+        else:
+            values = [_to_unicode(x) if isinstance(x, str) else x for x in list(value)]
+            if name in FOREST_LAYOUT_SCALARS:
+                values = values[0] if len(values) > 0 else None
+            layout[name] = values
+    return layout
+
+def _to_unicode(x):
+    if isinstance(x, unicode):
+        return x
+    return unicode(str(x), "utf-8")
+
+##### Plot editing #####
+# While a plot is open in the editor, R keeps its data, params, results and
+# plot data resident (see the 'forest plot edit sessions' in plotting.r),
+# keyed by the params path.
+
+@RfunctionCaller
+def open_plot_edit_session(params_path):
+    '''
+    Loads the plot saved to params_path for editing. Returns its params as a
+    dictionary, or None if the files the plot was saved to can't be found.
+    '''
+    for var in ("data", "params", "res"):
+        cur_path = "%s.%s" % (params_path, var)
+        if not os.path.exists(cur_path):
+            print "whoops -- couldn't load %s" % cur_path
+            return None
+    r_params = execute_r_string("open.plot.edit.session('%s')" % params_path)
+    return R_parse_tools.recursioner(r_params)
+
+@RfunctionCaller
+def update_plot_edit_session(params_path, plot_params):
+    '''
+    Applies plot_params to the plot being edited in one go, writes the
+    updated params and plot data out to params_path and returns the layout of
+    the plot (as get_forest_plot_layout).
+    '''
+    r_layout = execute_r_string("update.plot.edit.session('%s', %s)" % \
+                                    (params_path, _to_R_params(plot_params)))
+    return _forest_layout_to_dict(r_layout)
+
+@RfunctionCaller
+def close_plot_edit_session(params_path):
+    execute_r_string("close.plot.edit.session('%s')" % params_path)
+
+def plot_edit_session_data_name(params_path):
+    ''' R expression for the plot data of the plot being edited '''
+    return "plot.edit.session.data('%s')" % params_path
 
 def parse_out_results(result):
     # parse out text field(s). note that "plot names" is 'reserved', i.e., it's
@@ -1156,7 +1407,7 @@ def parse_out_results(result):
         elif text_n == "weights":
             text_d[text_n] = make_weights_str(result)
         elif text_n in ["res","res.info", "input_data","input_params"]: # ignore the special output for OpenMEE (may want to have this in the future for OpenMeta as well)
-            pass
+            pass # (res and res.info are turned into tables below)
         elif "gui.ignore" in text_n:
             pass
         else:
@@ -1169,10 +1420,61 @@ def parse_out_results(result):
                  "image_var_names":image_var_name_d,
                  "texts":text_d,
                  "image_params_paths":image_params_paths_d,
-                 "image_order":image_order}
+                 "image_order":image_order,
+                 "tables":get_results_tables(result)}
     
     return to_return
 
+# rpy2 vector classes --> the type names used for results tables
+R_VECTOR_TYPES = ((rpy2.robjects.vectors.BoolVector, "bool"),
+                  (rpy2.robjects.vectors.IntVector, "int"),
+                  (rpy2.robjects.vectors.FloatVector, "float"),
+                  (rpy2.robjects.vectors.StrVector, "str"))
+
+def get_results_tables(result):
+    '''
+    Returns the numbers behind the results of an analysis (its 'res', as
+    described by its 'res.info') as typed tables, i.e. an ordered dictionary
+    mapping table names (see results.tables in utilities.r) to dictionaries
+    with the keys 'columns' (the column names), 'types' ('float', 'int',
+    'bool' or 'str') and 'data' (a list per column; NA is None). Empty if the
+    method doesn't return res and res.info.
+
+    result is the analysis result as a dictionary of R objects, as in
+    parse_out_results.
+    '''
+    tables = OrderedDict()
+    if not ("res" in result and "res.info" in result):
+        return tables
+
+    study_names = ro.r['as.null']()
+    if "input_data" in result:
+        study_names = result["input_data"].do_slot("study.names")
+    try:
+        r_tables = ro.r['results.tables'](result["res"], result["res.info"],
+                                          study_names)
+    except Exception, e:
+        # the tables are a bonus; don't let them get in the way of the results
+        # (nor with R's working directory, which the plots are written to)
+        print "couldn't tabulate the results: %s" % e
+        return tables
+
+    for table_name, r_df in zip(list(r_tables.names), list(r_tables)):
+        columns, types, data = [], [], []
+        for col_name, r_col in zip(list(r_df.names), list(r_df)):
+            if type(r_col) == rpy2.robjects.vectors.FactorVector:
+                r_col = ro.r["as.character"](r_col)
+            col_type = "str"
+            for vector_class, type_name in R_VECTOR_TYPES:
+                if isinstance(r_col, vector_class):
+                    col_type = type_name
+                    break
+            columns.append(col_name)
+            types.append(col_type)
+            data.append([R_parse_tools._convert_NA_to_None(x) for x in r_col])
+        tables[table_name] = {"columns":columns, "types":types, "data":data}
+    return tables
+
 def make_weights_str(results):
     ''' Make a string representing the weights due to each study in the meta analysis '''
     
@@ -1217,32 +1519,40 @@ def run_binary_fixed_meta_regression(selected_cov, bin_data_name="tmp_obj",
     return parse_out_results(result)
 
 
-def _gen_cov_vals_obj_str(cov, study_ids, dataset): 
-    values_str, cov_vals = cov_to_str(cov, study_ids, dataset, named_list=False,
-                                      return_cov_vals=True)
-    ref_var = cov_vals[0].replace("'", "") # arbitrary
-
-    ## setting the reference variable to the first entry
-    # for now -- this only matters for factors, obviously
-
-    r_str = "new('CovariateValues', cov.name='%s', cov.vals=%s, \
-                    cov.type='%s', ref.var='%s')" % \
-                (cov.name, values_str, TYPE_TO_STR_DICT[cov.data_type], ref_var)
-    return r_str
-
-
-def list_of_cov_value_objects_str(dataset, study_ids, cov_list=None):
-    ''' makes r_string of covariate objects with their values '''
-    
-    r_cov_str = []
+def covariates_to_R(dataset, study_ids, cov_list=None, var_name="tmp_covs"):
+    '''
+    Assigns a list of CovariateValues objects holding the values of the
+    covariates in cov_list (all of the dataset's covariates, by default) for
+    the studies with study_ids (in that order) to var_name in R, and returns
+    var_name. The values are handed over as vectors (numeric for continuous
+    covariates, character for factors) taken from the dataset's covariate
+    columns, so no R source is built for them.
+    '''
     if cov_list is None:
         # then use all covariates that belong to the dataset
         cov_list = dataset.covariates
-    for cov in cov_list:
-        r_cov_str.append(_gen_cov_vals_obj_str(cov, study_ids, dataset))
-    r_cov_str = "list(" + ",".join(r_cov_str) + ")"
+    ids_to_rows = dataset.study_ids_to_rows()
+    cov_objs = [_cov_values_robj(cov, _cov_values_for_studies(cov, study_ids, dataset, ids_to_rows)) \
+                                    for cov in cov_list]
+    ro.globalenv[var_name] = ro.r['list'](*cov_objs)
+    return var_name
+
+def _cov_values_robj(cov, values):
+    if cov.data_type == CONTINUOUS:
+        r_values = ro.FloatVector([_float_or_NA(x) for x in values])
+    else:
+        # the R code compares factor values to (character) levels, so these
+        # go over as a character vector rather than an R factor
+        r_values = ro.StrVector([ro.NA_Character if x is None else _sanitize_for_R(x) \
+                                        for x in values])
 
-    return r_cov_str
+    ## setting the reference variable to the first entry
+    # for now -- this only matters for factors, obviously
+    ref_var = "NA" if len(values) == 0 or values[0] is None else "%s" % values[0] # arbitrary
+
+    cov_args = {"cov.name":_sanitize_for_R(unicode(cov.name)), "cov.vals":r_values,
+                "cov.type":TYPE_TO_STR_DICT[cov.data_type], "ref.var":_sanitize_for_R(unicode(ref_var))}
+    return ro.r['new']("CovariateValues", **cov_args)
 
 
 @RfunctionCaller
@@ -1290,6 +1600,7 @@ def run_meta_regression(dataset, study_names, cov_list, metric_name,
 @RfunctionCaller
 def run_meta_method_diag(meta_function_name, function_names, list_of_params,
                          res_name="result", diag_data_name="tmp_obj"):
+    ensure_R_libs_for_methods(function_names)
     # list of parameter objects
     r_params_str = "list(%s)" % ",".join([_to_R_params(p) for p in list_of_params])
     r_str = "list.of.params <- %s" % r_params_str
@@ -1312,6 +1623,13 @@ def run_meta_method_diag(meta_function_name, function_names, list_of_params,
     return parse_out_results(result)
         
 
+@RfunctionCaller
+def set_n_cores(n_cores):
+    ''' Sets the number of processes R runs independent fits (e.g., of the
+    subgroups of a subgroup analysis) over; see parallel.lapply in
+    meta_global.r '''
+    execute_r_string("set.n.cores(%d)" % max(1, int(n_cores)))
+
 @RfunctionCaller
 def run_meta_method(meta_function_name, function_name, params, \
                         res_name="result", data_name="tmp_obj"):
@@ -1335,6 +1653,202 @@ def run_meta_method(meta_function_name, function_name, params, \
     return parse_out_results(result)  
 
 
+#################### MULTIPLE-UNIT (BATCH) ANALYSES ####################
+# An analysis 'unit' is an (outcome, follow-up, group pair) -- what the
+# spreadsheet displays at any one time. The functions below convert a whole
+# dataset into a single long-format data frame on the R side (one row per
+# study per unit) so that a method can be run over every unit in one call
+# (see units.ma in batch.r), rather than re-converting the dataset and
+# calling R once per unit.
+
+UNITS_RAW_DATA_COLS = {BINARY:["g1O1", "g1O2", "g2O1", "g2O2"],
+                       CONTINUOUS:["N1", "mean1", "sd1", "N2", "mean2", "sd2"]}
+
+def _float_or_NA(x):
+    if x in EMPTY_VALS:
+        return ro.NA_Real
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return ro.NA_Real
+
+def _group_names_in_dataset_order(dataset):
+    '''
+    The names of the groups in the dataset in the order they were entered:
+    the order they first appear in, going through the studies in order and
+    through each unit's groups in the order they were added to it. (Unlike
+    Dataset.get_group_names, which returns them in no particular order.)
+    '''
+    group_names = []
+    for study in dataset.studies:
+        for outcome in dataset.get_outcome_names():
+            for ma_unit in study.outcomes_to_follow_ups.get(outcome, {}).values():
+                groups = sorted(ma_unit.tx_groups.values(), key=lambda group: group.id)
+                group_names.extend([group.name for group in groups \
+                                        if group.name not in group_names])
+    return group_names
+
+def get_analysis_units(dataset, data_type, metric, outcomes=None, group_pairs=None):
+    '''
+    Returns the list of (outcome, follow-up, groups) tuples in the dataset for
+    outcomes of the given data_type. For two-arm metrics groups is every pair
+    of groups, each in the order the groups were entered in the dataset,
+    unless group_pairs is given (in which case each pair is kept as given);
+    for one-arm metrics it is each single group.
+
+    Note that the order of a pair decides the direction of its effects (the
+    first group is the treatment), so the pairs must not be re-ordered, e.g.,
+    by name; sort the returned units only to display them.
+    '''
+    all_groups = _group_names_in_dataset_order(dataset)
+    units = []
+    for outcome in dataset.get_outcome_names():
+        if outcomes is not None and outcome not in outcomes:
+            continue
+        if dataset.get_outcome_type(outcome) != data_type:
+            continue
+        for follow_up in dataset.get_follow_up_names_for_outcome(outcome):
+            groups = dataset.get_group_names_for_outcome_fu(outcome, follow_up)
+            groups = [group for group in all_groups if group in groups]
+            if metric in ONE_ARM_METRICS:
+                unit_groups = [(group,) for group in groups]
+            elif group_pairs is not None:
+                unit_groups = [tuple(pair) for pair in group_pairs \
+                                    if pair[0] in groups and pair[1] in groups]
+            else:
+                unit_groups = [(group_a, group_b) for i, group_a in enumerate(groups) \
+                                    for group_b in groups[i+1:]]
+            for groups_for_unit in unit_groups:
+                units.append((outcome, follow_up, groups_for_unit))
+    return units
+
+def _unit_rows_for_study(study, unit, data_type, metric, mult):
+    ''' the raw data and (calc. scale) effect for study in unit, or None if
+    the study has neither complete raw data nor an effect for the unit '''
+    outcome, follow_up, groups = unit
+    try:
+        ma_unit = study.outcomes_to_follow_ups[outcome][follow_up]
+        raw_data = ma_unit.get_raw_data_for_groups(list(groups))
+    except KeyError:
+        return None
+
+    one_arm = metric in ONE_ARM_METRICS
+    group_str = groups[0] if one_arm else "-".join(groups)
+    try:
+        est, se = ma_unit.get_effect_and_se(metric, group_str, mult)
+    except KeyError:
+        est, se = None, None
+
+    raw_cols = UNITS_RAW_DATA_COLS[data_type]
+    if data_type == BINARY:
+        raw = list(raw_data) + ([0, 0] if one_arm else [])
+        # the BinaryData class wants events and non-events
+        events1, total1, events2, total2 = raw
+        if not _data_blank_or_none(*raw):
+            raw = [events1, total1-events1, events2, total2-events2]
+        else:
+            raw = [None]*4
+    else:
+        # for one-arm continuous metrics we (as in
+        # ma_dataset_to_simple_continuous_robj) just use the effects
+        raw = list(raw_data) if not one_arm else [None]*len(raw_cols)
+        if _data_blank_or_none(*raw):
+            raw = [None]*len(raw_cols)
+
+    has_raw = None not in raw
+    if not has_raw and None in (est, se):
+        return None
+    return dict(zip(raw_cols, raw), y=est, SE=se)
+
+@RfunctionCaller
+def ma_dataset_to_units_robj(dataset, data_type, metric, var_name="units.data",
+                             units=None, conf_level=DEFAULT_CONF_LEVEL):
+    '''
+    Builds the long-format data frame for every analysis unit in units
+    (all of the units for data_type by default; see get_analysis_units) in
+    one go and assigns it to var_name on the R side. Studies the user
+    excluded, and studies without usable data for a unit, are left out of
+    that unit. Returns the list of units.
+    '''
+    if data_type not in UNITS_RAW_DATA_COLS:
+        raise ValueError("Batch analyses are only available for binary and continuous data")
+    if units is None:
+        units = get_analysis_units(dataset, data_type, metric)
+    mult = get_mult_from_r(conf_level)
+
+    raw_cols = UNITS_RAW_DATA_COLS[data_type]
+    str_cols = ["unit", "outcome", "follow.up", "group1", "group2", "study.name"]
+    cols = dict([(col, []) for col in str_cols + ["year", "y", "SE"] + raw_cols])
+    for outcome, follow_up, groups in units:
+        unit_id = "%s/%s/%s" % (outcome, follow_up, "-".join(groups))
+        for study in dataset.studies:
+            if study.manually_excluded:
+                continue
+            row = _unit_rows_for_study(study, (outcome, follow_up, groups),
+                                       data_type, metric, mult)
+            if row is None:
+                continue
+            row.update({"unit":unit_id, "outcome":outcome, "follow.up":follow_up,
+                        "group1":groups[0], "group2":groups[1] if len(groups) > 1 else "",
+                        "study.name":study.name, "year":study.year})
+            for col in cols:
+                cols[col].append(row[col])
+
+    # columns are handed to R as typed vectors, in a fixed order
+    df_cols = rlc.OrdDict()
+    for col in str_cols:
+        df_cols[col] = ro.StrVector([_sanitize_for_R(unicode(x)) for x in cols[col]])
+    for col in ["year", "y", "SE"] + raw_cols:
+        df_cols[col] = ro.FloatVector([_float_or_NA(x) for x in cols[col]])
+    ro.globalenv[var_name] = ro.DataFrame(df_cols)
+    return units
+
+def _r_data_frame_to_rows(r_df):
+    ''' converts an R data frame to a list of {column name:value} dicts '''
+    col_names = list(r_df.names)
+    cols = []
+    for r_col in r_df:
+        if type(r_col) == rpy2.robjects.vectors.FactorVector:
+            r_col = ro.r["as.character"](r_col)
+        cols.append([R_parse_tools._convert_NA_to_None(x) for x in r_col])
+    return [dict(zip(col_names, row)) for row in zip(*cols)]
+
+@RfunctionCaller
+def run_ma_for_all_units(dataset, data_type, function_name, params, metric,
+                         units=None, n_cores=1, units_data_name="units.data",
+                         res_name="units.result"):
+    '''
+    Runs function_name (e.g., binary.random) over every analysis unit of
+    data_type in the dataset (or just those in units) with a single call
+    to R; units are run in parallel over n_cores processes where the
+    platform allows. Returns the combined results table as a list of
+    dictionaries, one per unit, with the keys:
+
+        unit, outcome, follow.up, group1, group2, k, est, lower, upper, se,
+        display.est, display.lower, display.upper, p.value, tau2, Q, Q.p,
+        I2, error
+
+    (est, lower, upper and se are on the calculation scale; error is None
+    unless the analysis failed for that unit)
+    '''
+    data_type_str = {BINARY:"binary", CONTINUOUS:"continuous"}.get(data_type)
+    params = dict(params)
+    params["measure"] = metric
+    conf_level = params.get("conf.level", DEFAULT_CONF_LEVEL)
+
+    ma_dataset_to_units_robj(dataset, data_type, metric, var_name=units_data_name,
+                             units=units, conf_level=conf_level)
+
+    params_df = ro.r['data.frame'](**params)
+    r_str = "%s <- units.ma('%s', %s, %s, '%s', n.cores=%s)" % \
+            (res_name, function_name, units_data_name, params_df.r_repr(),
+             data_type_str, int(n_cores))
+    execute_r_string(r_str)
+    return _r_data_frame_to_rows(ro.globalenv[res_name])
+
+#################### END OF MULTIPLE-UNIT (BATCH) ANALYSES ####################
+
+
 def _get_c_str_for_col(m, i):
     return ", ".join(_get_col(m, i))
 
@@ -1,45 +1,59 @@
+import math
+
 from PyQt4.Qt import *
 import forms.ui_network_view
 import edit_list_models
-import meta_py_r
+from meta_globals import BINARY, CONTINUOUS, EMPTY_VALS
 
 PageSize = (500, 300)
+# the diameters of the nodes and the widths of the edges (in pixels) are
+# scaled into these ranges by sample size and number of studies
+NODE_SIZE_RANGE = (16, 56)
+EDGE_WIDTH_RANGE = (1, 8)
+# where the sample size is in the raw data of a group
+SAMPLE_SIZE_INDEX = {BINARY:1, CONTINUOUS:0}
 
 class ViewDialog(QDialog, forms.ui_network_view.Ui_network_view_dialog):
 
     def __init__(self, model, parent=None):
         super(ViewDialog, self).__init__(parent)
         self.setupUi(self)
-        
+
         self.model = model
         self.dataset = model.dataset
         self.cur_outcome = model.current_outcome
         self.cur_follow_up = model.get_current_follow_up_name()
-        
+
+        # (outcome, follow up, data revision) --> network (see get_network)
+        self.networks = {}
+        # (nodes, edges) --> positions of the nodes (see layout_network)
+        self.layouts = {}
+
         self.populate_cbo_boxes()
         self.setup_signals()
-        
+
         self.x_coord = 5
         self.y_coord = 5
         self.scene = QGraphicsScene(self)
         self.scene.setSceneRect(0, 0, PageSize[0], PageSize[1])
         self.network_viewer.setScene(self.scene)
+        self.network_viewer.setRenderHint(QPainter.Antialiasing)
         self.graph_network(self.cur_outcome, self.cur_follow_up)
-    
+
     def setup_signals(self):
         QObject.connect(self.outcome_cbo_box, SIGNAL("currentIndexChanged(QString)"),
                                                             self.outcome_changed)
         QObject.connect(self.follow_up_cbo_box, SIGNAL("currentIndexChanged(QString)"),
                                                             self.follow_up_changed)
-        
+
     def outcome_changed(self, new_outcome):
         self.cur_outcome = str(new_outcome)
         self.graph_network(self.cur_outcome, self.cur_follow_up)
-        
+
     def follow_up_changed(self, new_follow_up):
         self.cur_follow_up = str(new_follow_up)
         self.graph_network(self.cur_outcome, self.cur_follow_up)
-        
+
     def populate_cbo_boxes(self):
         self.outcome_cbo_box.addItems(self.dataset.get_outcome_names())
         self.follow_up_cbo_box.addItems(self.dataset.get_follow_up_names())
@@ -48,17 +62,158 @@ class ViewDialog(QDialog, forms.ui_network_view.Ui_network_view_dialog):
         # and follow-up
         cur_outcome_index = self.outcome_cbo_box.findText(self.cur_outcome)
         self.outcome_cbo_box.setCurrentIndex(cur_outcome_index)
-        
+
         cur_follow_up_index = self.follow_up_cbo_box.findText(self.cur_follow_up)
         self.follow_up_cbo_box.setCurrentIndex(cur_follow_up_index)
-        
+
+    def get_network(self, outcome, follow_up):
+        ''' the nodes, edges, edge weights (numbers of studies) and sample sizes of
+        the nodes of the network of outcome at follow_up '''
+        key = (outcome, follow_up, self.model.data_revision)
+        if key not in self.networks:
+            nodes, edges, edge_weights = self.dataset.get_network(outcome, follow_up)
+            data_type = self.model.get_outcome_type(outcome, get_str=False)
+            sample_sizes = group_sample_sizes(self.dataset, outcome, follow_up, data_type)
+            self.networks[key] = (nodes, edges, edge_weights, sample_sizes)
+        return self.networks[key]
+
     def graph_network(self, outcome, follow_up):
-        data_type = self.model.get_outcome_type(outcome, get_str=False)
-        
-        img_path = meta_py_r.ma_dataset_to_simple_network(
-                                      table_model=self.model,
-                                      data_type=data_type,
-                                      outcome=outcome,
-                                      follow_up=follow_up)
-        pixmap = QPixmap(img_path)
-        self.scene.addPixmap(pixmap)
\ No newline at end of file
+        self.scene.clear()
+        # not every outcome has every follow up
+        if not self.dataset.outcome_names_to_follow_ups[outcome].has_value(follow_up):
+            self.scene.addSimpleText("There is no data for %s at %s" % (outcome, follow_up))
+            return
+        nodes, edges, edge_weights, sample_sizes = self.get_network(outcome, follow_up)
+
+        layout_key = (tuple(nodes), tuple(edges))
+        if layout_key not in self.layouts:
+            self.layouts[layout_key] = layout_network(nodes, edges)
+        draw_network(self.scene, nodes, edges, edge_weights, sample_sizes,
+                     self.layouts[layout_key])
+
+def group_sample_sizes(dataset, outcome, follow_up, data_type):
+    ''' the total sample size of each group of the outcome at follow_up, over the
+    studies that give it (all zeros for data types without group sample sizes) '''
+    sample_sizes = {}
+    index = SAMPLE_SIZE_INDEX.get(data_type)
+    for study in dataset.studies:
+        # (studies added since the outcome was have no unit for it yet)
+        ma_unit = study.outcomes_to_follow_ups.get(outcome, {}).get(follow_up)
+        if ma_unit is None:
+            continue
+        for group in ma_unit.get_group_names():
+            sample_sizes.setdefault(group, 0)
+            if index is None:
+                continue
+            n = ma_unit.get_raw_data_for_group(group)[index]
+            if n not in EMPTY_VALS:
+                try:
+                    sample_sizes[group] += float(n)
+                except ValueError:
+                    pass
+    return sample_sizes
+
+def layout_network(nodes, edges, iterations=50):
+    '''
+    Computes positions (in the unit square) for the nodes with the
+    Fruchterman-Reingold force-directed algorithm, starting from the nodes
+    on a circle. Returns a dictionary mapping each node to its (x, y).
+    '''
+    positions = circular_layout(nodes)
+    n = len(nodes)
+    if n <= 2 or len(edges) == 0:
+        return positions
+
+    k = math.sqrt(1.0/n) # the ideal distance between nodes
+    for iteration in range(iterations):
+        # how far the nodes can move falls linearly to zero
+        temperature = 0.1*(1 - float(iteration)/iterations)
+        displacements = dict([(node, [0.0, 0.0]) for node in nodes])
+        # all of the nodes repel one another ...
+        for i, a in enumerate(nodes):
+            for b in nodes[i+1:]:
+                dx, dy, distance = _difference(positions[a], positions[b])
+                force = k*k/distance
+                _displace(displacements, a, b, dx/distance*force, dy/distance*force)
+        # ... and the nodes of an edge attract one another
+        for a, b in edges:
+            dx, dy, distance = _difference(positions[a], positions[b])
+            force = distance*distance/k
+            _displace(displacements, a, b, -dx/distance*force, -dy/distance*force)
+
+        for node in nodes:
+            dx, dy = displacements[node]
+            length = max(math.hypot(dx, dy), 1e-9)
+            step = min(length, temperature)
+            x, y = positions[node]
+            positions[node] = (x + dx/length*step, y + dy/length*step)
+    return _fit_to_unit_square(positions)
+
+def circular_layout(nodes):
+    n = len(nodes)
+    positions = {}
+    for i, node in enumerate(nodes):
+        angle = 2*math.pi*i/n
+        positions[node] = (0.5 + 0.5*math.cos(angle), 0.5 + 0.5*math.sin(angle))
+    return positions
+
+def _difference(p1, p2):
+    dx, dy = p1[0]-p2[0], p1[1]-p2[1]
+    return dx, dy, max(math.hypot(dx, dy), 1e-9)
+
+def _displace(displacements, a, b, dx, dy):
+    ''' moves a by (dx, dy) and b the other way '''
+    displacements[a][0] += dx
+    displacements[a][1] += dy
+    displacements[b][0] -= dx
+    displacements[b][1] -= dy
+
+def _fit_to_unit_square(positions):
+    xs = [x for x, y in positions.values()]
+    ys = [y for x, y in positions.values()]
+    scale = max(max(xs)-min(xs), max(ys)-min(ys))
+    if scale == 0:
+        return dict([(node, (0.5, 0.5)) for node in positions])
+    # keep the aspect ratio, and center the nodes
+    x_offset = (1 - (max(xs)-min(xs))/scale)/2
+    y_offset = (1 - (max(ys)-min(ys))/scale)/2
+    return dict([(node, (x_offset + (x-min(xs))/scale, y_offset + (y-min(ys))/scale)) \
+                    for node, (x, y) in positions.items()])
+
+def draw_network(scene, nodes, edges, edge_weights, sample_sizes, positions):
+    ''' Draws the network onto scene: nodes sized by sample size (by area) and
+    edges as wide as their weights, the nodes placed at positions (in the unit
+    square; see layout_network) '''
+    margin = NODE_SIZE_RANGE[1]
+    width, height = PageSize[0]-2*margin, PageSize[1]-2*margin
+    to_scene = dict([(node, (margin + x*width, margin + y*height)) \
+                        for node, (x, y) in positions.items()])
+
+    max_weight = max(edge_weights.values() + [1])
+    for g1, g2 in edges:
+        (x1, y1), (x2, y2) = to_scene[g1], to_scene[g2]
+        weight = edge_weights[(g1, g2)]
+        pen = QPen(QColor(Qt.darkGray))
+        pen.setWidthF(_scaled(weight, max_weight, EDGE_WIDTH_RANGE))
+        line = scene.addLine(x1, y1, x2, y2, pen)
+        line.setToolTip("%s vs. %s: %d studies (N = %g and %g)" % (g1, g2, weight,
+                        sample_sizes.get(g1, 0), sample_sizes.get(g2, 0)))
+
+    max_root_size = math.sqrt(max([sample_sizes.get(node, 0) for node in nodes] + [0]))
+    for node in nodes:
+        x, y = to_scene[node]
+        diameter = _scaled(math.sqrt(sample_sizes.get(node, 0)), max_root_size, NODE_SIZE_RANGE)
+        ellipse = scene.addEllipse(x-diameter/2, y-diameter/2, diameter, diameter,
+                                   QPen(QColor(Qt.black)), QBrush(QColor(Qt.lightGray)))
+        ellipse.setZValue(1)
+        ellipse.setToolTip("%s: N = %g" % (node, sample_sizes.get(node, 0)))
+        label = scene.addSimpleText(node)
+        label.setPos(x - label.boundingRect().width()/2, y + diameter/2 + 2)
+        label.setZValue(2)
+
+def _scaled(value, max_value, value_range):
+    ''' value (in [0, max_value]) scaled linearly into value_range '''
+    low, high = value_range
+    if max_value <= 0:
+        return low
+    return low + (high-low)*float(value)/max_value
@@ -0,0 +1,107 @@
+#############################################
+#                                           #
+#  OpenMeta[analyst]                        #
+#                                           #
+#  Writes the tables of numeric results     #
+#  of an analysis (see                      #
+#  meta_py_r.get_results_tables) to disk,   #
+#  as one CSV file per table and/or a       #
+#  single compact binary file.              #
+#                                           #
+#############################################
+
+import os
+import csv
+import math
+import array
+import cPickle
+
+# the binary file is a pickle (protocol 2) of
+#    {"format_version":BINARY_FORMAT_VERSION,
+#     "tables":[(table name, {"columns":[...], "types":[...], "data":[...]}), ...]}
+# in which float columns are array('d')s (with NA as nan), int columns
+# without NAs are array('l')s and all other columns are lists
+BINARY_FORMAT_VERSION = 1
+BINARY_FILE_NAME = "results_tables.pkl"
+
+
+def table_file_name(table_name):
+    ''' 'Subgroup A/summary' --> 'Subgroup_A__summary.csv' '''
+    keep = "-_."
+    name = table_name.replace("/", "__")
+    name = "".join([c if (c.isalnum() or c in keep) else "_" for c in name])
+    return (name or "table") + ".csv"
+
+def write_tables(tables, out_dir, csv_files=True, binary=False):
+    '''
+    Writes tables (an ordered dictionary of results tables, as returned by
+    meta_py_r.get_results_tables) to out_dir: a CSV file per table and/or
+    (if binary is True) all tables in a single binary file. Returns a
+    dictionary mapping table names to the CSV files written (relative to
+    out_dir); the binary file, if any, is under the key None.
+    '''
+    written = {}
+    if len(tables) == 0:
+        return written
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    if csv_files:
+        for table_name, table in tables.items():
+            fname = table_file_name(table_name)
+            write_csv(table, os.path.join(out_dir, fname))
+            written[table_name] = fname
+
+    if binary:
+        write_binary(tables, os.path.join(out_dir, BINARY_FILE_NAME))
+        written[None] = BINARY_FILE_NAME
+    return written
+
+def write_csv(table, path):
+    ''' NA (None) is written as an empty field '''
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow([_encode(col) for col in table["columns"]])
+        for row in zip(*table["data"]):
+            writer.writerow([_csv_value(x) for x in row])
+
+def write_binary(tables, path):
+    binary_tables = []
+    for table_name, table in tables.items():
+        data = []
+        for col_type, col in zip(table["types"], table["data"]):
+            if col_type == "float":
+                col = array.array('d', [float("nan") if x is None else x for x in col])
+            elif col_type == "int" and None not in col:
+                col = array.array('l', col)
+            else:
+                col = list(col)
+            data.append(col)
+        binary_tables.append((table_name, {"columns":list(table["columns"]),
+                                           "types":list(table["types"]),
+                                           "data":data}))
+    with open(path, 'wb') as f:
+        cPickle.dump({"format_version":BINARY_FORMAT_VERSION, "tables":binary_tables},
+                     f, protocol=2)
+
+def read_binary(path):
+    ''' Reads a file written by write_binary back into a list of
+    (table name, table) tuples '''
+    with open(path, 'rb') as f:
+        contents = cPickle.load(f)
+    return contents["tables"]
+
+def _csv_value(x):
+    if x is None:
+        return ""
+    if isinstance(x, float):
+        if math.isnan(x):
+            return "NaN"
+        # full precision, rather than str's 12 digits
+        return repr(x)
+    return _encode(x)
+
+def _encode(x):
+    if isinstance(x, unicode):
+        return x.encode("utf-8")
+    return x
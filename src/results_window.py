@@ -12,10 +12,14 @@
 
 import random
 from PyQt4.Qt import *
+from PyQt4.QtSvg import QSvgRenderer
 import os
 import sys
 import ui_results_window
 import edit_forest_plot_form
+import forest_plot_renderer
+import results_export
+import meta_globals
 import meta_py_r
 #import shutil
 
@@ -29,6 +33,113 @@ SCALE_P = .5 # percent images are to be scaled
 SIDE_BY_SIDE_FOREST_PLOTS = ("NLR and PLR Forest Plot", "Sensitivity and Specificity", "Cumulative Forest Plot")
 ROW_HEIGHT = 15 # by trial-and-error; seems to work very well
 
+# how far the results can be zoomed in and out (ctrl + mouse wheel, or the
+# zoom in/out keys), and the step of a single zoom
+MIN_ZOOM, MAX_ZOOM = 0.25, 8.0
+ZOOM_STEP = 1.25
+
+# images are decoded (and scaled) off the GUI thread, and only when they are
+# in or near (within this many viewport heights of) the visible area
+PRELOAD_MARGIN = 1.0
+# bound on the memory taken by decoded images that aren't currently shown
+IMAGE_CACHE_KB = 32*1024
+PLACEHOLDER_COLOR = QColor(235, 235, 235)
+
+# states of the images in a results window
+PLACEHOLDER, LOADING, LOADED = range(3)
+
+
+class ImageItem(QGraphicsPixmapItem):
+    '''
+    A pixmap item that has the size of its image from the start, and shows
+    a placeholder while it has no pixmap, i.e., before its image is loaded
+    (or after it's been dropped to save memory).
+
+    Natively rendered forest plots also have their SVG (see set_svg); when
+    the view is zoomed in past the pixmap's resolution they are drawn from
+    it, at the zoom level, rather than by scaling up the pixmap.
+    '''
+    def __init__(self, size):
+        QGraphicsPixmapItem.__init__(self)
+        self.image_size = QSizeF(size)
+        self.svg_renderer = None
+
+    def set_svg(self, svg):
+        ''' svg is the image as SVG, or None if it's only a raster image '''
+        if svg is None:
+            self.svg_renderer = None
+            self.setCacheMode(QGraphicsItem.NoCache)
+        else:
+            self.svg_renderer = QSvgRenderer(QByteArray(svg))
+            # drawing the SVG is slow for big plots, so it's done once per
+            # zoom level rather than whenever the view is scrolled
+            self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.update()
+
+    def setPixmap(self, pixmap):
+        if not pixmap.isNull() and QSizeF(pixmap.size()) != self.image_size:
+            self.prepareGeometryChange()
+            self.image_size = QSizeF(pixmap.size())
+        QGraphicsPixmapItem.setPixmap(self, pixmap)
+
+    def boundingRect(self):
+        return QRectF(QPointF(0, 0), self.image_size)
+
+    def shape(self):
+        path = QPainterPath()
+        path.addRect(self.boundingRect())
+        return path
+
+    def paint(self, painter, option, widget=None):
+        if self.pixmap().isNull():
+            painter.fillRect(self.boundingRect(), PLACEHOLDER_COLOR)
+            painter.drawText(self.boundingRect(), Qt.AlignCenter, "loading...")
+        elif self.svg_renderer is not None and \
+                QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform()) > 1:
+            painter.fillRect(self.boundingRect(), Qt.white)
+            painter.setRenderHint(QPainter.Antialiasing)
+            self.svg_renderer.render(painter, self.boundingRect())
+        else:
+            QGraphicsPixmapItem.paint(self, painter, option, widget)
+
+
+class ImageLoader(QRunnable):
+    '''
+    Decodes an image (or draws a natively rendered forest plot from its SVG)
+    at the size it's displayed at, on a thread pool thread. QPixmaps can only
+    be made on the GUI thread, so the result is handed back as a QImage via
+    the imageLoaded signal of notifier.
+    '''
+    def __init__(self, notifier, key, version, size, image_path=None, svg=None):
+        QRunnable.__init__(self)
+        # we hang on to the loader until it reports back (see
+        # ResultsWindow.image_loaded), so python is in charge of deleting it
+        self.setAutoDelete(False)
+        self.notifier = notifier
+        self.key, self.version = key, version
+        self.size = size
+        self.image_path, self.svg = image_path, svg
+
+    def run(self):
+        try:
+            if self.svg is not None:
+                image = QImage(self.size, QImage.Format_ARGB32_Premultiplied)
+                image.fill(QColor("white").rgb())
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.Antialiasing)
+                QSvgRenderer(QByteArray(self.svg)).render(painter)
+                painter.end()
+            else:
+                image = QImage(self.image_path)
+                if not image.isNull():
+                    image = image.scaled(self.size, Qt.IgnoreAspectRatio, \
+                                         Qt.SmoothTransformation)
+        except Exception, e:
+            print "couldn't load image %s: %s" % (self.image_path, e)
+            image = QImage()
+        self.notifier.emit(SIGNAL("imageLoaded"), self.key, self.version, image)
+
+
 class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
 
     def __init__(self, results, parent=None):
@@ -67,6 +178,14 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
 
         self.scene = QGraphicsScene(self)
 
+        # images are added as placeholders and loaded in the background as
+        # they come into view; see load_visible_images
+        self.image_records = {}
+        self._image_loaders = {}
+        self.image_notifier = QObject()
+        QObject.connect(self.image_notifier, SIGNAL("imageLoaded"), self.image_loaded)
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), IMAGE_CACHE_KB))
+
         self.images = results["images"]
         print "images returned from analytic routine: %s" % self.images
         self.image_order = None
@@ -82,6 +201,9 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
         self.set_psuedo_console_text()
         self.items_to_coords = {}
         self.texts = results["texts"]
+        # the numbers behind the results; see export_tables
+        self.tables = results.get("tables", {})
+        self.setup_export_menu()
 
 
         # first add the text to self.scene
@@ -102,6 +224,84 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
         self.graphics_view.setScene(self.scene)
         self.graphics_view.ensureVisible(QRectF(0,0,0,0))
 
+        for scroll_bar in (self.graphics_view.verticalScrollBar(),
+                           self.graphics_view.horizontalScrollBar()):
+            QObject.connect(scroll_bar, SIGNAL("valueChanged(int)"),
+                            self.load_visible_images)
+        # once the window is up, load whatever's in view
+        QTimer.singleShot(0, self.load_visible_images)
+
+        # zooming; see zoom
+        self.graphics_view.viewport().installEventFilter(self)
+        for key_sequence, zoom_f in ((QKeySequence.ZoomIn, self.zoom_in),
+                                     (QKeySequence.ZoomOut, self.zoom_out)):
+            shortcut = QShortcut(QKeySequence(key_sequence), self)
+            QObject.connect(shortcut, SIGNAL("activated()"), zoom_f)
+
+    ##### Exporting the results tables #####
+
+    def setup_export_menu(self):
+        file_menu = self.menubar.addMenu("&File")
+        for label, export_f in (("Export results tables as CSV...", self.export_tables),
+                                ("Export results tables as binary file...", self.export_binary_tables)):
+            action = file_menu.addAction(label)
+            action.setEnabled(len(self.tables) > 0)
+            QObject.connect(action, SIGNAL("triggered()"), export_f)
+
+    def export_tables(self):
+        ''' Writes the results tables as one CSV file per table, to a
+        directory the user picks (see results_export) '''
+        out_dir = unicode(QFileDialog.getExistingDirectory(self,
+                                "OpenMeta[Analyst] -- export results tables to"))
+        if out_dir == "":
+            return
+        try:
+            written = results_export.write_tables(self.tables, out_dir)
+        except (IOError, OSError), e:
+            QMessageBox.warning(self, "Couldn't export the results tables", str(e))
+            return
+        self.statusBar().showMessage("Wrote %d tables to %s" % (len(written), out_dir), 5000)
+
+    def export_binary_tables(self):
+        ''' Writes all of the results tables to a single binary file (see
+        results_export.write_binary) '''
+        file_path = unicode(QFileDialog.getSaveFileName(self,
+                                "OpenMeta[Analyst] -- export results tables as",
+                                QString(results_export.BINARY_FILE_NAME)))
+        if file_path == "":
+            return
+        try:
+            results_export.write_binary(self.tables, file_path)
+        except (IOError, OSError), e:
+            QMessageBox.warning(self, "Couldn't export the results tables", str(e))
+            return
+        self.statusBar().showMessage("Wrote the results tables to %s" % file_path, 5000)
+
+    ##### Zooming #####
+
+    def eventFilter(self, obj, event):
+        # ctrl + mouse wheel zooms the results
+        if obj is self.graphics_view.viewport() and event.type() == QEvent.Wheel \
+                and event.modifiers() & Qt.ControlModifier:
+            self.zoom(ZOOM_STEP**(event.delta()/120.0))
+            return True
+        return QMainWindow.eventFilter(self, obj, event)
+
+    def zoom_in(self):
+        self.zoom(ZOOM_STEP)
+
+    def zoom_out(self):
+        self.zoom(1/ZOOM_STEP)
+
+    def zoom(self, factor):
+        ''' Scales the view of the results by factor (within MIN_ZOOM and
+        MAX_ZOOM of the original size). Native forest plots are redrawn at the
+        new zoom level, see ImageItem '''
+        cur_zoom = self.graphics_view.transform().m11()
+        factor = min(max(cur_zoom*factor, MIN_ZOOM), MAX_ZOOM)/cur_zoom
+        self.graphics_view.scale(factor, factor)
+        self.load_visible_images()
+
 
 
     def f(self):
@@ -143,8 +343,6 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
             # first add the title
             qt_item = self.add_title(title)
 
-            pixmap = self.generate_pixmap(image)
-            
             # if there is a parameters object associated with this object
             # (i.e., it is a forest plot of some variety), we pass it along
             # to the create_pixmap_item method to for the context_menu 
@@ -153,13 +351,114 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
             if self.params_paths is not None and title in self.params_paths:
                 params_path = self.params_paths[title]
 
-            img_shape, pos, pixmap_item = self.create_pixmap_item(pixmap, self.position(),\
+            # we only need the size of the image here; it's loaded later
+            svg, size = None, None
+            if self.is_native_plot(params_path, title):
+                svg = forest_plot_renderer.get_svg(params_path)
+                if svg is not None:
+                    size = QSvgRenderer(QByteArray(svg)).defaultSize()
+                elif not os.path.exists(image):
+                    # R only computed the layout, so have it draw the png after all
+                    meta_py_r.load_in_R("%s.plotdata" % params_path)
+                    meta_py_r.generate_forest_plot(image)
+            if size is None:
+                svg = None
+                size = self.scaled_image_size(image)
+
+            img_shape, pos, pixmap_item = self.create_pixmap_item(size, self.position(),\
                                                 title, image, params_path=params_path)
+            pixmap_item.set_svg(svg)
+            self.add_image_record(pixmap_item, size, image_path=image, svg=svg)
             
             self.items_to_coords[qt_item] = pos
             
 
 
+    def scaled_image_size(self, image):
+        ''' The size image is displayed at; only its header is read '''
+        size = QImageReader(image).size()
+        if not size.isValid():
+            size = QSize(0, 0)
+        scaled_size = QSize(int(SCALE_P*size.width()), int(SCALE_P*size.height()))
+        if scaled_size.width() > self.scene.width():
+            self.scene.setSceneRect(0, 0, \
+                                scaled_size.width()+horizontal_padding,\
+                                self.scene.height())
+        return scaled_size
+
+    ##### Background image loading #####
+
+    def add_image_record(self, item, size, image_path=None, svg=None):
+        key = len(self.image_records)
+        self.image_records[key] = {"item":item, "size":size, "image_path":image_path,
+                                   "svg":svg, "state":PLACEHOLDER, "version":0}
+        return key
+
+    def _image_cache_key(self, key):
+        return "results_window:%s:%s:%s" % (id(self), key, self.image_records[key]["version"])
+
+    def load_visible_images(self, *args):
+        '''
+        Loads the images in or near the visible part of the scene. Images far
+        from it are swapped back to placeholders; their pixmaps stay in the
+        (bounded) QPixmapCache, so scrolling back is usually quick.
+        '''
+        if len(self.image_records) == 0:
+            return
+        view = self.graphics_view
+        visible = view.mapToScene(view.viewport().rect()).boundingRect()
+        margin = PRELOAD_MARGIN*visible.height()
+        near = visible.adjusted(0, -margin, 0, margin)
+        for key, record in self.image_records.items():
+            if record["item"].sceneBoundingRect().intersects(near):
+                self.show_image(key)
+            elif record["state"] == LOADED:
+                record["item"].setPixmap(QPixmap())
+                record["state"] = PLACEHOLDER
+
+    def show_image(self, key):
+        record = self.image_records[key]
+        if record["state"] != PLACEHOLDER:
+            return
+        pixmap = QPixmap()
+        if QPixmapCache.find(self._image_cache_key(key), pixmap):
+            record["item"].setPixmap(pixmap)
+            record["state"] = LOADED
+            return
+
+        record["state"] = LOADING
+        loader = ImageLoader(self.image_notifier, key, record["version"], record["size"],
+                             image_path=record["image_path"], svg=record["svg"])
+        self._image_loaders[(key, record["version"])] = loader
+        QThreadPool.globalInstance().start(loader)
+
+    def image_loaded(self, key, version, image):
+        self._image_loaders.pop((key, version), None)
+        record = self.image_records.get(key)
+        if record is None or version != record["version"]:
+            # the image was replaced (e.g., by the plot editor) meanwhile
+            return
+        record["state"] = LOADED
+        if image.isNull():
+            return
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(self._image_cache_key(key), pixmap)
+        record["item"].setPixmap(pixmap)
+
+    def replace_image(self, item, pixmap, image_path=None, svg=None):
+        '''
+        Shows pixmap (which has already been generated) in item from now on;
+        image_path or svg are where it can be re-loaded from if need be.
+        '''
+        for key, record in self.image_records.items():
+            if record["item"] is item:
+                QPixmapCache.remove(self._image_cache_key(key))
+                record.update({"image_path":image_path, "svg":svg, "size":pixmap.size(),
+                               "state":LOADED, "version":record["version"]+1})
+                QPixmapCache.insert(self._image_cache_key(key), pixmap)
+        item.set_svg(svg)
+        item.setPixmap(pixmap)
+
     def generate_pixmap(self, image):
         # now the image
         pixmap = QPixmap(image)
@@ -183,6 +482,39 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
 
         return pixmap
 
+    def is_native_plot(self, params_path, title):
+        ''' 
+        True if the plot was (or is to be) drawn on the python side from its
+        layout (see forest_plot_renderer) -- only simple forest plots are.
+        '''
+        return meta_globals.NATIVE_FOREST_PLOTS and params_path is not None and \
+                    self._get_plot_type(title) == "forest" and \
+                    not self._is_side_by_side_fp(title)
+
+    def generate_native_pixmap(self, params_path):
+        '''
+        Draws the forest plot at params_path from its (cached) SVG, at the size
+        it is displayed at. Returns None if this can't be done, in which case
+        we fall back on the png generated by R.
+        '''
+        renderer = forest_plot_renderer.get_renderer(params_path)
+        if renderer is None:
+            return None
+
+        size = renderer.defaultSize()
+        if size.width() > self.scene.width():
+            self.scene.setSceneRect(0, 0, \
+                                size.width()+horizontal_padding,\
+                                self.scene.height())
+
+        pixmap = QPixmap(size)
+        pixmap.fill(Qt.white)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        renderer.render(painter)
+        painter.end()
+        return pixmap
+
 
     def add_text(self):
         
@@ -309,9 +641,10 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
             plot_type = "regression"
         return plot_type
 
-    def create_pixmap_item(self, pixmap, position, title, image_path,\
+    def create_pixmap_item(self, size, position, title, image_path,\
                              params_path=None, matrix=QMatrix()):
-        item = QGraphicsPixmapItem(pixmap)
+        # the image itself is loaded later, see load_visible_images
+        item = ImageItem(size)
         item.setToolTip("To save the image:\nright-click on the image and choose \"save image as\".\nSave as png will correctly render non-latin fonts but does not respect changes to plot made through 'edit_plot ...'")
         
         
@@ -349,8 +682,14 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
 
     def _make_context_menu(self, params_path, title, png_path, 
                            qpixmap_item, plot_type="forest"):
-        plot_img = QImage(png_path)
-        
+        native = self.is_native_plot(params_path, title)
+        def get_unscaled_image():
+            # only loaded (or drawn) when the user actually saves it
+            if native:
+                image = forest_plot_renderer.render_image(params_path, scale=1/SCALE_P)
+                if image is not None:
+                    return image
+            return QImage(png_path)
         
         def _graphics_item_context_menu(event):
             def add_save_as_pdf_menu_action(menu):
@@ -364,7 +703,7 @@ class ResultsWindow(QMainWindow, ui_results_window.Ui_ResultsWindow):
                 QObject.connect(action, SIGNAL("triggered()"),
                             lambda : self.save_image_as(params_path, title, 
                                             plot_type=plot_type,
-                                            unscaled_image = plot_img, format="png"))
+                                            unscaled_image = get_unscaled_image(), format="png"))
                 menu.addAction(action)
             def add_edit_plot_menu_action(menu):
                 # only know how to edit *simple* (i.e., _not_ side-by-side, as 
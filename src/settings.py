@@ -20,6 +20,12 @@ DEFAULT_SETTINGS = {"splash":True,
                     "digits":3,
                     "recent_files":[],
                     "explain_diag":True,
+                    # the memory (in MB) the undo history of the spreadsheet
+                    # may hold on to; 0 means no limit
+                    "undo_memory_budget_mb":0,
+                    # the number of processes R may run independent fits
+                    # (e.g., of subgroups) over
+                    "r_processes":1,
                     #"method_params":{},
                     }
 
@@ -71,6 +77,12 @@ def get_setting(field):
         return _get_setting_helper(field)
     return _get_setting_helper(field)
 
+def get_undo_memory_budget():
+    ''' the undo_memory_budget_mb setting in bytes (as BudgetedUndoStack wants
+    it), or None if it is 0, i.e., no limit '''
+    budget_mb = get_setting("undo_memory_budget_mb")
+    return budget_mb*1024*1024 if budget_mb > 0 else None
+
 def _get_setting_helper(field):
     settings = QSettings()
 
@@ -217,6 +229,14 @@ def make_r_tmp():
     print("Made r_tmp_path at %s" % r_tmp_path)
     return r_tmp_path
 
+def make_logs_dir():
+    ''' Makes the logs folder (startup timings etc.) and returns the path to it'''
+    logs_path = "/".join([get_base_path(),"logs"])
+    success = QDir().mkpath(logs_path)
+    if not success:
+        raise Exception("Could not create logs path at %s" % logs_path)
+    return logs_path
+
 def to_posix_path(path):
     ''' for now, just changes \ to /
     Assumes there are no escapes in the path, very important!'''
@@ -63,6 +63,7 @@ print("Importing meta_form")
 import meta_form
 print("Importing meta_py_r")
 import meta_py_r
+import binary_imputation
 
 
 from types import (NoneType, BooleanType, IntType, LongType, FloatType,
@@ -503,6 +504,289 @@ def check_diagnostic_meta_method_analysis(test_data):
     _results_match(test_result, test_data['results'], ['images',]) #,'texts'])
 
 
+
+################### BINARY BACK-CALCULATION TESTS #############################
+# binary_imputation is a python port of gimpute.bin.data; its results must
+# be those of R's
+
+def _bin_imputation_test_cases():
+    # (metric, estimate, lower, upper, N_A, N_B, conf.level), the estimate
+    # and CI on the display scale
+    cases = [("OR", 2.25, 0.997, 5.078, 100, 100, 95.0),
+             ("OR", 2.25, None,  5.078, 100, 100, 95.0),
+             ("OR", None,  0.997, 5.078, 100, 100, 95.0),
+             ("OR", 0.4, 0.2, 0.8, 35, 50, 90.0),
+             ("OR", 1.0, 0.5, 2.0, 10, 12, 99.0),
+             ("OR", 2.0, 1.0, None, 1000, 20, 95.0),
+             ("RR", 2.0, 1.0, 4.0, 100, 100, 95.0),
+             ("RR", 0.5, 0.3, None, 80, 120, 95.0),
+             ("RR", None, 0.3, 0.9, 80, 120, 80.0),
+             ("RD", 0.1, 0.005, 0.195, 100, 100, 95.0),
+             ("RD", -0.2, -0.35, None, 60, 40, 95.0),
+             ("RD", None, 0.01, 0.3, 25, 25, 99.0),
+             ("RD", 0.5, 0.4, 0.6, 3, 3, 95.0),        # no solution
+             ("OR", 2.0, 1.0, 4.0, None, 100, 95.0),   # not enough data
+             ("RR", 2.0, None, None, 100, 100, 95.0)]  # not enough data
+    return [dict(zip(["metric", "estimate", "lower", "upper", "N_A", "N_B", "conf.level"], case)) \
+                for case in cases]
+
+def test_native_bin_imputation_matches_R():
+    for case in _bin_imputation_test_cases():
+        check_native_bin_imputation.description = "Testing native binary back-calculation: %s" % case
+        yield check_native_bin_imputation, case
+
+def check_native_bin_imputation(case):
+    from_R = meta_py_r.impute_bin_data(dict(case))
+    native = binary_imputation.impute_bin_data(dict(case))
+    if "FAIL" in from_R:
+        assert "FAIL" in native, native
+        return
+    assert set(native.keys()) == set(from_R.keys()), (native, from_R)
+    for op in from_R:
+        for key in ["a", "b", "c", "d"]:
+            assert float(native[op][key]) == float(from_R[op][key]), (op, key, native, from_R)
+
+def test_native_bin_imputation_batch_matches_R():
+    rows = _bin_imputation_test_cases()
+    from_R = meta_py_r.impute_bin_data_batch(rows)
+    native = binary_imputation.impute_bin_data_batch(rows)
+    assert len(native) == len(from_R)
+    for row, native_row, R_row in zip(rows, native, from_R):
+        for key in ["a1", "c1", "a2", "c2"]:
+            R_value = R_row[key]
+            if R_value is not None and R_value != R_value:
+                R_value = None # NaN
+            assert native_row[key] == R_value, (row, native_row, R_row)
+
+def test_normal_quantile_matches_R():
+    for p in [1e-300, 1e-10, 0.005, 0.025, 0.05, 0.3, 0.5, 0.7, 0.975, 1-1e-10]:
+        assert binary_imputation.normal_quantile(p) == meta_py_r.execute_r_string("qnorm(%r)" % p)[0], p
+
+################### COVARIATE TESTS ############################################
+
+def _covariate_test_dataset():
+    import ma_dataset
+    dataset = ma_dataset.Dataset()
+    for i, name in enumerate(["A", "B", "C", "D"]):
+        dataset.add_study(ma_dataset.Study(i, name=name))
+    dataset.add_covariate(ma_dataset.Covariate("dose", "continuous"),
+                          cov_values={"A":1.5, "B":2.0, "D":0.25})
+    dataset.add_covariate(ma_dataset.Covariate("arm", "factor"),
+                          cov_values={"A":"high", "B":"low", "C":"high"})
+    return dataset
+
+def test_covariate_columns():
+    dataset = _covariate_test_dataset()
+    dose, arm = dataset.get_covariate_column("dose"), dataset.get_covariate_column("arm")
+    assert dose.get_values() == [1.5, 2.0, None, 0.25], dose.get_values()
+    assert arm.levels == [u"high", u"low"], arm.levels
+    assert list(arm.values) == [0, 1, 0, -1], arm.values
+    assert dataset.get_covariate_column("dose") is dose # cached
+
+    # edits and changes to the studies are picked up
+    dataset.set_covariate_value(dataset.studies[3], "arm", "mid")
+    assert dataset.get_covariate_column("arm").get_values() == [u"high", u"low", u"high", u"mid"]
+    dataset.studies.reverse()
+    assert dataset.get_covariate_column("dose").get_values() == [0.25, None, 2.0, 1.5]
+
+def test_covariates_to_R_match_R_source():
+    # the covariates passed to R as vectors are those that were previously
+    # built from R source
+    dataset = _covariate_test_dataset()
+    study_ids = [2, 0, 3, 1]
+    var_name = meta_py_r.covariates_to_R(dataset, study_ids, var_name="tmp_test_covs")
+    for i, cov in enumerate(dataset.covariates):
+        values_str, cov_vals = meta_py_r.cov_to_str(cov, study_ids, dataset, named_list=False,
+                                                    return_cov_vals=True)
+        expected = "new('CovariateValues', cov.name='%s', cov.vals=%s, cov.type='%s', ref.var='%s')" % \
+                    (cov.name, values_str, meta_py_r.TYPE_TO_STR_DICT[cov.data_type],
+                     cov_vals[0].replace("'", ""))
+        r_str = "identical(%s[[%d]], %s)" % (var_name, i+1, expected)
+        assert meta_py_r.execute_r_string(r_str)[0], r_str
+
+################### UNDO TESTS #################################################
+
+def test_dataset_delta_restores_edits():
+    import ma_dataset
+    dataset = _covariate_test_dataset()
+    dataset.add_outcome(ma_dataset.Outcome("death", ma_dataset.BINARY))
+    first = dataset.studies[0]
+    unit = first.outcomes_to_follow_ups["death"]["first"]
+    group = unit.get_group_names()[0]
+    unit.set_raw_data_for_group(group, [1, 10])
+    studies = list(dataset.studies)
+
+    delta = ma_dataset.DatasetDelta(dataset, touched_studies=[first])
+    unit.set_raw_data_for_group(group, [5, 10])
+    first.name = "A2"
+    dataset.set_covariate_value(first, "dose", 9.0)
+    dataset.add_study(ma_dataset.Study(10, name="E"))
+    delta.restore()
+
+    assert dataset.studies == studies
+    assert first.name == "A"
+    assert unit.get_raw_data_for_group(group) == [1, 10]
+    assert first.outcomes_to_follow_ups["death"]["first"] is unit
+    assert dataset.get_covariate_column("dose").get_values() == [1.5, 2.0, None, 0.25]
+
+    # a state can be restored more than once
+    state = unit.get_state()
+    for i in range(2):
+        unit.set_raw_data_for_group(group, [7, 10])
+        unit.set_state(state)
+        assert unit.get_raw_data_for_group(group) == [1, 10]
+
+def test_undo_budget_drops_oldest_snapshots():
+    import weakref
+    import meta_globals
+
+    class Snapshot(object):
+        pass
+
+    state = {"value":0}
+    def set_value_command(value, size):
+        snapshot = Snapshot()
+        snapshot.old_value = state["value"]
+        def redo_f():
+            state["value"] = value
+        def undo_f():
+            state["value"] = snapshot.old_value
+        return meta_globals.CommandGenericDo(redo_f, undo_f, size=size), weakref.ref(snapshot)
+
+    stack = meta_globals.BudgetedUndoStack(memory_budget=100)
+    snapshots = []
+    for value in (1, 2, 3):
+        command, snapshot = set_value_command(value, size=40)
+        stack.push(command)
+        snapshots.append(snapshot)
+    del command
+
+    # the first command was released (and dropped) to stay under budget
+    assert stack.count() == 2 and stack.undo_size() == 80
+    assert snapshots[0]() is None
+    assert snapshots[1]() is not None and snapshots[2]() is not None
+
+    # and undo stops at the oldest command still on the stack
+    for i in range(3):
+        stack.undo()
+    assert state["value"] == 1 and not stack.canUndo()
+    stack.redo()
+    assert state["value"] == 2
+
+def test_data_form_commands_count_toward_the_undo_budget():
+    import calculator_routines
+    import meta_globals
+    class Form:
+        state = None
+    form = Form()
+    def field_changed_command(value):
+        old_state, new_state = [str(value-1)]*1000, [str(value)]*1000
+        def restore_f(state):
+            form.state = state
+        command = calculator_routines.CommandFieldChanged(
+                        restore_new_f=lambda: restore_f(new_state),
+                        restore_old_f=lambda: restore_f(old_state))
+        command.just_created = False
+        return command
+
+    # the commands report the size of the states bound in their restore functions
+    command = field_changed_command(1)
+    assert command.undo_size() >= meta_globals.estimate_size([["0"]*1000, ["1"]*1000])
+    stack = meta_globals.BudgetedUndoStack(memory_budget=int(2.5*command.undo_size()))
+    for value in (1, 2, 3):
+        stack.push(field_changed_command(value))
+    assert stack.count() == 2
+    stack.undo(); stack.undo()
+    assert form.state[0] == "1" and not stack.canUndo()
+
+################### NETWORK TESTS ##############################################
+
+def test_network_edges_and_weights():
+    import ma_dataset
+    dataset = _covariate_test_dataset()
+    dataset.add_outcome(ma_dataset.Outcome("death", ma_dataset.BINARY))
+    dataset.add_group("tx C", "death")
+    units = [study.outcomes_to_follow_ups["death"]["first"] for study in dataset.studies]
+    tx_a, tx_b = [group for group in units[0].get_group_names() if group != "tx C"]
+    # A and B compare tx_a and tx_b through their raw data, C compares
+    # tx C and tx_a through an effect entered directly; D has no data
+    for unit in units[:2]:
+        unit.set_raw_data_for_group(tx_a, [1, 10])
+        unit.set_raw_data_for_group(tx_b, [2, 10])
+    units[2].set_effect("OR", "-".join(("tx C", tx_a)), 0.5)
+
+    nodes, edges, weights = dataset.get_network("death", "first")
+    assert sorted(nodes) == sorted([tx_a, tx_b, "tx C"])
+    assert len(edges) == 2 and sorted(weights.keys()) == sorted(edges)
+    weights = dict([(frozenset(edge), weight) for edge, weight in weights.items()])
+    assert weights == {frozenset((tx_a, tx_b)):2, frozenset(("tx C", tx_a)):1}
+    assert ("tx C", tx_a) in edges
+
+def test_network_skips_studies_added_after_the_outcome():
+    import ma_dataset
+    import network_view
+    dataset = _covariate_test_dataset()
+    dataset.add_outcome(ma_dataset.Outcome("death", ma_dataset.BINARY))
+    unit = dataset.studies[0].outcomes_to_follow_ups["death"]["first"]
+    tx_a, tx_b = unit.get_group_names()
+    unit.set_raw_data_for_group(tx_a, [1, 10])
+    unit.set_raw_data_for_group(tx_b, [2, 20])
+    # (as the spreadsheet's new and blank rows are)
+    dataset.add_study(ma_dataset.Study(10, name="E"))
+    assert "death" not in dataset.studies[-1].outcomes_to_follow_ups
+
+    nodes, edges, weights = dataset.get_network("death", "first")
+    assert sorted(nodes) == sorted([tx_a, tx_b])
+    assert weights.values() == [1]
+    sample_sizes = network_view.group_sample_sizes(dataset, "death", "first", ma_dataset.BINARY)
+    assert sample_sizes == {tx_a:10, tx_b:20}
+
+def test_ma_unit_view_blanks_only_the_missing_groups():
+    import ma_dataset
+    unit = ma_dataset.MetaAnalyticUnit(ma_dataset.Outcome("death", ma_dataset.BINARY),
+                                       group_names=["a", "b"])
+    unit.set_raw_data_for_group("a", [1, 10])
+    unit.set_effect("PR", "a", 0.1)
+
+    view = ma_dataset.MetaAnalyticUnitView(unit, ["a", "c"])
+    assert view.get_raw_data_for_groups(["a", "c"]) == [1, 10, "", ""]
+    assert view.get_estimate("PR", "a") == 0.1
+    assert view.get_estimate("OR", "a-c") is None
+    assert "c" not in unit.tx_groups
+    # the view follows edits of the unit's data, but not of its groups
+    unit.set_raw_data_for_group("a", [2, 10])
+    assert view.get_raw_data_for_group("a") == [2, 10] and view.is_current()
+    unit.add_group("c")
+    assert not view.is_current()
+
+def test_analysis_units_keep_the_order_the_groups_were_entered_in():
+    import ma_dataset
+    import meta_py_r
+    dataset = _covariate_test_dataset()
+    dataset.add_outcome(ma_dataset.Outcome("death", ma_dataset.BINARY))
+    unit = dataset.studies[0].outcomes_to_follow_ups["death"]["first"]
+    tx_a, tx_b = sorted(unit.tx_groups.values(), key=lambda group: group.id)
+    # (first by name, but entered last)
+    dataset.add_group("A control", "death")
+
+    units = meta_py_r.get_analysis_units(dataset, ma_dataset.BINARY, "OR")
+    assert [groups for outcome, follow_up, groups in units] == \
+            [(tx_a.name, tx_b.name), (tx_a.name, "A control"), (tx_b.name, "A control")]
+    # pairs given by the user are kept as given
+    units = meta_py_r.get_analysis_units(dataset, ma_dataset.BINARY, "OR",
+                                         group_pairs=[("A control", tx_b.name)])
+    assert units == [("death", "first", ("A control", tx_b.name))]
+
+def test_layout_network():
+    import network_view
+    nodes = ["a", "b", "c", "d"]
+    edges = [("a", "b"), ("b", "c"), ("c", "a")]
+    positions = network_view.layout_network(nodes, edges)
+    assert sorted(positions.keys()) == nodes
+    for x, y in positions.values():
+        assert -1e-9 <= x <= 1+1e-9 and -1e-9 <= y <= 1+1e-9
+    # the layout is deterministic, so it can be cached
+    assert network_view.layout_network(nodes, edges) == positions
         
 ####### Don't delete this. Its good to use as a template ####
 #def setup_module(module):
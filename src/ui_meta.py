@@ -271,6 +271,8 @@ class Ui_MainWindow(object):
         self.action_view_network.setObjectName(_fromUtf8("action_view_network"))
         self.action_add_covariate = QtGui.QAction(MainWindow)
         self.action_add_covariate.setObjectName(_fromUtf8("action_add_covariate"))
+        self.action_impute_all = QtGui.QAction(MainWindow)
+        self.action_impute_all.setObjectName(_fromUtf8("action_impute_all"))
         self.action_cum_ma = QtGui.QAction(MainWindow)
         icon10 = QtGui.QIcon()
         icon10.addPixmap(QtGui.QPixmap(_fromUtf8(":/misc/cum_meta_analysis.png")), QtGui.QIcon.Normal, QtGui.QIcon.Off)
@@ -359,6 +361,8 @@ class Ui_MainWindow(object):
         self.menuDataset.addAction(self.action_edit)
         self.menuDataset.addAction(self.action_view_network)
         self.menuDataset.addAction(self.action_add_covariate)
+        self.menuDataset.addSeparator()
+        self.menuDataset.addAction(self.action_impute_all)
         self.menuEdit.addAction(self.action_undo)
         self.menuEdit.addAction(self.action_redo)
         self.menuEdit.addAction(self.action_copy)
@@ -411,6 +415,7 @@ class Ui_MainWindow(object):
         self.action_edit.setText(_translate("MainWindow", "edit...", None))
         self.action_view_network.setText(_translate("MainWindow", "view network...", None))
         self.action_add_covariate.setText(_translate("MainWindow", "add covariate...", None))
+        self.action_impute_all.setText(_translate("MainWindow", "fill in imputable data", None))
         self.action_cum_ma.setText(_translate("MainWindow", "cumulative meta-analysis...", None))
         self.action_loo_ma.setText(_translate("MainWindow", "leave-one-out meta-analysis...", None))
         self.actionOR.setText(_translate("MainWindow", "OR", None))